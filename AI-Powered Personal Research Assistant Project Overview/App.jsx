@@ -16,6 +16,7 @@ function App() {
   const [messages, setMessages] = useState([])
   const [currentMessage, setCurrentMessage] = useState('')
   const [isUploading, setIsUploading] = useState(false)
+  const [uploadProgress, setUploadProgress] = useState(null)
   const [isChatting, setIsChatting] = useState(false)
   const [selectedFile, setSelectedFile] = useState(null)
   const fileInputRef = useRef(null)
@@ -50,6 +51,21 @@ function App() {
     setSelectedFile(file)
   }
 
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`)
+      if (!response.ok) {
+        throw new Error('Could not get upload status')
+      }
+      const job = await response.json()
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job
+      }
+      setUploadProgress(job)
+      await new Promise(resolve => setTimeout(resolve, 1000))
+    }
+  }
+
   const handleFileUpload = async () => {
     if (!selectedFile) return
 
@@ -69,12 +85,19 @@ function App() {
         if (fileInputRef.current) {
           fileInputRef.current.value = ''
         }
+
+        // Processing continues in the background; wait for the job to finish
+        const job = await waitForJob(data.job_id)
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Processing failed')
+        }
         fetchDocuments()
         
         // Add success message to chat
         setMessages(prev => [...prev, {
           type: 'system',
-          content: `Document "${data.filename}" uploaded successfully! ${data.chunks_created} chunks created.`,
+          content: `Document "${data.filename}" uploaded successfully! ${job.chunks_total} chunks created` +
+            (job.chunks_deduplicated ? ` (${job.chunks_deduplicated} duplicates of indexed passages).` : '.'),
           timestamp: new Date().toISOString()
         }])
       } else {
@@ -90,6 +113,7 @@ function App() {
       }])
     } finally {
       setIsUploading(false)
+      setUploadProgress(null)
     }
   }
 
@@ -107,7 +131,7 @@ function App() {
     setIsChatting(true)
 
     try {
-      const response = await fetch(`${API_BASE_URL}/chat`, {
+      const response = await fetch(`${API_BASE_URL}/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -117,21 +141,51 @@ function App() {
         }),
       })
 
-      if (response.ok) {
-        const data = await response.json()
-        
-        const assistantMessage = {
-          type: 'assistant',
-          content: data.answer,
-          citations: data.citations || [],
-          timestamp: new Date().toISOString()
-        }
-
-        setMessages(prev => [...prev, assistantMessage])
-      } else {
+      if (!response.ok) {
         const error = await response.json()
         throw new Error(error.error || 'Chat request failed')
       }
+
+      // Citations arrive once retrieval is done, then the answer token by token
+      const messageId = `${Date.now()}-${Math.random()}`
+      const updateAnswer = (update) => {
+        setMessages(prev => prev.map(message => message.id === messageId ? update(message) : message))
+      }
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        const events = buffer.split('\n\n')
+        buffer = events.pop()
+        for (const block of events) {
+          const event = block.match(/^event: (.*)$/m)?.[1]
+          const dataLine = block.match(/^data: (.*)$/m)?.[1]
+          if (!event || dataLine === undefined) continue
+          const data = JSON.parse(dataLine)
+
+          if (event === 'citations') {
+            setIsChatting(false)
+            setMessages(prev => [...prev, {
+              id: messageId,
+              type: 'assistant',
+              content: '',
+              citations: data.citations || [],
+              timestamp: new Date().toISOString()
+            }])
+          } else if (event === 'token') {
+            updateAnswer(message => ({ ...message, content: message.content + data.content }))
+          } else if (event === 'done') {
+            updateAnswer(message => ({ ...message, content: data.answer }))
+          } else if (event === 'error') {
+            throw new Error(data.error)
+          }
+        }
+      }
     } catch (error) {
       console.error('Error sending message:', error)
       setMessages(prev => [...prev, {
@@ -217,7 +271,9 @@ function App() {
                     {isUploading ? (
                       <>
                         <Sparkles className="h-4 w-4 mr-2 animate-spin" />
-                        Processing...
+                        {uploadProgress?.stage === 'embedding' && uploadProgress.chunks_embedded
+                          ? `Embedded ${uploadProgress.chunks_embedded} chunks...`
+                          : 'Processing...'}
                       </>
                     ) : (
                       <>
@@ -318,6 +374,11 @@ function App() {
                                         </Badge>
                                         <span className="font-medium">{citation.filename}</span>
                                       </div>
+                                      {citation.also_in && (
+                                        <p className="opacity-75 mb-1">
+                                          Also in: {citation.also_in.map(source => source.filename).join(', ')}
+                                        </p>
+                                      )}
                                       <p className="opacity-75">{citation.text}</p>
                                     </div>
                                   ))}
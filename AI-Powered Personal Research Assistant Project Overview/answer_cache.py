@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    LRU cache of /chat answers with expiry and invalidation
+
+    Answers are keyed on (normalized query, document set, retrieval
+    options). A question asked again against the same documents is
+    answered from the cache without an embedding or LLM call. With
+    semantic_threshold set, a differently worded question whose query
+    embedding is at least that similar (cosine) to a cached one against
+    the same documents is too. That is off by default: questions that
+    differ in a word such as "not" or a year can be that similar, and
+    would be given the other question's answer.
+
+    Entries expire ttl seconds after they were stored and are dropped when
+    a document they depend on changes: one in their document set, or any
+    document for answers over all documents. Answers are stored with the
+    generation read before they were computed, so one computed while a
+    document changed is never cached. Changes are remembered for ttl
+    seconds, so their record stays as small as the set of documents
+    changed lately; an answer computed from before a forgotten change is
+    not cached either.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0,
+                 semantic_threshold: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.clock = clock
+        self._entries = OrderedDict()  # Key -> (answer, stored_at, embedding or None)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._last_change = 0
+        # Document ID -> (generation, time) of its last change, least recent first
+        self._document_changes = OrderedDict()
+        self._forgotten_generation = 0  # Latest generation of a change dropped from _document_changes
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Lowercase and collapse whitespace and trailing punctuation"""
+        return " ".join(query.lower().split()).rstrip(" ?!.")
+
+    @classmethod
+    def make_key(cls, query: str, document_ids: Optional[List[str]], *options: Hashable) -> tuple:
+        """Key of an answer; document order and duplicates do not matter"""
+        documents = frozenset(document_ids) if document_ids else None
+        return (cls.normalize_query(query), documents) + options
+
+    def generation(self) -> int:
+        """Read before computing an answer and pass to put()"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key: tuple, query_embedding: List[float] = None) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Look up an answer by key, then by query embedding if given
+
+        Returns:
+            (answer, 'exact' or 'semantic'), or (None, None) on a miss
+        """
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], 'exact'
+
+            if query_embedding is not None and self.semantic_threshold is not None:
+                match = self._find_similar(key, _normalize(query_embedding), now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match][0], 'semantic'
+
+            self.misses += 1
+            return None, None
+
+    def put(self, key: tuple, answer: dict, generation: int, query_embedding: List[float] = None):
+        """Store an answer computed after generation() returned generation"""
+        with self._lock:
+            if self._changed_since(key[1], generation):
+                return
+            embedding = _normalize(query_embedding) if query_embedding is not None else None
+            self._entries[key] = (answer, self.clock(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_document(self, document_id: str):
+        """Drop answers that depend on a document that was added, changed or deleted"""
+        with self._lock:
+            self._generation += 1
+            self._last_change = self._generation
+            now = self.clock()
+            self._document_changes[document_id] = (self._generation, now)
+            self._document_changes.move_to_end(document_id)
+            while next(iter(self._document_changes.values()))[1] < now - self.ttl:
+                _, (self._forgotten_generation, _) = self._document_changes.popitem(last=False)
+            stale = [key for key in self._entries if key[1] is None or document_id in key[1]]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and size"""
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries)
+            }
+
+    def _expired(self, entry: tuple, now: float) -> bool:
+        return now - entry[1] > self.ttl
+
+    def _changed_since(self, documents: Optional[frozenset], generation: int) -> bool:
+        if documents is None:
+            return self._last_change > generation
+        if self._forgotten_generation > generation:
+            return True
+        return any(self._document_changes.get(document_id, (0, None))[0] > generation for document_id in documents)
+
+    def _find_similar(self, key: tuple, embedding: np.ndarray, now: float) -> Optional[tuple]:
+        """Key of the most similar live entry with the same documents and options"""
+        candidates = [(other, entry[2]) for other, entry in self._entries.items()
+                      if other[1:] == key[1:] and entry[2] is not None and not self._expired(entry, now)]
+        if not candidates:
+            return None
+        similarities = np.stack([vector for _, vector in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+        return candidates[best][0]
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,46 @@
+"""
+Production entry point: serves the app over ASGI with uvicorn
+
+    python src/asgi.py --workers 1 --port 5000
+
+or with the ASGI server of your choice, e.g.
+
+    uvicorn --factory src.asgi:create_app --port 5000
+
+Chat and summary requests await the LLM on the event loop; see
+routes/research_assistant_async.py. main.py's app.run() remains the
+development server.
+"""
+
+import argparse
+import os
+import sys
+# Same as main.py, so the src package resolves when run as a script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_app():
+    """The ASGI app; built in each worker process rather than at import"""
+    from src.main import app as flask_app
+    from src.routes.research_assistant_async import create_asgi_app
+    return create_asgi_app(flask_app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the research assistant over ASGI with uvicorn")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 1)),
+                        help="Worker processes, each with its own event loop serving many requests "
+                             "(default: $WORKERS or 1). Workers share the vector store on disk and "
+                             "each runs ingestion workers of its own.")
+    parser.add_argument('--log-level', default=os.environ.get('LOG_LEVEL', 'info'))
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run('src.asgi:create_app', factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Load test of the async server against the current Flask server
+Sends chat requests at several levels of concurrency, against a stub LLM
+of fixed latency, to Flask's threaded development server (what main.py's
+app.run() serves) and to the ASGI app under uvicorn, and reports
+throughput, latency, failed requests and the most threads the process
+used
+
+Usage: python benchmark_async_server.py [llm_latency_seconds]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import flat_layout
+flat_layout.install()
+# The routes module creates OpenAI clients on import; the benchmark swaps in mock ones
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+
+import numpy as np
+import uvicorn
+from flask import Flask
+from werkzeug.serving import make_server
+
+from mock_openai import MockAsyncOpenAIClient, MockOpenAIClient, mock_embedding
+from src.models.document import Document, db
+from src.routes import research_assistant
+from src.routes.research_assistant_async import create_asgi_app
+
+CONCURRENCY_LEVELS = (10, 50, 200)
+ROUNDS = 3  # Requests sent per concurrent client
+
+
+def start_server(app):
+    """(uvicorn server, port) serving an ASGI app from a background thread"""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning'))
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, sock.getsockname()[1]
+
+
+def build_app(directory):
+    """Flask app over a database in directory with one document, and the mock client the routes answer with"""
+    flask_app = Flask(__name__)
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'app.db')}"
+    db.init_app(flask_app)
+    flask_app.register_blueprint(research_assistant.research_bp, url_prefix='/api')
+
+    texts = [f"Passage {i} on photosynthesis converting light into chemical energy in chloroplasts."
+             for i in range(8)]
+    with flask_app.app_context():
+        db.create_all()
+        db.session.add(Document(document_id='plants', filename='plants.txt', content=" ".join(texts),
+                                file_type='txt'))
+        db.session.commit()
+    research_assistant.vector_store.add_embeddings(
+        [mock_embedding(text) for text in texts],
+        [{'document_id': 'plants', 'filename': 'plants.txt', 'chunk_index': i, 'text': text}
+         for i, text in enumerate(texts)])
+
+    client = MockOpenAIClient(embedding_latency=0.05, chat_token_latency=0.01)
+    rag_service = research_assistant.rag_service
+    rag_service.openai_client = rag_service.summarizer.openai_client = client
+    rag_service.async_openai_client = rag_service.summarizer.async_openai_client = MockAsyncOpenAIClient(client)
+    return flask_app, client
+
+
+async def post_chat(port, query):
+    """Seconds a /api/chat request took, or None if it failed"""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        body = json.dumps({'query': query}).encode('utf-8')
+        writer.write(b'POST /api/chat HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     b'Connection: close\r\nContent-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return time.perf_counter() - start if response.startswith(b'HTTP/1.1 200') else None
+    except OSError:
+        return None
+
+
+async def load(port, concurrency, level):
+    """Results of concurrency clients each sending ROUNDS distinct questions in turn"""
+    async def client(i):
+        return [await post_chat(port, f'Question {level}-{i}-{n} on light energy?') for n in range(ROUNDS)]
+    return [seconds for results in await asyncio.gather(*(client(i) for i in range(concurrency)))
+            for seconds in results]
+
+
+def measure(name, port, concurrency):
+    peak_threads = threading.active_count()
+    running = True
+
+    def sample_threads():
+        nonlocal peak_threads
+        while running:
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    results = asyncio.run(load(port, concurrency, f'{name}-{concurrency}'))
+    elapsed = time.perf_counter() - start
+    running = False
+    sampler.join()
+
+    latencies = np.array([seconds for seconds in results if seconds is not None])
+    row = {'throughput': len(latencies) / elapsed, 'failed': len(results) - len(latencies),
+           'p50': np.percentile(latencies, 50), 'p95': np.percentile(latencies, 95), 'threads': peak_threads}
+    print(f"{name:<22} {concurrency:>6} {row['throughput']:8.1f} {row['p50']:7.2f} {row['p95']:7.2f} "
+          f"{row['failed']:>7} {row['threads']:>8}")
+    return row
+
+
+def benchmark_async_server(llm_latency=1.0):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    flask_app, client = build_app(tempfile.mkdtemp())
+    client.chat.completions.latency = llm_latency  # The async mock shares it
+    research_assistant.rag_service.answer_cache = None  # Every request waits on the LLM
+
+    print(f"🔄 /api/chat with a {llm_latency}s stub LLM, {ROUNDS} requests per client")
+    print(f"{'server':<22} {'conc.':>6} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'failed':>7} {'threads':>8}")
+
+    flask_server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=flask_server.serve_forever, daemon=True).start()
+    asgi_server, asgi_port = start_server(create_asgi_app(flask_app))
+
+    success = True
+    try:
+        for concurrency in CONCURRENCY_LEVELS:
+            measure('Flask (threaded)', flask_server.server_port, concurrency)
+            after = measure('ASGI (uvicorn, 1 wkr)', asgi_port, concurrency)
+            # Ideal: every client's requests back to back, each taking the LLM's latency
+            ideal = concurrency / (llm_latency + 0.05)
+            if after['failed'] or after['throughput'] < ideal * 0.6:
+                print(f"❌ The async server should serve {concurrency} clients at about {ideal:.0f} req/s")
+                success = False
+    finally:
+        flask_server.shutdown()
+        asgi_server.should_exit = True
+
+    if success:
+        print("✅ One async worker serves every concurrent client without a thread each")
+    return success
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:2]]
+    success = benchmark_async_server(*args)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Chunking benchmark for the document processor
+Compares the previous character-window chunker with the token-budget
+chunking strategies on the sample corpus and on pathological inputs, and
+checks that every strategy stays linear and within the token budget
+
+Usage: python benchmark_chunking.py [megabytes]
+"""
+
+import os
+import re
+import sys
+import time
+import flat_layout
+flat_layout.install()
+
+from src.services.chunking import CHUNKING_STRATEGIES, build_chunker
+
+CORPUS_FILES = ['test_document.txt', 'README.md', 'AI-Powered Personal Research Assistant: Technical Deep Dive.md']
+
+
+def legacy_chunk_text(text, chunk_size=1000, chunk_overlap=200):
+    """The previous chunker: 1000-character windows ending at the last '.' or ' '"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            sentence_end = text.rfind('.', start, end)
+            if sentence_end > start:
+                end = sentence_end + 1
+            else:
+                word_end = text.rfind(' ', start, end)
+                if word_end > start:
+                    end = word_end
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        # Without the +1 a boundary inside the overlap would repeat forever
+        start = max(end - chunk_overlap, start + 1)
+    return chunks
+
+
+def sample_corpus():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    texts = []
+    for name in CORPUS_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                texts.append(f.read())
+    return "\n\n".join(texts)
+
+
+def repeat_to(text, size):
+    return (text * (size // len(text) + 1))[:size]
+
+
+def pathological_inputs(size):
+    words = "retrieval augmented generation grounds answers in cited sources "
+    return {
+        # Sentences longer than a chunk: the old chunker steps one character at a time
+        'long sentences': repeat_to(repeat_to(words, 1500) + ". ", size),
+        'no whitespace': "x" * size,
+        'tiny sentences': repeat_to("Ok. ", size),
+        'blank lines': repeat_to("word\n\n\n", size),
+        'one huge line': repeat_to(words, size),
+        # Runs of sentence punctuation: a backtracking boundary search rescans them at every position
+        'dot runs': "." * size,
+        'punctuation runs': repeat_to("!?", size),
+        # A heading every few characters must not make a chunk of each
+        'heading runs': repeat_to("\n# h", size),
+    }
+
+
+def run(chunk, text):
+    start = time.perf_counter()
+    chunks = chunk(text)
+    return chunks, time.perf_counter() - start
+
+
+def check(name, chunker, text, chunks):
+    """Returns an error message, or None if the chunks are valid"""
+    largest = max((chunker.token_counter(c) for c in chunks), default=0)
+    if largest > chunker.chunk_size:
+        return f"{name}: a chunk has {largest} tokens (budget {chunker.chunk_size})"
+    # Words longer than a chunk are cut, so only check the others
+    covered = set()
+    for c in chunks:
+        covered.update(c.split())
+    words = {word for word in text.split() if len(word) < 100}
+    if not words <= covered:
+        return f"{name}: some words are missing from the chunks"
+    return None
+
+
+def benchmark_chunking(megabytes=1):
+    size = int(megabytes * 1024 * 1024)
+    chunkers = {strategy: build_chunker(strategy) for strategy in CHUNKING_STRATEGIES}
+    inputs = {'sample corpus': repeat_to(sample_corpus(), size)}
+    inputs.update(pathological_inputs(size))
+
+    print(f"🔄 Chunking {megabytes} MB inputs (budget {chunkers['sentence'].chunk_size} tokens, "
+          f"overlap {chunkers['sentence'].chunk_overlap})")
+    print(f"{'input':<16} {'chunker':<10} {'chunks':>8} {'chunks/s':>10} {'MB/s':>7}")
+
+    success = True
+    for input_name, text in inputs.items():
+        # Growing pathological inputs shows the legacy chunker's blow-up
+        candidates = [('legacy', legacy_chunk_text)]
+        candidates += [(strategy, chunker.chunk_text) for strategy, chunker in chunkers.items()]
+        for label, chunk in candidates:
+            chunks, elapsed = run(chunk, text)
+            print(f"{input_name:<16} {label:<10} {len(chunks):>8} {len(chunks) / elapsed:10.0f} "
+                  f"{megabytes / elapsed:7.1f}")
+            if label in chunkers:
+                error = check(f"{input_name}/{label}", chunkers[label], text, chunks)
+                if error:
+                    print(f"❌ {error}")
+                    success = False
+
+    # Linear time: four times the text takes about four times as long
+    for input_name, text in pathological_inputs(size * 4).items():
+        for strategy, chunker in chunkers.items():
+            _, small = run(chunker.chunk_text, text[:size])
+            _, large = run(chunker.chunk_text, text)
+            if large > 8 * small:
+                print(f"❌ {input_name}/{strategy}: 4x the input took {large / small:.1f}x as long")
+                success = False
+    # Chunks of at least a quarter of the budget, so short sections are merged
+    text = inputs['heading runs']
+    paragraph = chunkers['paragraph']
+    if len(paragraph.chunk_text(text)) > 4 * paragraph.token_counter(text) / paragraph.chunk_size + 1:
+        print("❌ paragraph: headings were cut into chunks far below the token budget")
+        success = False
+    if success:
+        print("✅ All strategies are linear and keep chunks within the token budget")
+
+    # Streaming pieces must not change the chunks
+    corpus = inputs['sample corpus']
+    pieces = [(i, piece) for i, piece in enumerate(re.findall(r'.{1,997}', corpus, re.DOTALL))]
+    for strategy, chunker in chunkers.items():
+        streamed = [c for _, c in chunker.iter_chunks(pieces)]
+        if streamed != chunker.chunk_text(corpus):
+            print(f"❌ {strategy}: chunking in pieces differs from chunking the whole text")
+            success = False
+    if success:
+        print("✅ Chunking a stream of pieces matches chunking the whole text")
+    return success
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:2]]
+    success = benchmark_chunking(*args)
+    sys.exit(0 if success else 1)
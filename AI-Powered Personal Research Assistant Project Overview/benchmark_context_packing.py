@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Context packing benchmark for RAGService prompts
+Chunks the sample corpus with the previous 1000-character chunker and the
+default sentence chunker, retrieves chunks for questions drawn from the
+corpus, and compares prompt tokens when every chunk is sent in full with
+the packed context, unlimited and within a token budget
+
+Retrieval is lexical: the mock embeddings carry no meaning, so dense
+retrieval would not return the neighbouring chunks real questions do.
+
+Usage: python benchmark_context_packing.py [queries]
+"""
+
+import random
+import re
+import sys
+import flat_layout
+flat_layout.install()
+
+import numpy as np
+
+from benchmark_chunking import legacy_chunk_text, sample_corpus
+from mock_openai import MockOpenAIClient, mock_embedding
+from src.services.chunking import build_chunker, estimate_tokens
+from src.services.context_builder import ContextBuilder
+from src.services.document_processor import VectorStore
+from src.services.rag_service import RAGService
+
+DIMENSION = 64
+BUDGET = 1000
+
+
+class UnpackedContextBuilder(ContextBuilder):
+    """The previous context: every chunk in full, in rank order"""
+
+    def build(self, relevant_chunks):
+        context = "\n\n".join(f"[{i+1}] {chunk.get('text', '')}" for i, (chunk, _) in enumerate(relevant_chunks))
+        return context, [{'document_id': chunk.get('document_id')} for chunk, _ in relevant_chunks]
+
+
+def build_store(chunks):
+    store = VectorStore(dimension=DIMENSION)
+    store.add_embeddings([mock_embedding(chunk, DIMENSION) for chunk in chunks],
+                         [{'document_id': 'corpus', 'filename': 'corpus.md', 'chunk_index': i, 'text': chunk}
+                          for i, chunk in enumerate(chunks)])
+    return store
+
+
+def questions(text, count, seed=0):
+    """Questions made of a few words of random sentences of the corpus"""
+    rng = random.Random(seed)
+    sentences = [s.split() for s in re.split(r'(?<=[.!?])\s+', text) if len(s.split()) >= 8]
+    return [" ".join(rng.sample(words, 5)) for words in rng.sample(sentences, min(count, len(sentences)))]
+
+
+def prompt_tokens(rag, query, hits):
+    messages, _ = rag._build_prompt(query, hits)
+    return sum(estimate_tokens(message['content']) for message in messages)
+
+
+def benchmark_context_packing(num_queries=200):
+    text = sample_corpus()
+    chunkers = {
+        'legacy 1000/200 chars': legacy_chunk_text,
+        'sentence 256/50 tokens': build_chunker('sentence').chunk_text,
+    }
+    builders = {
+        'unpacked': UnpackedContextBuilder(max_tokens=None),
+        'packed': ContextBuilder(max_tokens=None),
+        f'packed, {BUDGET} budget': ContextBuilder(max_tokens=BUDGET),
+    }
+    queries = questions(text, num_queries)
+    print(f"🔄 Packing contexts for {len(queries)} questions over the sample corpus ({len(text)} characters)")
+    print(f"{'chunker':<24} {'k':>3} {'builder':<20} {'prompt tokens':>14} {'passages':>9} {'saved':>7}")
+
+    success = True
+    for chunker_name, chunk in chunkers.items():
+        store = build_store(chunk(text))
+        for k in (5, 10):
+            hits = [store.lexical_search(query, k) for query in queries]
+            baseline = None
+            for builder_name, builder in builders.items():
+                rag = RAGService(store, openai_client=MockOpenAIClient(dimension=DIMENSION), context_builder=builder)
+                tokens = np.array([prompt_tokens(rag, query, h) for query, h in zip(queries, hits)])
+                passages = np.mean([len(builder.build(h)[1]) for h in hits])
+                baseline = tokens.mean() if baseline is None else baseline
+                saved = 1 - tokens.mean() / baseline
+                print(f"{chunker_name:<24} {k:>3} {builder_name:<20} {tokens.mean():14.0f} {passages:9.1f} "
+                      f"{saved:7.1%}")
+                if builder.max_tokens is not None and (tokens - prompt_tokens(rag, "", [])).max() > BUDGET + 20:
+                    print(f"❌ A packed context exceeded the {BUDGET} token budget")
+                    success = False
+                if builder_name == 'packed' and saved <= 0:
+                    print("❌ Packing should send fewer tokens than the unpacked context")
+                    success = False
+    if success:
+        print("✅ Packed contexts send each overlapping span once and stay within the budget")
+    return success
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    success = benchmark_context_packing(*args)
+    sys.exit(0 if success else 1)
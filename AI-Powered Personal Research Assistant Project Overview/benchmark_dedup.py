@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate deduplication benchmark for document ingestion
+Ingests a corpus where every paper is uploaded in several versions
+(identical, reformatted, lightly and heavily edited) with and without the
+dedup stage, and reports the dedup ratio per version, the embeddings and
+index size saved, and how many distinct passages fill a top-k search
+
+Usage: python benchmark_dedup.py [num_papers]
+"""
+
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+import flat_layout
+flat_layout.install()
+
+from src.services.dedup import ChunkDeduplicator, MinHashIndex, fingerprint
+from src.services.document_processor import DocumentProcessor, VectorStore
+from mock_openai import MockOpenAIClient
+
+DIMENSION = 256
+K = 10
+VOCABULARY = [f"word{i}" for i in range(5000)]
+
+
+def paper(rng, paragraphs=25):
+    return "\n\n".join(
+        " ".join(" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))) + "."
+                 for _ in range(6))
+        for _ in range(paragraphs))
+
+
+def edit(rng, text, fraction):
+    words = text.split(" ")
+    for i in rng.sample(range(len(words)), int(len(words) * fraction)):
+        words[i] = rng.choice(VOCABULARY)
+    return " ".join(words)
+
+
+VERSIONS = {
+    'original': lambda rng, text: text,
+    'identical copy': lambda rng, text: text,
+    'reformatted': lambda rng, text: text.upper().replace(". ", ".\n"),
+    '0.5% of words edited': lambda rng, text: edit(rng, text, 0.005),
+    '5% of words edited': lambda rng, text: edit(rng, text, 0.05),
+}
+
+
+def ingest(store, processor, document_id, text, indexed=None):
+    """Chunk, embed and index a document; with indexed (a MinHashIndex) deduplicate first"""
+    chunks = processor.chunk_pages([(None, text)])
+    if indexed is None:
+        embeddings = processor.generate_embeddings([chunk for _, chunk in chunks])
+        store.add_embeddings(embeddings, [{'document_id': document_id, 'chunk_index': i, 'text': chunk}
+                                          for i, (_, chunk) in enumerate(chunks)])
+        return len(chunks), 0
+
+    deduplicator = ChunkDeduplicator(document_id, find_indexed=indexed.find)
+    unique = list(deduplicator.filter(chunks))
+    if unique:
+        embeddings = processor.generate_embeddings([chunk for _, chunk in unique])
+        metadata = []
+        for (chunk_index, fp), (_, chunk) in zip(deduplicator.unique, unique):
+            metadata.append({'document_id': document_id, 'chunk_index': chunk_index, 'text': chunk})
+            indexed.add((document_id, chunk_index), fp)
+        store.add_embeddings(embeddings, metadata)
+    duplicates = deduplicator.take_duplicates()
+    store.link_duplicates([original for *_, original in duplicates],
+                          [{'document_id': document_id, 'chunk_index': chunk_index, 'text': chunk}
+                           for chunk_index, _, chunk, _, _ in duplicates])
+    return deduplicator.chunks_seen, deduplicator.duplicates_found
+
+
+def store_bytes(store, directory, name):
+    path = os.path.join(directory, name)
+    store.save_to_file(path)
+    return sum(os.path.getsize(p) for p in glob.glob(f"{glob.escape(path)}.*"))
+
+
+def distinct_passages(store, queries):
+    """Mean number of different passages among the top K hits"""
+    total = 0
+    for query in queries:
+        hits = store.search(query, k=K)
+        total += len({fingerprint(chunk['text']).content_hash for chunk, _ in hits})
+    return total / len(queries)
+
+
+def benchmark_dedup(num_papers=20):
+    rng = random.Random(42)
+    papers = [paper(rng) for _ in range(num_papers)]
+    print(f"🔄 Ingesting {num_papers} papers in {len(VERSIONS)} versions each (mock embeddings, dim {DIMENSION})")
+
+    results = {}
+    for label, deduplicate in (('without dedup', False), ('with dedup', True)):
+        client = MockOpenAIClient(dimension=DIMENSION)
+        processor = DocumentProcessor(openai_client=client)
+        store = VectorStore(dimension=DIMENSION, collapse_similarity=0.8 if deduplicate else None)
+        indexed = MinHashIndex() if deduplicate else None
+        per_version = {version: [0, 0] for version in VERSIONS}
+        edit_rng = random.Random(7)
+
+        start = time.perf_counter()
+        for p, text in enumerate(papers):
+            for version, make in VERSIONS.items():
+                chunks, duplicates = ingest(store, processor, f'paper-{p}-{version}',
+                                            make(edit_rng, text), indexed)
+                per_version[version][0] += chunks
+                per_version[version][1] += duplicates
+        elapsed = time.perf_counter() - start
+
+        queries = [processor.generate_embeddings(processor.chunk_text(text)[:3]) for text in papers]
+        with tempfile.TemporaryDirectory() as directory:
+            size = store_bytes(store, directory, 'store')
+        results[label] = {
+            'per_version': per_version,
+            'vectors': len(store.chunk_metadata),
+            'embedded': client.embeddings.inputs,
+            'bytes': size,
+            'seconds': elapsed,
+            'distinct': distinct_passages(store, [q for batch in queries for q in batch])
+        }
+
+    print(f"{'version':<22} {'chunks':>7} {'deduplicated':>13}")
+    for version, (chunks, duplicates) in results['with dedup']['per_version'].items():
+        print(f"{version:<22} {chunks:>7} {duplicates / chunks:12.0%}")
+
+    print(f"\n{'':<14} {'vectors':>8} {'embedded':>9} {'store MB':>9} {'ingest s':>9} {'distinct top-' + str(K):>15}")
+    for label, result in results.items():
+        print(f"{label:<14} {result['vectors']:>8} {result['embedded']:>9} {result['bytes'] / 1e6:9.2f} "
+              f"{result['seconds']:9.2f} {result['distinct']:15.1f}")
+
+    baseline, deduped = results['without dedup'], results['with dedup']
+    print(f"\n📊 Index and metadata {1 - deduped['bytes'] / baseline['bytes']:.0%} smaller, "
+          f"{baseline['embedded'] - deduped['embedded']} embeddings saved")
+    if deduped['per_version']['identical copy'][1] != deduped['per_version']['identical copy'][0]:
+        print("❌ Identical copies were not fully deduplicated")
+        return False
+    if deduped['distinct'] <= baseline['distinct']:
+        print("❌ Collapsing duplicates did not diversify search results")
+        return False
+    print("✅ Duplicates are linked instead of indexed and collapsed in search results")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    success = benchmark_dedup(*args)
+    sys.exit(0 if success else 1)
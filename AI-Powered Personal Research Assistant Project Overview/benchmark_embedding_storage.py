@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Embedding storage benchmark for DocumentChunk
+Compares database size and decode throughput of the legacy JSON text
+column with the binary formats, and checks that migrate_embeddings
+converts a legacy database without changing its vectors
+
+Usage: python benchmark_embedding_storage.py [num_chunks] [dimension]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from flask import Flask
+import flat_layout
+flat_layout.install()
+
+from src.models.document import (Document, DocumentChunk, EMBEDDING_FORMATS, db,
+                                 migrate_embeddings)
+
+CHUNKS_PER_DOCUMENT = 100
+
+
+def create_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def fill_database(vectors, embedding_format):
+    """Insert one chunk per vector; embedding_format None writes legacy JSON"""
+    for start in range(0, len(vectors), CHUNKS_PER_DOCUMENT):
+        document_id = f'doc-{start // CHUNKS_PER_DOCUMENT:05d}'
+        db.session.add(Document(document_id=document_id, filename=f'{document_id}.txt',
+                                content='', file_type='txt'))
+        for i, vector in enumerate(vectors[start:start + CHUNKS_PER_DOCUMENT]):
+            chunk = DocumentChunk(document_id=document_id, chunk_index=i, text='')
+            if embedding_format is None:
+                chunk.embedding = json.dumps(vector.tolist())
+            else:
+                chunk.set_embedding(vector, embedding_format)
+            db.session.add(chunk)
+    db.session.commit()
+
+
+def time_json_decode():
+    """Legacy path: fetch every chunk and json.loads its embedding"""
+    start = time.perf_counter()
+    matrix = np.array([json.loads(chunk.embedding) for chunk in DocumentChunk.query.all()],
+                      dtype=np.float32)
+    return matrix, time.perf_counter() - start
+
+
+def time_bulk_load():
+    start = time.perf_counter()
+    _, matrix = DocumentChunk.load_embeddings()
+    return matrix, time.perf_counter() - start
+
+
+def benchmark_embedding_storage(num_chunks=5000, dimension=1536):
+    print(f"🔄 Storing {num_chunks} embeddings of dimension {dimension}")
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((num_chunks, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    print(f"\n{'format':<9} {'db MB':>8} {'bytes/chunk':>12} {'load s':>8} {'vectors/s':>10} {'max cos err':>12}")
+    success = True
+    with tempfile.TemporaryDirectory() as directory:
+        for embedding_format in (None,) + EMBEDDING_FORMATS:
+            label = embedding_format or 'json'
+            db_path = os.path.join(directory, f'{label}.db')
+            app = create_app(db_path)
+            with app.app_context():
+                db.create_all()
+                fill_database(vectors, embedding_format)
+                db.session.remove()
+                if embedding_format is None:
+                    matrix, seconds = time_json_decode()
+                else:
+                    matrix, seconds = time_bulk_load()
+            size = os.path.getsize(db_path)
+            cos_error = float(np.max(1 - np.sum(matrix * vectors, axis=1)))
+            print(f"{label:<9} {size / 1e6:8.1f} {size / num_chunks:12.0f} {seconds:8.3f} "
+                  f"{num_chunks / seconds:10.0f} {cos_error:12.2e}")
+
+        print("\n🔍 Migrating the legacy JSON database...")
+        app = create_app(os.path.join(directory, 'json.db'))
+        with app.app_context():
+            before = os.path.getsize(os.path.join(directory, 'json.db'))
+            start = time.perf_counter()
+            converted = migrate_embeddings()
+            seconds = time.perf_counter() - start
+            keys, matrix = DocumentChunk.load_embeddings()
+            after = os.path.getsize(os.path.join(directory, 'json.db'))
+            print(f"Converted {converted} embeddings in {seconds:.2f}s, "
+                  f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+            if converted != num_chunks or not np.array_equal(matrix, vectors):
+                print("❌ Migrated embeddings differ from the originals")
+                success = False
+            if migrate_embeddings() != 0:
+                print("❌ Second migration converted rows again")
+                success = False
+
+            document_ids = [f'doc-{i:05d}' for i in (1, 3)]
+            keys, matrix = DocumentChunk.load_embeddings(document_ids)
+            expected = np.concatenate([vectors[100:200], vectors[300:400]])
+            if keys[0] != ('doc-00001', 0) or not np.array_equal(matrix, expected):
+                print("❌ Loading selected documents returned the wrong rows")
+                success = False
+
+    if success:
+        print("✅ Binary embeddings round-trip and migrate correctly")
+    return success
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    success = benchmark_embedding_storage(*args)
+    sys.exit(0 if success else 1)
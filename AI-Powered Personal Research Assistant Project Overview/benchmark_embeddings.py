@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Embedding throughput benchmark for the AI Research Assistant
+Compares per-chunk embedding calls with the batched pipeline using a
+local mock client with simulated network latency (no OpenAI API needed)
+"""
+
+import sys
+import os
+import time
+import tempfile
+import flat_layout
+flat_layout.install()
+
+from src.services.document_processor import DocumentProcessor
+from src.services.embedding_cache import EmbeddingCache
+from mock_openai import MockOpenAIClient
+
+NUM_CHUNKS = 300
+REQUEST_LATENCY = 0.05      # seconds per embeddings request
+PER_INPUT_LATENCY = 0.0005  # seconds per text in a request
+
+
+def make_chunks(n):
+    base = "Retrieval-augmented generation grounds answers in uploaded documents. "
+    return [f"Chunk {i}. " + base * 14 for i in range(n)]
+
+
+def run(label, processor, chunks, batched):
+    client = processor.openai_client
+    start = time.perf_counter()
+    if batched:
+        embeddings = processor.generate_embeddings(chunks)
+    else:
+        embeddings = [processor.generate_embedding(chunk) for chunk in chunks]
+    elapsed = time.perf_counter() - start
+
+    assert len(embeddings) == len(chunks)
+    print(f"{label:<28} {elapsed:7.2f}s  {len(chunks) / elapsed:8.1f} chunks/s  "
+          f"{client.embeddings.calls:4d} requests")
+    return embeddings
+
+
+def benchmark_embeddings():
+    print("🔄 Benchmarking embedding generation (mock client)...")
+    chunks = make_chunks(NUM_CHUNKS)
+
+    def new_processor(**kwargs):
+        client = MockOpenAIClient(embedding_latency=REQUEST_LATENCY,
+                                  per_input_latency=PER_INPUT_LATENCY)
+        return DocumentProcessor(openai_client=client, **kwargs)
+
+    serial = run("serial (1 per chunk)", new_processor(), chunks, batched=False)
+    batched = run("batched", new_processor(), chunks, batched=True)
+    run("batched, concurrency=1", new_processor(max_concurrency=1), chunks, batched=True)
+    run("batched, concurrency=8", new_processor(max_concurrency=8), chunks, batched=True)
+
+    # Batching must not change results or their order
+    assert serial == batched
+    print("✅ Batched embeddings match per-chunk embeddings in order")
+
+    print("\n💾 Benchmarking with the embedding cache...")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, "embedding_cache.db")
+        cache = EmbeddingCache(cache_path)
+        run("cold cache", new_processor(embedding_cache=cache), chunks, batched=True)
+        revised = chunks[:285] + make_chunks(NUM_CHUNKS + 15)[NUM_CHUNKS:]
+        run("revised document (95% same)", new_processor(embedding_cache=cache), revised, batched=True)
+        cache.close()
+
+        # A fresh process only has the disk tier to go on
+        cache = EmbeddingCache(cache_path)
+        processor = new_processor(embedding_cache=cache)
+        run("re-ingest after restart", processor, chunks, batched=True)
+        assert processor.openai_client.embeddings.calls == 0
+        print(f"✅ Re-ingest made no embedding calls. Cache stats: {cache.stats()}")
+        cache.close()
+    return True
+
+
+if __name__ == "__main__":
+    success = benchmark_embeddings()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Document-filtered retrieval benchmark for the vector store
+Compares the old approach (global top-k, then drop chunks from other
+documents) with filtering inside VectorStore.search on 1k documents
+
+Usage: python benchmark_filtered_search.py [chunks_per_document] [dimension]
+"""
+
+import sys
+import time
+import numpy as np
+import flat_layout
+flat_layout.install()
+
+from src.services.document_processor import VectorStore
+from synthetic_data import synthetic_vectors
+
+NUM_DOCUMENTS = 1000
+NUM_QUERIES = 100
+K = 5
+
+
+def build_store(chunks_per_document, dimension, **kwargs):
+    store = VectorStore(dimension=dimension, **kwargs)
+    vectors = synthetic_vectors(NUM_DOCUMENTS * chunks_per_document, dimension)
+    for d in range(NUM_DOCUMENTS):
+        rows = vectors[d * chunks_per_document:(d + 1) * chunks_per_document]
+        store.add_embeddings(rows, [{'document_id': f'doc-{d}', 'chunk_index': i, 'text': ''}
+                                    for i in range(len(rows))])
+    if store._maintenance_thread is not None:
+        store._maintenance_thread.join()
+    return store
+
+
+def run(store, queries, filters, prefilter):
+    """Returns (ms/query, mean results per query)"""
+    returned = 0
+    start = time.perf_counter()
+    for query, document_ids in zip(queries, filters):
+        if prefilter:
+            results = store.search(query, K, document_ids)
+        else:
+            results = [(chunk, score) for chunk, score in store.search(query, K)
+                       if document_ids is None or chunk['document_id'] in document_ids]
+        returned += len(results)
+    elapsed = time.perf_counter() - start
+    return elapsed / len(queries) * 1000, returned / len(queries)
+
+
+def benchmark_filtered_search(chunks_per_document=100, dimension=384):
+    rng = np.random.default_rng(2)
+    queries = synthetic_vectors(NUM_QUERIES, dimension, seed=3)
+
+    for index_type in ('flat', 'hnsw'):
+        print(f"\n🔄 {index_type} index: {NUM_DOCUMENTS} documents x {chunks_per_document} chunks, "
+              f"dim {dimension}, k={K}")
+        store = build_store(chunks_per_document, dimension, index_type=index_type, promote_threshold=0)
+        print(f"{'filter':<16} {'post ms':>8} {'post hits':>10} {'pre ms':>8} {'pre hits':>9}")
+
+        for num_docs in (None, 1, 10, 100, 500):
+            if num_docs is None:
+                filters = [None] * NUM_QUERIES
+                label = "none"
+            else:
+                filters = [[f'doc-{d}' for d in rng.choice(NUM_DOCUMENTS, num_docs, replace=False)]
+                           for _ in range(NUM_QUERIES)]
+                label = f"{num_docs} documents"
+            post_ms, post_hits = run(store, queries, filters, prefilter=False)
+            pre_ms, pre_hits = run(store, queries, filters, prefilter=True)
+            print(f"{label:<16} {post_ms:8.3f} {post_hits:10.2f} {pre_ms:8.3f} {pre_hits:9.2f}")
+            if pre_hits < K:
+                print(f"❌ Filtered search returned fewer than {K} results")
+                return False
+
+    print("\n✅ Filtered searches returned a full k results")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    success = benchmark_filtered_search(*args)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Lexical search benchmark for the BM25 inverted index
+Builds a segment for a synthetic corpus of chunks with Zipf-distributed
+words and rare identifiers, opens it the way a loaded store does, adds
+and removes chunks in memory on top, and measures query latency for
+identifier, mixed and common-word queries
+
+Usage: python benchmark_lexical_search.py [num_chunks]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import flat_layout
+flat_layout.install()
+
+import numpy as np
+
+from src.services.lexical_index import LexicalIndex, LexicalSegment, SegmentBuilder
+
+WORDS_PER_CHUNK = 60
+VOCABULARY_SIZE = 50000
+IDENTIFIER_EVERY = 50  # One chunk in this many names an identifier
+NUM_IDENTIFIERS = 5000
+QUERIES = 500
+
+
+def corpus(num_chunks, seed=0):
+    """Yield (vector_id, text) for synthetic chunks"""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(VOCABULARY_SIZE)])
+    for first in range(0, num_chunks, 10000):
+        count = min(10000, num_chunks - first)
+        ranks = np.minimum(rng.zipf(1.2, size=(count, WORDS_PER_CHUNK)), VOCABULARY_SIZE) - 1
+        for i, row in enumerate(vocabulary[ranks]):
+            vector_id = first + i
+            text = " ".join(row)
+            if vector_id % IDENTIFIER_EVERY == 0:
+                text += f" GENE{vector_id // IDENTIFIER_EVERY % NUM_IDENTIFIERS}-A"
+            yield vector_id, text
+
+
+def latency(index, queries, k=10):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def benchmark_lexical_search(num_chunks=1000000):
+    print(f"🔄 Building a lexical index over {num_chunks} chunks of {WORDS_PER_CHUNK} words...")
+    builder = SegmentBuilder()
+    start = time.perf_counter()
+    for vector_id, text in corpus(num_chunks):
+        builder.add(vector_id, text)
+    build_seconds = time.perf_counter() - start
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'vector_store.000001.lexical')
+    start = time.perf_counter()
+    builder.write(path)
+    write_seconds = time.perf_counter() - start
+    del builder
+
+    start = time.perf_counter()
+    index = LexicalIndex(LexicalSegment(path))
+    open_ms = (time.perf_counter() - start) * 1000
+
+    # Changes since the checkpoint live in memory on top of the segment
+    start = time.perf_counter()
+    for vector_id, text in corpus(10000, seed=1):
+        index.add(num_chunks + vector_id, text)
+    add_us = (time.perf_counter() - start) / 10000 * 1e6
+    for vector_id in range(0, num_chunks, 997):
+        index.remove(vector_id)
+
+    print(f"📊 Tokenized {num_chunks / build_seconds:.0f} chunks/s, wrote the segment in {write_seconds:.1f}s "
+          f"({os.path.getsize(path) / 1e6:.0f} MB), opened it in {open_ms:.1f}ms, "
+          f"added chunks in memory at {add_us:.0f}µs each")
+
+    rng = np.random.default_rng(2)
+    genes = min(NUM_IDENTIFIERS, num_chunks // IDENTIFIER_EVERY)
+    identifiers = [f"GENE{i}-A" for i in rng.integers(0, genes, QUERIES)]
+    query_sets = {
+        'identifier': identifiers,
+        'identifier + words': [f"{gene} expression w{rng.integers(100, 1000)} w{rng.integers(1000, 5000)}"
+                               for gene in identifiers],
+        'rare words': [f"w{rng.integers(5000, VOCABULARY_SIZE)} w{rng.integers(5000, VOCABULARY_SIZE)}"
+                       for _ in range(QUERIES)],
+        'common words': [f"w{rng.integers(0, 10)} w{rng.integers(10, 100)}" for _ in range(QUERIES)],
+    }
+
+    print(f"{'query':<20} {'p50 ms':>8} {'p99 ms':>8}")
+    results = {}
+    for name, queries in query_sets.items():
+        results[name] = latency(index, queries)
+        print(f"{name:<20} {results[name][0]:8.3f} {results[name][1]:8.3f}")
+
+    found = index.search(identifiers[0], 1)[1]
+    expected = int(identifiers[0][4:-2])
+    if not len(found) or (int(found[0]) // IDENTIFIER_EVERY) % NUM_IDENTIFIERS != expected:
+        print("❌ The identifier query did not find a chunk naming it")
+        return False
+    if results['identifier'][0] >= 1.0:
+        print(f"❌ Identifier queries took {results['identifier'][0]:.3f}ms at the median")
+        return False
+    print(f"✅ Identifier queries answered in under a millisecond over {num_chunks} chunks")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    success = benchmark_lexical_search(*args)
+    sys.exit(0 if success else 1)
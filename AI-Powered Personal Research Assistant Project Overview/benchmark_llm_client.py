@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Load test of the shared LLM client against the local fake OpenAI server
+Many users each embed a question and ask for an answer, against a server
+that rate limits each model. Compares one OpenAI client per service with
+the SDK's own retries, as before, with one shared LLMClient, and reports
+successes, failures, 429s, connections opened and request latency
+
+Usage: python benchmark_llm_client.py [users] [requests_per_second]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import flat_layout
+flat_layout.install()
+
+import numpy as np
+import openai
+
+from fake_openai_server import FakeOpenAIServer
+from src.services.llm_client import LLMClient
+
+QUESTIONS_PER_USER = 4
+DISTINCT_QUESTIONS = 40  # Users often ask the same questions
+LATENCY = 0.05
+
+
+def ask(embedding_client, chat_client, question):
+    """Embed a question and answer it, as /chat does; returns (seconds, error or None)"""
+    start = time.perf_counter()
+    try:
+        embedding_client.embeddings.create(model="text-embedding-ada-002", input=question)
+        chat_client.chat.completions.create(model="gpt-4", max_tokens=200,
+                                            messages=[{"role": "user", "content": question}])
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, e
+
+
+def run(name, users, requests_per_second, make_clients):
+    server = FakeOpenAIServer(requests_per_second=requests_per_second, latency=LATENCY).start()
+    try:
+        embedding_client, chat_client = make_clients(server.url)
+        questions = [f"Question {(user * QUESTIONS_PER_USER + i) % DISTINCT_QUESTIONS}"
+                     for user in range(users) for i in range(QUESTIONS_PER_USER)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            results = list(executor.map(lambda q: ask(embedding_client, chat_client, q), questions))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop()
+
+    latencies = np.array([seconds for seconds, error in results if error is None])
+    failed = sum(error is not None for _, error in results)
+    row = {
+        'ok': len(latencies), 'failed': failed, 'sent': server.requests, '429s': server.rate_limited,
+        'connections': server.connections, 'seconds': elapsed,
+        'p50': np.percentile(latencies, 50) if len(latencies) else float('nan'),
+        'p95': np.percentile(latencies, 95) if len(latencies) else float('nan'),
+    }
+    print(f"{name:<26} {row['ok']:>5} {row['failed']:>7} {row['sent']:>6} {row['429s']:>6} "
+          f"{row['connections']:>6} {row['seconds']:8.2f} {row['p50']:7.2f} {row['p95']:7.2f}")
+    return row
+
+
+def benchmark_llm_client(users=64, requests_per_second=40):
+    print(f"🔄 {users} users asking {QUESTIONS_PER_USER} questions each, "
+          f"server limit {requests_per_second} requests/s per model, {LATENCY * 1000:.0f}ms latency")
+    print(f"{'client':<26} {'ok':>5} {'failed':>7} {'sent':>6} {'429s':>6} {'conns':>6} "
+          f"{'seconds':>8} {'p50 s':>7} {'p95 s':>7}")
+
+    def per_service_clients(url):
+        # DocumentProcessor and RAGService each built openai.OpenAI() with default retries
+        return (openai.OpenAI(base_url=url, api_key='test-key'),
+                openai.OpenAI(base_url=url, api_key='test-key'))
+
+    def shared_client(url):
+        client = LLMClient(openai.OpenAI(base_url=url, api_key='test-key', max_retries=0),
+                           requests_per_minute=requests_per_second * 60 * 0.9)
+        return client, client
+
+    before = run('per-service SDK clients', users, requests_per_second, per_service_clients)
+    after = run('shared LLMClient', users, requests_per_second, shared_client)
+
+    if after['failed'] or after['429s'] > before['429s'] / 10 or after['sent'] >= before['sent']:
+        print("❌ The shared client should complete every request with far fewer 429s and requests")
+        return False
+    print(f"✅ Shared client: no failures (was {before['failed']}), {after['429s']} 429s (was {before['429s']}), "
+          f"{after['sent']} requests sent (was {before['sent']})")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    success = benchmark_llm_client(*args)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+PDF extraction benchmark for the document processor
+Generates a multi-page PDF and compares serial page extraction with the
+process pool, then checks that chunks carry the right page numbers
+
+Usage: python benchmark_pdf_extraction.py [num_pages] [workers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import flat_layout
+flat_layout.install()
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+
+from src.services.document_processor import DocumentProcessor
+
+LINES_PER_PAGE = 45
+
+
+def page_lines(page_number):
+    return [f"Page {page_number} line {line}: retrieval augmented generation grounds answers in sources."
+            for line in range(LINES_PER_PAGE)]
+
+
+def generate_pdf(path, num_pages):
+    """Write a plain-text PDF with one Helvetica text stream per page"""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for page_number in range(1, num_pages + 1):
+        page_id, content_id = 2 + 2 * page_number, 3 + 2 * page_number
+        kids.append(f"{page_id} 0 R")
+        text = "\n".join(f"({line}) Tj T*" for line in page_lines(page_number))
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td\n{text}\nET".encode('latin-1')
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {num_pages} >>".encode()
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id]))
+        xref = f.tell()
+        count = max(objects) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+        for object_id in range(1, count):
+            f.write(b"%010d 00000 n \n" % offsets[object_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+
+
+def benchmark_pdf_extraction(num_pages=500, workers=None):
+    workers = workers or os.cpu_count() or 1
+    print(f"🔄 Extracting a generated {num_pages}-page PDF ({os.cpu_count()} CPUs)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'generated.pdf')
+        generate_pdf(path, num_pages)
+
+        serial = DocumentProcessor(openai_client=object(), parallel_pdf_pages=num_pages + 1)
+        parallel = DocumentProcessor(openai_client=object(), parallel_pdf_pages=2, pdf_workers=workers)
+
+        results = {}
+        for label, processor in (('serial', serial), (f'{workers} workers', parallel)):
+            start = time.perf_counter()
+            pages = processor.extract_pages_from_file(path, 'pdf')
+            elapsed = time.perf_counter() - start
+            results[label] = pages
+            print(f"{label:<12} {elapsed:7.2f}s {num_pages / elapsed:8.1f} pages/s")
+
+    serial_pages, parallel_pages = results.values()
+    if serial_pages != parallel_pages:
+        print("❌ Parallel extraction differs from serial extraction")
+        return False
+    if [page_number for page_number, _ in parallel_pages] != list(range(1, num_pages + 1)):
+        print("❌ Pages are missing or out of order")
+        return False
+
+    chunks = parallel.chunk_pages(parallel_pages)
+    for page_number, chunk in chunks:
+        # A chunk starts on its page, possibly mid-line, so the first full
+        # line in it is from that page or, at a page break, the next one
+        first_line = int(chunk[chunk.index("Page "):].split()[1])
+        if first_line not in (page_number, page_number + 1):
+            print(f"❌ Chunk attributed to page {page_number} starts: {chunk[:60]!r}")
+            return False
+    print(f"✅ {len(chunks)} chunks attributed to pages 1-{chunks[-1][0]}")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    success = benchmark_pdf_extraction(*args)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Vector store startup benchmark
+Saves stores of increasing size and measures, in a fresh process each,
+how long load_from_file takes and how much private (unshared) memory
+the process holds, with the checkpoint index loaded into RAM and
+memory-mapped. Mapped file pages are shared between worker processes
+and are not counted.
+
+Usage: python benchmark_startup.py [dimension]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import flat_layout
+flat_layout.install()
+
+from src.services.document_processor import VectorStore
+from synthetic_data import synthetic_vectors
+
+CORPUS_SIZES = [10000, 50000, 200000]
+CHUNK_TEXT = "lorem ipsum dolor sit amet " * 40  # ~1 KB per chunk
+
+
+def private_mb():
+    """Resident anonymous memory of this process (Linux)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def build_store(path, num_vectors, dimension):
+    store = VectorStore(dimension=dimension)
+    vectors = synthetic_vectors(num_vectors, dimension)
+    batch = 10000
+    for start in range(0, num_vectors, batch):
+        rows = vectors[start:start + batch]
+        store.add_embeddings(rows, [{'document_id': f'doc-{i // 100}', 'chunk_index': i % 100,
+                                     'text': CHUNK_TEXT}
+                                    for i in range(start, start + len(rows))])
+    store.save_to_file(path)
+
+
+def measure_load(path, dimension, mmap_index):
+    """Load the store in this process and print 'seconds private_mb first_query_ms private_mb'"""
+    before = private_mb()
+    start = time.perf_counter()
+    store = VectorStore(dimension=dimension, mmap_index=mmap_index)
+    store.load_from_file(path)
+    load_seconds = time.perf_counter() - start
+    loaded = private_mb() - before
+
+    query = synthetic_vectors(1, dimension, seed=1)[0]
+    start = time.perf_counter()
+    store.search(query, 5)
+    query_ms = (time.perf_counter() - start) * 1000
+    print(f"{load_seconds} {loaded} {query_ms} {private_mb() - before}")
+
+
+def benchmark_startup(dimension=384):
+    print(f"🔄 Startup cost by corpus size (dim {dimension}, ~1 KB text per chunk)")
+    print(f"{'vectors':>8} {'mode':<5} {'load s':>8} {'MB loaded':>10} {'1st query ms':>13} {'MB queried':>11}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for num_vectors in CORPUS_SIZES:
+            path = os.path.join(directory, f'store-{num_vectors}')
+            build_store(path, num_vectors, dimension)
+            for mmap_index in (False, True):
+                output = subprocess.run(
+                    [sys.executable, __file__, '--measure', path, str(dimension), str(int(mmap_index))],
+                    check=True, capture_output=True, text=True).stdout
+                load_seconds, loaded, query_ms, queried = (float(value) for value in output.split())
+                mode = 'mmap' if mmap_index else 'load'
+                results[num_vectors, mode] = queried
+                print(f"{num_vectors:>8} {mode:<5} {load_seconds:8.3f} {loaded:10.1f} "
+                      f"{query_ms:13.3f} {queried:11.1f}")
+
+    smallest, largest = CORPUS_SIZES[0], CORPUS_SIZES[-1]
+    growth = results[largest, 'mmap'] / max(results[smallest, 'mmap'], 1.0)
+    print(f"\n📊 Memory-mapped private memory grew {growth:.1f}x for {largest // smallest}x more vectors")
+    if results[largest, 'mmap'] >= results[largest, 'load']:
+        print("❌ Memory-mapped startup did not reduce private memory")
+        return False
+    print("✅ Memory-mapped startup keeps the corpus out of private memory")
+    return True
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--measure']:
+        measure_load(sys.argv[2], int(sys.argv[3]), sys.argv[4] == '1')
+        sys.exit(0)
+    args = [int(arg) for arg in sys.argv[1:2]]
+    success = benchmark_startup(*args)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Peak memory benchmark for document ingestion
+Runs extraction, chunking and embedding of generated text files of
+increasing size, materialized (whole text, all chunks, all embeddings)
+and streamed through DocumentProcessor's generator pipeline
+
+Usage: python benchmark_streaming_ingestion.py [max_megabytes]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import flat_layout
+flat_layout.install()
+
+from src.services.document_processor import DocumentProcessor
+from mock_openai import MockOpenAIClient
+
+DIMENSION = 256
+
+
+def write_text_file(path, megabytes):
+    paragraph = ("Streaming ingestion keeps memory flat. Each sentence is numbered {} so "
+                 "that chunks differ and none are served from a cache.\n")
+    with open(path, 'w', encoding='utf-8') as f:
+        i = 0
+        while f.tell() < megabytes * 1024 * 1024:
+            f.write(paragraph.format(i))
+            i += 1
+
+
+def materialized(processor, path):
+    text = processor.extract_text_from_file(path, 'txt')
+    chunks = processor.chunk_text(text)
+    embeddings = processor.generate_embeddings(chunks)
+    return len(embeddings)
+
+
+def streamed(processor, path):
+    count = 0
+    pieces = processor.iter_text_from_file(path, 'txt')
+    for group in processor.embed_chunks(processor.iter_chunks(pieces)):
+        count += len(group)
+    return count
+
+
+def measure(pipeline, path):
+    processor = DocumentProcessor(openai_client=MockOpenAIClient(dimension=DIMENSION))
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = pipeline(processor, path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, peak / 1024 / 1024, elapsed
+
+
+def benchmark_streaming_ingestion(max_megabytes=16):
+    sizes = [size for size in (1, 4, 16, 64) if size <= max_megabytes]
+    print(f"🔄 Peak Python memory while ingesting text files (mock embeddings, dim {DIMENSION})")
+    print(f"{'file MB':>8} {'chunks':>8} {'materialized MB':>16} {'streamed MB':>12} {'streamed s':>11}")
+
+    streamed_peaks = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f'{size}.txt')
+            write_text_file(path, size)
+            count, materialized_peak, _ = measure(materialized, path)
+            streamed_count, streamed_peak, seconds = measure(streamed, path)
+            if streamed_count != count:
+                print(f"❌ Streaming produced {streamed_count} chunks instead of {count}")
+                return False
+            streamed_peaks.append(streamed_peak)
+            print(f"{size:>8} {count:>8} {materialized_peak:16.1f} {streamed_peak:12.1f} {seconds:11.2f}")
+
+    # The streamed peak levels off once a document fills an embedding group
+    if len(streamed_peaks) > 1 and streamed_peaks[-1] > 1.5 * streamed_peaks[-2]:
+        print("❌ Streaming peak memory grew with the document size")
+        return False
+    print("✅ Streaming peak memory is independent of the document size")
+    return True
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    success = benchmark_streaming_ingestion(*args)
+    sys.exit(0 if success else 1)
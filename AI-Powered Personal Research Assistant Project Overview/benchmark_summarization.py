@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Summarization benchmark for full-length documents
+Summarizes a long document built from the sample corpus with a mock LLM
+of fixed latency, and reports LLM calls, wall-clock time and how much of
+the document is read at several concurrency limits, next to the previous
+summary of the first 4000 characters and a re-summary with another
+number of bullets
+
+Usage: python benchmark_summarization.py [kilobytes] [llm_latency_seconds]
+"""
+
+import math
+import sys
+import flat_layout
+flat_layout.install()
+
+from benchmark_chunking import sample_corpus
+from mock_openai import MockOpenAIClient
+from src.services.summarizer import DocumentSummarizer
+
+PREVIOUS_LIMIT = 4000  # Characters the previous summarize_document read
+
+
+def long_document(size):
+    """Distinct sections of the sample corpus, about size characters in all"""
+    corpus = sample_corpus()
+    copies = size // len(corpus) + 1
+    return "\n\n".join(f"# Part {i + 1}\n\n{corpus}" for i in range(copies))[:size]
+
+
+def benchmark_summarization(kilobytes=300, llm_latency=0.3):
+    document = long_document(kilobytes * 1024)
+    print(f"🔄 Summarizing a {len(document) // 1024} KB document, {llm_latency}s per LLM call")
+    print(f"{'mode':<28} {'read':>6} {'calls':>6} {'levels':>7} {'seconds':>8}")
+    print(f"{'previous (first 4000 chars)':<28} {PREVIOUS_LIMIT / len(document):6.1%} {1:>6} {0:>7} "
+          f"{llm_latency:8.2f}")
+
+    success = True
+    for concurrency in (1, 4, 8):
+        client = MockOpenAIClient(chat_latency=llm_latency)
+        summarizer = DocumentSummarizer(client, max_concurrency=concurrency)
+        result = summarizer.summarize(document, max_bullets=5)
+        print(f"{f'map-reduce, concurrency {concurrency}':<28} {1:6.0%} {result['llm_calls']:>6} "
+              f"{result['reduce_levels']:>7} {result['seconds']:8.2f}")
+        # Map rounds of `concurrency` calls, then the merge and final calls
+        ideal = (math.ceil(result['sections'] / concurrency) + result['llm_calls'] - result['sections']) * llm_latency
+        if result['seconds'] > ideal * 1.5 + 0.2:
+            print(f"❌ Concurrency {concurrency} took {result['seconds']:.2f}s, expected about {ideal:.2f}s")
+            success = False
+
+    again = summarizer.summarize(document, max_bullets=3)
+    print(f"{'re-summary, 3 bullets':<28} {1:6.0%} {again['llm_calls']:>6} {again['reduce_levels']:>7} "
+          f"{again['seconds']:8.2f}")
+    if again['llm_calls'] != 1:
+        print("❌ Re-summarizing with cached notes should take one call")
+        success = False
+    if success:
+        print(f"✅ The whole document is read in {result['sections']} sections; "
+              f"re-summaries take one call")
+    return success
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:3]]
+    if args:
+        args[0] = int(args[0])
+    success = benchmark_summarization(*args)
+    sys.exit(0 if success else 1)
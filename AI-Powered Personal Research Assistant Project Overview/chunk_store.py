@@ -0,0 +1,274 @@
+"""
+Compact, memory-mapped storage for chunk metadata
+
+A chunk store file holds one record per vector ID (the chunk's metadata
+as JSON followed by its text), sorted by ID, plus offset arrays and a
+document -> vector IDs index. Records of duplicate chunks linked to a
+vector follow, with the IDs of their vectors, in the order written. Opening a store only maps the file and reads
+the footer; a chunk's record is decoded when it is looked up, so startup
+cost and memory do not grow with the number of chunks, and processes that
+open the same file share its pages.
+
+Layout: [records][arrays][footer JSON][footer length: uint64][MAGIC]
+"""
+
+import heapq
+import json
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from src.services.vector_persistence import fsync_directory
+
+MAGIC = b'RACHUNK1'
+TRAILER = struct.Struct('<Q8s')
+
+
+def write_chunk_store(path: str, chunks: Iterable[Tuple[int, dict]], info: dict = None,
+                      links: Iterable[Tuple[int, dict]] = ()):
+    """
+    Stream (vector_id, metadata) pairs, in increasing ID order, into a new store
+
+    info is a small JSON-serializable dict stored in the footer. links are
+    (vector_id, metadata) pairs of duplicate chunks, in any order; they are
+    read after the last chunk, so a generator can depend on the chunks
+    streamed before it. Raises ValueError, leaving any existing store in
+    place, if the chunk IDs are not increasing, since lookups binary-search
+    them.
+    """
+    tmp_path = f"{path}.tmp"
+    ids = array('q')
+    record_offsets = array('q', [0])
+    meta_lengths = array('i')
+    document_ids = {}  # Document ID -> array of vector IDs, in insertion order
+    link_ids = array('q')
+    link_meta_lengths = array('i')
+
+    with open(tmp_path, 'wb') as f:
+        for vector_id, chunk in chunks:
+            if ids and vector_id <= ids[-1]:
+                f.close()
+                os.unlink(tmp_path)
+                raise ValueError(f"Chunk store IDs must be increasing: {vector_id} after {ids[-1]}")
+            meta_length, length = _write_record(f, chunk)
+            ids.append(vector_id)
+            meta_lengths.append(meta_length)
+            record_offsets.append(record_offsets[-1] + length)
+            document_ids.setdefault(chunk.get('document_id'), array('q')).append(vector_id)
+
+        link_offsets = array('q', [record_offsets[-1]])
+        for vector_id, chunk in links:
+            meta_length, length = _write_record(f, chunk)
+            link_ids.append(vector_id)
+            link_meta_lengths.append(meta_length)
+            link_offsets.append(link_offsets[-1] + length)
+
+        documents = list(document_ids)
+        document_starts = array('q', [0])
+        for document_id in documents:
+            document_starts.append(document_starts[-1] + len(document_ids[document_id]))
+
+        sections = {}
+        for name, values in (('ids', ids), ('record_offsets', record_offsets),
+                             ('meta_lengths', meta_lengths),
+                             ('document_vector_ids', _concat(document_ids.values())),
+                             ('document_starts', document_starts), ('link_ids', link_ids),
+                             ('link_offsets', link_offsets), ('link_meta_lengths', link_meta_lengths)):
+            # Align arrays so they can be viewed in place
+            f.write(b'\0' * (-f.tell() % 8))
+            sections[name] = [f.tell(), values.typecode, len(values)]
+            values.tofile(f)
+
+        footer = json.dumps({
+            'count': len(ids),
+            'documents': documents,
+            'sections': sections,
+            'info': info or {}
+        }).encode('utf-8')
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def _write_record(f, chunk: dict) -> Tuple[int, int]:
+    """Write a chunk's metadata and text; returns the metadata's length and the record's"""
+    chunk = dict(chunk)
+    text = chunk.pop('text', '').encode('utf-8')
+    meta = json.dumps(chunk).encode('utf-8')
+    f.write(meta)
+    f.write(text)
+    return len(meta), len(meta) + len(text)
+
+
+def _concat(arrays: Iterable[array]) -> array:
+    result = array('q')
+    for values in arrays:
+        result.extend(values)
+    return result
+
+
+def is_chunk_store(path: str) -> bool:
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < TRAILER.size:
+            return False
+        f.seek(-TRAILER.size, os.SEEK_END)
+        return TRAILER.unpack(f.read(TRAILER.size))[1] == MAGIC
+
+
+class ChunkStore:
+    """Read-only view of a chunk store file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer_length, magic = TRAILER.unpack_from(self._mmap, len(self._mmap) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk store")
+        footer_start = len(self._mmap) - TRAILER.size - footer_length
+        footer = json.loads(self._mmap[footer_start:footer_start + footer_length])
+
+        self.info = footer['info']
+        self.documents = footer['documents']
+        arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(typecode), count=count, offset=offset)
+            for name, (offset, typecode, count) in footer['sections'].items()
+        }
+        self.ids = arrays['ids']
+        self._record_offsets = arrays['record_offsets']
+        self._meta_lengths = arrays['meta_lengths']
+        self._document_vector_ids = arrays['document_vector_ids']
+        self._document_starts = arrays['document_starts']
+        # Stores written before links were records have them in info
+        self._link_ids = arrays.get('link_ids', np.empty(0, dtype=np.int64))
+        self._link_offsets = arrays.get('link_offsets')
+        self._link_meta_lengths = arrays.get('link_meta_lengths')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, vector_id: int) -> bool:
+        return self._position(vector_id) is not None
+
+    def get(self, vector_id: int) -> Optional[dict]:
+        """Decode one chunk's metadata, including its text"""
+        position = self._position(vector_id)
+        if position is None:
+            return None
+        return self._read(position)
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        for position in range(len(self.ids)):
+            yield int(self.ids[position]), self._read(position)
+
+    def links(self) -> Iterator[Tuple[int, dict]]:
+        """(vector_id, metadata) of the duplicate chunks linked to vectors, in the order written"""
+        for position in range(len(self._link_ids)):
+            yield int(self._link_ids[position]), self._decode(
+                int(self._link_offsets[position]), int(self._link_offsets[position + 1]),
+                int(self._link_meta_lengths[position]))
+
+    def document_vectors(self) -> Dict[str, np.ndarray]:
+        """Document ID -> vector IDs, as views into the file"""
+        starts = self._document_starts
+        return {
+            document_id: self._document_vector_ids[starts[i]:starts[i + 1]]
+            for i, document_id in enumerate(self.documents)
+        }
+
+    def _position(self, vector_id: int) -> Optional[int]:
+        position = int(np.searchsorted(self.ids, vector_id))
+        if position < len(self.ids) and self.ids[position] == vector_id:
+            return position
+        return None
+
+    def _read(self, position: int) -> dict:
+        return self._decode(int(self._record_offsets[position]), int(self._record_offsets[position + 1]),
+                            int(self._meta_lengths[position]))
+
+    def _decode(self, start: int, end: int, meta_length: int) -> dict:
+        meta_end = start + meta_length
+        chunk = json.loads(self._mmap[start:meta_end])
+        chunk['text'] = self._mmap[meta_end:end].decode('utf-8')
+        return chunk
+
+
+class ChunkMetadata:
+    """
+    Mapping of vector ID -> chunk metadata for VectorStore
+
+    Chunks from the last checkpoint are read lazily from a ChunkStore;
+    chunks added since live in memory, and removed checkpoint chunks are
+    remembered in a set.
+    """
+
+    def __init__(self, base: ChunkStore = None, added: dict = None, removed: set = None):
+        self.base = base
+        self.added = added if added is not None else {}
+        self.removed = removed if removed is not None else set()
+
+    def get(self, vector_id: int, default=None):
+        chunk = self.added.get(vector_id)
+        if chunk is not None:
+            return chunk
+        if self.base is not None and vector_id not in self.removed:
+            chunk = self.base.get(vector_id)
+            if chunk is not None:
+                return chunk
+        return default
+
+    def __getitem__(self, vector_id: int) -> dict:
+        chunk = self.get(vector_id)
+        if chunk is None:
+            raise KeyError(vector_id)
+        return chunk
+
+    def __setitem__(self, vector_id: int, chunk: dict):
+        if self.base is not None and vector_id in self.base:
+            # Replaces the checkpointed chunk
+            self.removed.add(vector_id)
+        self.added[vector_id] = chunk
+
+    def __contains__(self, vector_id: int) -> bool:
+        if vector_id in self.added:
+            return True
+        return self.base is not None and vector_id not in self.removed and vector_id in self.base
+
+    def discard(self, vector_id: int):
+        """Remove a chunk if present"""
+        if self.added.pop(vector_id, None) is None and self.base is not None:
+            if vector_id in self.base:
+                self.removed.add(vector_id)
+
+    def __len__(self) -> int:
+        base_count = len(self.base) - len(self.removed) if self.base is not None else 0
+        return base_count + len(self.added)
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        """
+        All live chunks in increasing vector ID order
+
+        Added chunks can have IDs below the base's largest: a checkpointed
+        vector handed over to a duplicate gets its new chunk here. So the
+        two are merged rather than concatenated.
+        """
+        added = ((vector_id, self.added[vector_id]) for vector_id in sorted(self.added))
+        if self.base is None:
+            return added
+        base = ((vector_id, chunk) for vector_id, chunk in self.base.items()
+                if vector_id not in self.removed and vector_id not in self.added)
+        return heapq.merge(base, added, key=lambda item: item[0])
+
+    def snapshot(self) -> 'ChunkMetadata':
+        """Copy that later changes to this mapping do not affect"""
+        return ChunkMetadata(self.base, dict(self.added), set(self.removed))
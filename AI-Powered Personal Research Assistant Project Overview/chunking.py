@@ -0,0 +1,197 @@
+"""
+Text chunking strategies for DocumentProcessor
+
+A chunker cuts text into chunks of at most chunk_size tokens, ending each
+chunk at the last of the strongest boundaries its strategy knows about (a
+heading, a blank line, the end of a sentence, whitespace) in the second
+half of the window, and starting the next one at a boundary about
+chunk_overlap tokens before that end.
+
+Each chunk is found with a constant number of forward regex scans of its
+window, none of which backtracks over runs of boundary characters, and
+the next chunk starts at least half a window minus the overlap further
+on, so chunking is linear in the length of the text and always makes
+progress, even in text without boundaries or made only of them.
+"""
+
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# Supported chunking strategies
+CHUNKING_STRATEGIES = ('fixed', 'sentence', 'paragraph')
+
+WORD_BOUNDARY = r'\s+'
+# Only the first of a run of punctuation can start a sentence end, so runs are not rescanned
+SENTENCE_BOUNDARY = r'(?<![.!?])[.!?]+["\')\]]*\s+|\n[ \t]*\n\s*'
+PARAGRAPH_BOUNDARY = r'\n[ \t]*\n\s*'
+# Line breaks before a markdown heading
+HEADING_START = re.compile(r'\n(?=#{1,6}\s)')
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about 4 characters per token for English)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Chunker:
+    """Base chunker; subclasses choose the boundaries, strongest first"""
+
+    boundaries = (WORD_BOUNDARY,)
+    heading_aware = False
+
+    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 50,
+                 token_counter: Callable[[str], int] = estimate_tokens):
+        """
+        Args:
+            chunk_size: Maximum tokens per chunk
+            chunk_overlap: Approximate tokens repeated from the end of the previous chunk
+            token_counter: Token count of a text; the default estimates it
+                from the length, pass e.g. a tiktoken encoder's for exact counts
+        """
+        if chunk_size < 1 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_size must be positive and chunk_overlap in [0, chunk_size)")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.token_counter = token_counter
+        self._boundaries = [re.compile(b) for b in self.boundaries]
+
+    def chunk_text(self, text: str) -> List[str]:
+        return [chunk for _, chunk in self.iter_chunks([(None, text)])]
+
+    def iter_chunks(self, pieces: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Split a stream of (page_number, text) pieces into (page_number, chunk) pairs
+
+        The pieces are chunked as their concatenation, and each chunk is
+        attributed to the page it starts on. Only the text from the current
+        chunk onwards, about one chunk plus one piece, is held in memory.
+        """
+        pieces = iter(pieces)
+        buffer = ""  # Text from offset `base` of the document onwards
+        base = 0
+        page_starts = []  # (offset, page_number) of the pieces in the buffer
+        exhausted = False
+        start = 0
+        chars_per_token = CHARS_PER_TOKEN
+
+        while True:
+            max_chars = max(1, int(self.chunk_size * chars_per_token))
+            # Read ahead one character past the window to know if it ends the text
+            if not exhausted and base + len(buffer) <= start + max_chars:
+                parts = [buffer]
+                length = base + len(buffer)
+                for page_number, text in pieces:
+                    page_starts.append((length, page_number))
+                    parts.append(text)
+                    length += len(text)
+                    if length > start + max_chars:
+                        break
+                else:
+                    exhausted = True
+                buffer = "".join(parts)
+
+            text_end = len(buffer)
+            if start - base >= text_end:
+                return
+
+            # Offsets from here on are relative to the buffer
+            first = start - base
+            end, next_start = self._find_end(buffer, first, min(first + max_chars, text_end), text_end)
+            tokens = self.token_counter(buffer[first:end])
+            while tokens > self.chunk_size and end - first > 1:
+                # The token counter disagrees with the estimate: shrink the window
+                limit = first + max(1, (end - first) * self.chunk_size // tokens - 1)
+                end, next_start = self._find_end(buffer, first, limit, text_end)
+                tokens = self.token_counter(buffer[first:end])
+
+            window = buffer[first:end]
+            chunk = window.strip()
+            if chunk:
+                chunk_start = start + len(window) - len(window.lstrip())
+                page_number = None
+                for offset, page in page_starts:
+                    if offset > chunk_start:
+                        break
+                    page_number = page
+                yield page_number, chunk
+            if end == text_end and exhausted:
+                return
+            if tokens and end - first >= max_chars // 2:
+                chars_per_token = min(CHARS_PER_TOKEN, (end - first) / tokens)
+
+            if next_start is None:
+                overlap_chars = int(self.chunk_overlap * chars_per_token)
+                next_start = self._overlap_start(buffer, max(first + 1, end - overlap_chars), end)
+            start = base + next_start
+            # Drop consumed text once it is most of the buffer, so copying stays linear
+            if next_start > len(buffer) // 2:
+                buffer = buffer[next_start:]
+                base = start
+                while len(page_starts) > 1 and page_starts[1][0] <= base:
+                    page_starts.pop(0)
+
+    def _find_end(self, buffer: str, first: int, limit: int, text_end: int) -> Tuple[int, Optional[int]]:
+        """
+        Return (end, next_start) of the chunk starting at first and ending by limit
+
+        next_start is None unless the next chunk must start exactly at end,
+        as it does at a heading, so that the heading starts it.
+        """
+        if limit == text_end:
+            return limit, None
+        half = first + (limit - first) // 2
+        if self.heading_aware:
+            heading = _last_match(HEADING_START, buffer, half, limit)
+            if heading:
+                return heading.end(), heading.end()
+        for pattern in self._boundaries:
+            match = _last_match(pattern, buffer, half, limit)
+            if match:
+                return match.end(), None
+        return limit, None
+
+    def _overlap_start(self, buffer: str, lower: int, end: int) -> int:
+        """First boundary in [lower, end) with text after it, strongest kind first, else lower"""
+        for pattern in self._boundaries:
+            match = pattern.search(buffer, lower, end)
+            # The boundary the chunk ends at would leave no overlap; try a weaker kind
+            if match and buffer[match.end():end].strip():
+                return match.end()
+        return lower
+
+
+def _last_match(pattern: re.Pattern, text: str, start: int, end: int) -> Optional[re.Match]:
+    """Last non-overlapping match of pattern in text[start:end], found in one forward scan"""
+    match = None
+    for match in pattern.finditer(text, start, end):
+        pass
+    return match
+
+
+class FixedChunker(Chunker):
+    """Cuts at whitespace only, ignoring sentence and paragraph structure"""
+
+    boundaries = (WORD_BOUNDARY,)
+
+
+class SentenceChunker(Chunker):
+    """Cuts at the end of a sentence, or at whitespace inside long sentences"""
+
+    boundaries = (SENTENCE_BOUNDARY, WORD_BOUNDARY)
+
+
+class ParagraphChunker(Chunker):
+    """Cuts before markdown headings where it can, else between paragraphs, so short sections share a chunk"""
+
+    boundaries = (PARAGRAPH_BOUNDARY, SENTENCE_BOUNDARY, WORD_BOUNDARY)
+    heading_aware = True
+
+
+def build_chunker(strategy: str = 'sentence', **kwargs) -> Chunker:
+    """Create a chunker for one of CHUNKING_STRATEGIES (kwargs go to Chunker)"""
+    chunkers = {'fixed': FixedChunker, 'sentence': SentenceChunker, 'paragraph': ParagraphChunker}
+    if strategy not in chunkers:
+        raise ValueError(f"Unknown chunking strategy: {strategy}. Supported strategies: {', '.join(CHUNKING_STRATEGIES)}")
+    return chunkers[strategy](**kwargs)
@@ -0,0 +1,142 @@
+"""
+Shared fixtures for the AI Research Assistant tests
+
+Run the suite with `python -m pytest` from the backend directory. The
+routes module keeps its stores in the working directory, so tests run
+from a scratch directory, and every test that goes through the API gets
+empty stores, a new database and mock OpenAI clients of its own.
+
+Tests marked live_openai call the real OpenAI API and are skipped unless
+OPENAI_API_KEY is set.
+"""
+
+import io
+import os
+import tempfile
+import time
+
+import flat_layout
+flat_layout.install()
+LIVE_OPENAI = bool(os.environ.get('OPENAI_API_KEY'))
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+
+import pytest
+from flask import Flask
+
+from mock_openai import MockAsyncOpenAIClient, MockOpenAIClient
+
+# The routes open their stores in the working directory when imported
+_working_directory = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+import research_assistant
+os.chdir(_working_directory)
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "live_openai: calls the real OpenAI API")
+
+
+def pytest_collection_modifyitems(config, items):
+    if LIVE_OPENAI:
+        return
+    skip = pytest.mark.skip(reason="OPENAI_API_KEY is not set")
+    for item in items:
+        if 'live_openai' in item.keywords:
+            item.add_marker(skip)
+
+
+def finish_maintenance(store):
+    """Block until a VectorStore's background checkpoint or compaction has finished"""
+    while store._maintenance_thread is not None and store._maintenance_thread.is_alive():
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def wait_for_maintenance():
+    return finish_maintenance
+
+
+@pytest.fixture
+def routes(tmp_path, monkeypatch):
+    """The routes module, run from tmp_path with fresh stores and mock OpenAI clients"""
+    from answer_cache import AnswerCache
+    from document_processor import DocumentProcessor, VectorStore
+    from embedding_cache import EmbeddingCache
+    from rag_service import RAGService
+
+    monkeypatch.chdir(tmp_path)
+    client = MockOpenAIClient()
+    embedding_cache = EmbeddingCache('embedding_cache.db')
+    vector_store = VectorStore(mmap_index=True)
+    answer_cache = AnswerCache()
+    monkeypatch.setattr(research_assistant, 'embedding_cache', embedding_cache)
+    monkeypatch.setattr(research_assistant, 'document_processor',
+                        DocumentProcessor(openai_client=client, embedding_cache=embedding_cache))
+    monkeypatch.setattr(research_assistant, 'vector_store', vector_store)
+    monkeypatch.setattr(research_assistant, 'answer_cache', answer_cache)
+    monkeypatch.setattr(research_assistant, 'rag_service', RAGService(
+        vector_store, openai_client=client, embedding_cache=embedding_cache, answer_cache=answer_cache,
+        async_openai_client=MockAsyncOpenAIClient(client)))
+    monkeypatch.setattr(research_assistant, 'ingestion_queue', None)
+    yield research_assistant
+
+    if research_assistant.ingestion_queue is not None:
+        research_assistant.ingestion_queue.stop()
+    vector_store.stop_sharing()
+    # Its checkpoints are written relative to the working directory
+    finish_maintenance(vector_store)
+
+
+@pytest.fixture
+def app(routes):
+    """Flask app serving the routes over a new database"""
+    from document import db, migrate_fingerprints
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath('app.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.register_blueprint(routes.research_bp, url_prefix='/api')
+    with app.app_context():
+        db.create_all()
+        migrate_fingerprints()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def ingestion(app, routes):
+    """Start one ingestion worker for the app"""
+    routes.start_ingestion_queue(app, num_workers=1)
+    return routes.ingestion_queue
+
+
+@pytest.fixture
+def wait_for_job(client):
+    """Poll an ingestion job until it completes or fails, and return it"""
+    from document import IngestionJob
+
+    def wait(job_id, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = client.get(f'/api/jobs/{job_id}').get_json()
+            if job['status'] in (IngestionJob.COMPLETED, IngestionJob.FAILED):
+                return job
+            time.sleep(0.05)
+        raise TimeoutError(f"Job {job_id} did not finish")
+    return wait
+
+
+@pytest.fixture
+def upload(client, wait_for_job):
+    """Upload a file's content through the API and return its finished job"""
+    def upload(content, filename, timeout=30):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        job_id = client.post('/api/upload-document', data={'file': (io.BytesIO(data), filename)},
+                             content_type='multipart/form-data').get_json()['job_id']
+        return wait_for_job(job_id, timeout)
+    return upload
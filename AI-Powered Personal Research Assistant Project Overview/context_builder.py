@@ -0,0 +1,170 @@
+"""
+Context packing for RAGService prompts
+
+Retrieved chunks overlap: consecutive chunks of a document repeat about
+chunk_overlap tokens, and a hit can lie inside another. The builder
+merges hits into passages, one per run of consecutive chunks of a
+document, with each overlapping span included once, and adds hits in
+rank order while the rendered context stays within a token budget.
+Passages are numbered by their best-ranked hit, and citation n is the
+passage marked [n] in the context.
+"""
+
+from typing import Callable, List, Optional, Tuple
+
+from src.services.chunking import estimate_tokens
+
+# Shorter suffix/prefix matches are taken to be coincidence, not chunk overlap
+MIN_OVERLAP_CHARS = 16
+CITATION_PREVIEW_CHARS = 200
+
+
+def overlap_length(first: str, second: str) -> int:
+    """
+    Length of the longest suffix of first that is a prefix of second
+
+    Overlaps may start mid-word: chunks stored before the token-budget
+    chunker repeat the last 200 characters of the previous chunk.
+    """
+    if not second:
+        return 0
+    start = max(0, len(first) - len(second))
+    while True:
+        position = first.find(second[0], start)
+        if position < 0 or len(first) - position < MIN_OVERLAP_CHARS:
+            return 0
+        if second.startswith(first[position:]):
+            return len(first) - position
+        start = position + 1
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a numbered context within a token budget"""
+
+    def __init__(self, max_tokens: Optional[int] = 3000,
+                 token_counter: Callable[[str], int] = estimate_tokens):
+        """
+        Args:
+            max_tokens: Token budget of the context, or None for no limit
+            token_counter: Token count of a text; the default estimates it
+                from the length, pass e.g. a tiktoken encoder's for exact counts
+        """
+        if max_tokens is not None and max_tokens < 1:
+            raise ValueError("max_tokens must be positive")
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+
+    def build(self, relevant_chunks: List[tuple]) -> Tuple[str, List[dict]]:
+        """
+        Pack (chunk_metadata, score) pairs, best first, into a context
+
+        Hits that would take the context over budget are skipped, except
+        that the best hit is cut to fit when it does not fit on its own.
+
+        Returns:
+            Tuple of (context, citations)
+        """
+        selected = []
+        for rank, (chunk, score) in enumerate(relevant_chunks):
+            candidate = selected + [(rank, chunk, score)]
+            if self._fits(self._render(self._passages(candidate))):
+                selected = candidate
+            elif not selected:
+                selected = [(rank, self._truncate(chunk), score)]
+
+        passages = self._passages(selected)
+        return self._render(passages), [self._citation(passage) for passage in passages]
+
+    def _fits(self, context: str) -> bool:
+        return self.max_tokens is None or self.token_counter(context) <= self.max_tokens
+
+    def _passages(self, hits: List[tuple]) -> List[dict]:
+        """Merge (rank, chunk, score) hits into passages, ordered by their best rank"""
+        by_document = {}
+        for hit in hits:
+            by_document.setdefault(hit[1].get('document_id'), []).append(hit)
+
+        passages = []
+        for document_hits in by_document.values():
+            document_hits.sort(key=lambda hit: (hit[1].get('chunk_index') is None, hit[1].get('chunk_index') or 0))
+            document_passages = []
+            for hit in document_hits:
+                rank, chunk, score = hit
+                text = chunk.get('text', '')
+                previous = document_passages[-1] if document_passages else None
+                index = chunk.get('chunk_index')
+                if previous is not None and index is not None and index == previous['last_index'] + 1:
+                    # The next chunk of the passage: add what it does not repeat
+                    overlap = overlap_length(previous['text'], text)
+                    previous['text'] += text[overlap:] if overlap else " " + text
+                    previous['last_index'] = index
+                    previous['hits'].append(hit)
+                    continue
+                container = next((p for p in document_passages if text and text in p['text']), None)
+                if container is not None:
+                    container['hits'].append(hit)
+                    continue
+                document_passages.append({'text': text, 'last_index': index, 'hits': [hit]})
+            passages.extend(document_passages)
+
+        for passage in passages:
+            passage['rank'] = min(hit[0] for hit in passage['hits'])
+        passages.sort(key=lambda passage: passage['rank'])
+        return passages
+
+    def _render(self, passages: List[dict]) -> str:
+        parts = []
+        for i, passage in enumerate(passages):
+            chunk = passage['hits'][0][1]
+            pages = self._pages(passage)
+            filename = chunk.get('filename', 'Unknown')
+            if not pages:
+                source = ""
+            elif len(pages) == 1:
+                source = f" ({filename}, page {pages[0]})"
+            else:
+                source = f" ({filename}, pages {pages[0]}-{pages[-1]})"
+            parts.append(f"[{i+1}]{source} {passage['text']}")
+        return "\n\n".join(parts)
+
+    def _citation(self, passage: dict) -> dict:
+        first = passage['hits'][0][1]
+        text = passage['text']
+        citation = {
+            'document_id': first.get('document_id', ''),
+            'filename': first.get('filename', 'Unknown'),
+            'text': text[:CITATION_PREVIEW_CHARS] + "..." if len(text) > CITATION_PREVIEW_CHARS else text,
+            'similarity_score': max(hit[2] for hit in passage['hits'])
+        }
+
+        # Hybrid retrieval ranks by the fused score, kept apart from the similarity
+        fusion_scores = [chunk['fusion_score'] for _, chunk, _ in passage['hits'] if 'fusion_score' in chunk]
+        if fusion_scores:
+            citation['fusion_score'] = max(fusion_scores)
+
+        pages = self._pages(passage)
+        if pages:
+            citation['page_number'] = pages[0]
+
+        # The same passage in other documents, merged into these hits
+        also_in = {}
+        for _, chunk, _ in passage['hits']:
+            for source in chunk.get('duplicates') or []:
+                also_in.setdefault(source['document_id'], {'document_id': source['document_id'],
+                                                           'filename': source['filename'],
+                                                           'page_number': source['page_number']})
+        if also_in:
+            citation['also_in'] = list(also_in.values())
+        return citation
+
+    @staticmethod
+    def _pages(passage: dict) -> List[int]:
+        return sorted({hit[1]['page_number'] for hit in passage['hits'] if hit[1].get('page_number') is not None})
+
+    def _truncate(self, chunk: dict) -> dict:
+        """The chunk with its text cut at a word so that it fits on its own"""
+        text = chunk.get('text', '')
+        while text and not self._fits(self._render([{'text': text, 'hits': [(0, chunk, 0.0)]}])):
+            cut = text.rfind(' ', 0, len(text) * 9 // 10)
+            text = text[:cut] if cut > 0 else text[:len(text) * 9 // 10]
+        return dict(chunk, text=text)
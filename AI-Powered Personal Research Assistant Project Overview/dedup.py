@@ -0,0 +1,169 @@
+"""
+Near-duplicate detection for document chunks
+
+Chunks are fingerprinted by a hash of their normalized text (lowercased
+words, punctuation and whitespace dropped), which catches copies that
+differ only in formatting, and a MinHash signature of their word
+3-shingles, which catches copies with small edits: the fraction of equal
+signature values estimates the Jaccard similarity of two chunks' shingle
+sets, and chunks estimated at MIN_SIMILARITY or more are near-duplicates.
+
+For lookups the signature is split into LSH_BANDS bands, each hashed to
+one integer. Chunks sharing any band are candidates, checked in full;
+with 4 bands of 8 values a chunk with one word changed (similarity ~0.97)
+shares a band with its original 99% of the time, unrelated chunks
+practically never.
+"""
+
+import hashlib
+import re
+import zlib
+from collections import deque, namedtuple
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+NUM_PERMUTATIONS = 32
+LSH_BANDS = 4
+MIN_SIMILARITY = 0.8
+SHINGLE_WORDS = 3
+
+WORD = re.compile(r'\w+')
+_PRIME = (1 << 32) + 15  # Smallest prime above 2^32
+# Fixed seed: signatures are stored and must be comparable across processes
+_random = np.random.RandomState(0x5EED)
+_A = _random.randint(1, 2 ** 32 - 1, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+_B = _random.randint(0, 2 ** 32 - 1, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+
+Fingerprint = namedtuple('Fingerprint', ['content_hash', 'signature'])
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+def minhash(normalized: str) -> np.ndarray:
+    """MinHash signature (uint32[NUM_PERMUTATIONS]) of the word shingles of normalized text"""
+    words = normalized.split(" ")
+    shingles = [" ".join(words[i:i + SHINGLE_WORDS]).encode('utf-8')
+                for i in range(max(1, len(words) - SHINGLE_WORDS + 1))]
+    hashes = np.fromiter((zlib.crc32(shingle) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # (a * h + b) mod p is a random hash function per row; a, b, h < 2^32 cannot overflow
+    return (((_A * hashes + _B) % _PRIME).min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+
+def fingerprint(text: str) -> Fingerprint:
+    normalized = normalize_text(text)
+    content_hash = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+    return Fingerprint(content_hash, minhash(normalized))
+
+
+def similarity(a: Fingerprint, b: Fingerprint) -> float:
+    """Estimated Jaccard similarity of two chunks' shingles"""
+    return float(np.mean(a.signature == b.signature))
+
+
+def is_duplicate(a: Fingerprint, b: Fingerprint, min_similarity: float = MIN_SIMILARITY) -> bool:
+    return a.content_hash == b.content_hash or similarity(a, b) >= min_similarity
+
+
+def lsh_bands(signature: np.ndarray) -> List[int]:
+    """One 63-bit key per band of the signature (fits a signed SQL integer)"""
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'little') >> 1
+            for band in np.split(signature, LSH_BANDS)]
+
+
+class MinHashIndex:
+    """In-memory fingerprint -> key lookup for near-duplicates"""
+
+    def __init__(self, min_similarity: float = MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._bands = [{} for _ in range(LSH_BANDS)]  # Band key -> [(fingerprint, key)]
+
+    def add(self, key, fp: Fingerprint):
+        for band, value in zip(self._bands, lsh_bands(fp.signature)):
+            band.setdefault(value, []).append((fp, key))
+
+    def find(self, fp: Fingerprint):
+        """Key of the first fingerprint added that fp duplicates, or None"""
+        for band, value in zip(self._bands, lsh_bands(fp.signature)):
+            for candidate, key in band.get(value, ()):
+                if is_duplicate(fp, candidate, self.min_similarity):
+                    return key
+        return None
+
+
+class ChunkDeduplicator:
+    """
+    Dedup stage between chunking and embedding for one document
+
+    filter() passes unique chunks on and holds back duplicates, of chunks
+    already indexed (found with find_indexed) or of earlier chunks of the
+    same document. Chunk indices follow the document order of all chunks:
+    unique records (chunk_index, fingerprint) for each chunk passed on, in
+    order, and duplicates records (chunk_index, page_number, text,
+    fingerprint, (document_id, chunk_index) of the chunk duplicated).
+    """
+
+    def __init__(self, document_id: str,
+                 find_indexed: Callable[[Fingerprint], Optional[Tuple[str, int]]] = None,
+                 min_similarity: float = MIN_SIMILARITY):
+        self.document_id = document_id
+        self.find_indexed = find_indexed
+        self.unique = deque()
+        self.duplicates = []
+        self.chunks_seen = 0
+        self.duplicates_found = 0
+        self._document_chunks = MinHashIndex(min_similarity)
+
+    def filter(self, chunks: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+        for page_number, text in chunks:
+            chunk_index = self.chunks_seen
+            self.chunks_seen += 1
+            fp = fingerprint(text)
+
+            original = self._document_chunks.find(fp)
+            if original is None and self.find_indexed is not None:
+                original = self.find_indexed(fp)
+            if original is not None:
+                self.duplicates.append((chunk_index, page_number, text, fp, original))
+                self.duplicates_found += 1
+                continue
+
+            self._document_chunks.add((self.document_id, chunk_index), fp)
+            self.unique.append((chunk_index, fp))
+            yield page_number, text
+
+    def take_duplicates(self) -> list:
+        """Duplicates held back since the last call"""
+        duplicates, self.duplicates = self.duplicates, []
+        return duplicates
+
+
+def chunk_source(chunk: dict) -> dict:
+    """The fields of chunk metadata that identify where it came from"""
+    return {key: chunk.get(key) for key in ('document_id', 'filename', 'chunk_index', 'page_number')}
+
+
+def collapse_duplicates(results: List[Tuple[dict, float]], k: int,
+                        min_similarity: float = MIN_SIMILARITY) -> List[Tuple[dict, float]]:
+    """
+    Merge search hits whose chunks are near-duplicates, keeping the best scored
+
+    A merged hit lists the sources of the hits folded into it under
+    'duplicates'. Hits without text are never merged. At most k hits are
+    returned.
+    """
+    kept = []  # [chunk, score, fingerprint or None]
+    for chunk, score in results:
+        fp = fingerprint(chunk['text']) if chunk.get('text') else None
+        for hit in kept:
+            if fp is not None and hit[2] is not None and is_duplicate(fp, hit[2], min_similarity):
+                hit[0] = dict(hit[0], duplicates=(hit[0].get('duplicates', []) + [chunk_source(chunk)]
+                                                  + chunk.get('duplicates', [])))
+                break
+        else:
+            if len(kept) == k:
+                continue
+            kept.append([chunk, score, fp])
+    return [(chunk, score) for chunk, score, _ in kept]
@@ -75,6 +75,7 @@ setup_backend() {
     # Install dependencies
     print_status "Installing backend dependencies..."
     pip install -r requirements.txt
+    pip install uvicorn asgiref  # ASGI server for production mode
     
     # Check OpenAI API key
     if [ -z "$OPENAI_API_KEY" ]; then
@@ -146,8 +147,8 @@ start_services() {
     cd research-assistant-backend
     source venv/bin/activate
     
-    print_status "Starting Flask backend on port 5000..."
-    python src/main.py &
+    print_status "Starting ASGI backend on port 5000 (${WORKERS:-1} worker(s))..."
+    python src/asgi.py --port 5000 --workers "${WORKERS:-1}" &
     BACKEND_PID=$!
     
     cd ..
@@ -226,6 +227,7 @@ show_help() {
     echo ""
     echo "Environment Variables:"
     echo "  OPENAI_API_KEY       Required for OpenAI API access"
+    echo "  WORKERS              Backend worker processes in production mode (default: 1)"
     echo ""
 }
 
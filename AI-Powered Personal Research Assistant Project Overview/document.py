@@ -1,9 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import bindparam, inspect, or_, text
+from datetime import datetime, timedelta
 import json
+import numpy as np
+from src.services.dedup import (LSH_BANDS, MIN_SIMILARITY, Fingerprint, fingerprint, is_duplicate,
+                                lsh_bands)
 
 db = SQLAlchemy()
 
+# Binary embedding encodings. float32 is lossless; float16 halves the size
+# with negligible effect on cosine similarity; int8 stores a float32 scale
+# followed by symmetric 8-bit codes, a quarter of float32.
+EMBEDDING_FORMATS = ('float32', 'float16', 'int8')
+DEFAULT_EMBEDDING_FORMAT = 'float32'
+
 class Document(db.Model):
     __tablename__ = 'documents'
     
@@ -21,16 +31,35 @@ class Document(db.Model):
             'upload_date': self.upload_date.isoformat(),
             'file_type': self.file_type
         }
+    
+    @classmethod
+    def append_content(cls, document_id: str, text: str):
+        """Append text to a document's content in the database, without loading it"""
+        if text:
+            db.session.execute(cls.__table__.update().where(
+                cls.document_id == document_id).values(content=cls.content + text))
 
 class DocumentChunk(db.Model):
     __tablename__ = 'document_chunks'
     
     id = db.Column(db.Integer, primary_key=True)
-    document_id = db.Column(db.String(36), db.ForeignKey('documents.document_id'), nullable=False)
+    document_id = db.Column(db.String(36), db.ForeignKey('documents.document_id'), nullable=False, index=True)
     chunk_index = db.Column(db.Integer, nullable=False)
     text = db.Column(db.Text, nullable=False)
     page_number = db.Column(db.Integer, nullable=True)
-    embedding = db.Column(db.Text, nullable=True)  # Store as JSON string
+    embedding = db.Column(db.Text, nullable=True)  # Legacy JSON string, see migrate_embeddings
+    embedding_blob = db.Column(db.LargeBinary, nullable=True)
+    embedding_format = db.Column(db.String(16), nullable=True)  # One of EMBEDDING_FORMATS
+    # Fingerprint for near-duplicate lookups, see services/dedup.py
+    content_hash = db.Column(db.String(16), nullable=True)
+    minhash = db.Column(db.LargeBinary, nullable=True)
+    minhash_band0 = db.Column(db.BigInteger, nullable=True, index=True)
+    minhash_band1 = db.Column(db.BigInteger, nullable=True, index=True)
+    minhash_band2 = db.Column(db.BigInteger, nullable=True, index=True)
+    minhash_band3 = db.Column(db.BigInteger, nullable=True, index=True)
+    # Chunk this one duplicates; duplicates store no embedding and share its vector
+    duplicate_of_document_id = db.Column(db.String(36), nullable=True, index=True)
+    duplicate_of_chunk_index = db.Column(db.Integer, nullable=True)
     
     def to_dict(self):
         return {
@@ -40,13 +69,421 @@ class DocumentChunk(db.Model):
             'page_number': self.page_number
         }
     
-    def set_embedding(self, embedding_vector):
-        """Store embedding as JSON string"""
-        self.embedding = json.dumps(embedding_vector)
+    def set_fingerprint(self, fp: Fingerprint):
+        self.content_hash = fp.content_hash
+        self.minhash = fp.signature.tobytes()
+        (self.minhash_band0, self.minhash_band1,
+         self.minhash_band2, self.minhash_band3) = lsh_bands(fp.signature)
+    
+    @classmethod
+    def band_columns(cls):
+        return [cls.minhash_band0, cls.minhash_band1, cls.minhash_band2, cls.minhash_band3]
+    
+    @classmethod
+    def find_original(cls, fp: Fingerprint, min_similarity: float = MIN_SIMILARITY, page_size: int = 50):
+        """
+        Find a stored chunk that fp duplicates
+        
+        Candidates sharing an LSH band with fp are fetched by index, in
+        insertion order and page_size at a time, and checked in full until
+        one matches, so the earliest stored original is found however many
+        chunks share a band; only chunks that are not themselves duplicates
+        are considered.
+        
+        Returns:
+            (document_id, chunk_index) of the chunk, or None
+        """
+        candidates = (db.session.query(cls.id, cls.document_id, cls.chunk_index, cls.content_hash, cls.minhash)
+                      .filter(cls.duplicate_of_document_id.is_(None))
+                      .filter(or_(*[band == value for band, value in zip(cls.band_columns(),
+                                                                         lsh_bands(fp.signature))]))
+                      .order_by(cls.id))
+        last_id = 0
+        while True:
+            rows = candidates.filter(cls.id > last_id).limit(page_size).all()
+            if not rows:
+                return None
+            for row in rows:
+                candidate = Fingerprint(row.content_hash, np.frombuffer(row.minhash, dtype=np.uint32))
+                if is_duplicate(fp, candidate, min_similarity):
+                    return row.document_id, row.chunk_index
+            last_id = rows[-1].id
+    
+    @classmethod
+    def promote_duplicates(cls, document_id: str) -> int:
+        """
+        Hand a document's duplicated chunks over to their first duplicate
+        
+        Call before deleting the document: the first duplicate of each of
+        its chunks (in other documents) gets the embedding and becomes the
+        chunk the others duplicate. Changes are left in the session.
+        
+        Returns:
+            Number of chunks promoted
+        """
+        duplicates = (cls.query.filter(cls.duplicate_of_document_id == document_id,
+                                       cls.document_id != document_id)
+                      .order_by(cls.duplicate_of_chunk_index, cls.id).all())
+        originals = {}
+        for duplicate in duplicates:
+            key = duplicate.duplicate_of_chunk_index
+            if key not in originals:
+                original = cls.query.filter_by(document_id=document_id, chunk_index=key).first()
+                originals[key] = duplicate
+                duplicate.duplicate_of_document_id = None
+                duplicate.duplicate_of_chunk_index = None
+                if original is not None:
+                    duplicate.embedding_blob = original.embedding_blob
+                    duplicate.embedding_format = original.embedding_format
+                    duplicate.embedding = original.embedding
+            else:
+                promoted = originals[key]
+                duplicate.duplicate_of_document_id = promoted.document_id
+                duplicate.duplicate_of_chunk_index = promoted.chunk_index
+        return len(originals)
+    
+    def set_embedding(self, embedding_vector, embedding_format: str = None):
+        """Store embedding as a binary blob"""
+        embedding_format = embedding_format or DEFAULT_EMBEDDING_FORMAT
+        self.embedding_blob = encode_embedding(embedding_vector, embedding_format)
+        self.embedding_format = embedding_format
+        self.embedding = None
     
     def get_embedding(self):
         """Retrieve embedding as list"""
+        embedding = self.get_embedding_array()
+        return None if embedding is None else embedding.tolist()
+    
+    def get_embedding_array(self):
+        """Retrieve embedding as a float32 array"""
+        if self.embedding_blob is not None:
+            return decode_embedding(self.embedding_blob, self.embedding_format)
         if self.embedding:
-            return json.loads(self.embedding)
+            return np.array(json.loads(self.embedding), dtype=np.float32)
         return None
+    
+    @classmethod
+    def load_embeddings(cls, document_ids=None, batch_size: int = 500):
+        """
+        Load the embeddings of many chunks as one matrix
+        
+        Only the key and embedding columns are read, and float32 blobs are
+        decoded in a single np.frombuffer over their concatenation rather
+        than one row at a time.
+        
+        Args:
+            document_ids: Documents to load (default: all)
+            batch_size: Document IDs per query, below SQLite's variable limit
+            
+        Returns:
+            (keys, matrix): (document_id, chunk_index) per row, in document
+            and chunk order, and a float32 array of shape (len(keys), dimension)
+        """
+        columns = (cls.document_id, cls.chunk_index, cls.embedding_blob,
+                   cls.embedding_format, cls.embedding)
+        if document_ids is None:
+            rows = db.session.query(*columns).order_by(cls.document_id, cls.chunk_index).all()
+        else:
+            document_ids = sorted(set(document_ids))
+            rows = []
+            for start in range(0, len(document_ids), batch_size):
+                rows.extend(db.session.query(*columns)
+                            .filter(cls.document_id.in_(document_ids[start:start + batch_size]))
+                            .order_by(cls.document_id, cls.chunk_index).all())
+        
+        rows = [row for row in rows if row.embedding_blob is not None or row.embedding]
+        keys = [(row.document_id, row.chunk_index) for row in rows]
+        return keys, _embedding_matrix(rows)
+    
+    @classmethod
+    def iter_pages(cls, page_size: int = 1000):
+        """
+        Stream chunks with embeddings, and their filenames, in primary key order
+        
+        Pages are fetched by keyset (id > last id of the previous page), so
+        every query is a short index range scan and memory is bounded by
+        page_size. Chunks whose document no longer exists are skipped.
+        
+        Yields:
+            (rows, matrix): rows with id, document_id, chunk_index, text,
+            page_number and filename, and their embeddings as a float32 matrix
+        """
+        last_id = 0
+        while True:
+            rows = (cls._with_embeddings(db.session.query(cls.id, cls.document_id, cls.chunk_index, cls.text,
+                                                          cls.page_number, Document.filename, cls.embedding_blob,
+                                                          cls.embedding_format, cls.embedding))
+                    .filter(cls.id > last_id)
+                    .order_by(cls.id)
+                    .limit(page_size)
+                    .all())
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield rows, _embedding_matrix(rows)
+    
+    @classmethod
+    def iter_ids(cls, page_size: int = 1000):
+        """Stream the primary keys of the chunks iter_pages yields, in the same order, reading no other column"""
+        last_id = 0
+        while True:
+            ids = [row.id for row in cls._with_embeddings(db.session.query(cls.id))
+                   .filter(cls.id > last_id)
+                   .order_by(cls.id)
+                   .limit(page_size)]
+            if not ids:
+                return
+            last_id = ids[-1]
+            yield from ids
+    
+    @classmethod
+    def _with_embeddings(cls, query):
+        """Restrict query to chunks with an embedding whose document still exists"""
+        return (query.join(Document, Document.document_id == cls.document_id)
+                .filter(or_(cls.embedding_blob.isnot(None), cls.embedding.isnot(None))))
+
+
+
+class IngestionJob(db.Model):
+    """A document upload waiting for or undergoing background ingestion"""
+    __tablename__ = 'ingestion_jobs'
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(36), unique=True, nullable=False)
+    document_id = db.Column(db.String(36), nullable=False)  # Assigned up front so retries reuse it
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50), nullable=False)
+    file_path = db.Column(db.String(1024), nullable=False)  # Upload kept until the job finishes
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    stage = db.Column(db.String(32), nullable=False, default='queued')
+    chunks_total = db.Column(db.Integer, nullable=True)
+    chunks_embedded = db.Column(db.Integer, nullable=False, default=0)
+    chunks_deduplicated = db.Column(db.Integer, nullable=False, default=0)  # Linked instead of embedded
+    error = db.Column(db.Text, nullable=True)
+    owner = db.Column(db.String(64), nullable=True)  # Queue running the job, see IngestionQueue.owner
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # Renewed while the owner is alive
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'document_id': self.document_id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'chunks_total': self.chunks_total,
+            'chunks_embedded': self.chunks_embedded,
+            'chunks_deduplicated': self.chunks_deduplicated,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    @classmethod
+    def claim(cls, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """
+        Atomically take a job for `owner`; False if another worker has it
+        
+        A queued job can be claimed, and so can a running job whose lease
+        has expired because its owner stopped renewing it. The handler
+        starts such a job over.
+        """
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            result = connection.execute(cls.__table__.update().where(
+                cls.job_id == job_id,
+                or_(cls.status == cls.QUEUED, (cls.status == cls.RUNNING) & cls.lease_expired(now))
+            ).values(status=cls.RUNNING, owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds),
+                     chunks_embedded=0, error=None, updated_at=now))
+        return result.rowcount == 1
+    
+    @classmethod
+    def lease_expired(cls, now: datetime):
+        """Condition on running jobs whose owner stopped renewing their lease"""
+        # Jobs claimed before leases existed have none
+        return or_(cls.lease_expires_at.is_(None), cls.lease_expires_at < now)
+    
+    @classmethod
+    def renew_leases(cls, owner: str, lease_seconds: float) -> int:
+        """Extend the leases of every job `owner` is running; returns how many"""
+        with db.engine.begin() as connection:
+            result = connection.execute(cls.__table__.update().where(
+                cls.owner == owner, cls.status == cls.RUNNING
+            ).values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds)))
+        return result.rowcount
+    
+    @classmethod
+    def report(cls, job_id: str, owner: str = None, **fields):
+        """
+        Update a job's progress fields in their own transaction
+        
+        Commits immediately without touching the caller's session, so
+        progress is visible to /jobs while the job's document is still
+        being written. With `owner`, the job is only updated while that
+        owner still holds it.
+        """
+        fields['updated_at'] = datetime.utcnow()
+        condition = cls.job_id == job_id
+        if owner is not None:
+            condition = condition & (cls.owner == owner)
+        with db.engine.begin() as connection:
+            connection.execute(cls.__table__.update().where(condition).values(**fields))
+
+def _embedding_matrix(rows) -> np.ndarray:
+    """Decode the embedding columns of query rows into one float32 matrix"""
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+    
+    if all(row.embedding_format == 'float32' and row.embedding_blob is not None for row in rows):
+        matrix = np.frombuffer(b''.join(row.embedding_blob for row in rows), dtype=np.float32)
+        return matrix.reshape(len(rows), -1)
+    
+    # Mixed or legacy encodings: decode row by row
+    return np.vstack([
+        decode_embedding(row.embedding_blob, row.embedding_format) if row.embedding_blob is not None
+        else np.array(json.loads(row.embedding), dtype=np.float32)
+        for row in rows
+    ])
+
+
+def encode_embedding(embedding_vector, embedding_format: str = DEFAULT_EMBEDDING_FORMAT) -> bytes:
+    """Encode a vector in one of EMBEDDING_FORMATS"""
+    vector = np.asarray(embedding_vector, dtype=np.float32)
+    if embedding_format == 'float32':
+        return vector.tobytes()
+    if embedding_format == 'float16':
+        return vector.astype(np.float16).tobytes()
+    if embedding_format == 'int8':
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        codes = np.round(vector / scale).astype(np.int8)
+        return np.float32(scale).tobytes() + codes.tobytes()
+    raise ValueError(f"Unknown embedding format: {embedding_format}. Supported formats: {', '.join(EMBEDDING_FORMATS)}")
+
+
+def decode_embedding(blob: bytes, embedding_format: str = DEFAULT_EMBEDDING_FORMAT) -> np.ndarray:
+    """
+    Decode a blob written by encode_embedding into a float32 vector
+    
+    float32 blobs are returned as a zero-copy, read-only view of the blob.
+    """
+    if embedding_format == 'float32':
+        return np.frombuffer(blob, dtype=np.float32)
+    if embedding_format == 'float16':
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if embedding_format == 'int8':
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding format: {embedding_format}. Supported formats: {', '.join(EMBEDDING_FORMATS)}")
+
+
+def migrate_embeddings(embedding_format: str = None, batch_size: int = 1000) -> int:
+    """
+    Upgrade the document_chunks table to binary embeddings
+    
+    Adds the blob columns to databases created before they existed and
+    converts JSON embeddings in batches, committing after each so the
+    migration can be interrupted and resumed. Safe to run on every startup.
+    
+    Returns:
+        Number of embeddings converted
+    """
+    embedding_format = embedding_format or DEFAULT_EMBEDDING_FORMAT
+    table = DocumentChunk.__tablename__
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as connection:
+        if 'embedding_blob' not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN embedding_blob BLOB"))
+        if 'embedding_format' not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN embedding_format VARCHAR(16)"))
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_document_id ON {table} (document_id)"))
+    
+    converted = 0
+    while True:
+        rows = db.session.query(DocumentChunk.id, DocumentChunk.embedding).filter(
+            DocumentChunk.embedding.isnot(None)).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(DocumentChunk.__table__.update().where(
+            DocumentChunk.id == bindparam('row_id')).values(
+            embedding=None,
+            embedding_blob=bindparam('blob'),
+            embedding_format=embedding_format
+        ), [{'row_id': row.id, 'blob': encode_embedding(json.loads(row.embedding), embedding_format)}
+            for row in rows])
+        db.session.commit()
+        converted += len(rows)
+    
+    if converted and db.engine.dialect.name == 'sqlite':
+        # Return the space freed by the JSON text to the filesystem
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("VACUUM"))
+    return converted
+
+
+def migrate_fingerprints(batch_size: int = 1000) -> int:
+    """
+    Add the near-duplicate columns and fingerprint chunks stored before them
+    
+    Existing chunks are fingerprinted in batches, committing after each, so
+    new uploads can be deduplicated against them. They are not deduplicated
+    among themselves. Safe to run on every startup.
+    
+    Returns:
+        Number of chunks fingerprinted
+    """
+    table = DocumentChunk.__tablename__
+    jobs_table = IngestionJob.__tablename__
+    inspector = inspect(db.engine)
+    existing = {column['name'] for column in inspector.get_columns(table)}
+    existing_jobs = {column['name'] for column in inspector.get_columns(jobs_table)}
+    columns = [('content_hash', 'VARCHAR(16)'), ('minhash', 'BLOB'),
+               ('duplicate_of_document_id', 'VARCHAR(36)'), ('duplicate_of_chunk_index', 'INTEGER')]
+    columns += [(f'minhash_band{band}', 'BIGINT') for band in range(LSH_BANDS)]
+    with db.engine.begin() as connection:
+        for name, column_type in columns:
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+        for name in ['duplicate_of_document_id'] + [f'minhash_band{band}' for band in range(LSH_BANDS)]:
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{name} ON {table} ({name})"))
+        if 'chunks_deduplicated' not in existing_jobs:
+            connection.execute(text(
+                f"ALTER TABLE {jobs_table} ADD COLUMN chunks_deduplicated INTEGER NOT NULL DEFAULT 0"))
+    
+    fingerprinted = 0
+    while True:
+        rows = db.session.query(DocumentChunk.id, DocumentChunk.text).filter(
+            DocumentChunk.content_hash.is_(None)).limit(batch_size).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            fp = fingerprint(row.text)
+            update = {'row_id': row.id, 'hash': fp.content_hash, 'signature': fp.signature.tobytes()}
+            update.update({f'band{band}': value for band, value in enumerate(lsh_bands(fp.signature))})
+            updates.append(update)
+        db.session.execute(DocumentChunk.__table__.update().where(
+            DocumentChunk.id == bindparam('row_id')).values(
+            content_hash=bindparam('hash'),
+            minhash=bindparam('signature'),
+            **{f'minhash_band{band}': bindparam(f'band{band}') for band in range(LSH_BANDS)}
+        ), updates)
+        db.session.commit()
+        fingerprinted += len(rows)
+    return fingerprinted
+
 
+def migrate_ingestion_jobs():
+    """Add the job lease columns to databases created before them; safe to run on every startup"""
+    table = IngestionJob.__tablename__
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as connection:
+        for name, column_type in (('owner', 'VARCHAR(64)'), ('lease_expires_at', 'DATETIME')):
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
@@ -2,105 +2,505 @@ import os
 import uuid
 import PyPDF2
 import docx
-from typing import List, Tuple
+import itertools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 import openai
 import numpy as np
 import faiss
 import json
+from src.services.embedding_cache import EmbeddingCache
+from src.services.vector_persistence import (
+    StoreLock, WriteAheadLog, encode_add, encode_link, encode_remove, iter_wal, read_manifest,
+    remove_unreferenced_files, versioned_path, write_file_atomic, write_manifest
+)
+from src.services.chunking import Chunker, build_chunker
+from src.services.chunk_store import ChunkMetadata, ChunkStore, is_chunk_store, write_chunk_store
+from src.services.dedup import MIN_SIMILARITY, chunk_source, collapse_duplicates
+from src.services.lexical_index import LexicalIndex, LexicalSegment, count_terms, reciprocal_rank_fusion
+from src.services.vector_file import FullVectors, VectorFile, write_vector_file
+from src.services.vector_index import (
+    INDEX_TYPES, LOSSY_INDEX_TYPES, build_index, check_reduction, export_vectors, index_type_of,
+    min_training_vectors, search_parameters, supports_removal, train_index
+)
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF (runs in pool workers)"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _separate_lines(spans: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+    """Prefix every span but the first with a newline, as "\\n".join would"""
+    first = True
+    for page_number, text in spans:
+        yield page_number, text if first else "\n" + text
+        first = False
 
 class DocumentProcessor:
-    def __init__(self):
-        self.openai_client = openai.OpenAI()
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+    def __init__(self, openai_client=None, embedding_cache: EmbeddingCache = None,
+                 max_batch_tokens: int = 20000, max_batch_size: int = 512,
+                 max_concurrency: int = 4, parallel_pdf_pages: int = 32,
+                 pdf_workers: int = None, chunker: Chunker = None):
+        self.openai_client = openai_client or openai.OpenAI()
+        self.embedding_cache = embedding_cache
+        # Token-sized chunks of whole sentences unless another strategy is given
+        self.chunker = chunker or build_chunker('sentence')
+        self.embedding_model = "text-embedding-ada-002"
+        # Limits for batched embedding requests (the API accepts at most
+        # 2048 inputs and 8191 tokens per input)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        # PDFs with at least this many pages are extracted by a process pool
+        self.parallel_pdf_pages = parallel_pdf_pages
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
         
     def extract_text_from_file(self, file_path: str, file_type: str) -> str:
         """Extract text content from uploaded file"""
+        return "".join(text for _, text in self.iter_text_from_file(file_path, file_type))
+    
+    def extract_pages_from_file(self, file_path: str, file_type: str) -> List[Tuple[Optional[int], str]]:
+        """
+        Extract text content from uploaded file as (page_number, text) spans
+        
+        PDFs yield one span per page, numbered from 1; other formats have no
+        pages and yield a single span with page_number None.
+        """
+        if file_type.lower() == 'pdf':
+            try:
+                return list(self._iter_pdf_pages(file_path))
+            except Exception as e:
+                raise Exception(f"Error extracting text from {file_type} file: {str(e)}")
+        return [(None, self.extract_text_from_file(file_path, file_type))]
+    
+    def iter_text_from_file(self, file_path: str, file_type: str) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Stream text content from uploaded file as (page_number, text) pieces
+        
+        Pieces are yielded as they are extracted (a PDF page, a DOCX
+        paragraph, a block of a text file) and concatenate to the document
+        text, pages and paragraphs separated by newlines.
+        """
         try:
             if file_type.lower() == 'pdf':
-                return self._extract_from_pdf(file_path)
+                yield from _separate_lines(self._iter_pdf_pages(file_path))
             elif file_type.lower() in ['docx', 'doc']:
-                return self._extract_from_docx(file_path)
+                yield from _separate_lines((None, text) for text in self._iter_docx_paragraphs(file_path))
             elif file_type.lower() == 'txt':
-                return self._extract_from_txt(file_path)
+                yield from ((None, text) for text in self._iter_txt_blocks(file_path))
             else:
                 raise ValueError(f"Unsupported file type: {file_type}")
         except Exception as e:
             raise Exception(f"Error extracting text from {file_type} file: {str(e)}")
     
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
+    def _iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        """
+        Extract text from PDF file, one (page_number, text) span per page
+        
+        PDFs with at least parallel_pdf_pages pages are split into page
+        ranges extracted by a process pool, since PyPDF2's text extraction
+        is pure Python and holds the GIL. Ranges are yielded in order as
+        they complete.
+        """
         with open(file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+            num_pages = len(pdf_reader.pages)
+            workers = min(self.pdf_workers, num_pages // max(self.parallel_pdf_pages // 2, 1))
+            if num_pages < self.parallel_pdf_pages or workers < 2:
+                for i, page in enumerate(pdf_reader.pages):
+                    yield i + 1, page.extract_text() or ""
+                return
+        
+        # Two ranges per worker even out pages of different cost; each
+        # range re-opens the file, so more would add parsing overhead
+        step = -(-num_pages // (workers * 2))
+        ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(_extract_pdf_page_range, itertools.repeat(file_path), *zip(*ranges))
+            page_numbers = itertools.count(1)
+            for texts in parts:
+                for text in texts:
+                    yield next(page_numbers), text
     
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
+    def _iter_docx_paragraphs(self, file_path: str) -> Iterator[str]:
+        """Extract text from DOCX file, one paragraph at a time"""
         doc = docx.Document(file_path)
-        text = ""
         for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+            yield paragraph.text
     
-    def _extract_from_txt(self, file_path: str) -> str:
-        """Extract text from TXT file"""
+    def _iter_txt_blocks(self, file_path: str, block_size: int = 65536) -> Iterator[str]:
+        """Extract text from TXT file in blocks of block_size characters"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    return
+                yield block
     
     def chunk_text(self, text: str) -> List[str]:
         """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + self.chunk_size
-            
-            # If we're not at the end, try to break at a sentence or word boundary
-            if end < len(text):
-                # Look for sentence boundary
-                sentence_end = text.rfind('.', start, end)
-                if sentence_end > start:
-                    end = sentence_end + 1
-                else:
-                    # Look for word boundary
-                    word_end = text.rfind(' ', start, end)
-                    if word_end > start:
-                        end = word_end
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - self.chunk_overlap
-            if start >= len(text):
-                break
-                
-        return chunks
+        return [chunk for _, chunk in self.iter_chunks([(None, text)])]
+    
+    def chunk_pages(self, pages: List[Tuple[Optional[int], str]]) -> List[Tuple[Optional[int], str]]:
+        """
+        Split (page_number, text) spans into overlapping (page_number, chunk) pairs
+        
+        Pages are joined with newlines, as extract_text_from_file joins
+        them, and chunked as one text.
+        """
+        return list(self.iter_chunks(_separate_lines(pages)))
+    
+    def iter_chunks(self, pieces: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Split a stream of (page_number, text) pieces into overlapping chunks
+        
+        The pieces are chunked as their concatenation by self.chunker, and
+        each chunk is attributed to the page it starts on. Only about one
+        chunk plus one piece of text is held in memory.
+        """
+        return self.chunker.iter_chunks(pieces)
+    
+    def embed_chunks(self, chunks: Iterable[Tuple[Optional[int], str]],
+                     progress: Callable[[int], None] = None) -> Iterator[List[Tuple[Optional[int], str, List[float]]]]:
+        """
+        Embed a stream of (page_number, chunk) pairs, one group at a time
+        
+        Chunks are collected into groups of max_batch_size * max_concurrency,
+        each embedded with generate_embeddings, and yielded as lists of
+        (page_number, chunk, embedding), so memory is bounded by a group.
+        
+        progress, if given, is called with the number of chunks embedded so far.
+        """
+        group_size = self.max_batch_size * self.max_concurrency
+        embedded = 0
+        chunks = iter(chunks)
+        while True:
+            group = list(itertools.islice(chunks, group_size))
+            if not group:
+                return
+            
+            group_progress = None
+            if progress is not None:
+                group_progress = lambda done, offset=embedded: progress(offset + done)
+            embeddings = self.generate_embeddings([chunk for _, chunk in group], progress=group_progress)
+            embedded += len(group)
+            yield [(page_number, chunk, embedding)
+                   for (page_number, chunk), embedding in zip(group, embeddings)]
     
     def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding for text using OpenAI"""
+        if self.embedding_cache is not None:
+            key = EmbeddingCache.make_key(self.embedding_model, text)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
             response = self.openai_client.embeddings.create(
-                model="text-embedding-ada-002",
+                model=self.embedding_model,
                 input=text
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
         except Exception as e:
             raise Exception(f"Error generating embedding: {str(e)}")
+        
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(key, embedding)
+        return embedding
+    
+    def generate_embeddings(self, texts: List[str],
+                            progress: Callable[[int], None] = None) -> List[List[float]]:
+        """
+        Generate embeddings for many texts using batched, concurrent requests
+        
+        Texts are packed into batches bounded by max_batch_tokens, counted
+        with the chunker's token counter, and max_batch_size, and up to
+        max_concurrency batches are in flight at once. The returned embeddings are in the same order as texts.
+        
+        With an embedding cache configured, only texts that are neither
+        cached nor repeated earlier in the list are sent to the API.
+        
+        progress, if given, is called with the number of texts embedded so
+        far each time a batch completes, one call at a time.
+        """
+        if not texts:
+            return []
+        
+        if self.embedding_cache is not None:
+            keys = [EmbeddingCache.make_key(self.embedding_model, text) for text in texts]
+            cached = self.embedding_cache.get_many(keys)
+            # One API input per distinct uncached key
+            pending = {}
+            for i, key in enumerate(keys):
+                if key not in cached and key not in pending:
+                    pending[key] = i
+            
+            on_batch = None
+            if progress is not None:
+                # Each API input completes every text sharing its key
+                occurrences = Counter(keys)
+                pending_keys = list(pending)
+                done = len(texts) - sum(occurrences[key] for key in pending_keys)
+                progress(done)
+                
+                def on_batch(indices: List[int]):
+                    nonlocal done
+                    done += sum(occurrences[pending_keys[i]] for i in indices)
+                    progress(done)
+            
+            fresh = self._embed_uncached([texts[i] for i in pending.values()], on_batch)
+            fresh_by_key = dict(zip(pending, fresh))
+            if fresh_by_key:
+                self.embedding_cache.put_many(fresh_by_key.items())
+            
+            return [cached.get(key) or fresh_by_key[key] for key in keys]
+        
+        on_batch = None
+        if progress is not None:
+            done = 0
+            
+            def on_batch(indices: List[int]):
+                nonlocal done
+                done += len(indices)
+                progress(done)
+        
+        return self._embed_uncached(texts, on_batch)
+    
+    def _embed_uncached(self, texts: List[str],
+                        on_batch: Callable[[List[int]], None] = None) -> List[List[float]]:
+        """Send texts to the embeddings API in concurrent, budgeted batches"""
+        if not texts:
+            return []
+        
+        batches = self._pack_batches(texts)
+        embeddings = [None] * len(texts)
+        callback_lock = threading.Lock()
+        
+        def embed_batch(indices: List[int]):
+            response = self.openai_client.embeddings.create(
+                model=self.embedding_model,
+                input=[texts[i] for i in indices]
+            )
+            for item in response.data:
+                embeddings[indices[item.index]] = item.embedding
+            if on_batch is not None:
+                with callback_lock:
+                    on_batch(indices)
+        
+        try:
+            if len(batches) == 1:
+                embed_batch(batches[0])
+            else:
+                workers = min(self.max_concurrency, len(batches))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    # list() re-raises the first failed batch
+                    list(executor.map(embed_batch, batches))
+        except Exception as e:
+            raise Exception(f"Error generating embeddings: {str(e)}")
+        
+        return embeddings
+    
+    def _pack_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches that fit the token and size budget"""
+        batches = []
+        current = []
+        current_tokens = 0
+        
+        for i, text in enumerate(texts):
+            tokens = self.chunker.token_counter(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
     
     def generate_document_id(self) -> str:
         """Generate unique document ID"""
         return str(uuid.uuid4())
 
 
+class ReadWriteLock:
+    """
+    Lock held by any number of readers at once, or by one writer
+    
+    Entered as a context manager it is the write lock; shared() is the
+    read lock. Waiting writers go before new readers, so a steady stream
+    of searches cannot hold off ingestion. Both are reentrant, and the
+    writer may also take the read lock; a reader cannot take the write lock.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()  # The thread's read lock depth
+    
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return self
+            if getattr(self._local, 'depth', 0):
+                raise RuntimeError("Cannot take the write lock while holding the read lock")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._condition.notify_all()
+    
+    @contextmanager
+    def shared(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth or self._writer == threading.get_ident():
+            # Already held by this thread
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        
+        with self._condition:
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+
 class VectorStore:
-    def __init__(self, dimension: int = 1536):
+    def __init__(self, dimension: int = 1536, compaction_threshold: float = 0.2,
+                 index_type: str = 'flat', promote_threshold: int = 100000,
+                 nprobe: int = 16, ef_search: int = 64, nlist: int = None,
+                 pq_m: int = 64, hnsw_m: int = 32, exact_filter_limit: int = 2000,
+                 wal_merge_ratio: float = 0.25, mmap_index: bool = False,
+                 collapse_similarity: Optional[float] = MIN_SIMILARITY,
+                 reduced_dimension: int = None, reduction: str = 'pca', rerank_factor: int = 4):
+        """
+        Args:
+            dimension: Embedding dimension
+            compaction_threshold: Dead fraction of the index that triggers compaction
+            index_type: Target backend, one of vector_index.INDEX_TYPES. The store
+                starts with an exact flat index and is promoted to this backend
+                in the background once it holds promote_threshold vectors.
+                The compressed flat_fp16, flat_int8 and flat_pq backends
+                shrink the index 2x, 4x and dimension * 4 / pq_m times.
+            promote_threshold: Vector count at which to switch to index_type
+            nprobe: IVF lists visited per query (ivf_flat, ivf_pq)
+            ef_search: HNSW search beam width
+            nlist, pq_m, hnsw_m: Build options passed to vector_index.build_index
+            exact_filter_limit: Document-filtered searches over at most this many
+                vectors score them exactly instead of searching the index
+            wal_merge_ratio: Size of the write-ahead log, relative to the last
+                checkpoint, at which it is merged into a new checkpoint
+            mmap_index: Memory-map the checkpoint index read-only instead of
+                loading it, so startup does not read the corpus and processes
+                share its pages. Vectors added since the checkpoint are kept
+                in a small in-memory index until the next checkpoint.
+            collapse_similarity: Search hits whose chunks are at least this
+                similar (estimated Jaccard similarity of their word shingles,
+                see dedup.py) are merged into one; None keeps them all
+            reduced_dimension, reduction: Reduce vectors to reduced_dimension
+                by PCA, or by keeping the leading dimensions of Matryoshka
+                embeddings ('truncate'), before compressing them (compressed
+                backends only)
+            rerank_factor: Backends with approximate scores (ivf_pq and the
+                compressed ones) fetch rerank_factor times the candidates and
+                re-rank them exactly against the full-precision vectors, which
+                are kept on disk next to the checkpoint and memory-mapped
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}. Supported types: {', '.join(INDEX_TYPES)}")
+        if reduced_dimension is not None:
+            check_reduction(index_type, dimension, reduced_dimension, reduction)
+        
         self.dimension = dimension
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        self.chunk_metadata = []  # Store chunk metadata
+        # Inner product for cosine similarity; the ID map lets vectors be removed by ID
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        # Read-only memory-mapped checkpoint index (mmap_index only); self.index
+        # then holds just the vectors added since that checkpoint
+        self.base_index = None
+        self._base_path = None
+        self._base_next_id = 0
+        self.chunk_metadata = ChunkMetadata()  # Vector ID -> chunk metadata
+        self.document_vectors = {}  # Document ID -> vector IDs, including linked ones
+        # Vector ID -> metadata of duplicate chunks sharing the vector, see link_duplicates
+        self.vector_links = {}
+        # BM25 index of the chunk text, for lexical_search and hybrid_search
+        self.lexical_index = LexicalIndex()
+        self.next_id = 0
+        self.collapse_similarity = collapse_similarity
+        
+        self.index_type = index_type
+        self.active_index_type = 'flat'
+        self.promote_threshold = promote_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.index_options = {'nlist': nlist, 'pq_m': pq_m, 'hnsw_m': hnsw_m,
+                              'reduced_dimension': reduced_dimension, 'reduction': reduction}
+        self.exact_filter_limit = exact_filter_limit
+        self.mmap_index = mmap_index
+        # Vector ID -> original vector, for re-ranking the hits of lossy backends
+        self.rerank_factor = rerank_factor
+        self._full_vectors = FullVectors(dimension) if index_type in LOSSY_INDEX_TYPES else None
+        
+        # Deleted vectors stay in the index until compaction; searches skip them
+        self.tombstones = set()
+        self.compaction_threshold = compaction_threshold
+        self._live_selector = None
+        # Searches share the lock and see the store as of one write; writes hold it alone
+        self._lock = ReadWriteLock()
+        self._maintenance_thread = None
+        self._index_generation = 0
+        
+        # Persistence: changes since the last save are encoded in _pending and
+        # appended to the write-ahead log of the attached store on save
+        self.wal_merge_ratio = wal_merge_ratio
+        self._storage_path = None
+        self._manifest = None
+        self._wal = None
+        self._pending = []
+        self._checkpoint_bytes = 0
+        self._checkpoint_lock = threading.Lock()
+        # Held to swap out _pending or _wal, and until the swapped out records are logged
+        self._persist_lock = threading.Lock()
+        self._wal_offset = 0  # Bytes of the log applied in memory
+        
+        # Sharing with other processes, see share
+        self._store_lock = None
+        self._on_change = None
+        self._stop_refreshing = threading.Event()
         
     def add_embeddings(self, embeddings: List[List[float]], metadata: List[dict]):
         """Add embeddings to the vector store"""
@@ -108,34 +508,985 @@ class VectorStore:
         
         # Normalize embeddings for cosine similarity
         faiss.normalize_L2(embeddings_array)
+        # Tokenized before taking the lock, so searches wait only for the inserts
+        term_counts = [count_terms(chunk.get('text', '')) for chunk in metadata]
         
-        self.index.add(embeddings_array)
-        self.chunk_metadata.extend(metadata)
+        with self._writing(), self._lock:
+            first_id = self.next_id
+            self._apply_add(first_id, embeddings_array, metadata, term_counts)
+            self._pending.append(encode_add(first_id, embeddings_array, metadata))
+            promote = self._should_promote()
+        
+        if promote:
+            self._run_in_background(self.rebuild_index)
     
-    def search(self, query_embedding: List[float], k: int = 5) -> List[Tuple[dict, float]]:
-        """Search for similar chunks"""
-        query_array = np.array([query_embedding], dtype=np.float32)
-        faiss.normalize_L2(query_array)
+    def _apply_add(self, first_id: int, embeddings_array: np.ndarray, metadata: List[dict],
+                   term_counts: List[Tuple[int, dict]] = None):
+        """Insert normalized vectors under consecutive IDs starting at first_id"""
+        ids = np.arange(first_id, first_id + len(metadata), dtype=np.int64)
+        self.next_id = max(self.next_id, first_id + len(metadata))
+        if term_counts is None:
+            term_counts = [count_terms(chunk.get('text', '')) for chunk in metadata]
         
-        scores, indices = self.index.search(query_array, k)
+        self.index.add_with_ids(embeddings_array, ids)
+        if self._full_vectors is not None:
+            self._full_vectors.add(ids, embeddings_array)
+        for vector_id, chunk, (length, counts) in zip(ids.tolist(), metadata, term_counts):
+            self.chunk_metadata[vector_id] = chunk
+            self._document_vector_list(chunk.get('document_id')).append(vector_id)
+            self.lexical_index.add_counts(vector_id, length, counts)
+    
+    def _document_vector_list(self, document_id: str) -> List[int]:
+        """A document's vector IDs as a list that can be appended to"""
+        vector_ids = self.document_vectors.get(document_id)
+        if not isinstance(vector_ids, list):
+            # Documents loaded from a checkpoint hold read-only arrays
+            vector_ids = self.document_vectors[document_id] = list(
+                vector_ids.tolist() if vector_ids is not None else [])
+        return vector_ids
+    
+    def link_duplicates(self, originals: List[Tuple[str, int]], metadata: List[dict]) -> int:
+        """
+        Index duplicate chunks by the vectors of the chunks they duplicate
         
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.chunk_metadata):
-                results.append((self.chunk_metadata[idx], float(score)))
+        A linked chunk adds no vector: searches filtered to its document
+        find it through the original's vector, hits on that vector list it
+        under 'duplicates', and the vector stays, owned by the first linked
+        chunk left, when the original's document is removed.
+        
+        Args:
+            originals: (document_id, chunk_index) of the chunk each duplicates
+            metadata: Metadata of the duplicate chunks
+            
+        Returns:
+            Number of chunks linked; duplicates of chunks not in the store are skipped
+        """
+        with self._writing(), self._lock:
+            vector_ids = self._find_chunk_vectors(originals)
+            links = [(vector_id, chunk) for vector_id, chunk in zip(vector_ids, metadata)
+                     if vector_id is not None]
+            if links:
+                vector_ids = [vector_id for vector_id, _ in links]
+                metadata = [chunk for _, chunk in links]
+                self._apply_link(vector_ids, metadata)
+                self._pending.append(encode_link(vector_ids, metadata))
+        return len(links)
+    
+    def _find_chunk_vectors(self, chunks: List[Tuple[str, int]]) -> List[Optional[int]]:
+        """Vector ID of each (document_id, chunk_index), or None if it is not stored"""
+        positions = {}
+        for document_id in {document_id for document_id, _ in chunks}:
+            positions[document_id] = {}
+            for vector_id in self.document_vectors.get(document_id, []):
+                vector_id = int(vector_id)
+                for chunk in [self.chunk_metadata.get(vector_id)] + self.vector_links.get(vector_id, []):
+                    if chunk is not None and chunk.get('document_id') == document_id:
+                        positions[document_id].setdefault(chunk.get('chunk_index'), vector_id)
+        return [positions[document_id].get(chunk_index) for document_id, chunk_index in chunks]
+    
+    def _apply_link(self, vector_ids: List[int], metadata: List[dict]):
+        for vector_id, chunk in zip(vector_ids, metadata):
+            self.vector_links.setdefault(vector_id, []).append(chunk)
+            self._document_vector_list(chunk.get('document_id')).append(vector_id)
+    
+    def _should_promote(self) -> bool:
+        """Whether the flat index has grown enough to switch to the ANN backend"""
+        if self.active_index_type == self.index_type:
+            return False
+        live = len(self.chunk_metadata)
+        needed = max(self.promote_threshold, self._min_training_vectors(self.index_type, live))
+        return live >= needed
+    
+    def _min_training_vectors(self, index_type: str, num_vectors: int) -> int:
+        options = self.index_options
+        return min_training_vectors(index_type, options['nlist'], num_vectors,
+                                    options['reduced_dimension'], options['reduction'])
+    
+    def remove_document(self, document_id: str) -> int:
+        """
+        Remove all vectors of a document
+        
+        The vectors are tombstoned, which costs O(chunks in the document);
+        they are physically dropped by a background compaction once the
+        dead fraction of the index exceeds compaction_threshold. Vectors
+        that duplicate chunks of other documents are linked to are kept.
+        
+        Returns:
+            Number of the document's vectors removed or unlinked
+        """
+        with self._writing(), self._lock:
+            vector_ids = self._apply_remove(document_id)
+            if vector_ids:
+                self._pending.append(encode_remove(document_id))
+        
+        if vector_ids and self.dead_fraction() > self.compaction_threshold:
+            self._run_in_background(self.compact)
+        return len(vector_ids)
+    
+    def _apply_remove(self, document_id: str) -> List[int]:
+        """Tombstone a document's vectors, unless linked from elsewhere, and return their IDs"""
+        vector_ids = list(dict.fromkeys(
+            int(vector_id) for vector_id in self.document_vectors.pop(document_id, [])))
+        dead = []
+        for vector_id in vector_ids:
+            if vector_id in self.vector_links:
+                links = [chunk for chunk in self.vector_links.pop(vector_id)
+                         if chunk.get('document_id') != document_id]
+                owned = self.chunk_metadata.get(vector_id, {}).get('document_id') == document_id
+                if owned and links:
+                    # The first remaining duplicate takes over the vector
+                    self.chunk_metadata[vector_id] = links.pop(0)
+                    self.lexical_index.add(vector_id, self.chunk_metadata[vector_id].get('text', ''))
+                    owned = False
+                if links:
+                    self.vector_links[vector_id] = links
+                if not owned:
+                    continue
+            self.chunk_metadata.discard(vector_id)
+            self.lexical_index.remove(vector_id)
+            dead.append(vector_id)
+        self.tombstones.update(dead)
+        if dead:
+            self._live_selector = None
+        return vector_ids
+    
+    def dead_fraction(self) -> float:
+        """Fraction of index rows that belong to deleted documents"""
+        with self._lock.shared():
+            rows = sum(index.ntotal for index, _ in self._searchable())
+            if rows == 0:
+                return 0.0
+            return len(self.tombstones) / rows
+    
+    def compact(self):
+        """Physically remove tombstoned vectors from the index"""
+        if not supports_removal(self.active_index_type):
+            self.rebuild_index(self.active_index_type)
+            return
+        
+        if self.base_index is not None:
+            # The mapped index is read-only; a checkpoint drops them instead
+            self.checkpoint()
+            return
+        
+        with self._lock:
+            if not self.tombstones:
+                return
+            dead = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            self.index.remove_ids(faiss.IDSelectorBatch(dead))
+            if self._full_vectors is not None:
+                self._full_vectors.discard(self.tombstones)
+            self.tombstones.clear()
+            self._live_selector = None
+            self._index_generation += 1
+    
+    def rebuild_index(self, index_type: str = None):
+        """
+        Rebuild the index with the given backend (default: the configured one)
+        
+        The new index is trained and filled from a snapshot of the live
+        vectors without holding the lock, so searches keep being served by
+        the old index. Vectors added and documents removed meanwhile are
+        carried over before the new index is swapped in. Stores that keep
+        full-precision vectors build it from those, not from the old
+        index's approximations.
+        """
+        index_type = index_type or self.index_type
+        
+        with self._lock.shared():
+            old_index = self.index
+            generation = self._index_generation
+            snapshot_rows = old_index.ntotal
+            dead = set(self.tombstones)
+            exported = [self._export_vectors(index) for index, _ in self._searchable()]
+        
+        ids = np.concatenate([ids for ids, _ in exported])
+        vectors = np.concatenate([vectors for _, vectors in exported])
+        if dead:
+            keep = ~np.isin(ids, np.fromiter(dead, dtype=np.int64, count=len(dead)))
+            ids, vectors = ids[keep], vectors[keep]
+        
+        if len(vectors) < self._min_training_vectors(index_type, len(vectors)):
+            return
+        
+        new_index = faiss.IndexIDMap2(build_index(
+            index_type, self.dimension, len(vectors), **self.index_options))
+        train_index(new_index, vectors)
+        new_index.add_with_ids(vectors, ids)
+        
+        with self._lock:
+            if self._index_generation != generation:
+                # The index was compacted or rebuilt in the meantime
+                return
+            
+            added_ids, added_vectors = self._export_vectors(old_index, start=snapshot_rows)
+            if len(added_ids):
+                new_index.add_with_ids(added_vectors, added_ids)
+            if self._full_vectors is not None:
+                self._full_vectors.discard(dead)
+            
+            # The rebuilt index holds everything until the next checkpoint maps it
+            self.index = new_index
+            self.base_index = None
+            self.active_index_type = index_type
+            self.tombstones -= dead
+            self._live_selector = None
+            self._index_generation += 1
+    
+    def _export_vectors(self, index: faiss.Index, start: int = 0):
+        """export_vectors, with the full-precision vectors when the store keeps them"""
+        if self._full_vectors is None:
+            return export_vectors(index, start)
+        ids = faiss.vector_to_array(index.id_map)[start:].astype(np.int64)
+        return ids, self._full_vectors.get_batch(ids)
+    
+    def _run_in_background(self, task):
+        """Run a maintenance task on a daemon thread unless one is already running"""
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(target=task, daemon=True)
+            self._maintenance_thread.start()
+    
+    def _searchable(self) -> List[Tuple[faiss.Index, str]]:
+        """(index, backend) pairs that together hold every vector"""
+        if self.base_index is None:
+            return [(self.index, self.active_index_type)]
+        return [(self.base_index, self.active_index_type), (self.index, 'flat')]
+    
+    def search(self, query_embedding: List[float], k: int = 5,
+               document_ids: List[str] = None) -> List[Tuple[dict, float]]:
+        """
+        Search for similar chunks
+        
+        Args:
+            query_embedding: Query vector
+            k: Number of results
+            document_ids: Optional list of document IDs to restrict the search to.
+                The filter is applied inside the index search, so up to k
+                results from those documents are returned.
+        
+        Near-duplicate hits are merged (see collapse_similarity), so twice k
+        candidates are fetched to still return k distinct chunks. The
+        sources of duplicates are listed under 'duplicates' in a hit's
+        metadata.
+        
+        Searches run concurrently with each other, each over the store as
+        of one write: a write waits for the searches in progress, and new
+        searches wait for it.
+        """
+        return self.search_batch([query_embedding], k, document_ids)[0]
+    
+    def search_batch(self, query_embeddings, k: int = 5,
+                     document_ids: List[str] = None) -> List[List[Tuple[dict, float]]]:
+        """
+        Search for the chunks similar to each of many queries
+        
+        The queries go to FAISS in a single call per index, which scans the
+        index once for all of them and spreads them over its threads, and
+        the lock is taken once, so a batch costs far less than a search per
+        query. document_ids restricts every query's results.
+        
+        Args:
+            query_embeddings: Query vectors, as a list or an (n, dimension) array
+            
+        Returns:
+            Each query's results, as search returns them
+        """
+        query_array = self._query_array(query_embeddings)
+        if not len(query_array):
+            return []
+        
+        with self._lock.shared():
+            scores, indices = self._vector_search(query_array, self._fetch_size(k), document_ids)
+            results = [self._hit_chunks(row_indices, row_scores, document_ids)
+                       for row_scores, row_indices in zip(scores, indices)]
         
+        return [self._collapse(row, k) for row in results]
+    
+    def lexical_search(self, query: str, k: int = 5,
+                       document_ids: List[str] = None) -> List[Tuple[dict, float]]:
+        """
+        Search for chunks containing the query's terms, ranked by BM25
+        
+        Finds exact tokens such as identifiers, gene names and formulas,
+        which embeddings blur, in time proportional to the number of chunks
+        containing them. Scores are BM25 scores; document_ids and
+        near-duplicate hits are handled as in search.
+        """
+        with self._lock.shared():
+            scores, ids = self._lexical_search(query, self._fetch_size(k), document_ids)
+            results = self._hit_chunks(ids, scores, document_ids)
+        
+        return self._collapse(results, k)
+    
+    def hybrid_search(self, query: str, query_embedding: List[float], k: int = 5,
+                      document_ids: List[str] = None, rrf_k: int = 60) -> List[Tuple[dict, float]]:
+        """
+        Search by embedding and by BM25 and fuse the two rankings
+        
+        Each ranking adds 1 / (rrf_k + rank) to a chunk's score (reciprocal
+        rank fusion), so chunks both rank well come first and a chunk with
+        an exact term the embedding misses still makes the results. Twice
+        as many candidates as search would fetch are taken from each
+        ranking. Hits are ordered by the fused score, given as the
+        metadata's 'fusion_score'; scores are cosine similarities as in
+        search, computed exactly for hits only BM25 found.
+        """
+        return self.hybrid_search_batch([query], [query_embedding], k, document_ids, rrf_k)[0]
+    
+    def hybrid_search_batch(self, queries: List[str], query_embeddings, k: int = 5,
+                            document_ids: List[str] = None, rrf_k: int = 60) -> List[List[Tuple[dict, float]]]:
+        """
+        hybrid_search for many queries, their embeddings searched in one batch as in search_batch
+        
+        Returns:
+            Each query's results, as hybrid_search returns them
+        """
+        query_array = self._query_array(query_embeddings)
+        if not len(query_array):
+            return []
+        fetch = 2 * self._fetch_size(k)
+        
+        with self._lock.shared():
+            vector_scores, vector_ids = self._vector_search(query_array, fetch, document_ids)
+            results = []
+            for query_vector, query, row_scores, row_ids in zip(query_array, queries, vector_scores, vector_ids):
+                _, lexical_ids = self._lexical_search(query, fetch, document_ids)
+                fused = reciprocal_rank_fusion([row_ids[row_ids >= 0], lexical_ids], fetch, rrf_k)
+                similarities = {int(vector_id): float(score) for score, vector_id in zip(row_scores, row_ids)
+                                if vector_id >= 0}
+                lexical_only = np.array(sorted(int(vector_id) for vector_id, _ in fused
+                                               if int(vector_id) not in similarities), dtype=np.int64)
+                if len(lexical_only):
+                    scores, ids = self._score_allowed(query_vector[None, :], len(lexical_only), lexical_only)
+                    similarities.update((int(vector_id), float(score)) for score, vector_id in zip(scores[0], ids[0])
+                                        if vector_id >= 0)
+                hits = []
+                for vector_id, fusion_score in fused:
+                    chunk = self._hit_chunk(int(vector_id), document_ids)
+                    if chunk is not None:
+                        hits.append((dict(chunk, fusion_score=float(fusion_score)),
+                                     similarities.get(int(vector_id), 0.0)))
+                results.append(hits)
+        
+        return [self._collapse(row, k) for row in results]
+    
+    def _query_array(self, query_embeddings) -> np.ndarray:
+        """Normalized (n, dimension) array of query vectors"""
+        query_array = np.array(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        faiss.normalize_L2(query_array)
+        return query_array
+    
+    def _fetch_size(self, k: int) -> int:
+        """Candidates to fetch for k results: twice k when duplicates are merged"""
+        return k if self.collapse_similarity is None else 2 * k
+    
+    def _collapse(self, results: List[Tuple[dict, float]], k: int) -> List[Tuple[dict, float]]:
+        if self.collapse_similarity is None:
+            return results[:k]
+        return collapse_duplicates(results, k, self.collapse_similarity)
+    
+    def _vector_search(self, query_array: np.ndarray, k: int, document_ids: List[str] = None):
+        """(scores, ids) of the k nearest live vectors, of document_ids if given"""
+        if document_ids:
+            return self._filtered_search(query_array, k, document_ids)
+        selector = self._get_live_selector() if self.tombstones else None
+        return self._search_indexes(query_array, k, selector)
+    
+    def _lexical_search(self, query: str, k: int, document_ids: List[str] = None):
+        """(scores, ids) of the k best BM25 matches, of document_ids if given"""
+        allowed = self._allowed_ids(document_ids) if document_ids else None
+        return self.lexical_index.search(query, k, allowed)
+    
+    def _hit_chunks(self, vector_ids, scores, document_ids: List[str] = None) -> List[Tuple[dict, float]]:
+        results = []
+        for score, vector_id in zip(scores, vector_ids):
+            chunk = self._hit_chunk(int(vector_id), document_ids)
+            if chunk is not None:
+                results.append((chunk, float(score)))
         return results
     
+    def _hit_chunk(self, vector_id: int, document_ids: List[str] = None) -> Optional[dict]:
+        """Metadata for a hit, from a chunk in document_ids if the vector is shared"""
+        chunk = self.chunk_metadata.get(vector_id)
+        links = self.vector_links.get(vector_id)
+        if chunk is None or not links:
+            return chunk
+        chunks = [chunk] + links
+        shown = 0
+        if document_ids:
+            shown = next((i for i, c in enumerate(chunks) if c.get('document_id') in document_ids), 0)
+        return dict(chunks[shown], duplicates=[chunk_source(c) for i, c in enumerate(chunks) if i != shown])
+    
+    def _search_indexes(self, query_array: np.ndarray, k: int, selector=None, nprobe: int = None):
+        """
+        Search every index holding vectors and merge their top k
+        
+        With full-precision vectors kept, rerank_factor times k candidates
+        are fetched and re-ranked exactly, so compression costs recall only
+        for vectors that miss the shortlist.
+        """
+        fetch = k if self._full_vectors is None else k * self.rerank_factor
+        parts = []
+        for index, index_type in self._searchable():
+            if index.ntotal:
+                params = search_parameters(index_type, nprobe or self.nprobe, self.ef_search, selector)
+                parts.append(index.search(query_array, fetch, params=params))
+        if self._full_vectors is None:
+            return _merge_top_k(parts, k, len(query_array))
+        _, ids = _merge_top_k(parts, fetch, len(query_array))
+        return self._rerank(query_array, ids, k)
+    
+    def _rerank(self, query_array: np.ndarray, ids: np.ndarray, k: int):
+        """(scores, ids) of each query's top k candidates by exact score"""
+        scores = np.full(ids.shape, -np.inf, dtype=np.float32)
+        found = ids >= 0
+        rows, _ = np.nonzero(found)
+        vectors = self._full_vectors.get_batch(ids[found])
+        scores[found] = np.einsum('ij,ij->i', vectors, query_array[rows])
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        rows = np.arange(len(ids))[:, None]
+        return scores[rows, top], ids[rows, top]
+    
+    def _filtered_search(self, query_array: np.ndarray, k: int, document_ids: List[str]):
+        """
+        Search only the vectors of the given documents
+        
+        Small candidate sets are scored exactly against the query, which is
+        cheaper than any full-index scan and unaffected by ANN recall. Larger
+        ones are searched with a bitmap ID selector so the index skips every
+        vector outside the documents with a single bit test; queries for
+        which that finds fewer than k of them are scored exactly instead.
+        """
+        allowed = self._allowed_ids(document_ids)
+        if not len(allowed):
+            return _merge_top_k([], k, len(query_array))
+        
+        if len(allowed) <= self.exact_filter_limit:
+            return self._score_allowed(query_array, k, allowed)
+        
+        bitmap = np.zeros(self.next_id, dtype=bool)
+        bitmap[allowed] = True
+        selector = faiss.IDSelectorBitmap(np.packbits(bitmap, bitorder='little'))
+        scores, ids = self._search_indexes(query_array, k, selector)
+        # An HNSW beam or the probed IVF lists can run out of allowed vectors
+        short = (ids >= 0).sum(axis=1) < min(k, len(allowed))
+        if short.any():
+            scores, ids = np.array(scores), np.array(ids)
+            exact_scores, exact_ids = self._score_allowed(query_array[short], k, allowed)
+            scores[short], ids[short] = -np.inf, -1
+            scores[short, :exact_ids.shape[1]] = exact_scores
+            ids[short, :exact_ids.shape[1]] = exact_ids
+        return scores, ids
+    
+    def _score_allowed(self, query_array: np.ndarray, k: int, allowed: np.ndarray):
+        """(scores, ids) of the k best of the allowed vectors, scored exactly"""
+        if self._full_vectors is not None:
+            scores = query_array @ self._full_vectors.get_batch(allowed).T
+            return _merge_top_k([(scores, np.broadcast_to(allowed, scores.shape))], k, len(query_array))
+        
+        parts = []
+        for index, index_type in self._searchable():
+            if index_type in ('ivf_flat', 'ivf_pq'):
+                # Visit every list so a selective filter still yields k results
+                params = search_parameters(index_type, faiss.downcast_index(index.index).nlist,
+                                           self.ef_search, faiss.IDSelectorBatch(allowed))
+                parts.append(index.search(query_array, k, params=params))
+                continue
+            
+            ids = allowed
+            if self.base_index is not None:
+                # The mapped index holds exactly the IDs below its checkpoint's next_id
+                in_base = allowed < self._base_next_id
+                ids = allowed[in_base] if index is self.base_index else allowed[~in_base]
+            if len(ids):
+                scores = query_array @ index.reconstruct_batch(ids).T
+                parts.append((scores, np.broadcast_to(ids, scores.shape)))
+        return _merge_top_k(parts, k, len(query_array))
+    
+    def _allowed_ids(self, document_ids: List[str]) -> np.ndarray:
+        """Sorted vector IDs of the given documents"""
+        vector_ids = [self.document_vectors.get(document_id, []) for document_id in document_ids]
+        # Documents can share vectors through duplicate links
+        return np.unique(np.concatenate([np.asarray(ids, dtype=np.int64) for ids in vector_ids]))
+    
+    def _get_live_selector(self):
+        """Selector excluding tombstoned IDs, rebuilt only after deletions"""
+        if self._live_selector is None:
+            dead = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            self._live_selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(dead))
+        return self._live_selector
+    
     def save_to_file(self, filepath: str):
-        """Save vector store to file"""
-        faiss.write_index(self.index, f"{filepath}.index")
-        with open(f"{filepath}.metadata", 'w') as f:
-            json.dump(self.chunk_metadata, f)
+        """
+        Save vector store to file
+        
+        Once the store is attached to filepath (by an earlier save or load)
+        only the changes since the last save are appended to its write-ahead
+        log, so the cost is proportional to what changed rather than to the
+        corpus. The log is merged into a new checkpoint in the background
+        when it outgrows wal_merge_ratio of the last checkpoint.
+        """
+        if self._store_lock is not None and self._storage_path == filepath:
+            # Shared: changes were logged as they were made
+            with self._lock:
+                merge = self._wal_offset > self.wal_merge_ratio * self._checkpoint_bytes
+            if merge:
+                self._run_in_background(self._merge_shared_wal)
+            return
+        
+        with self._persist_lock:
+            with self._lock:
+                attached = self._storage_path == filepath and self._wal is not None
+                if attached:
+                    records, self._pending = self._pending, []
+            if attached:
+                # Fsynced without the store lock, so neither searches nor writes wait on the disk
+                self._wal.append(records)
+                merge = self._wal.size() > self.wal_merge_ratio * self._checkpoint_bytes
+        
+        if not attached:
+            self.checkpoint(filepath)
+        elif merge:
+            self._run_in_background(self.checkpoint)
+    
+    def checkpoint(self, filepath: str = None):
+        """
+        Write a full snapshot of the store and start a new write-ahead log
+        
+        The snapshot is taken under the read lock, so searches go on, and
+        written to disk without it.
+        Changes saved meanwhile go to the new log, which the manifest lists
+        next to the old one until the new checkpoint is swapped in, so the
+        store on disk is recoverable at every step. Afterwards the chunk
+        metadata (and, with mmap_index, the index) is served from the new
+        checkpoint files.
+        """
+        if self._store_lock is not None:
+            # Other processes must not log changes to the old log meanwhile, nor read a half-written checkpoint
+            with self._store_lock.exclusive():
+                self._catch_up(repair=True)
+                self._checkpoint(filepath)
+            return
+        self._checkpoint(filepath)
+    
+    def _checkpoint(self, filepath: str = None):
+        with self._checkpoint_lock:
+            with self._persist_lock:
+                with self._lock.shared():
+                    filepath = filepath or self._storage_path
+                    attached = self._storage_path == filepath and self._wal is not None
+                    previous = self._manifest if attached else read_manifest(filepath)
+                    version = previous['version'] + 1 if previous else 1
+                    
+                    snapshot = {
+                        'generation': self._index_generation,
+                        'next_id': self.next_id,
+                        'rows': self.index.ntotal,
+                        'tombstones': set(self.tombstones),
+                        'chunks': self.chunk_metadata.snapshot(),
+                        'links': {vector_id: list(links) for vector_id, links in self.vector_links.items()},
+                        'lexical': self.lexical_index.snapshot()
+                    }
+                    if self._full_vectors is not None:
+                        snapshot['vectors'] = self._full_vectors.snapshot()
+                    if self.base_index is None:
+                        snapshot['index'] = faiss.serialize_index(self.index)
+                    else:
+                        # Merged with the mapped index outside the lock
+                        snapshot['base_path'] = self._base_path
+                        snapshot['delta'] = self._export_vectors(self.index)
+                    self._pending = []
+                    
+                    wal_path = versioned_path(filepath, version, 'wal')
+                    new_wal = WriteAheadLog(wal_path)
+                    if attached:
+                        self._manifest = dict(previous, wals=previous['wals'] + [os.path.basename(wal_path)])
+                        write_manifest(filepath, self._manifest)
+                        self._wal.close()
+                    self._wal = new_wal
+                    self._wal_offset = 0
+                    self._storage_path = filepath
+                    
+                if not attached:
+                    # Nothing on disk references the new log yet; saves wait until it does
+                    self._write_checkpoint(filepath, version, snapshot, wal_path)
+                    return
+            
+            self._write_checkpoint(filepath, version, snapshot, wal_path)
+    
+    def _write_checkpoint(self, filepath: str, version: int, snapshot: dict, wal_path: str):
+        """Write checkpoint files, point the manifest at them and switch over to them"""
+        index_path = versioned_path(filepath, version, 'index')
+        metadata_path = versioned_path(filepath, version, 'metadata')
+        lexical_path = versioned_path(filepath, version, 'lexical')
+        
+        tombstones = snapshot['tombstones']
+        if 'index' in snapshot:
+            write_file_atomic(index_path, snapshot['index'])
+        else:
+            index = faiss.read_index(snapshot['base_path'])
+            index.add_with_ids(snapshot['delta'][1], snapshot['delta'][0])
+            if tombstones and supports_removal(index_type_of(index)):
+                index.remove_ids(faiss.IDSelectorBatch(
+                    np.fromiter(tombstones, dtype=np.int64, count=len(tombstones))))
+                tombstones = set()
+            faiss.write_index(index, f"{index_path}.tmp")
+            del index
+            os.replace(f"{index_path}.tmp", index_path)
+        
+        write_chunk_store(metadata_path, snapshot['chunks'].items(), info={
+            'next_id': snapshot['next_id'],
+            'tombstones': sorted(tombstones)
+        }, links=((vector_id, chunk) for vector_id, links in snapshot['links'].items() for chunk in links))
+        snapshot['lexical'].write(lexical_path)
+        paths = [index_path, metadata_path, lexical_path]
+        vectors_path = None
+        if 'vectors' in snapshot:
+            # The vectors of the rows the written index holds
+            vectors_path = versioned_path(filepath, version, 'vectors')
+            write_vector_file(vectors_path, snapshot['vectors'].blocks(snapshot['tombstones'] - tombstones),
+                              self.dimension)
+            paths.append(vectors_path)
+        
+        with self._lock:
+            manifest = {
+                'version': version,
+                'index': os.path.basename(index_path),
+                'metadata': os.path.basename(metadata_path),
+                'lexical': os.path.basename(lexical_path),
+                # Older logs only hold changes already in the snapshot
+                'wals': [os.path.basename(wal_path)]
+            }
+            if vectors_path is not None:
+                manifest['vectors'] = os.path.basename(vectors_path)
+            write_manifest(filepath, manifest)
+            self._manifest = manifest
+            self._checkpoint_bytes = sum(os.path.getsize(path) for path in paths)
+            
+            # Serve chunk metadata from the new file; later changes stay layered on top
+            store = ChunkStore(metadata_path)
+            written = snapshot['chunks'].added
+            # Chunks added, or handed over to a duplicate, after the snapshot
+            added = {vector_id: chunk for vector_id, chunk in self.chunk_metadata.added.items()
+                     if vector_id >= snapshot['next_id'] or written.get(vector_id) is not chunk}
+            self.chunk_metadata = ChunkMetadata(
+                store,
+                added,
+                {vector_id for vector_id in itertools.chain(self.tombstones, added)
+                 if vector_id < snapshot['next_id'] and vector_id in store}
+            )
+            
+            # Likewise for the lexical index
+            segment = LexicalSegment(lexical_path)
+            written = snapshot['lexical'].added
+            added = {vector_id: entry for vector_id, entry in self.lexical_index.added.items()
+                     if vector_id >= snapshot['next_id'] or written.get(vector_id) is not entry}
+            removed = itertools.chain(self.tombstones, added, self.lexical_index.removed().tolist())
+            self.lexical_index = LexicalIndex(segment, added, removed)
+            
+            # And for the full-precision vectors, which are never replaced
+            if vectors_path is not None and self._full_vectors is not None:
+                written = snapshot['vectors']
+                full_vectors = self._full_vectors
+                # Rows dropped from the index after the snapshot
+                dropped = itertools.chain(full_vectors.removed - written.removed,
+                                          written.added.keys() - full_vectors.added.keys())
+                self._full_vectors = FullVectors(
+                    self.dimension,
+                    VectorFile(vectors_path),
+                    {vector_id: vector for vector_id, vector in full_vectors.added.items()
+                     if vector_id >= snapshot['next_id']},
+                    {vector_id for vector_id in dropped if vector_id < snapshot['next_id']}
+                )
+            
+            if self.mmap_index and self._index_generation == snapshot['generation']:
+                self._map_checkpoint_index(index_path, snapshot, tombstones)
+        
+        remove_unreferenced_files(filepath, manifest)
+    
+    def _map_checkpoint_index(self, index_path: str, snapshot: dict, kept_tombstones: set):
+        """Swap in the checkpoint index, memory-mapped, keeping vectors added since"""
+        added_ids, added_vectors = self._export_vectors(self.index, start=snapshot['rows'])
+        delta = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        if len(added_ids):
+            delta.add_with_ids(added_vectors, added_ids)
+        
+        self.base_index = self._read_index(index_path)
+        self._base_path = index_path
+        self._base_next_id = snapshot['next_id']
+        self.index = delta
+        self.tombstones -= snapshot['tombstones'] - kept_tombstones
+        self._live_selector = None
+        self._index_generation += 1
+    
+    def _read_index(self, index_path: str) -> faiss.Index:
+        if self.mmap_index:
+            try:
+                return faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC)
+            except RuntimeError:
+                # Older FAISS builds cannot map every index type
+                pass
+        return faiss.read_index(index_path)
     
     def load_from_file(self, filepath: str):
-        """Load vector store from file"""
+        """
+        Load vector store from file
+        
+        The latest checkpoint is loaded and the write-ahead log replayed on
+        top of it. A record torn by a crash at the end of the log is dropped,
+        as are files left behind by an interrupted checkpoint. Chunk metadata
+        is memory-mapped and decoded per search hit.
+        """
+        manifest = read_manifest(filepath)
+        if manifest is None:
+            self._load_legacy_files(filepath)
+            return
+        
+        directory = os.path.dirname(filepath)
+        index_path = os.path.join(directory, manifest['index'])
+        metadata_path = os.path.join(directory, manifest['metadata'])
+        # Stores checkpointed before the lexical index have it rebuilt from the chunks
+        lexical_path = os.path.join(directory, manifest['lexical']) if 'lexical' in manifest else None
+        vectors_path = os.path.join(directory, manifest['vectors']) if 'vectors' in manifest else None
+        index = self._read_index(index_path)
+        
+        with self._persist_lock, self._lock:
+            if is_chunk_store(metadata_path):
+                store = ChunkStore(metadata_path)
+                lexical_index = LexicalIndex(LexicalSegment(lexical_path)) if lexical_path else None
+                full_vectors = FullVectors(self.dimension, VectorFile(vectors_path)) if vectors_path else None
+                self._set_state(index, store.info, ChunkMetadata(store), store.document_vectors(),
+                                lexical_index, full_vectors)
+            else:
+                with open(metadata_path, 'r') as f:
+                    self._set_state_from_json(index, json.load(f))
+            
+            if self.mmap_index:
+                self.base_index = index
+                self._base_path = index_path
+                self._base_next_id = self.next_id
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+            
+            wal_paths = [os.path.join(directory, name) for name in manifest['wals']]
+            for wal_path in wal_paths:
+                self._wal_offset = 0
+                for record, self._wal_offset in iter_wal(wal_path, self.dimension, repair=wal_path == wal_paths[-1]):
+                    self._apply_record(record)
+            
+            if self._wal is not None:
+                self._wal.close()
+            self._wal = WriteAheadLog(wal_paths[-1])
+            self._manifest = manifest
+            self._storage_path = filepath
+            self._pending = []
+            self._checkpoint_bytes = sum(os.path.getsize(path) for path in (index_path, metadata_path, lexical_path,
+                                                                            vectors_path) if path is not None)
+        
+        remove_unreferenced_files(filepath, manifest)
+    
+    def _apply_record(self, record: dict):
+        """Apply a change read from the write-ahead log"""
+        if record['op'] == 'add':
+            self._apply_add(record['first_id'], record['vectors'], record['metadata'])
+        elif record['op'] == 'link':
+            self._apply_link(record['vector_ids'], record['metadata'])
+        else:
+            self._apply_remove(record['document_id'])
+    
+    def share(self, filepath: str, refresh_interval: float = 1.0,
+              on_change: Callable[[set], None] = None):
+        """
+        Load the store saved at filepath and share it with other processes
+        
+        For app servers running several worker processes. Each change is
+        logged as it is made rather than on save_to_file, under an exclusive
+        lock on {filepath}.lock taken after applying the changes other
+        processes logged, so vector IDs never collide. A background thread
+        applies other processes' changes every refresh_interval seconds
+        under a shared lock, and reloads the store when one of them wrote a
+        checkpoint. Searches take neither lock, so they never wait on another
+        process's ingestion, and see its documents within refresh_interval.
+        
+        Args:
+            filepath: Base path of the store; created if it does not exist
+            refresh_interval: Seconds between checks for other processes' changes
+            on_change: Called with the IDs of documents other processes
+                changed; after a reload, with every document
+        """
+        store_lock = StoreLock(filepath)
+        with store_lock.exclusive():
+            self.load_from_file(filepath)
+            if self._storage_path != filepath:
+                # Empty or in the legacy format: checkpointed, so there is a log to share
+                self._checkpoint(filepath)
+            with self._lock:
+                self._store_lock = store_lock
+                self._on_change = on_change
+        
+        self._stop_refreshing.clear()
+        threading.Thread(target=self._refresh, args=(refresh_interval,), daemon=True).start()
+    
+    def stop_sharing(self):
+        """Stop applying other processes' changes; changes made here are still logged"""
+        self._stop_refreshing.set()
+    
+    @contextmanager
+    def _writing(self):
+        """
+        Wrap a change: when shared, applies other processes' changes first
+        and logs the change before any other process can change the store
+        """
+        if self._store_lock is None:
+            yield
+            return
+        
+        with self._store_lock.exclusive():
+            self._catch_up(repair=True)
+            yield
+            with self._persist_lock:
+                with self._lock:
+                    records, self._pending = self._pending, []
+                if records:
+                    # Searches are not held up by the fsync
+                    self._wal.append(records)
+                    with self._lock:
+                        self._wal_offset = self._wal.size()
+    
+    def _catch_up(self, repair: bool = False):
+        """
+        Apply the changes other processes made to the shared store since it was read
+        
+        Call with the store lock held; repair (of a log torn by a crash) only
+        with it held exclusively.
+        """
+        manifest = read_manifest(self._storage_path)
+        if manifest is None:
+            return
+        
+        if manifest != self._manifest:
+            # Another process wrote a checkpoint
+            changed = set(self.document_vectors)
+            self.load_from_file(self._storage_path)
+            changed.update(self.document_vectors)
+        else:
+            records = list(iter_wal(self._wal.path, self.dimension, start=self._wal_offset, repair=repair))
+            if not records:
+                return
+            changed = set()
+            with self._lock:
+                for record, self._wal_offset in records:
+                    self._apply_record(record)
+                    if record['op'] == 'remove':
+                        changed.add(record['document_id'])
+                    else:
+                        changed.update(chunk.get('document_id') for chunk in record['metadata'])
+        
+        if self._on_change is not None and changed:
+            self._on_change(changed)
+    
+    def _refresh(self, interval: float):
+        """Apply other processes' changes every interval seconds until sharing stops"""
+        while not self._stop_refreshing.wait(interval):
+            try:
+                # Checked without the lock first; nothing changed most of the time
+                if read_manifest(self._storage_path) == self._manifest and \
+                        os.path.getsize(self._wal.path) == self._wal_offset:
+                    continue
+                with self._store_lock.shared():
+                    self._catch_up()
+            except Exception as e:
+                print(f"Could not refresh shared vector store: {e}")
+    
+    def _merge_shared_wal(self):
+        """Checkpoint a shared store if its log is still too large; another process may have merged it"""
+        with self._store_lock.exclusive():
+            self._catch_up(repair=True)
+            if self._wal_offset > self.wal_merge_ratio * self._checkpoint_bytes:
+                self.checkpoint()
+    
+    def _load_legacy_files(self, filepath: str):
+        """Load a store saved as a single {filepath}.index / {filepath}.metadata pair"""
         if os.path.exists(f"{filepath}.index") and os.path.exists(f"{filepath}.metadata"):
-            self.index = faiss.read_index(f"{filepath}.index")
+            index = faiss.read_index(f"{filepath}.index")
             with open(f"{filepath}.metadata", 'r') as f:
-                self.chunk_metadata = json.load(f)
+                saved = json.load(f)
+            
+            if isinstance(saved, list):
+                # Oldest format: plain flat index whose row number was the chunk position
+                vectors = index.reconstruct_n(0, index.ntotal)
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+                index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+                saved = {
+                    'next_id': len(saved),
+                    'chunks': {str(i): chunk for i, chunk in enumerate(saved)},
+                    'tombstones': []
+                }
+            
+            with self._lock:
+                self._set_state_from_json(index, saved)
+    
+    def _set_state_from_json(self, index: faiss.Index, saved: dict):
+        """Load state saved as JSON with all chunk metadata inline"""
+        chunk_metadata = ChunkMetadata(added={
+            int(vector_id): chunk for vector_id, chunk in saved['chunks'].items()})
+        document_vectors = {}
+        for vector_id, chunk in chunk_metadata.items():
+            document_vectors.setdefault(chunk.get('document_id'), []).append(vector_id)
+        self._set_state(index, saved, chunk_metadata, document_vectors)
+    
+    def _set_state(self, index: faiss.Index, info: dict, chunk_metadata: ChunkMetadata,
+                   document_vectors: dict, lexical_index: LexicalIndex = None,
+                   full_vectors: FullVectors = None):
+        """Replace the in-memory state with a loaded index and metadata"""
+        self.index = index
+        self.base_index = None
+        self.active_index_type = index_type_of(index)
+        if full_vectors is None and self.index_type in LOSSY_INDEX_TYPES and \
+                self.active_index_type not in LOSSY_INDEX_TYPES:
+            # Saved without them (by a store of another backend): the exact
+            # index holds them. A lossy one is searched without re-ranking.
+            full_vectors = FullVectors(self.dimension)
+            full_vectors.add(*export_vectors(index))
+        self._full_vectors = full_vectors
+        self._index_generation += 1
+        self.next_id = info['next_id']
+        self.chunk_metadata = chunk_metadata
+        self.document_vectors = document_vectors
+        self.vector_links = {}
+        for vector_id, links in info.get('links', {}).items():
+            self._apply_link([int(vector_id)] * len(links), links)
+        if chunk_metadata.base is not None:
+            for vector_id, chunk in chunk_metadata.base.links():
+                self._apply_link([vector_id], [chunk])
+        self.tombstones = set(info['tombstones'])
+        self._live_selector = None
+        if lexical_index is None:
+            lexical_index = LexicalIndex()
+            for vector_id, chunk in chunk_metadata.items():
+                lexical_index.add(vector_id, chunk.get('text', ''))
+        self.lexical_index = lexical_index
 
+
+def _merge_top_k(parts: List[Tuple[np.ndarray, np.ndarray]], k: int, queries: int = 1):
+    """
+    Merge (scores, ids) search results of shape (queries, n) into each query's top k
+    
+    Like FAISS results, rows with fewer than k hits are padded with ID -1.
+    """
+    if not parts:
+        return np.empty((queries, 0), dtype=np.float32), np.empty((queries, 0), dtype=np.int64)
+    if len(parts) == 1:
+        scores, ids = parts[0]
+        if ids.shape[1] <= k:
+            return parts[0]
+    else:
+        scores = np.concatenate([part[0] for part in parts], axis=1)
+        ids = np.concatenate([part[1] for part in parts], axis=1)
+        padding = ids < 0
+        if padding.any():
+            scores = np.where(padding, np.float32(-np.inf), scores)
+    top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    rows = np.arange(len(ids))[:, None]
+    return scores[rows, top], ids[rows, top]
@@ -0,0 +1,213 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache with two tiers:
+
+    * an in-memory LRU of the most recently used vectors
+    * an optional SQLite file holding up to max_disk_entries vectors,
+      evicted least-recently-used first
+
+    Keys are SHA-256 hashes of (model name, normalized text), so identical
+    chunks are embedded once no matter which document they come from.
+
+    Disk hits do not write on the read path: their access times are
+    buffered and written in one transaction every touch_batch_size hits,
+    with the next put, before evicting and on close. The number of disk
+    entries is counted once on open and then kept up to date with the
+    rows this instance inserts and evicts.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_entries: int = 10000,
+                 max_disk_entries: int = 500000, touch_batch_size: int = 1000):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.touch_batch_size = touch_batch_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_entries = 0
+        self._touched = {}  # Key -> access time of disk hits not yet written
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access "
+                "ON embeddings (last_access)"
+            )
+            self._conn.commit()
+            self._disk_entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Collapse whitespace so formatting-only differences share a key"""
+        return " ".join(text.split())
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        """Hash of (model name, normalized text)"""
+        payload = f"{model}\x00{cls.normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Look up a single embedding"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Look up several embeddings, returning only the keys that hit"""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                else:
+                    missing.append(key)
+
+            if missing and self._conn is not None:
+                for key, vector in self._read_disk(missing):
+                    self._remember(key, vector)
+                    found[key] = vector
+                    self.disk_hits += 1
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put(self, key: str, embedding: List[float]):
+        """Store a single embedding"""
+        self.put_many([(key, embedding)])
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]):
+        """Store several embeddings in both tiers"""
+        rows = []
+        now = time.time()
+        with self._lock:
+            for key, embedding in items:
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+
+            if rows and self._conn is not None:
+                inserted = self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                    rows
+                ).rowcount
+                if inserted < len(rows):
+                    # Some keys were stored already, by an earlier put or another process
+                    self._conn.executemany(
+                        "UPDATE embeddings SET vector = ?, last_access = ? WHERE key = ?",
+                        [(blob, last_access, key) for key, blob, last_access in rows]
+                    )
+                for key, _, _ in rows:
+                    self._touched.pop(key, None)
+                self._write_touches()
+                self._conn.commit()
+                self._disk_entries += inserted
+                self._evict_disk()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_evictions': self.memory_evictions,
+                'disk_evictions': self.disk_evictions,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._disk_entries
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._write_touches()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert into the memory tier, evicting least recently used entries"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    def _read_disk(self, keys: List[str]) -> List[Tuple[str, np.ndarray]]:
+        results = []
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            results.extend((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+
+        now = time.time()
+        self._touched.update((key, now) for key, _ in results)
+        if len(self._touched) >= self.touch_batch_size:
+            self._write_touches()
+            self._conn.commit()
+        return results
+
+    def _write_touches(self):
+        """Write the buffered access times of disk hits; the caller commits"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()]
+            )
+            self._touched = {}
+
+    def _evict_disk(self):
+        """
+        Trim the disk tier to max_disk_entries, oldest access first
+
+        Trims a hundredth more than needed, so at capacity the rows are
+        counted once every that many inserts rather than on every put.
+        """
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        # Other processes sharing the file may have added or evicted rows
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        excess = self._disk_entries - self.max_disk_entries + self.max_disk_entries // 100
+        self._write_touches()
+        evicted = self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        ).rowcount
+        self._conn.commit()
+        self._disk_entries -= evicted
+        self.disk_evictions += evicted
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Local fake of the OpenAI HTTP API used by client tests and load tests
+Serves /v1/embeddings and /v1/chat/completions (streamed or not) over
+HTTP/1.1 keep-alive, answers requests over a per-model rate limit with
+429 and Retry-After like the real API, and counts requests, 429s,
+connections and the most requests in flight
+"""
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mock_openai import mock_embedding
+
+
+class FakeOpenAIServer:
+    def __init__(self, requests_per_second=None, latency=0.0, dimension=64, error_every=0):
+        """
+        Args:
+            requests_per_second: Requests a model accepts in any one second, or None for no limit
+            latency: Seconds each response takes
+            error_every: Answer every n-th request with a 500 (0 for never)
+        """
+        self.requests_per_second = requests_per_second
+        self.latency = latency
+        self.dimension = dimension
+        self.error_every = error_every
+        self.requests = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._windows = {}  # Model -> times of its accepted requests in the last second
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def admit(self, model):
+        """None to serve the request, or the seconds to wait before retrying"""
+        with self._lock:
+            self.requests += 1
+            if self.error_every and self.requests % self.error_every == 0:
+                self.server_errors += 1
+                return 0.0
+            if self.requests_per_second is None:
+                return None
+            now = time.monotonic()
+            window = self._windows.setdefault(model, deque())
+            while window and window[0] <= now - 1.0:
+                window.popleft()
+            if len(window) >= self.requests_per_second:
+                self.rate_limited += 1
+                return window[0] + 1.0 - now
+            window.append(now)
+            return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+    fake = None
+
+    def setup(self):
+        super().setup()
+        with self.fake._lock:
+            self.fake.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        fake = self.fake
+        with fake._lock:
+            fake.in_flight += 1
+            fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+        try:
+            retry_after = fake.admit(body.get('model'))
+            if retry_after == 0.0:
+                return self._send_json(500, {'error': {'message': 'The server had an error', 'type': 'server_error'}})
+            if retry_after is not None:
+                return self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                                       'code': 'rate_limit_exceeded'}},
+                                       {'retry-after-ms': str(int(retry_after * 1000) + 1)})
+            time.sleep(fake.latency)
+            if self.path.endswith('/embeddings'):
+                self._embeddings(body)
+            elif self.path.endswith('/chat/completions'):
+                self._chat(body)
+            else:
+                self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        finally:
+            with fake._lock:
+                fake.in_flight -= 1
+
+    def _embeddings(self, body):
+        texts = [body['input']] if isinstance(body['input'], str) else body['input']
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        self._send_json(200, {
+            'object': 'list',
+            'data': [{'object': 'embedding', 'index': i, 'embedding': mock_embedding(text, self.fake.dimension)}
+                     for i, text in enumerate(texts)],
+            'model': body['model'],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        })
+
+    def _chat(self, body):
+        content = f"Fake answer citing [1] for: {body['messages'][-1]['content'][-80:]}"
+        if not body.get('stream'):
+            return self._send_json(200, {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': body['model'],
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in re.findall(r'\S+\s*', content) + [None]:
+                chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                         'model': body['model'],
+                         'choices': [{'index': 0, 'delta': {'content': token} if token else {},
+                                      'finish_reason': None if token else 'stop'}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client closed the stream early
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
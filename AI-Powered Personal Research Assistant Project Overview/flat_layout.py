@@ -0,0 +1,49 @@
+"""
+Import support for running the backend from this flat directory
+
+The backend's modules import each other as src.models.*, src.routes.*
+and src.services.*, the package layout they are deployed in. Here the
+files are kept side by side, so install() adds an import hook that
+resolves those names to the modules of this directory: src.services.X
+is the module X itself, not a second copy of it, so tests can import
+modules by their plain names and patch the same objects the app uses.
+"""
+
+import importlib
+import importlib.abc
+import importlib.machinery
+import os
+import sys
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PACKAGES = ('src', 'src.models', 'src.routes', 'src.services')
+
+
+class FlatLayoutFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """Finds src.<package>.<module> as the module <module> of DIRECTORY"""
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname in PACKAGES:
+            return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+        package, _, name = fullname.rpartition('.')
+        if package in PACKAGES[1:] and os.path.exists(os.path.join(DIRECTORY, f"{name}.py")):
+            return importlib.machinery.ModuleSpec(fullname, self)
+        return None
+
+    def create_module(self, spec):
+        return None  # A placeholder, replaced by the real module in exec_module
+
+    def exec_module(self, module):
+        if module.__name__ in PACKAGES:
+            module.__path__ = []
+            return
+        # The import system returns whatever sys.modules holds once this returns
+        sys.modules[module.__name__] = importlib.import_module(module.__name__.rpartition('.')[2])
+
+
+def install():
+    """Resolve src.* imports to this directory's modules; safe to call more than once"""
+    if DIRECTORY not in sys.path:
+        sys.path.insert(0, DIRECTORY)
+    if not any(isinstance(finder, FlatLayoutFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, FlatLayoutFinder())
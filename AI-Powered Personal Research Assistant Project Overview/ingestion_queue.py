@@ -0,0 +1,130 @@
+import os
+import queue
+import socket
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable
+
+from src.models.document import IngestionJob, db
+
+
+class IngestionQueue:
+    """
+    In-process queue of ingestion jobs, processed by a pool of worker threads
+
+    Jobs live in the ingestion_jobs table and the queue only carries their
+    IDs, so work submitted before a restart is not lost: start() enqueues
+    every job that is still queued or was interrupted while running.
+
+    Several processes may run a queue over the same database. A worker
+    claims a job with a lease that a heartbeat thread renews while the
+    process is alive, and a running job is only taken over once its lease
+    has expired, so jobs in hand in another process are left alone.
+    """
+
+    def __init__(self, app, handler: Callable[[IngestionJob], None], num_workers: int = 2,
+                 lease_seconds: float = 60):
+        """
+        Args:
+            app: Flask app whose context workers run in
+            handler: Processes one job, reporting progress through
+                IngestionJob.report; an exception marks the job failed
+            num_workers: Number of jobs processed concurrently
+            lease_seconds: How long a running job stays claimed without a
+                heartbeat; leases are renewed three times per period
+        """
+        self.app = app
+        self.handler = handler
+        self.num_workers = num_workers
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue()
+        self._workers = []
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        """Recover unfinished jobs and start the workers"""
+        job_ids = self._unclaimed_jobs(include_queued=True)
+        for job_id in job_ids:
+            self._queue.put(job_id)
+        for _ in range(self.num_workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._stopped.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return len(job_ids)
+
+    def submit(self, job_id: str):
+        """Enqueue a job already committed to the database"""
+        self._queue.put(job_id)
+
+    def stop(self, timeout: float = None):
+        """Let the workers finish the jobs in hand and exit"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout)
+            self._heartbeat = None
+
+    def join(self):
+        """Block until every submitted job has been processed"""
+        self._queue.join()
+
+    def _unclaimed_jobs(self, include_queued: bool):
+        """IDs of jobs whose running owner's lease expired, and optionally of queued jobs"""
+        with self.app.app_context():
+            try:
+                expired = IngestionJob.lease_expired(datetime.utcnow())
+                condition = (IngestionJob.status == IngestionJob.RUNNING) & expired
+                if include_queued:
+                    condition = condition | (IngestionJob.status == IngestionJob.QUEUED)
+                rows = db.session.query(IngestionJob.job_id).filter(condition).order_by(IngestionJob.id).all()
+                return [row.job_id for row in rows]
+            finally:
+                db.session.remove()
+
+    def _beat(self):
+        """Renew the leases of jobs in hand and pick up jobs whose owner died"""
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                with self.app.app_context():
+                    IngestionJob.renew_leases(self.owner, self.lease_seconds)
+                for job_id in self._unclaimed_jobs(include_queued=False):
+                    self._queue.put(job_id)
+            except Exception as e:
+                print(f"Ingestion heartbeat failed: {e}")
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                if job_id is None:
+                    return
+                with self.app.app_context():
+                    try:
+                        self._run(job_id)
+                    finally:
+                        db.session.remove()
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str):
+        if not IngestionJob.claim(job_id, self.owner, self.lease_seconds):
+            return
+        job = IngestionJob.query.filter_by(job_id=job_id).first()
+
+        try:
+            self.handler(job)
+        except Exception as e:
+            db.session.rollback()
+            IngestionJob.report(job_id, owner=self.owner, status=IngestionJob.FAILED, error=str(e))
+            return
+        IngestionJob.report(job_id, owner=self.owner, status=IngestionJob.COMPLETED, stage='done')
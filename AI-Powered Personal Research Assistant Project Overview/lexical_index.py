@@ -0,0 +1,421 @@
+"""
+BM25 inverted index over chunk text for lexical and hybrid search
+
+Dense embeddings blur exact tokens such as identifiers, gene names and
+formulas; the inverted index finds the chunks containing them directly.
+Like the chunk metadata, the index is a read-only segment from the last
+checkpoint plus the chunks added since, kept in memory:
+
+* A segment file holds the postings sorted by term, each a (document
+  position, term frequency) pair, the sorted term hashes to find a term's
+  postings by binary search, and the documents' vector IDs and lengths.
+  Opening one only maps the file, so startup cost does not grow with the
+  corpus.
+* A query scores the postings of its terms with vectorized BM25, so its
+  cost is proportional to how many chunks contain them: microseconds for
+  rare terms like identifiers, regardless of the corpus size.
+
+Layout: [arrays][footer JSON][footer length: uint64][MAGIC]
+"""
+
+import functools
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.services.vector_persistence import fsync_directory
+
+MAGIC = b'RALEXIC1'
+TRAILER = struct.Struct('<Q8s')
+
+# Words joined by '-', '.' or '/' (IL-6, 3.14, TNF/IL) are indexed whole and by part
+TOKEN = re.compile(r'\w+(?:[-./]\w+)*')
+PART = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the their this "
+    "to was were which with".split())
+MAX_FREQUENCY = np.iinfo(np.uint16).max
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text, stopwords dropped"""
+    terms = []
+    for token in TOKEN.findall(text.lower()):
+        if token not in STOPWORDS:
+            terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in PART.findall(token) if part not in STOPWORDS)
+    return terms
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def term_hash(term: str) -> int:
+    """Positive 63-bit hash identifying a term in a segment"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little') >> 1
+
+
+def count_terms(text: str) -> Tuple[int, Dict[int, int]]:
+    """(length in terms, term hash -> frequency) of a text"""
+    terms = tokenize(text)
+    return len(terms), {term_hash(term): count for term, count in Counter(terms).items()}
+
+
+class SegmentBuilder:
+    """Accumulates documents in compact arrays and writes them as a segment file"""
+
+    def __init__(self):
+        self.doc_ids = array('q')
+        self.doc_lengths = array('I')
+        self.terms = array('q')
+        self.posting_ids = array('q')
+        self.frequencies = array('I')
+
+    def add(self, vector_id: int, text: str):
+        self.add_counts(vector_id, *count_terms(text))
+
+    def add_counts(self, vector_id: int, length: int, counts: Dict[int, int]):
+        if not counts:
+            return
+        self.doc_ids.append(vector_id)
+        self.doc_lengths.append(length)
+        self.terms.extend(counts.keys())
+        self.posting_ids.extend([vector_id] * len(counts))
+        self.frequencies.extend(counts.values())
+
+    def write(self, path: str, segment: 'LexicalSegment' = None, live: np.ndarray = None):
+        """
+        Write the documents added, plus segment's documents where live, to path
+
+        The two sets of vector IDs must not overlap.
+        """
+        doc_ids = np.frombuffer(self.doc_ids, dtype=np.int64)
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+        terms = np.frombuffer(self.terms, dtype=np.int64)
+        posting_ids = np.frombuffer(self.posting_ids, dtype=np.int64)
+        frequencies = np.minimum(np.frombuffer(self.frequencies, dtype=np.uint32), MAX_FREQUENCY)
+
+        if segment is not None and len(segment):
+            live = live if live is not None else np.ones(len(segment), dtype=bool)
+            # Expand the segment's postings to (term, vector ID) and drop dead documents
+            posting_live = live[segment.positions]
+            doc_ids = np.concatenate([segment.doc_ids[live], doc_ids])
+            doc_lengths = np.concatenate([segment.doc_lengths[live], doc_lengths])
+            segment_terms = np.repeat(segment.terms, np.diff(segment.term_starts))
+            terms = np.concatenate([segment_terms[posting_live], terms])
+            posting_ids = np.concatenate([segment.doc_ids[segment.positions[posting_live]], posting_ids])
+            frequencies = np.concatenate([segment.frequencies[posting_live], frequencies])
+
+        order = np.argsort(doc_ids, kind='stable')
+        doc_ids, doc_lengths = doc_ids[order], doc_lengths[order]
+        order = np.lexsort((posting_ids, terms))
+        terms, posting_ids, frequencies = terms[order], posting_ids[order], frequencies[order]
+        unique_terms, term_starts = np.unique(terms, return_index=True)
+
+        _write_segment(path, {
+            'terms': unique_terms.astype(np.int64),
+            'term_starts': np.append(term_starts, len(terms)).astype(np.int64),
+            'positions': np.searchsorted(doc_ids, posting_ids).astype(np.uint32),
+            'frequencies': frequencies.astype(np.uint16),
+            'doc_ids': doc_ids.astype(np.int64),
+            'doc_lengths': doc_lengths.astype(np.uint32)
+        }, {'total_length': int(doc_lengths.sum(dtype=np.int64))})
+
+
+def _write_segment(path: str, arrays: Dict[str, np.ndarray], info: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        sections = {}
+        for name, values in arrays.items():
+            # Align arrays so they can be viewed in place
+            f.write(b'\0' * (-f.tell() % 8))
+            sections[name] = [f.tell(), values.dtype.str, len(values)]
+            f.write(values.tobytes())
+        footer = json.dumps({'sections': sections, 'info': info}).encode('utf-8')
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+class LexicalSegment:
+    """Read-only view of a segment file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer_length, magic = TRAILER.unpack_from(self._mmap, len(self._mmap) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lexical index segment")
+        footer_start = len(self._mmap) - TRAILER.size - footer_length
+        footer = json.loads(self._mmap[footer_start:footer_start + footer_length])
+
+        self.total_length = footer['info']['total_length']
+        arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count, offset=offset)
+            for name, (offset, dtype, count) in footer['sections'].items()
+        }
+        self.terms = arrays['terms']
+        self.term_starts = arrays['term_starts']
+        self.positions = arrays['positions']
+        self.frequencies = arrays['frequencies']
+        self.doc_ids = arrays['doc_ids']
+        self.doc_lengths = arrays['doc_lengths']
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def position(self, vector_id: int) -> Optional[int]:
+        position = int(np.searchsorted(self.doc_ids, vector_id))
+        if position < len(self.doc_ids) and self.doc_ids[position] == vector_id:
+            return position
+        return None
+
+    def postings(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(document positions, frequencies) of a term hash"""
+        i = int(np.searchsorted(self.terms, term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return self.positions[:0], self.frequencies[:0]
+        start, end = self.term_starts[i], self.term_starts[i + 1]
+        return self.positions[start:end], self.frequencies[start:end]
+
+
+class LexicalIndex:
+    """
+    BM25 index of vector ID -> chunk text for VectorStore
+
+    Documents from the last checkpoint are read from a LexicalSegment;
+    documents added since are indexed in memory, and removed segment
+    documents are masked out. Document frequencies count masked documents
+    until the next checkpoint, which only shifts scores slightly.
+    """
+
+    def __init__(self, segment: LexicalSegment = None, added: dict = None, removed: Iterable[int] = (),
+                 k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            segment: Documents from the last checkpoint
+            added: Vector ID -> (length, term counts) of documents indexed since
+            removed: Vector IDs of segment documents that no longer count
+            k1, b: BM25 term frequency saturation and length normalization
+        """
+        self.segment = segment
+        self.k1 = k1
+        self.b = b
+        self.added = {}
+        self._postings = {}  # Term hash -> {vector ID: frequency} of added documents
+        self.document_count = 0
+        self.total_length = 0
+        self._live = None
+        if segment is not None:
+            self._live = np.ones(len(segment), dtype=bool)
+            self.document_count = len(segment)
+            self.total_length = segment.total_length
+            for vector_id in removed:
+                self._remove_from_segment(vector_id)
+        for vector_id, entry in (added or {}).items():
+            self._add_entry(vector_id, entry)
+
+    def __len__(self) -> int:
+        return self.document_count
+
+    def add(self, vector_id: int, text: str):
+        """Index a chunk's text, replacing any text indexed under vector_id"""
+        self.add_counts(vector_id, *count_terms(text))
+
+    def add_counts(self, vector_id: int, length: int, counts: Dict[int, int]):
+        """Index a chunk's text from count_terms, replacing any text indexed under vector_id"""
+        self.remove(vector_id)
+        if counts:
+            self._add_entry(vector_id, (length, counts))
+
+    def _add_entry(self, vector_id: int, entry: Tuple[int, Dict[int, int]]):
+        self._remove_from_segment(vector_id)
+        length, counts = entry
+        self.added[vector_id] = entry
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[vector_id] = frequency
+        self.document_count += 1
+        self.total_length += length
+
+    def remove(self, vector_id: int):
+        """Stop matching a chunk; unknown IDs are ignored"""
+        entry = self.added.pop(vector_id, None)
+        if entry is None:
+            self._remove_from_segment(vector_id)
+            return
+        length, counts = entry
+        for term in counts:
+            postings = self._postings[term]
+            del postings[vector_id]
+            if not postings:
+                del self._postings[term]
+        self.document_count -= 1
+        self.total_length -= length
+
+    def _remove_from_segment(self, vector_id: int):
+        if self.segment is None:
+            return
+        position = self.segment.position(vector_id)
+        if position is not None and self._live[position]:
+            self._live[position] = False
+            self.document_count -= 1
+            self.total_length -= int(self.segment.doc_lengths[position])
+
+    def removed(self) -> np.ndarray:
+        """Vector IDs of masked segment documents"""
+        if self.segment is None:
+            return np.empty(0, dtype=np.int64)
+        return self.segment.doc_ids[~self._live]
+
+    def search(self, query: str, k: int, allowed: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top k chunks for a query by BM25
+
+        Terms are scored rarest first. Once the k-th best score so far is at
+        least what the remaining terms could add, no chunk outside the
+        candidates can reach the top k, so the remaining (most common) terms
+        are only looked up for the candidates instead of scoring all their
+        postings (MaxScore pruning).
+
+        Args:
+            query: Query text
+            k: Number of results
+            allowed: Optional sorted vector IDs to restrict the search to
+
+        Returns:
+            (scores, vector IDs) arrays, best first
+        """
+        ids, scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if not self.document_count:
+            return scores, ids
+        average_length = self.total_length / self.document_count
+
+        terms = []  # (idf, segment postings, added postings)
+        for term in {term_hash(term) for term in tokenize(query)}:
+            postings = self.segment.postings(term) if self.segment is not None else None
+            added = self._postings.get(term, {})
+            df = (len(postings[0]) if postings is not None else 0) + len(added)
+            if df:
+                idf = math.log(1 + (self.document_count - df + 0.5) / (df + 0.5))
+                terms.append((idf, postings, added))
+        terms.sort(key=lambda term: -term[0])
+        # A term adds at most idf * (k1 + 1) to a chunk's score
+        bounds = np.cumsum([idf * (self.k1 + 1) for idf, _, _ in reversed(terms)])[::-1]
+
+        for (idf, postings, added), bound in zip(terms, bounds):
+            if len(ids) >= k and np.partition(scores, len(scores) - k)[len(scores) - k] >= bound:
+                scores = scores + self._score_candidates(ids, idf, postings, added, average_length)
+                continue
+            term_ids, term_scores = self._score_postings(idf, postings, added, average_length, allowed)
+            if len(ids):
+                # Sum the scores of each chunk's matching terms
+                ids, inverse = np.unique(np.concatenate([ids, term_ids]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, term_scores])).astype(np.float32)
+            else:
+                ids, scores = term_ids, term_scores
+
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return scores[order], ids[order]
+
+    def _score_postings(self, idf: float, postings, added: dict, average_length: float,
+                        allowed: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(sorted vector IDs, scores) of the live chunks containing a term"""
+        ids, scores = [], []
+        if postings is not None and len(postings[0]):
+            positions, frequencies = postings
+            live = self._live[positions]
+            positions = positions[live]
+            ids.append(self.segment.doc_ids[positions])
+            scores.append(self._bm25(idf, frequencies[live], self.segment.doc_lengths[positions],
+                                     average_length))
+        if added:
+            ids.append(np.fromiter(added.keys(), dtype=np.int64, count=len(added)))
+            scores.append(self._bm25(idf, np.fromiter(added.values(), dtype=np.float32, count=len(added)),
+                                     self._added_lengths(added), average_length))
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        if added:
+            order = np.argsort(ids, kind='stable')
+            ids, scores = ids[order], scores[order]
+        if allowed is not None:
+            keep = np.isin(ids, allowed)
+            ids, scores = ids[keep], scores[keep]
+        return ids, scores
+
+    def _score_candidates(self, ids: np.ndarray, idf: float, postings, added: dict,
+                          average_length: float) -> np.ndarray:
+        """A term's scores for the chunks with sorted vector IDs ids, 0 where it is absent"""
+        scores = np.zeros(len(ids), dtype=np.float32)
+        if postings is not None and len(postings[0]):
+            positions, frequencies = postings
+            # Segment postings are sorted by document position, like the document IDs
+            candidates = np.minimum(np.searchsorted(self.segment.doc_ids, ids), len(self.segment) - 1)
+            found = np.minimum(np.searchsorted(positions, candidates), len(positions) - 1)
+            hits = ((self.segment.doc_ids[candidates] == ids) & (positions[found] == candidates)
+                    & self._live[candidates])
+            scores[hits] = self._bm25(idf, frequencies[found[hits]],
+                                      self.segment.doc_lengths[candidates[hits]], average_length)
+        if added:
+            added_ids = np.fromiter(added.keys(), dtype=np.int64, count=len(added))
+            found = np.minimum(np.searchsorted(ids, added_ids), len(ids) - 1)
+            hits = ids[found] == added_ids
+            frequencies = np.fromiter(added.values(), dtype=np.float32, count=len(added))
+            scores[found[hits]] += self._bm25(idf, frequencies[hits], self._added_lengths(added)[hits],
+                                              average_length)
+        return scores
+
+    def _added_lengths(self, postings: dict) -> np.ndarray:
+        return np.fromiter((self.added[vector_id][0] for vector_id in postings), dtype=np.float32,
+                           count=len(postings))
+
+    def _bm25(self, idf: float, frequencies: np.ndarray, lengths: np.ndarray,
+              average_length: float) -> np.ndarray:
+        frequencies = frequencies.astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths.astype(np.float32) / average_length)
+        return (idf * frequencies * (self.k1 + 1) / (frequencies + norm)).astype(np.float32)
+
+    def snapshot(self) -> 'LexicalIndex':
+        """Copy, for write(), that later changes to this index do not affect"""
+        copy = LexicalIndex(k1=self.k1, b=self.b)
+        # Only what write() needs: the added documents' postings are not copied
+        copy.segment = self.segment
+        copy._live = self._live.copy() if self._live is not None else None
+        copy.added = dict(self.added)
+        return copy
+
+    def write(self, path: str):
+        """Write the live documents as one segment file"""
+        builder = SegmentBuilder()
+        for vector_id in sorted(self.added):
+            builder.add_counts(vector_id, *self.added[vector_id])
+        builder.write(path, self.segment, self._live)
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int, rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuse ranked lists of vector IDs, best first, into the top k (vector ID, score)
+
+    A chunk scores sum(1 / (rrf_k + rank)) over the lists it appears in, so
+    agreement between rankings counts and their raw scores need not be
+    comparable.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, vector_id in enumerate(ranking.tolist(), start=1):
+            fused[vector_id] = fused.get(vector_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:k]
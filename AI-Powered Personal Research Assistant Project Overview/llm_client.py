@@ -0,0 +1,471 @@
+"""
+Shared, rate-limit-aware client for the OpenAI API
+
+LLMClient wraps one openai.OpenAI() client, and with it one pool of
+keep-alive HTTP connections, for every service in the process. It has
+the same embeddings.create and chat.completions.create interface, so
+DocumentProcessor, RAGService and DocumentSummarizer take it in place of
+their own client. Each request:
+
+* waits for its model's requests- and tokens-per-minute buckets, so
+  bursts are spread out instead of answered with 429s
+* waits for a slot under an adaptive concurrency limit, which halves on
+  a 429 and grows back by one after a limit's worth of successes
+* shares the response of an identical request already in flight
+  (streams excepted)
+* is retried on 429s, timeouts, connection errors and 5xx responses after
+  the server's Retry-After plus a jittered exponential backoff; after a
+  429 the model's other requests wait out the Retry-After too
+
+AsyncLLMClient does the same for coroutines on openai.AsyncOpenAI(),
+under an LLMClient's limits.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Callable, Dict, Optional, Tuple
+
+import openai
+
+from src.services.chunking import estimate_tokens
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class TokenBucket:
+    """
+    Allows rate_per_minute units a minute, in bursts of up to capacity
+
+    A request for more than capacity, such as a large embedding batch
+    against a tokens-per-minute bucket, goes ahead once the bucket is full
+    and is charged in full: the balance goes negative, and later requests
+    wait until the debt is paid off, so every unit is counted against the rate.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate_per_minute / 60.0
+        # A second's worth by default, so a burst cannot use up the minute at once
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until amount units are available and take them; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, amount: float = 1.0) -> float:
+        """acquire for coroutines, waiting without blocking the event loop"""
+        waited = 0.0
+        while True:
+            wait = self._take(amount)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def _take(self, amount: float) -> float:
+        """Take amount units if available and return 0, or return the seconds until they are"""
+        needed = min(amount, self.capacity)  # Larger requests would never fit, so they overdraw
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if now >= self._paused_until and self._tokens >= needed:
+                self._tokens -= amount
+                return 0.0
+            return max(self._paused_until - now, (needed - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold back every acquire for seconds, as after a 429 with Retry-After"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Bounds requests in flight; the bound halves on overload and grows back additively"""
+
+    def __init__(self, max_concurrency: int = 16, min_concurrency: int = 1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, poll_interval: float = 0.005):
+        """acquire for coroutines; they poll, as waiting on the condition would block the event loop"""
+        while not self.try_acquire():
+            await asyncio.sleep(poll_interval)
+
+    def release(self, overloaded: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Release the slot of a request given up before it completed, leaving the bound as it is"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class HeldStream:
+    """Iterates a streamed response, calling release once it is exhausted, fails or is closed"""
+
+    def __init__(self, response, release: Callable[[], None]):
+        self._response = response
+        self._iterator = iter(response)
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        close = getattr(self._response, 'close', None)
+        if close is not None:
+            close()
+        self._release()
+
+    def __del__(self):
+        self.close()
+
+
+class HeldAsyncStream:
+    """HeldStream for the async streams of openai.AsyncOpenAI()"""
+
+    def __init__(self, response, release: Callable[[], None]):
+        self._response = response
+        self._iterator = response.__aiter__()
+        self._release = release
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self._released:
+            return
+        self._released = True
+        close = getattr(self._response, 'close', None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        self._release()
+
+    def __del__(self):
+        # Too late to close the response, but the slot must not leak
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+class LLMClient:
+    """Drop-in replacement for openai.OpenAI() shared by the services; see the module docstring"""
+
+    def __init__(self, client=None, requests_per_minute: float = 3000, tokens_per_minute: float = 250000,
+                 model_limits: Dict[str, Tuple[float, float]] = None, max_concurrency: int = 16,
+                 max_retries: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 coalesce: bool = True, sleep: Callable[[float], None] = time.sleep,
+                 random_fraction: Callable[[], float] = random.random):
+        """
+        Args:
+            client: OpenAI client to send requests with (default: openai.OpenAI()
+                with its own retries off, as they would bypass the rate limits)
+            requests_per_minute, tokens_per_minute: Default limits of a model
+            model_limits: Model -> (requests_per_minute, tokens_per_minute)
+                for models whose limits differ from the default
+            max_concurrency: Most requests in flight at once, and connections used
+            max_retries: Retries of a request before its error is raised
+            base_delay, max_delay: Backoff before retry n is Retry-After plus a
+                random [0, min(max_delay, base_delay * 2**n)) seconds
+            coalesce: Share the response of identical requests in flight
+        """
+        self.client = client or openai.OpenAI(max_retries=0)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce = coalesce
+        self.sleep = sleep
+        self.random_fraction = random_fraction
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+        self._buckets = {}  # Model -> (requests bucket, tokens bucket)
+        self._in_flight = {}  # Request key -> Future of its response
+        self._lock = threading.Lock()
+
+        self.embeddings = SimpleNamespace(create=lambda **kwargs: self._request('embeddings', kwargs))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: self._request('chat', kwargs)))
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'coalesced': self.coalesced,
+                'failures': self.failures,
+                'throttled_seconds': self.throttled_seconds,
+                'concurrency_limit': self.limiter.limit
+            }
+
+    def _request(self, endpoint: str, kwargs: dict):
+        if kwargs.get('stream') or not self.coalesce:
+            return self._send(endpoint, kwargs)
+
+        key = json.dumps([endpoint, kwargs], sort_keys=True, default=str)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._send(endpoint, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def _send(self, endpoint: str, kwargs: dict):
+        requests_bucket, tokens_bucket = self._model_buckets(kwargs.get('model'))
+        create = self.client.embeddings.create if endpoint == 'embeddings' else self.client.chat.completions.create
+        tokens = self._estimate_tokens(endpoint, kwargs)
+
+        attempt = 0
+        while True:
+            waited = requests_bucket.acquire(1) + tokens_bucket.acquire(tokens)
+            self.limiter.acquire()
+            with self._lock:
+                self.requests += 1
+                self.throttled_seconds += waited
+            try:
+                response = create(**kwargs)
+            except Exception as e:
+                self.sleep(self._retry_delay(e, attempt, requests_bucket))
+                attempt += 1
+                continue
+            except BaseException:
+                self.limiter.cancel()
+                raise
+            
+            if kwargs.get('stream'):
+                # The slot is held until the stream is read or closed
+                return HeldStream(response, self.limiter.release)
+            self.limiter.release()
+            return response
+
+    def _retry_delay(self, e: Exception, attempt: int, requests_bucket: TokenBucket) -> float:
+        """Release the failed attempt's slot and return the delay before retrying, or raise e"""
+        overloaded = getattr(e, 'status_code', None) == 429
+        self.limiter.release(overloaded)
+        with self._lock:
+            self.rate_limited += overloaded
+        if not self._retryable(e) or attempt >= self.max_retries:
+            with self._lock:
+                self.failures += 1
+            raise e
+        # Jittered on top of Retry-After too, or everyone waiting on it retries at once
+        delay = (self._retry_after(e) or 0.0) + \
+            self.random_fraction() * min(self.max_delay, self.base_delay * 2 ** attempt)
+        if overloaded:
+            # Everyone waits, rather than each request drawing its own 429
+            requests_bucket.pause(delay)
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def _model_buckets(self, model: Optional[str]) -> tuple:
+        with self._lock:
+            buckets = self._buckets.get(model)
+            if buckets is None:
+                rpm, tpm = self.model_limits.get(model, (self.requests_per_minute, self.tokens_per_minute))
+                buckets = self._buckets[model] = (TokenBucket(rpm, sleep=self.sleep),
+                                                  TokenBucket(tpm, sleep=self.sleep))
+            return buckets
+
+    @staticmethod
+    def _estimate_tokens(endpoint: str, kwargs: dict) -> int:
+        """Tokens a request counts against the limit; completions count their max_tokens"""
+        if endpoint == 'embeddings':
+            texts = kwargs.get('input', [])
+            return sum(estimate_tokens(text) for text in ([texts] if isinstance(texts, str) else texts))
+        prompt = sum(estimate_tokens(str(message.get('content', ''))) for message in kwargs.get('messages', []))
+        return prompt + kwargs.get('max_tokens', 0)
+
+    @staticmethod
+    def _retryable(e: Exception) -> bool:
+        if isinstance(e, openai.APIConnectionError):  # Includes timeouts
+            return True
+        status = getattr(e, 'status_code', None)
+        return status is not None and (status in RETRYABLE_STATUS_CODES or status >= 500)
+
+    @staticmethod
+    def _retry_after(e: Exception) -> Optional[float]:
+        """Seconds the server asked to wait, if it did"""
+        headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+        try:
+            if headers.get('retry-after-ms') is not None:
+                return float(headers['retry-after-ms']) / 1000
+            if headers.get('retry-after') is not None:
+                return float(headers['retry-after'])
+        except ValueError:
+            pass  # An HTTP date; fall back to backoff
+        return None
+
+
+class AsyncLLMClient:
+    """
+    Counterpart of LLMClient for coroutines, used by the async server
+
+    Sends requests with openai.AsyncOpenAI() but under the rate limits,
+    concurrency limit, retry policy and counters of an LLMClient, so
+    the threads and the event loop of a process share one set of limits.
+    Identical requests are coalesced within the event loop it is used on.
+    """
+
+    def __init__(self, llm_client: LLMClient, client=None):
+        """
+        Args:
+            llm_client: Client whose limits and counters are shared
+            client: Async OpenAI client to send requests with (default:
+                openai.AsyncOpenAI() with its own retries off)
+        """
+        self.llm_client = llm_client
+        self.client = client or openai.AsyncOpenAI(max_retries=0)
+        self._in_flight = {}  # Request key -> asyncio.Future of its response
+
+        self.embeddings = SimpleNamespace(create=lambda **kwargs: self._request('embeddings', kwargs))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: self._request('chat', kwargs)))
+
+    def stats(self) -> dict:
+        return self.llm_client.stats()
+
+    async def _request(self, endpoint: str, kwargs: dict):
+        shared = self.llm_client
+        if kwargs.get('stream') or not shared.coalesce:
+            return await self._send(endpoint, kwargs)
+
+        key = json.dumps([endpoint, kwargs], sort_keys=True, default=str)
+        future = self._in_flight.get(key)
+        if future is not None:
+            with shared._lock:
+                shared.coalesced += 1
+            # Shielded, so a cancelled follower does not cancel the leader's request
+            return await asyncio.shield(future)
+
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            future.set_result(await self._send(endpoint, kwargs))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved, so no warning when nobody else awaits it
+        finally:
+            del self._in_flight[key]
+        return future.result()
+
+    async def _send(self, endpoint: str, kwargs: dict):
+        shared = self.llm_client
+        requests_bucket, tokens_bucket = shared._model_buckets(kwargs.get('model'))
+        create = self.client.embeddings.create if endpoint == 'embeddings' else self.client.chat.completions.create
+        tokens = shared._estimate_tokens(endpoint, kwargs)
+
+        attempt = 0
+        while True:
+            waited = await requests_bucket.acquire_async(1) + await tokens_bucket.acquire_async(tokens)
+            await shared.limiter.acquire_async()
+            with shared._lock:
+                shared.requests += 1
+                shared.throttled_seconds += waited
+            try:
+                response = await create(**kwargs)
+            except Exception as e:
+                await asyncio.sleep(shared._retry_delay(e, attempt, requests_bucket))
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, which is no Exception: the slot is still ours to give back
+                shared.limiter.cancel()
+                raise
+
+            if kwargs.get('stream'):
+                return HeldAsyncStream(response, shared.limiter.release)
+            shared.limiter.release()
+            return response
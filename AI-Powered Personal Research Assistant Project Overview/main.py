@@ -6,9 +6,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from src.models.user import db
-from src.models.document import Document, DocumentChunk
+from src.models.document import (Document, DocumentChunk, migrate_embeddings, migrate_fingerprints,
+                                 migrate_ingestion_jobs)
 from src.routes.user import user_bp
-from src.routes.research_assistant import research_bp, initialize_vector_store
+from src.routes.research_assistant import research_bp, initialize_vector_store, start_ingestion_queue
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -30,9 +31,18 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 with app.app_context():
     db.create_all()
+    # Convert embeddings stored as JSON by earlier versions
+    migrate_embeddings()
+    # Fingerprint chunks stored before deduplication so uploads match them
+    migrate_fingerprints()
+    # Add the lease columns that let several processes share ingestion jobs
+    migrate_ingestion_jobs()
     # Initialize vector store
     initialize_vector_store()
 
+# Process uploads in the background
+start_ingestion_queue(app)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI client used by tests and benchmarks
+Mimics the parts of the openai.OpenAI() and openai.AsyncOpenAI()
+interfaces the backend calls, with configurable latency and call
+counting, so nothing hits the network
+"""
+
+import asyncio
+import re
+import time
+import zlib
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+
+def mock_embedding(text, dimension=1536):
+    """Deterministic pseudo-embedding derived from the text"""
+    rng = np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+    return rng.standard_normal(dimension).astype(np.float32).tolist()
+
+
+class MockEmbeddings:
+    """Implements client.embeddings.create(model=..., input=...)"""
+
+    def __init__(self, dimension=1536, latency=0.0, per_input_latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.calls = 0
+        self.inputs = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, input):
+        texts = self._count(input)
+        time.sleep(self.latency + self.per_input_latency * len(texts))
+        return self._respond(model, texts)
+
+    async def acreate(self, model, input):
+        texts = self._count(input)
+        await asyncio.sleep(self.latency + self.per_input_latency * len(texts))
+        return self._respond(model, texts)
+
+    def _count(self, input):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self._lock:
+            self.calls += 1
+            self.inputs += len(texts)
+        return texts
+
+    def _respond(self, model, texts):
+        data = [
+            SimpleNamespace(index=i, embedding=mock_embedding(text, self.dimension))
+            for i, text in enumerate(texts)
+        ]
+        return SimpleNamespace(data=data, model=model)
+
+
+class MockChatCompletions:
+    """
+    Implements client.chat.completions.create(model=..., messages=..., ...)
+    With stream=True, returns an iterator of chunks: the first after
+    latency, then one word per token_latency, like a streaming completion
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self.last_messages = None
+        self._lock = threading.Lock()
+
+    def create(self, model, messages, stream=False, **kwargs):
+        content = self._count(messages)
+        if stream:
+            return self._stream(model, content)
+
+        time.sleep(self.latency + self.token_latency * len(content.split()))
+        return self._respond(model, content)
+
+    async def acreate(self, model, messages, stream=False, **kwargs):
+        content = self._count(messages)
+        if stream:
+            return self._astream(model, content)
+
+        await asyncio.sleep(self.latency + self.token_latency * len(content.split()))
+        return self._respond(model, content)
+
+    def _count(self, messages):
+        with self._lock:
+            self.calls += 1
+            self.last_messages = messages
+        return f"Mock answer citing [1] for: {messages[-1]['content'][-80:]}"
+
+    @staticmethod
+    def _respond(model, content):
+        message = SimpleNamespace(role='assistant', content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason='stop')],
+                               model=model)
+
+    def _stream(self, model, content):
+        time.sleep(self.latency)
+        for i, token in enumerate(re.findall(r'\S+\s*', content)):
+            if i:
+                time.sleep(self.token_latency)
+            yield self._chunk(model, token, first=i == 0)
+        yield self._chunk(model, None)
+
+    async def _astream(self, model, content):
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(re.findall(r'\S+\s*', content)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield self._chunk(model, token, first=i == 0)
+        yield self._chunk(model, None)
+
+    @staticmethod
+    def _chunk(model, token, first=False):
+        """A streamed chunk carrying token, or the final chunk if token is None"""
+        delta = SimpleNamespace(role='assistant' if first else None, content=token)
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta,
+                                                        finish_reason=None if token else 'stop')], model=model)
+
+
+class MockOpenAIClient:
+    """Drop-in replacement for openai.OpenAI() in tests"""
+
+    def __init__(self, dimension=1536, embedding_latency=0.0, per_input_latency=0.0, chat_latency=0.0,
+                 chat_token_latency=0.0):
+        self.embeddings = MockEmbeddings(dimension, embedding_latency, per_input_latency)
+        self.chat = SimpleNamespace(completions=MockChatCompletions(chat_latency, chat_token_latency))
+
+
+class MockAsyncOpenAIClient:
+    """Drop-in replacement for openai.AsyncOpenAI() with the latencies and call counts of a MockOpenAIClient"""
+
+    def __init__(self, client=None):
+        client = client or MockOpenAIClient()
+        self.embeddings = SimpleNamespace(create=client.embeddings.acreate)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=client.chat.completions.acreate))
@@ -1,13 +1,42 @@
+import asyncio
 import openai
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Iterator, Tuple
+from src.services.answer_cache import AnswerCache
+from src.services.context_builder import ContextBuilder
 from src.services.document_processor import VectorStore
+from src.services.embedding_cache import EmbeddingCache
+from src.services.summarizer import DocumentSummarizer
+
+# Supported retrieval modes: embeddings only, BM25 only, or both fused
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
+
+NO_CONTEXT_ANSWER = "I couldn't find relevant information in the uploaded documents to answer your question."
+
+# Queries embedded per embeddings request by chat_batch
+QUERY_EMBEDDING_BATCH_SIZE = 512
 
 class RAGService:
-    def __init__(self, vector_store: VectorStore):
-        self.openai_client = openai.OpenAI()
+    def __init__(self, vector_store: VectorStore, openai_client=None,
+                 embedding_cache: EmbeddingCache = None, retrieval_mode: str = 'vector',
+                 answer_cache: AnswerCache = None, context_builder: ContextBuilder = None,
+                 summarizer: DocumentSummarizer = None, async_openai_client=None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}. Supported modes: {', '.join(RETRIEVAL_MODES)}")
+        self.openai_client = openai_client or openai.OpenAI()
+        # Awaited by the async server's coroutines; openai.AsyncOpenAI() when first needed if not given
+        self.async_openai_client = async_openai_client
         self.vector_store = vector_store
+        self.embedding_cache = embedding_cache
+        self.embedding_model = "text-embedding-ada-002"
+        self.retrieval_mode = retrieval_mode
+        self.answer_cache = answer_cache
+        self.context_builder = context_builder or ContextBuilder()
+        self.summarizer = summarizer or DocumentSummarizer(self.openai_client,
+                                                           async_openai_client=async_openai_client)
         
-    def chat_with_documents(self, query: str, document_ids: List[str] = None, k: int = 5) -> Dict[str, Any]:
+    def chat_with_documents(self, query: str, document_ids: List[str] = None, k: int = 5,
+                            retrieval_mode: str = None) -> Dict[str, Any]:
         """
         Chat with documents using RAG approach
         
@@ -15,46 +44,237 @@ class RAGService:
             query: User's natural language question
             document_ids: Optional list of specific document IDs to search in
             k: Number of relevant chunks to retrieve
+            retrieval_mode: One of RETRIEVAL_MODES (default: the service's,
+                'vector' unless configured otherwise). 'hybrid' fuses
+                embedding and BM25 rankings, so exact terms like identifiers
+                are found without raising k; its citations carry the fused
+                score as 'fusion_score' next to the similarity.
             
         Returns:
-            Dictionary containing answer and citations
+            Dictionary containing answer and citations, and whether it came
+            from the answer cache
         """
+        retrieval_mode = self._resolve_retrieval_mode(retrieval_mode)
+        
         try:
-            # Generate embedding for the query
-            query_embedding = self._generate_query_embedding(query)
+            cached, cache_entry = self._lookup_answer(query, document_ids, k, retrieval_mode)
+            if cached is not None:
+                return dict(cached, cached=True)
             
-            # Retrieve relevant chunks
-            relevant_chunks = self.vector_store.search(query_embedding, k)
-            
-            # Filter by document IDs if specified
-            if document_ids:
-                relevant_chunks = [
-                    (chunk, score) for chunk, score in relevant_chunks
-                    if chunk.get('document_id') in document_ids
-                ]
+            # Retrieve relevant chunks, restricted to document_ids if specified
+            relevant_chunks = self._retrieve(query, document_ids, k, retrieval_mode, cache_entry[2])
             
             # Generate answer using retrieved context
             answer, citations = self._generate_answer_with_citations(query, relevant_chunks)
             
-            return {
+            result = {
+                'answer': answer,
+                'citations': citations,
+                'retrieved_chunks': len(relevant_chunks)
+            }
+            self._store_answer(cache_entry, result)
+            return dict(result, cached=False)
+            
+        except Exception as e:
+            raise Exception(f"Error in RAG chat: {str(e)}")
+    
+    def chat_batch(self, queries: List[str], document_ids: List[str] = None, k: int = 5,
+                   retrieval_mode: str = None, max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        Answer many questions, for bulk question answering and evaluation jobs
+        
+        The questions are embedded in bulk requests, retrieved for in one
+        batched search (see VectorStore.search_batch), and up to
+        max_concurrency answers are generated at once. Answers are cached
+        and served from the cache as by chat_with_documents.
+        
+        Returns:
+            A result per question, in order, as chat_with_documents returns
+            it, or with just an 'error' if its answer could not be generated
+        """
+        retrieval_mode = self._resolve_retrieval_mode(retrieval_mode)
+        
+        try:
+            if retrieval_mode == 'lexical':
+                embeddings = [None] * len(queries)
+            else:
+                embeddings = self._generate_query_embeddings(queries)
+            lookups = [self._lookup_answer(query, document_ids, k, retrieval_mode, embedding)
+                       for query, embedding in zip(queries, embeddings)]
+            results = [dict(cached, cached=True) if cached is not None else None for cached, _ in lookups]
+            
+            misses = [i for i, result in enumerate(results) if result is None]
+            retrieved = self._retrieve_batch([queries[i] for i in misses], document_ids, k, retrieval_mode,
+                                             [embeddings[i] for i in misses])
+        except Exception as e:
+            raise Exception(f"Error in RAG batch chat: {str(e)}")
+        
+        def answer(i: int, relevant_chunks: List[tuple]) -> Dict[str, Any]:
+            try:
+                answer, citations = self._generate_answer_with_citations(queries[i], relevant_chunks)
+            except Exception as e:
+                # One failed answer does not fail the batch
+                return {'error': str(e)}
+            result = {
                 'answer': answer,
                 'citations': citations,
                 'retrieved_chunks': len(relevant_chunks)
             }
+            self._store_answer(lookups[i][1], result)
+            return dict(result, cached=False)
+        
+        if misses:
+            with ThreadPoolExecutor(max_workers=min(max_concurrency, len(misses))) as executor:
+                for i, result in zip(misses, executor.map(answer, misses, retrieved)):
+                    results[i] = result
+        return results
+    
+    def stream_chat_with_documents(self, query: str, document_ids: List[str] = None, k: int = 5,
+                                   retrieval_mode: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of chat_with_documents
+        
+        Yields (event, data) pairs: 'citations' as soon as retrieval is done,
+        with the citations, retrieved_chunks and cached, then a 'token' per
+        piece of the answer as the LLM produces it, then 'done' with the
+        full answer. A cached answer is yielded as a single token. The
+        answer is cached once the stream completes.
+        """
+        # Validated here rather than when the stream is first read
+        retrieval_mode = self._resolve_retrieval_mode(retrieval_mode)
+        return self._stream_answer(query, document_ids, k, retrieval_mode)
+    
+    def _stream_answer(self, query: str, document_ids: List[str], k: int,
+                       retrieval_mode: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        try:
+            cached, cache_entry = self._lookup_answer(query, document_ids, k, retrieval_mode)
+            if cached is not None:
+                yield 'citations', {'citations': cached['citations'],
+                                    'retrieved_chunks': cached['retrieved_chunks'], 'cached': True}
+                yield 'token', {'content': cached['answer']}
+                yield 'done', {'answer': cached['answer']}
+                return
+            
+            relevant_chunks = self._retrieve(query, document_ids, k, retrieval_mode, cache_entry[2])
+            messages, citations = self._build_prompt(query, relevant_chunks) if relevant_chunks else (None, [])
+            yield 'citations', {'citations': citations, 'retrieved_chunks': len(relevant_chunks), 'cached': False}
+            
+            parts = []
+            for token in self._stream_completion(messages) if messages else [NO_CONTEXT_ANSWER]:
+                parts.append(token)
+                yield 'token', {'content': token}
+            answer = "".join(parts)
+            
+            self._store_answer(cache_entry, {
+                'answer': answer,
+                'citations': citations,
+                'retrieved_chunks': len(relevant_chunks)
+            })
+            yield 'done', {'answer': answer}
             
         except Exception as e:
             raise Exception(f"Error in RAG chat: {str(e)}")
     
+    def _resolve_retrieval_mode(self, retrieval_mode: str) -> str:
+        retrieval_mode = retrieval_mode or self.retrieval_mode
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}. Supported modes: {', '.join(RETRIEVAL_MODES)}")
+        return retrieval_mode
+    
+    def _lookup_answer(self, query: str, document_ids: List[str], k: int, retrieval_mode: str,
+                       query_embedding: List[float] = None) -> tuple:
+        """
+        Cached answer, or None, and the (key, generation, query_embedding)
+        to store a computed answer with. query_embedding is computed here
+        when the cache looks answers up by similarity, and reused to retrieve.
+        """
+        if self.answer_cache is None:
+            return None, (None, None, query_embedding)
+        generation = self.answer_cache.generation()
+        cache_key = AnswerCache.make_key(query, document_ids, retrieval_mode, k)
+        if query_embedding is None and self._lookup_needs_embedding(retrieval_mode):
+            # Needed to retrieve on a miss anyway; repeated queries hit the embedding cache
+            query_embedding = self._generate_query_embedding(query)
+        cached, _ = self.answer_cache.get(cache_key, query_embedding)
+        return cached, (cache_key, generation, query_embedding)
+    
+    def _lookup_needs_embedding(self, retrieval_mode: str) -> bool:
+        return (self.answer_cache is not None and retrieval_mode != 'lexical'
+                and self.answer_cache.semantic_threshold is not None)
+    
+    def _store_answer(self, cache_entry: tuple, result: Dict[str, Any]):
+        if self.answer_cache is not None:
+            cache_key, generation, query_embedding = cache_entry
+            self.answer_cache.put(cache_key, result, generation, query_embedding)
+    
+    def _retrieve(self, query: str, document_ids: List[str], k: int, retrieval_mode: str,
+                  query_embedding: List[float] = None) -> List[tuple]:
+        """(chunk_metadata, score) pairs for the query; lexical retrieval needs no embedding"""
+        if retrieval_mode == 'lexical':
+            return self.vector_store.lexical_search(query, k, document_ids)
+        
+        if query_embedding is None:
+            query_embedding = self._generate_query_embedding(query)
+        if retrieval_mode == 'vector':
+            return self.vector_store.search(query_embedding, k, document_ids)
+        return self.vector_store.hybrid_search(query, query_embedding, k, document_ids)
+    
+    def _retrieve_batch(self, queries: List[str], document_ids: List[str], k: int, retrieval_mode: str,
+                        query_embeddings: List[List[float]]) -> List[List[tuple]]:
+        """_retrieve for many queries, their embeddings searched in one batch"""
+        if not queries:
+            return []
+        if retrieval_mode == 'lexical':
+            return [self.vector_store.lexical_search(query, k, document_ids) for query in queries]
+        if retrieval_mode == 'vector':
+            return self.vector_store.search_batch(query_embeddings, k, document_ids)
+        return self.vector_store.hybrid_search_batch(queries, query_embeddings, k, document_ids)
+    
+    def _generate_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Embeddings of many queries, requested in bulk; cached like _generate_query_embedding's"""
+        embeddings = {}
+        if self.embedding_cache is not None:
+            keys = {query: EmbeddingCache.make_key(self.embedding_model, query) for query in queries}
+            cached = self.embedding_cache.get_many(keys.values())
+            embeddings = {query: cached[key] for query, key in keys.items() if key in cached}
+        pending = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        
+        try:
+            for start in range(0, len(pending), QUERY_EMBEDDING_BATCH_SIZE):
+                batch = pending[start:start + QUERY_EMBEDDING_BATCH_SIZE]
+                response = self.openai_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=batch
+                )
+                for item in response.data:
+                    embeddings[batch[item.index]] = item.embedding
+        except Exception as e:
+            raise Exception(f"Error generating query embeddings: {str(e)}")
+        
+        if self.embedding_cache is not None and pending:
+            self.embedding_cache.put_many((keys[query], embeddings[query]) for query in pending)
+        return [embeddings[query] for query in queries]
+    
     def _generate_query_embedding(self, query: str) -> List[float]:
         """Generate embedding for user query"""
+        if self.embedding_cache is not None:
+            key = EmbeddingCache.make_key(self.embedding_model, query)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
             response = self.openai_client.embeddings.create(
-                model="text-embedding-ada-002",
+                model=self.embedding_model,
                 input=query
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
         except Exception as e:
             raise Exception(f"Error generating query embedding: {str(e)}")
+        
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(key, embedding)
+        return embedding
     
     def _generate_answer_with_citations(self, query: str, relevant_chunks: List[tuple]) -> tuple:
         """
@@ -68,35 +288,44 @@ class RAGService:
             Tuple of (answer, citations)
         """
         if not relevant_chunks:
-            return "I couldn't find relevant information in the uploaded documents to answer your question.", []
-        
-        # Prepare context from retrieved chunks
-        context_parts = []
-        citations = []
-        
-        for i, (chunk_metadata, score) in enumerate(relevant_chunks):
-            chunk_text = chunk_metadata.get('text', '')
-            document_id = chunk_metadata.get('document_id', '')
-            page_number = chunk_metadata.get('page_number')
-            filename = chunk_metadata.get('filename', 'Unknown')
-            
-            # Add to context with reference number
-            context_parts.append(f"[{i+1}] {chunk_text}")
-            
-            # Prepare citation
-            citation = {
-                'document_id': document_id,
-                'filename': filename,
-                'text': chunk_text[:200] + "..." if len(chunk_text) > 200 else chunk_text,
-                'similarity_score': score
-            }
-            
-            if page_number is not None:
-                citation['page_number'] = page_number
-                
-            citations.append(citation)
+            return NO_CONTEXT_ANSWER, []
         
-        context = "\n\n".join(context_parts)
+        messages, citations = self._build_prompt(query, relevant_chunks)
+        try:
+            response = self.openai_client.chat.completions.create(**self._completion_request(messages))
+            
+            answer = response.choices[0].message.content
+            return answer, citations
+            
+        except Exception as e:
+            raise Exception(f"Error generating LLM response: {str(e)}")
+    
+    def _stream_completion(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Answer text as the LLM produces it"""
+        try:
+            response = self.openai_client.chat.completions.create(**self._completion_request(messages),
+                                                                  stream=True)
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                    
+        except Exception as e:
+            raise Exception(f"Error generating LLM response: {str(e)}")
+    
+    @staticmethod
+    def _completion_request(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Arguments of the completion call answering a chat prompt"""
+        return {
+            'model': "gpt-4",
+            'messages': messages,
+            'temperature': 0.1,
+            'max_tokens': 1000
+        }
+    
+    def _build_prompt(self, query: str, relevant_chunks: List[tuple]) -> tuple:
+        """Chat messages answering the query from the chunks, and their citations"""
+        # Adjacent chunks are merged and overlaps included once, within the token budget
+        context, citations = self.context_builder.build(relevant_chunks)
         
         # Create prompt for LLM
         system_prompt = """You are a helpful research assistant. Answer the user's question based on the provided context from their uploaded documents. 
@@ -115,27 +344,18 @@ Question: {query}
 
 Please answer the question based on the provided context, using reference numbers [1], [2], etc. when citing sources."""
 
-        try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            answer = response.choices[0].message.content
-            return answer, citations
-            
-        except Exception as e:
-            raise Exception(f"Error generating LLM response: {str(e)}")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ], citations
     
     def summarize_document(self, document_content: str, max_bullets: int = 5) -> str:
         """
         Generate a summary of a document
         
+        The whole document is summarized, map-reduce style for long ones;
+        see DocumentSummarizer.
+        
         Args:
             document_content: Full text content of the document
             max_bullets: Maximum number of bullet points in summary
@@ -144,24 +364,145 @@ Please answer the question based on the provided context, using reference number
             Summary string
         """
         try:
-            prompt = f"""Please provide a concise summary of the following document in {max_bullets} key bullet points:
-
-{document_content[:4000]}  # Limit content to avoid token limits
-
-Focus on the main ideas, key findings, and important conclusions."""
-
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that creates concise, informative summaries."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
+            return self.summarizer.summarize(document_content, max_bullets)['summary']
             
-            return response.choices[0].message.content
+        except Exception as e:
+            raise Exception(f"Error generating summary: {str(e)}")
+    
+    # Coroutine versions for the async server. Caches, retrieval and prompt
+    # building block on SQLite, locks and the vector store's read lock, so
+    # they run in worker threads; only the LLM calls run on the event loop.
+    
+    async def achat_with_documents(self, query: str, document_ids: List[str] = None, k: int = 5,
+                                   retrieval_mode: str = None) -> Dict[str, Any]:
+        """chat_with_documents for coroutines"""
+        retrieval_mode = self._resolve_retrieval_mode(retrieval_mode)
+        
+        try:
+            cached, cache_entry = await self._alookup_answer(query, document_ids, k, retrieval_mode)
+            if cached is not None:
+                return dict(cached, cached=True)
+            
+            relevant_chunks = await self._aretrieve(query, document_ids, k, retrieval_mode, cache_entry[2])
+            if relevant_chunks:
+                messages, citations = await asyncio.to_thread(self._build_prompt, query, relevant_chunks)
+                answer = await self._acomplete(messages)
+            else:
+                answer, citations = NO_CONTEXT_ANSWER, []
+            
+            result = {
+                'answer': answer,
+                'citations': citations,
+                'retrieved_chunks': len(relevant_chunks)
+            }
+            await asyncio.to_thread(self._store_answer, cache_entry, result)
+            return dict(result, cached=False)
+            
+        except Exception as e:
+            raise Exception(f"Error in RAG chat: {str(e)}")
+    
+    def astream_chat_with_documents(self, query: str, document_ids: List[str] = None, k: int = 5,
+                                    retrieval_mode: str = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """stream_chat_with_documents for coroutines, as an async iterator"""
+        retrieval_mode = self._resolve_retrieval_mode(retrieval_mode)
+        return self._astream_answer(query, document_ids, k, retrieval_mode)
+    
+    async def _astream_answer(self, query: str, document_ids: List[str], k: int,
+                              retrieval_mode: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        try:
+            cached, cache_entry = await self._alookup_answer(query, document_ids, k, retrieval_mode)
+            if cached is not None:
+                yield 'citations', {'citations': cached['citations'],
+                                    'retrieved_chunks': cached['retrieved_chunks'], 'cached': True}
+                yield 'token', {'content': cached['answer']}
+                yield 'done', {'answer': cached['answer']}
+                return
+            
+            relevant_chunks = await self._aretrieve(query, document_ids, k, retrieval_mode, cache_entry[2])
+            messages, citations = (await asyncio.to_thread(self._build_prompt, query, relevant_chunks)
+                                   if relevant_chunks else (None, []))
+            yield 'citations', {'citations': citations, 'retrieved_chunks': len(relevant_chunks), 'cached': False}
+            
+            parts = []
+            if messages:
+                async for token in self._astream_completion(messages):
+                    parts.append(token)
+                    yield 'token', {'content': token}
+            else:
+                parts.append(NO_CONTEXT_ANSWER)
+                yield 'token', {'content': NO_CONTEXT_ANSWER}
+            answer = "".join(parts)
+            
+            await asyncio.to_thread(self._store_answer, cache_entry, {
+                'answer': answer,
+                'citations': citations,
+                'retrieved_chunks': len(relevant_chunks)
+            })
+            yield 'done', {'answer': answer}
+            
+        except Exception as e:
+            raise Exception(f"Error in RAG chat: {str(e)}")
+    
+    async def asummarize_document(self, document_content: str, max_bullets: int = 5) -> str:
+        """summarize_document for coroutines"""
+        try:
+            return (await self.summarizer.asummarize(document_content, max_bullets))['summary']
             
         except Exception as e:
             raise Exception(f"Error generating summary: {str(e)}")
-
+    
+    async def _alookup_answer(self, query: str, document_ids: List[str], k: int, retrieval_mode: str) -> tuple:
+        query_embedding = None
+        if self._lookup_needs_embedding(retrieval_mode):
+            query_embedding = await self._agenerate_query_embedding(query)
+        return await asyncio.to_thread(self._lookup_answer, query, document_ids, k, retrieval_mode, query_embedding)
+    
+    async def _aretrieve(self, query: str, document_ids: List[str], k: int, retrieval_mode: str,
+                         query_embedding: List[float] = None) -> List[tuple]:
+        if retrieval_mode != 'lexical' and query_embedding is None:
+            query_embedding = await self._agenerate_query_embedding(query)
+        return await asyncio.to_thread(self._retrieve, query, document_ids, k, retrieval_mode, query_embedding)
+    
+    async def _agenerate_query_embedding(self, query: str) -> List[float]:
+        if self.embedding_cache is not None:
+            key = EmbeddingCache.make_key(self.embedding_model, query)
+            cached = await asyncio.to_thread(self.embedding_cache.get, key)
+            if cached is not None:
+                return cached
+        
+        try:
+            response = await self._async_client().embeddings.create(
+                model=self.embedding_model,
+                input=query
+            )
+            embedding = response.data[0].embedding
+        except Exception as e:
+            raise Exception(f"Error generating query embedding: {str(e)}")
+        
+        if self.embedding_cache is not None:
+            await asyncio.to_thread(self.embedding_cache.put, key, embedding)
+        return embedding
+    
+    async def _acomplete(self, messages: List[Dict[str, str]]) -> str:
+        try:
+            response = await self._async_client().chat.completions.create(**self._completion_request(messages))
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            raise Exception(f"Error generating LLM response: {str(e)}")
+    
+    async def _astream_completion(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        try:
+            response = await self._async_client().chat.completions.create(**self._completion_request(messages),
+                                                                          stream=True)
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                    
+        except Exception as e:
+            raise Exception(f"Error generating LLM response: {str(e)}")
+    
+    def _async_client(self):
+        if self.async_openai_client is None:
+            self.async_openai_client = openai.AsyncOpenAI()
+        return self.async_openai_client
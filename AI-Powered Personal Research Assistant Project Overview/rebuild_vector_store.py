@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Rebuild the vector store from the document_chunks table
+
+Streams chunks out of the database in pages, bulk-decodes their
+embeddings and adds them to a fresh index, while chunk metadata, and then
+the duplicate chunks linked to them, is streamed straight into the new
+chunk store file and chunk text into the lexical index. The files are
+written under staging names, then renamed to the next checkpoint version
+and swapped in by atomically replacing the manifest, under the store's
+exclusive lock, so neither a server sharing the store nor one of its
+checkpoints sees or deletes a half-written rebuild. The old store stays
+valid until the swap and is deleted after it. Memory is bounded by a page
+plus the index and lexical postings themselves. Index types holding full
+precision vectors (flat, ivf_flat, hnsw) are refused when they would
+outgrow --max-index-memory; use --index-type ivf_pq or one of the
+compressed flat_* types for such corpora. Those also get the full-precision
+vectors written to a vector file, which the store re-ranks their hits
+against.
+
+Stop the server before rebuilding: servers sharing the store reload it
+after the swap, but changes they make during the rebuild are lost.
+
+Usage: python rebuild_vector_store.py [--path vector_store] [--index-type flat]
+"""
+
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import faiss
+import numpy as np
+from flask import Flask
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+from src.models.document import Document, DocumentChunk, db
+from src.services.chunk_store import write_chunk_store
+from src.services.lexical_index import SegmentBuilder
+from src.services.vector_file import VectorFileWriter
+from src.services.vector_index import (INDEX_TYPES, LOSSY_INDEX_TYPES, REDUCTIONS, build_index, default_nlist,
+                                       min_training_vectors, train_index)
+from src.services.vector_persistence import (read_manifest, remove_unreferenced_files, versioned_path,
+                                             write_manifest, StoreLock, WriteAheadLog)
+
+# Default budget, in bytes, for an index holding full precision vectors
+MAX_INDEX_MEMORY = 2 * 1024 ** 3
+
+
+def create_app(database_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def collect_training_sample(page_size, max_vectors):
+    """Normalized embeddings from the first pages, for training IVF indexes"""
+    sample = []
+    count = 0
+    for _, matrix in DocumentChunk.iter_pages(page_size):
+        sample.append(np.array(matrix, dtype=np.float32))
+        count += len(matrix)
+        if count >= max_vectors:
+            break
+    sample = np.concatenate(sample)[:max_vectors] if sample else np.empty((0, 0), dtype=np.float32)
+    faiss.normalize_L2(sample)
+    return sample
+
+
+def check_index_memory(index_type, num_vectors, dimension, max_index_memory=MAX_INDEX_MEMORY):
+    """Raise if an index_type index of num_vectors would hold more than max_index_memory bytes of vectors"""
+    if max_index_memory is None or index_type in LOSSY_INDEX_TYPES:
+        return
+    needed = num_vectors * dimension * 4
+    if needed > max_index_memory:
+        raise Exception(f"A {index_type} index of {num_vectors} vectors needs about {needed // 2 ** 20} MB, over the "
+                        f"{max_index_memory // 2 ** 20} MB budget; use a compressed index type "
+                        f"({', '.join(LOSSY_INDEX_TYPES)}) or raise the budget")
+
+
+def stream_chunks(index, lexical, info, page_size, total, progress, vectors_file=None):
+    """
+    Add every page's embeddings to index, and text to lexical, and yield (vector_id, metadata)
+    
+    The embeddings also go to vectors_file, if given. Vector IDs are
+    assigned consecutively in table order, matching what
+    VectorStore.add_embeddings would have assigned. info['next_id'] is set
+    once the stream is exhausted.
+    """
+    next_id = 0
+    start = time.perf_counter()
+    for rows, matrix in DocumentChunk.iter_pages(page_size):
+        vectors = np.array(matrix, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        ids = np.arange(next_id, next_id + len(rows), dtype=np.int64)
+        index.add_with_ids(vectors, ids)
+        if vectors_file is not None:
+            vectors_file.add(ids, vectors)
+        
+        for row in rows:
+            lexical.add(next_id, row.text)
+            yield next_id, {
+                'document_id': row.document_id,
+                'filename': row.filename,
+                'chunk_index': row.chunk_index,
+                'text': row.text,
+                'page_number': row.page_number
+            }
+            next_id += 1
+        
+        elapsed = time.perf_counter() - start
+        progress(next_id, total, elapsed)
+    
+    info['next_id'] = next_id
+
+
+def iter_duplicates(page_size):
+    """
+    Stream (chunk, filename, original chunk's primary key) of duplicate chunks, ordered by their original
+    
+    Pages are joined to the chunk they duplicate in the database and
+    fetched by keyset on (original ID, ID), so memory is bounded by a page.
+    """
+    original = aliased(DocumentChunk)
+    last = (0, 0)
+    while True:
+        rows = (db.session.query(DocumentChunk, Document.filename, original.id)
+                .join(Document, Document.document_id == DocumentChunk.document_id)
+                .join(original, and_(original.document_id == DocumentChunk.duplicate_of_document_id,
+                                     original.chunk_index == DocumentChunk.duplicate_of_chunk_index))
+                .filter(DocumentChunk.duplicate_of_document_id.isnot(None))
+                .filter(or_(original.id > last[0], and_(original.id == last[0], DocumentChunk.id > last[1])))
+                .order_by(original.id, DocumentChunk.id)
+                .limit(page_size)
+                .all())
+        if not rows:
+            return
+        last = (rows[-1][2], rows[-1][0].id)
+        yield from rows
+
+
+def stream_links(page_size):
+    """
+    Yield (vector_id, metadata) of duplicate chunks, which have no embedding, by the vector of the chunk they duplicate
+    
+    Vector IDs follow the order of DocumentChunk.iter_pages, as assigned by
+    stream_chunks, so duplicates ordered by their original are matched to
+    them by merging with DocumentChunk.iter_ids, holding no lookup table.
+    Duplicates of chunks that were not indexed are skipped.
+    """
+    indexed = DocumentChunk.iter_ids(page_size)
+    chunk_id, vector_id = 0, -1
+    for chunk, filename, original_id in iter_duplicates(page_size):
+        while chunk_id < original_id:
+            chunk_id = next(indexed, None)
+            if chunk_id is None:
+                return
+            vector_id += 1
+        if chunk_id == original_id:
+            yield vector_id, {
+                'document_id': chunk.document_id,
+                'filename': filename,
+                'chunk_index': chunk.chunk_index,
+                'text': chunk.text,
+                'page_number': chunk.page_number
+            }
+
+
+def print_progress(done, total, elapsed):
+    percent = done / total * 100 if total else 100.0
+    print(f"\r🔄 {done}/{total} chunks ({percent:.0f}%), {done / max(elapsed, 1e-9):.0f} chunks/s",
+          end='', flush=True)
+
+
+def rebuild_vector_store(store_path, index_type='flat', page_size=2000, nlist=None, pq_m=64,
+                         hnsw_m=32, max_training_vectors=100000, progress=print_progress,
+                         reduced_dimension=None, reduction='pca', max_index_memory=MAX_INDEX_MEMORY):
+    """
+    Rebuild the store at store_path from the database in the current app context
+    
+    Raises before building anything if index_type holds full precision
+    vectors and they would take more than max_index_memory bytes (None: no
+    limit).
+    
+    Returns:
+        Number of chunks indexed
+    """
+    total = DocumentChunk.query.filter(
+        or_(DocumentChunk.embedding_blob.isnot(None), DocumentChunk.embedding.isnot(None))).count()
+    
+    sample = collect_training_sample(page_size, max_training_vectors)
+    if not len(sample):
+        raise Exception("No chunk embeddings found in the database")
+    dimension = sample.shape[1]
+    check_index_memory(index_type, total, dimension, max_index_memory)
+    
+    inner = build_index(index_type, dimension, total, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m,
+                        reduced_dimension=reduced_dimension, reduction=reduction)
+    if not inner.is_trained:
+        needed = min_training_vectors(index_type, nlist, total, reduced_dimension, reduction)
+        if len(sample) < needed:
+            raise Exception(f"{index_type} needs at least {needed} vectors to train, found {len(sample)}")
+        print(f"🔄 Training {index_type} index (nlist={nlist or default_nlist(total)}) "
+              f"on {len(sample)} vectors...")
+        train_index(inner, sample)
+    del sample
+    index = faiss.IndexIDMap2(inner)
+    
+    # Staging names, which checkpoints of a server sharing the store do not clean up
+    kinds = ['index', 'metadata', 'lexical'] + (['vectors'] if index_type in LOSSY_INDEX_TYPES else [])
+    staged = {kind: f"{store_path}.rebuild.{kind}" for kind in kinds}
+    
+    start = time.perf_counter()
+    # Writing the chunk store drives the streams, which fill the index as they
+    # go; the footer holding info is written after the last chunk and link
+    info = {'tombstones': []}
+    lexical = SegmentBuilder()
+    vectors_file = VectorFileWriter(staged['vectors'], dimension) if 'vectors' in staged else None
+    write_chunk_store(staged['metadata'],
+                      stream_chunks(index, lexical, info, page_size, total, progress, vectors_file),
+                      info=info, links=stream_links(page_size))
+    count = index.ntotal
+    faiss.write_index(index, staged['index'])
+    lexical.write(staged['lexical'])
+    if vectors_file is not None:
+        vectors_file.close()
+    elapsed = time.perf_counter() - start
+    print()
+    
+    # The swap: readers see either the old store or the new one
+    store_lock = StoreLock(store_path)
+    try:
+        with store_lock.exclusive():
+            previous = read_manifest(store_path)
+            version = previous['version'] + 1 if previous else 1
+            manifest = {'version': version}
+            for kind, path in staged.items():
+                os.replace(path, versioned_path(store_path, version, kind))
+                manifest[kind] = os.path.basename(versioned_path(store_path, version, kind))
+            wal_path = versioned_path(store_path, version, 'wal')
+            WriteAheadLog(wal_path).close()
+            manifest['wals'] = [os.path.basename(wal_path)]
+            write_manifest(store_path, manifest)
+            remove_unreferenced_files(store_path, manifest)
+    finally:
+        store_lock.close()
+    
+    print(f"✅ Indexed {count} chunks in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} chunks/s) "
+          f"into {store_path} version {version}")
+    return count
+
+
+def main():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--database', default=os.path.join(directory, 'database', 'app.db'),
+                        help='SQLite database to read chunks from')
+    parser.add_argument('--path', default='vector_store', help='Vector store base path')
+    parser.add_argument('--index-type', default='flat', choices=INDEX_TYPES)
+    parser.add_argument('--page-size', type=int, default=2000, help='Chunks fetched per query')
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists (ivf_flat, ivf_pq)')
+    parser.add_argument('--pq-m', type=int, default=64, help='PQ sub-quantizers (ivf_pq, flat_pq)')
+    parser.add_argument('--hnsw-m', type=int, default=32, help='Graph degree (hnsw)')
+    parser.add_argument('--reduced-dimension', type=int, default=None,
+                        help='Reduce vectors to this dimension before compressing them (flat_* types)')
+    parser.add_argument('--reduction', default='pca', choices=REDUCTIONS,
+                        help="PCA, or keep the leading dimensions of Matryoshka embeddings ('truncate')")
+    parser.add_argument('--max-index-memory', type=int, default=MAX_INDEX_MEMORY // 2 ** 20,
+                        help='Largest flat, ivf_flat or hnsw index to build, in MB (0: no limit)')
+    args = parser.parse_args()
+    
+    with create_app(args.database).app_context():
+        try:
+            rebuild_vector_store(args.path, args.index_type, args.page_size, args.nlist,
+                                 args.pq_m, args.hnsw_m, reduced_dimension=args.reduced_dimension,
+                                 reduction=args.reduction,
+                                 max_index_memory=args.max_index_memory * 2 ** 20 or None)
+        except Exception as e:
+            print(f"\n❌ Error rebuilding vector store: {str(e)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,41 @@
+import json
 import os
-import tempfile
-from flask import Blueprint, request, jsonify, current_app
+import uuid
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from werkzeug.utils import secure_filename
-from src.models.document import Document, DocumentChunk, db
+from src.models.document import Document, DocumentChunk, IngestionJob, db
+from src.services.dedup import ChunkDeduplicator
 from src.services.document_processor import DocumentProcessor, VectorStore
-from src.services.rag_service import RAGService
+from src.services.ingestion_queue import IngestionQueue
+from src.services.llm_client import AsyncLLMClient, LLMClient
+from src.services.rag_service import RAGService, RETRIEVAL_MODES
+from src.services.embedding_cache import EmbeddingCache
+from src.services.answer_cache import AnswerCache
 
 research_bp = Blueprint('research', __name__)
 
 # Global instances (will be initialized in main.py)
-document_processor = DocumentProcessor()
-vector_store = VectorStore()
-rag_service = RAGService(vector_store)
+# One connection pool and one set of rate limits for every OpenAI call;
+# set requests/tokens per minute to the account's limits
+llm_client = LLMClient()
+async_llm_client = AsyncLLMClient(llm_client)  # For the async server, under the same limits
+embedding_cache = EmbeddingCache('embedding_cache.db')
+document_processor = DocumentProcessor(openai_client=llm_client, embedding_cache=embedding_cache)
+vector_store = VectorStore(mmap_index=True)
+# Exact repeats only, unless a deployment opts in to serving reworded questions
+# from the cache by setting a cosine threshold such as 0.95
+answer_cache = AnswerCache(semantic_threshold=float(os.environ['ANSWER_CACHE_SEMANTIC_THRESHOLD'])
+                           if os.environ.get('ANSWER_CACHE_SEMANTIC_THRESHOLD') else None)
+# Embedding similarity, unless a deployment opts in to 'hybrid' or 'lexical' for every request;
+# a request can still choose its own with retrieval_mode
+rag_service = RAGService(vector_store, openai_client=llm_client, embedding_cache=embedding_cache,
+                         retrieval_mode=os.environ.get('RETRIEVAL_MODE', 'vector'),
+                         answer_cache=answer_cache, async_openai_client=async_llm_client)
+ingestion_queue = None  # Started by start_ingestion_queue
 
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'doc'}
 UPLOAD_FOLDER = 'uploads'
+MAX_BATCH_QUERIES = 1000  # Questions per /chat/batch request
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -26,7 +47,7 @@ def ensure_upload_folder():
 
 @research_bp.route('/upload-document', methods=['POST'])
 def upload_document():
-    """Upload and process a document"""
+    """Upload a document and queue it for processing"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -40,112 +61,304 @@ def upload_document():
         
         ensure_upload_folder()
         
-        # Save uploaded file
+        # Keep the upload until its job finishes, so queued jobs survive a restart
         filename = secure_filename(file.filename)
         file_extension = filename.rsplit('.', 1)[1].lower()
+        job_id = str(uuid.uuid4())
+        file_path = os.path.abspath(os.path.join(UPLOAD_FOLDER, f'{job_id}.{file_extension}'))
+        file.save(file_path)
         
-        # Create temporary file path
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as temp_file:
-            file.save(temp_file.name)
-            temp_file_path = temp_file.name
+        job = IngestionJob(
+            job_id=job_id,
+            document_id=document_processor.generate_document_id(),
+            filename=filename,
+            file_type=file_extension,
+            file_path=file_path
+        )
+        db.session.add(job)
+        db.session.commit()
+        ingestion_queue.submit(job_id)
         
-        try:
-            # Extract text from file
-            content = document_processor.extract_text_from_file(temp_file_path, file_extension)
-            
-            # Generate document ID
-            document_id = document_processor.generate_document_id()
-            
-            # Save document to database
-            document = Document(
-                document_id=document_id,
-                filename=filename,
-                content=content,
-                file_type=file_extension
-            )
-            db.session.add(document)
-            
-            # Chunk the text
-            chunks = document_processor.chunk_text(content)
-            
-            # Generate embeddings and save chunks
-            embeddings = []
+        return jsonify({
+            'message': 'Document uploaded and queued for processing',
+            'job_id': job_id,
+            'document_id': job.document_id,
+            'filename': filename,
+            'status': job.status
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error uploading document: {str(e)}'}), 500
+
+@research_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status and progress of an ingestion job"""
+    try:
+        job = IngestionJob.query.filter_by(job_id=job_id).first()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify(job.to_dict()), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error retrieving job: {str(e)}'}), 500
+
+@research_bp.route('/jobs', methods=['GET'])
+def get_jobs():
+    """Get the most recent ingestion jobs"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        jobs = IngestionJob.query.order_by(IngestionJob.id.desc()).limit(limit).all()
+        return jsonify({
+            'jobs': [job.to_dict() for job in jobs]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error retrieving jobs: {str(e)}'}), 500
+
+def ingest_document(job: IngestionJob):
+    """
+    Extract, chunk, embed and index an uploaded document (runs on an ingestion worker)
+    
+    The stages are streamed: text is extracted incrementally and chunked as
+    it arrives, and each group of embedded chunks is written to the
+    database and the vector store before the next is read, so memory does
+    not grow with the size of the document. Chunks that duplicate an
+    indexed chunk, or an earlier chunk of the document, are not embedded
+    but linked to the vector of the chunk they duplicate.
+    """
+    app = current_app._get_current_object()
+    
+    def report_embedded(done):
+        # Called from the embedding threads, outside the worker's app context
+        with app.app_context():
+            IngestionJob.report(job.job_id, chunks_embedded=done)
+    
+    # Text extracted but not yet appended to Document.content
+    content_parts = []
+    
+    def record_content(pieces):
+        for page_number, text in pieces:
+            content_parts.append(text)
+            yield page_number, text
+    
+    try:
+        # Drop anything left by an attempt interrupted by a restart
+        discard_document(job.document_id)
+        
+        db.session.add(Document(
+            document_id=job.document_id,
+            filename=job.filename,
+            content='',
+            file_type=job.file_type
+        ))
+        db.session.commit()
+        
+        IngestionJob.report(job.job_id, stage='embedding', chunks_total=None, chunks_embedded=0,
+                            chunks_deduplicated=0)
+        pieces = record_content(document_processor.iter_text_from_file(job.file_path, job.file_type))
+        deduplicator = ChunkDeduplicator(job.document_id, find_indexed=DocumentChunk.find_original)
+        chunks = deduplicator.filter(document_processor.iter_chunks(pieces))
+        
+        for group in document_processor.embed_chunks(chunks, progress=report_embedded):
             chunk_metadata = []
-            
-            for i, chunk_text in enumerate(chunks):
-                # Generate embedding
-                embedding = document_processor.generate_embedding(chunk_text)
+            for page_number, chunk_text, embedding in group:
+                chunk_index, fingerprint = deduplicator.unique.popleft()
                 
                 # Save chunk to database
                 chunk = DocumentChunk(
-                    document_id=document_id,
-                    chunk_index=i,
+                    document_id=job.document_id,
+                    chunk_index=chunk_index,
                     text=chunk_text,
-                    page_number=None  # Could be enhanced to track page numbers
+                    page_number=page_number
                 )
                 chunk.set_embedding(embedding)
+                chunk.set_fingerprint(fingerprint)
                 db.session.add(chunk)
                 
                 # Prepare for vector store
-                embeddings.append(embedding)
-                chunk_metadata.append({
-                    'document_id': document_id,
-                    'filename': filename,
-                    'chunk_index': i,
-                    'text': chunk_text,
-                    'page_number': None
-                })
+                chunk_metadata.append(vector_metadata(job, chunk_index, chunk_text, page_number))
+            
+            Document.append_content(job.document_id, "".join(content_parts))
+            content_parts.clear()
             
-            # Add to vector store
-            vector_store.add_embeddings(embeddings, chunk_metadata)
+            # Add to vector store, then link duplicates of the chunks just added
+            vector_store.add_embeddings([embedding for _, _, embedding in group], chunk_metadata)
+            store_duplicates(job, deduplicator.take_duplicates())
             
             # Commit database changes
             db.session.commit()
             
             # Save vector store
             vector_store.save_to_file('vector_store')
-            
-            return jsonify({
-                'message': 'Document uploaded and processed successfully',
-                'document_id': document_id,
-                'filename': filename,
-                'chunks_created': len(chunks)
-            }), 201
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                
-    except Exception as e:
+        
+        Document.append_content(job.document_id, "".join(content_parts))
+        if store_duplicates(job, deduplicator.take_duplicates()):
+            vector_store.save_to_file('vector_store')
+        db.session.commit()
+        # Answers over all documents may now be incomplete
+        answer_cache.invalidate_document(job.document_id)
+        IngestionJob.report(job.job_id, chunks_total=deduplicator.chunks_seen,
+                            chunks_embedded=deduplicator.chunks_seen - deduplicator.duplicates_found,
+                            chunks_deduplicated=deduplicator.duplicates_found)
+        
+    except Exception:
+        # Nothing of a failed document should stay visible
         db.session.rollback()
-        return jsonify({'error': f'Error processing document: {str(e)}'}), 500
+        discard_document(job.document_id)
+        raise
+        
+    finally:
+        # Failed jobs are not retried, so the upload is no longer needed either way
+        if os.path.exists(job.file_path):
+            os.unlink(job.file_path)
+
+def vector_metadata(job, chunk_index, chunk_text, page_number):
+    """Vector store metadata of a chunk of the job's document"""
+    return {
+        'document_id': job.document_id,
+        'filename': job.filename,
+        'chunk_index': chunk_index,
+        'text': chunk_text,
+        'page_number': page_number
+    }
+
+def store_duplicates(job, duplicates):
+    """Save duplicate chunks without embeddings and link them in the vector store"""
+    metadata = []
+    for chunk_index, page_number, chunk_text, fingerprint, (document_id, original_index) in duplicates:
+        chunk = DocumentChunk(
+            document_id=job.document_id,
+            chunk_index=chunk_index,
+            text=chunk_text,
+            page_number=page_number,
+            duplicate_of_document_id=document_id,
+            duplicate_of_chunk_index=original_index
+        )
+        chunk.set_fingerprint(fingerprint)
+        db.session.add(chunk)
+        metadata.append(vector_metadata(job, chunk_index, chunk_text, page_number))
+    if not duplicates:
+        return 0
+    return vector_store.link_duplicates([original for *_, original in duplicates], metadata)
+
+def discard_document(document_id):
+    """Remove a document, its chunks and its vectors if they exist"""
+    DocumentChunk.promote_duplicates(document_id)
+    DocumentChunk.query.filter_by(document_id=document_id).delete()
+    Document.query.filter_by(document_id=document_id).delete()
+    db.session.commit()
+    if vector_store.remove_document(document_id):
+        vector_store.save_to_file('vector_store')
+        answer_cache.invalidate_document(document_id)
+
+def validate_chat_request(data):
+    """(query, document_ids, retrieval_mode) from a chat request's JSON, or an error message"""
+    if not data or 'query' not in data:
+        return None, 'Query is required'
+    
+    retrieval_mode = data.get('retrieval_mode', None)
+    if retrieval_mode is not None and retrieval_mode not in RETRIEVAL_MODES:
+        return None, f"retrieval_mode must be one of: {', '.join(RETRIEVAL_MODES)}"
+    return (data['query'], data.get('document_ids', None), retrieval_mode), None
+
+def parse_chat_request():
+    """(query, document_ids, retrieval_mode) from a chat request, or an error response"""
+    chat_request, error = validate_chat_request(request.get_json(silent=True))
+    if error:
+        return None, (jsonify({'error': error}), 400)
+    return chat_request, None
 
 @research_bp.route('/chat', methods=['POST'])
 def chat_with_documents():
     """Chat with uploaded documents"""
     try:
-        data = request.get_json()
-        
-        if not data or 'query' not in data:
-            return jsonify({'error': 'Query is required'}), 400
-        
-        query = data['query']
-        document_ids = data.get('document_ids', None)
+        chat_request, error = parse_chat_request()
+        if error:
+            return error
+        query, document_ids, retrieval_mode = chat_request
         
         # Use RAG service to get answer
-        result = rag_service.chat_with_documents(query, document_ids)
+        result = rag_service.chat_with_documents(query, document_ids, retrieval_mode=retrieval_mode)
         
         return jsonify(result), 200
         
     except Exception as e:
         return jsonify({'error': f'Error processing chat request: {str(e)}'}), 500
 
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@research_bp.route('/chat/stream', methods=['POST'])
+def stream_chat_with_documents():
+    """Chat with uploaded documents, streaming the answer as server-sent events"""
+    chat_request, error = parse_chat_request()
+    if error:
+        return error
+    query, document_ids, retrieval_mode = chat_request
+    events = rag_service.stream_chat_with_documents(query, document_ids, retrieval_mode=retrieval_mode)
+    
+    def generate():
+        try:
+            for event, data in events:
+                yield server_sent_event(event, data)
+        except Exception as e:
+            # The status line has already been sent
+            yield server_sent_event('error', {'error': f'Error processing chat request: {str(e)}'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from holding back tokens
+    })
+
+def validate_batch_chat_request(data):
+    """(queries, document_ids, retrieval_mode) from a batch chat request's JSON, or an error message"""
+    queries = data.get('queries') if data else None
+    if not isinstance(queries, list) or not queries:
+        return None, 'queries must be a non-empty list of questions'
+    if len(queries) > MAX_BATCH_QUERIES:
+        return None, f'At most {MAX_BATCH_QUERIES} queries per request'
+    if not all(isinstance(query, str) and query.strip() for query in queries):
+        return None, 'Every query must be a non-empty string'
+    
+    retrieval_mode = data.get('retrieval_mode', None)
+    if retrieval_mode is not None and retrieval_mode not in RETRIEVAL_MODES:
+        return None, f"retrieval_mode must be one of: {', '.join(RETRIEVAL_MODES)}"
+    return (queries, data.get('document_ids', None), retrieval_mode), None
+
+@research_bp.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many questions at once, for bulk question answering and evaluation"""
+    try:
+        batch_request, error = validate_batch_chat_request(request.get_json(silent=True))
+        if error:
+            return jsonify({'error': error}), 400
+        queries, document_ids, retrieval_mode = batch_request
+        
+        results = rag_service.chat_batch(queries, document_ids, retrieval_mode=retrieval_mode)
+        
+        return jsonify({'results': results}), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Error processing batch chat request: {str(e)}'}), 500
+
+@research_bp.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Hit rates of the answer and embedding caches"""
+    return jsonify({
+        'answers': answer_cache.stats(),
+        'embeddings': embedding_cache.stats()
+    }), 200
+
 @research_bp.route('/documents', methods=['GET'])
 def get_documents():
     """Get list of all uploaded documents"""
     try:
-        documents = Document.query.all()
+        # Documents still being ingested are listed once their job completes
+        unfinished = db.session.query(IngestionJob.document_id).filter(
+            IngestionJob.status.in_([IngestionJob.QUEUED, IngestionJob.RUNNING]))
+        documents = Document.query.filter(Document.document_id.notin_(unfinished)).all()
         return jsonify({
             'documents': [doc.to_dict() for doc in documents]
         }), 200
@@ -162,15 +375,18 @@ def delete_document(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
-        # Delete chunks
+        # Delete chunks, handing those other documents duplicate over to them
+        DocumentChunk.promote_duplicates(document_id)
         DocumentChunk.query.filter_by(document_id=document_id).delete()
         
         # Delete document
         db.session.delete(document)
         db.session.commit()
         
-        # Note: In a production system, you would also need to rebuild the vector store
-        # to remove the deleted document's embeddings
+        # Remove the document's vectors so it no longer appears in search results
+        vector_store.remove_document(document_id)
+        vector_store.save_to_file('vector_store')
+        answer_cache.invalidate_document(document_id)
         
         return jsonify({'message': 'Document deleted successfully'}), 200
         
@@ -178,17 +394,25 @@ def delete_document(document_id):
         db.session.rollback()
         return jsonify({'error': f'Error deleting document: {str(e)}'}), 500
 
+def validate_summarize_request(data):
+    """max_bullets from a summary request's JSON, or an error message"""
+    max_bullets = (data or {}).get('max_bullets', 5)
+    if isinstance(max_bullets, bool) or not isinstance(max_bullets, int) or max_bullets < 1:
+        return None, 'max_bullets must be a positive integer'
+    return max_bullets, None
+
 @research_bp.route('/summarize-document/<document_id>', methods=['POST'])
 def summarize_document(document_id):
     """Generate a summary of a specific document"""
     try:
+        max_bullets, error = validate_summarize_request(request.get_json(silent=True))
+        if error:
+            return jsonify({'error': error}), 400
+        
         document = Document.query.filter_by(document_id=document_id).first()
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
-        data = request.get_json() or {}
-        max_bullets = data.get('max_bullets', 5)
-        
         summary = rag_service.summarize_document(document.content, max_bullets)
         
         return jsonify({
@@ -201,12 +425,24 @@ def summarize_document(document_id):
         return jsonify({'error': f'Error generating summary: {str(e)}'}), 500
 
 def initialize_vector_store():
-    """Initialize vector store on app startup"""
+    """Initialize vector store on app startup, shared with the app's other worker processes"""
     global vector_store
     try:
-        vector_store.load_from_file('vector_store')
+        vector_store.share('vector_store', on_change=invalidate_answers)
         print("Vector store loaded from file")
     except Exception as e:
         print(f"Could not load vector store from file: {e}")
         print("Starting with empty vector store")
 
+def invalidate_answers(document_ids):
+    """Drop cached answers over documents another worker process changed"""
+    for document_id in document_ids:
+        answer_cache.invalidate_document(document_id)
+
+def start_ingestion_queue(app, num_workers=2):
+    """Start the background ingestion workers on app startup"""
+    global ingestion_queue
+    ingestion_queue = IngestionQueue(app, ingest_document, num_workers)
+    resumed = ingestion_queue.start()
+    if resumed:
+        print(f"Resumed {resumed} pending ingestion jobs")
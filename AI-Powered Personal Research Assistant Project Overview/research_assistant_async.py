@@ -0,0 +1,191 @@
+"""
+Async serving of the research assistant API over ASGI
+
+create_asgi_app wraps the Flask app for an ASGI server such as uvicorn.
+The routes that wait on the LLM (POST /api/chat, /api/chat/stream and
+/api/summarize-document/<id>) are coroutines that await the embedding
+and completion calls, so one worker serves many of them at once on its
+event loop instead of holding a thread for each. They validate requests
+with the research blueprint's helpers, respond and cache exactly like its
+routes, and carry the CORS headers the Flask app would add to the same
+request, so flask_cors's configuration in main.py applies to both.
+
+Every other request, uploads included, is passed to the Flask app. Its
+body is read on the event loop first, so a slow upload holds no thread,
+and the route then runs on a thread of the loop's executor.
+"""
+
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from src.models.document import Document
+from src.routes import research_assistant
+from src.routes.research_assistant import server_sent_event, validate_chat_request, validate_summarize_request
+
+API_PREFIX = '/api'  # Where main.py registers research_bp
+SUMMARIZE_PATH = re.compile(rf'^{API_PREFIX}/summarize-document/([^/]+)$')
+
+
+class _WsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default, which
+    # would serve the Flask routes one at a time
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class _FlaskApp(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiToAsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+def create_asgi_app(flask_app):
+    """ASGI app serving flask_app's routes, with those waiting on the LLM as coroutines"""
+    flask_routes = _FlaskApp(flask_app)
+    max_content_length = flask_app.config.get('MAX_CONTENT_LENGTH')
+
+    def find_document(document_id):
+        """(filename, content) of a document, or None; runs on an executor thread"""
+        with flask_app.app_context():
+            document = Document.query.filter_by(document_id=document_id).first()
+            return (document.filename, document.content) if document else None
+
+    def cors_headers(scope):
+        """CORS headers flask_app's after-request handlers, such as flask_cors's, add to a response to the request"""
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        with flask_app.test_request_context(scope['path'], method=scope['method'], headers=headers):
+            response = flask_app.process_response(flask_app.response_class())
+        return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()
+                if name.lower().startswith('access-control-') or name.lower() == 'vary']
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await _lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        path = scope['path']
+        if scope['method'] == 'POST':
+            if path == f'{API_PREFIX}/chat':
+                return await chat(receive, _with_headers(send, cors_headers(scope)))
+            if path == f'{API_PREFIX}/chat/stream':
+                return await stream_chat(receive, _with_headers(send, cors_headers(scope)))
+            match = SUMMARIZE_PATH.match(path)
+            if match:
+                return await summarize(match.group(1), receive, _with_headers(send, cors_headers(scope)))
+
+        # Refused before the body is read, rather than after buffering all of it
+        content_length = dict(scope['headers']).get(b'content-length')
+        if max_content_length and content_length and int(content_length) > max_content_length:
+            return await _send_json(_with_headers(send, cors_headers(scope)), 413,
+                                    {'error': f'Request exceeds {max_content_length} bytes'})
+        await flask_routes(scope, receive, send)
+
+    async def chat(receive, send):
+        chat_request, error = validate_chat_request(_parse_json(await _read_body(receive)))
+        if error:
+            return await _send_json(send, 400, {'error': error})
+        query, document_ids, retrieval_mode = chat_request
+
+        try:
+            result = await research_assistant.rag_service.achat_with_documents(
+                query, document_ids, retrieval_mode=retrieval_mode)
+            await _send_json(send, 200, result)
+        except Exception as e:
+            await _send_json(send, 500, {'error': f'Error processing chat request: {str(e)}'})
+
+    async def stream_chat(receive, send):
+        chat_request, error = validate_chat_request(_parse_json(await _read_body(receive)))
+        if error:
+            return await _send_json(send, 400, {'error': error})
+        query, document_ids, retrieval_mode = chat_request
+        events = research_assistant.rag_service.astream_chat_with_documents(
+            query, document_ids, retrieval_mode=retrieval_mode)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')  # Stop reverse proxies from holding back tokens
+        ]})
+        try:
+            async for event, data in events:
+                await send({'type': 'http.response.body', 'body': server_sent_event(event, data).encode('utf-8'),
+                            'more_body': True})
+        except Exception as e:
+            # The status line has already been sent
+            error_event = server_sent_event('error', {'error': f'Error processing chat request: {str(e)}'})
+            await send({'type': 'http.response.body', 'body': error_event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def summarize(document_id, receive, send):
+        max_bullets, error = validate_summarize_request(_parse_json(await _read_body(receive)))
+        if error:
+            return await _send_json(send, 400, {'error': error})
+        try:
+            document = await asyncio.to_thread(find_document, document_id)
+            if document is None:
+                return await _send_json(send, 404, {'error': 'Document not found'})
+            filename, content = document
+
+            summary = await research_assistant.rag_service.asummarize_document(content, max_bullets)
+
+            await _send_json(send, 200, {
+                'document_id': document_id,
+                'filename': filename,
+                'summary': summary
+            })
+        except Exception as e:
+            await _send_json(send, 500, {'error': f'Error generating summary: {str(e)}'})
+
+    return app
+
+
+async def _lifespan(receive, send):
+    # Startup happens when the app is created; nothing to do but acknowledge
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.extend(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+def _parse_json(body: bytes):
+    """The body's JSON object, or None, like Flask's request.get_json(silent=True)"""
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+def _with_headers(send, headers):
+    """send, adding headers to the response's start message"""
+    async def send_with_headers(message):
+        if message['type'] == 'http.response.start':
+            message = dict(message, headers=list(message.get('headers', [])) + headers)
+        await send(message)
+    return send_with_headers
+
+
+async def _send_json(send, status: int, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('ascii'))
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,252 @@
+"""
+Map-reduce summarization of full-length documents
+
+A document that fits in one section is summarized with a single call.
+A longer one is split into sections, and each section is summarized
+into notes (map), with up to max_concurrency calls in flight. The notes
+are then merged, a group that fits reduce_tokens at a time, until they
+fit one call. That call writes the max_bullets summary (reduce).
+
+Section and merged notes do not depend on max_bullets, and they are
+cached by a hash of their input. Summarizing the same document again,
+for example with another number of bullets, only repeats the final
+call. asummarize does the same for the async server, awaiting its calls
+and chunking and reading the cache in worker threads, off the event loop.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import openai
+
+from src.services.chunking import build_chunker, estimate_tokens
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful assistant that creates concise, informative summaries."
+
+NOTES_PROMPT = """Summarize the following section of a longer document as concise notes covering its main ideas, key findings and conclusions. Keep names, numbers and terminology exact.
+
+{text}"""
+
+MERGE_PROMPT = """The following are notes on consecutive sections of a document. Merge them into one set of concise notes covering the main ideas, key findings and conclusions, removing repetition.
+
+{text}"""
+
+FINAL_PROMPT = """Please provide a concise summary of the following {source} in {max_bullets} key bullet points:
+
+{text}
+
+Focus on the main ideas, key findings, and important conclusions."""
+
+
+class DocumentSummarizer:
+    def __init__(self, openai_client, model: str = "gpt-4", section_tokens: int = 3000,
+                 reduce_tokens: int = 3000, notes_tokens: int = 400, max_concurrency: int = 4,
+                 max_cached_notes: int = 10000, token_counter: Callable[[str], int] = estimate_tokens,
+                 async_openai_client=None):
+        """
+        Args:
+            async_openai_client: Client asummarize awaits calls on (default:
+                openai.AsyncOpenAI(), created when first needed)
+            section_tokens: Maximum tokens of a section summarized in one call
+            reduce_tokens: Maximum tokens of notes merged in one call
+            notes_tokens: Completion limit of each map or merge call
+            max_concurrency: Calls in flight at once while mapping or merging
+            max_cached_notes: Section and merged notes kept, least recently used evicted
+        """
+        if reduce_tokens <= notes_tokens:
+            raise ValueError("reduce_tokens must exceed notes_tokens, or merging would not shrink the notes")
+        self.openai_client = openai_client
+        self.async_openai_client = async_openai_client
+        self.model = model
+        self.section_tokens = section_tokens
+        self.reduce_tokens = reduce_tokens
+        self.notes_tokens = notes_tokens
+        self.max_concurrency = max_concurrency
+        self.max_cached_notes = max_cached_notes
+        self.token_counter = token_counter
+        # Not 'paragraph': it starts a chunk at every heading, leaving sections far below the budget
+        self.chunker = build_chunker('sentence', chunk_size=section_tokens, chunk_overlap=0,
+                                     token_counter=token_counter)
+        self._notes = OrderedDict()  # Hash of (model, prompt, text) -> notes
+        self._lock = threading.Lock()
+
+        self.llm_calls = 0
+        self.cache_hits = 0
+
+    def summarize(self, document_content: str, max_bullets: int = 5) -> dict:
+        """
+        Summarize a document of any length
+
+        Returns:
+            Dictionary with the summary, the number of sections and reduce
+            levels, the LLM calls made and notes served from cache, and the
+            wall-clock seconds taken
+        """
+        start = time.perf_counter()
+        usage = {'llm_calls': 0, 'cached_notes': 0}
+
+        sections = self.chunker.chunk_text(document_content) or [""]
+        levels = 0
+        if len(sections) == 1:
+            summary = self._final_summary(sections[0], 'document', max_bullets, usage)
+        else:
+            notes = self._notes_for(NOTES_PROMPT, sections, usage)
+            while True:
+                groups = self._groups_to_merge(notes)
+                if groups is None:
+                    break
+                notes = self._notes_for(MERGE_PROMPT, ["\n\n".join(group) for group in groups], usage)
+                levels += 1
+            summary = self._final_summary("\n\n".join(notes), 'notes on a document', max_bullets, usage)
+
+        return dict(usage, summary=summary, sections=len(sections), reduce_levels=levels,
+                    seconds=time.perf_counter() - start)
+
+    async def asummarize(self, document_content: str, max_bullets: int = 5) -> dict:
+        """summarize for coroutines, awaiting the calls on async_openai_client"""
+        start = time.perf_counter()
+        usage = {'llm_calls': 0, 'cached_notes': 0}
+
+        sections = await asyncio.to_thread(self.chunker.chunk_text, document_content) or [""]
+        levels = 0
+        if len(sections) == 1:
+            summary = await self._afinal_summary(sections[0], 'document', max_bullets, usage)
+        else:
+            notes = await self._anotes_for(NOTES_PROMPT, sections, usage)
+            while True:
+                groups = await asyncio.to_thread(self._groups_to_merge, notes)
+                if groups is None:
+                    break
+                notes = await self._anotes_for(MERGE_PROMPT, ["\n\n".join(group) for group in groups], usage)
+                levels += 1
+            summary = await self._afinal_summary("\n\n".join(notes), 'notes on a document', max_bullets, usage)
+
+        return dict(usage, summary=summary, sections=len(sections), reduce_levels=levels,
+                    seconds=time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'llm_calls': self.llm_calls,
+                'cache_hits': self.cache_hits,
+                'cached_notes': len(self._notes)
+            }
+
+    def _notes_for(self, prompt: str, texts: List[str], usage: dict) -> List[str]:
+        """Notes on each text, from the cache or with up to max_concurrency calls in flight"""
+        keys, notes, missing = self._cached_notes(prompt, texts, usage)
+
+        def write_notes(i: int):
+            notes[i] = self._complete(prompt.format(text=texts[i]), self.notes_tokens, usage)
+            self._store(keys[i], notes[i])
+
+        if len(missing) == 1:
+            write_notes(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(missing))) as executor:
+                # list() re-raises the first failed call
+                list(executor.map(write_notes, missing))
+        return notes
+
+    async def _anotes_for(self, prompt: str, texts: List[str], usage: dict) -> List[str]:
+        keys, notes, missing = await asyncio.to_thread(self._cached_notes, prompt, texts, usage)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def write_notes(i: int):
+            async with semaphore:
+                notes[i] = await self._acomplete(prompt.format(text=texts[i]), self.notes_tokens, usage)
+            self._store(keys[i], notes[i])
+
+        await asyncio.gather(*(write_notes(i) for i in missing))
+        return notes
+
+    def _cached_notes(self, prompt: str, texts: List[str], usage: dict) -> tuple:
+        """Cache keys of the texts, their cached notes or None, and the indexes of those missing"""
+        keys = [self._key(prompt, text) for text in texts]
+        notes = [self._cached(key) for key in keys]
+        missing = [i for i, note in enumerate(notes) if note is None]
+        usage['cached_notes'] += len(texts) - len(missing)
+        return keys, notes, missing
+
+    def _groups_to_merge(self, notes: List[str]):
+        """Groups of notes for the next reduce level, or None once the notes fit one call"""
+        if self.token_counter("\n\n".join(notes)) <= self.reduce_tokens:
+            return None
+        groups = self._group(notes)
+        if len(groups) == len(notes):
+            # Each note fills a group on its own: merging cannot shrink them further
+            return None
+        return groups
+
+    def _group(self, notes: List[str]) -> List[List[str]]:
+        """Consecutive notes in groups of at most reduce_tokens"""
+        groups = []
+        current = []
+        current_tokens = 0
+        for note in notes:
+            tokens = self.token_counter(note)
+            if current and current_tokens + tokens > self.reduce_tokens:
+                groups.append(current)
+                current = []
+                current_tokens = 0
+            current.append(note)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def _final_summary(self, text: str, source: str, max_bullets: int, usage: dict) -> str:
+        prompt = FINAL_PROMPT.format(source=source, max_bullets=max_bullets, text=text)
+        return self._complete(prompt, 500, usage)
+
+    async def _afinal_summary(self, text: str, source: str, max_bullets: int, usage: dict) -> str:
+        prompt = FINAL_PROMPT.format(source=source, max_bullets=max_bullets, text=text)
+        return await self._acomplete(prompt, 500, usage)
+
+    def _complete(self, prompt: str, max_tokens: int, usage: dict) -> str:
+        response = self.openai_client.chat.completions.create(**self._request(prompt, max_tokens, usage))
+        return response.choices[0].message.content
+
+    async def _acomplete(self, prompt: str, max_tokens: int, usage: dict) -> str:
+        if self.async_openai_client is None:
+            self.async_openai_client = openai.AsyncOpenAI()
+        response = await self.async_openai_client.chat.completions.create(**self._request(prompt, max_tokens, usage))
+        return response.choices[0].message.content
+
+    def _request(self, prompt: str, max_tokens: int, usage: dict) -> dict:
+        """Arguments of a completion call, counted as one call"""
+        with self._lock:
+            self.llm_calls += 1
+            usage['llm_calls'] += 1
+        return {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.1,
+            'max_tokens': max_tokens
+        }
+
+    def _key(self, prompt: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{prompt}\0{text}".encode('utf-8')).hexdigest()
+
+    def _cached(self, key: str):
+        with self._lock:
+            notes = self._notes.get(key)
+            if notes is not None:
+                self._notes.move_to_end(key)
+                self.cache_hits += 1
+            return notes
+
+    def _store(self, key: str, notes: str):
+        with self._lock:
+            self._notes[key] = notes
+            self._notes.move_to_end(key)
+            while len(self._notes) > self.max_cached_notes:
+                self._notes.popitem(last=False)
@@ -0,0 +1,31 @@
+"""
+Synthetic data for the tests and benchmarks of the AI Research Assistant
+Generates embeddings shaped like real ones, so vector index tests and
+benchmarks do not need an OpenAI key or a corpus
+"""
+
+import faiss
+import numpy as np
+
+
+def synthetic_vectors(n, dimension, num_clusters=256, seed=0):
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def matryoshka_vectors(n, dimension, seed=0):
+    """
+    Clustered unit vectors whose leading dimensions carry most of the
+    variance, as in Matryoshka-trained embeddings (text-embedding-3-*),
+    so truncating them is meaningful; ada-002 embeddings are not ordered
+    this way and should be reduced by PCA instead
+    """
+    vectors = synthetic_vectors(n, dimension, seed=seed) / np.sqrt(1 + np.arange(dimension) / (dimension / 16))
+    vectors = vectors.astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
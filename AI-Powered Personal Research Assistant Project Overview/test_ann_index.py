@@ -0,0 +1,77 @@
+"""
+Approximate index test for the AI Research Assistant
+Checks that the vector store starts on the exact flat index, is promoted
+to the configured IVF or HNSW backend in the background once it holds
+promote_threshold vectors, finds what the flat index finds, and keeps
+the backend across a save and reload
+"""
+
+import numpy as np
+import pytest
+
+from document_processor import VectorStore
+from synthetic_data import matryoshka_vectors
+
+DIMENSION = 64
+NUM_VECTORS = 3000
+PROMOTE_THRESHOLD = 1000
+K = 10
+
+# (index_type, options, minimum recall@K against the flat index)
+CONFIGURATIONS = [
+    ('ivf_flat', {'nlist': 32, 'nprobe': 16}, 0.9),
+    ('ivf_pq', {'nlist': 32, 'nprobe': 16, 'pq_m': 16}, 0.8),
+    ('hnsw', {'hnsw_m': 16, 'ef_search': 64}, 0.9),
+]
+
+VECTORS = matryoshka_vectors(NUM_VECTORS, DIMENSION)
+QUERIES = matryoshka_vectors(50, DIMENSION, seed=1)
+
+
+def chunks(start, stop):
+    return [{'document_id': f'doc-{i // 10}', 'chunk_index': i % 10, 'text': f'chunk {i}'}
+            for i in range(start, stop)]
+
+
+def hit_ids(results):
+    return [[int(c['text'].split()[1]) for c, _ in row] for row in results]
+
+
+@pytest.fixture(scope='module')
+def expected():
+    flat = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    flat.add_embeddings(VECTORS, chunks(0, NUM_VECTORS))
+    return hit_ids(flat.search_batch(QUERIES, K))
+
+
+@pytest.mark.parametrize('index_type, options, minimum', CONFIGURATIONS)
+def test_promotion_and_recall(expected, wait_for_maintenance, tmp_path, index_type, options, minimum):
+    store = VectorStore(dimension=DIMENSION, index_type=index_type, promote_threshold=PROMOTE_THRESHOLD,
+                        collapse_similarity=None, **options)
+    store.add_embeddings(VECTORS[:PROMOTE_THRESHOLD // 2], chunks(0, PROMOTE_THRESHOLD // 2))
+    wait_for_maintenance(store)
+    assert store.active_index_type == 'flat', "Small stores should stay on the exact index"
+
+    store.add_embeddings(VECTORS[PROMOTE_THRESHOLD // 2:], chunks(PROMOTE_THRESHOLD // 2, NUM_VECTORS))
+    wait_for_maintenance(store)
+    assert store.active_index_type == index_type
+    results = hit_ids(store.search_batch(QUERIES, K))
+    recall = np.mean([len(set(found) & set(wanted)) / K for found, wanted in zip(results, expected)])
+    assert recall >= minimum, f"{index_type} recall@{K} {recall:.2f} below {minimum}"
+
+    # Vectors added after promotion go into the promoted index
+    store.add_embeddings(QUERIES[:1], [{'document_id': 'new', 'chunk_index': 0, 'text': 'chunk -1'}])
+    assert store.search(QUERIES[0], k=1)[0][0]['document_id'] == 'new'
+
+    path = str(tmp_path / 'vector_store')
+    store.save_to_file(path)
+    store.checkpoint()
+    reloaded = VectorStore(dimension=DIMENSION, collapse_similarity=None, **options)
+    reloaded.load_from_file(path)
+    assert reloaded.active_index_type == index_type
+    assert reloaded.search_batch(QUERIES, K) == store.search_batch(QUERIES, K)
+
+
+def test_unknown_index_type():
+    with pytest.raises(ValueError):
+        VectorStore(dimension=DIMENSION, index_type='annoy')
@@ -0,0 +1,160 @@
+"""
+Answer cache test for the AI Research Assistant
+Checks that repeated and near-identical questions against the same
+documents are answered without an LLM call, that entries expire, are
+evicted least recently used first and are invalidated when a document
+they depend on is uploaded or deleted, that document changes are only
+remembered for the TTL, and that /cache-stats reports it
+"""
+
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache
+from document_processor import VectorStore
+from embedding_cache import EmbeddingCache
+from mock_openai import MockOpenAIClient, mock_embedding
+from rag_service import RAGService
+
+DIMENSION = 64
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def llm():
+    return MockOpenAIClient(dimension=DIMENSION)
+
+
+@pytest.fixture
+def service(clock, llm):
+    store = VectorStore(dimension=DIMENSION)
+    for document_id in ('doc-a', 'doc-b'):
+        texts = [f"{document_id} passage {i} about term{i} and its measurements." for i in range(5)]
+        store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                             [{'document_id': document_id, 'chunk_index': i, 'text': text}
+                              for i, text in enumerate(texts)])
+    return RAGService(store, openai_client=llm, embedding_cache=EmbeddingCache(),
+                      answer_cache=AnswerCache(ttl=600, semantic_threshold=0.95, clock=clock))
+
+
+def test_repeated_questions(service, llm):
+    first = service.chat_with_documents("What is term3?", ['doc-a', 'doc-b'])
+    again = service.chat_with_documents("  what is   TERM3 ", ['doc-b', 'doc-a', 'doc-a'])
+    assert not first['cached'] and again['cached']
+    assert again['answer'] == first['answer'] and llm.chat.completions.calls == 1
+    # Another document set or k does not share the answer
+    assert not service.chat_with_documents("What is term3?", ['doc-a'])['cached']
+    assert not service.chat_with_documents("What is term3?", ['doc-a', 'doc-b'], k=3)['cached']
+
+
+def test_semantic_lookup(service, llm):
+    service.chat_with_documents("What is term3?", ['doc-a', 'doc-b'])
+    # A paraphrase whose query embedding is nearly the same as the original's
+    original = np.array(mock_embedding("What is term3?", DIMENSION))
+    paraphrase = original + np.random.default_rng(0).normal(0, 0.05, DIMENSION)
+    service.embedding_cache.put(EmbeddingCache.make_key(service.embedding_model, "Can you explain term3"),
+                                paraphrase.tolist())
+    calls = llm.chat.completions.calls
+    assert service.chat_with_documents("Can you explain term3", ['doc-a', 'doc-b'])['cached']
+    assert not service.chat_with_documents("Summarize the measurements", ['doc-a', 'doc-b'])['cached']
+    assert llm.chat.completions.calls == calls + 1
+    assert service.answer_cache.stats()['semantic_hits'] == 1
+
+
+def test_semantic_lookup_off_by_default(service, llm):
+    service.answer_cache = AnswerCache()
+    service.chat_with_documents("What is term3?", ['doc-a', 'doc-b'])
+    service.embedding_cache.put(EmbeddingCache.make_key(service.embedding_model, "What is not term3?"),
+                                mock_embedding("What is term3?", DIMENSION))
+    assert not service.chat_with_documents("What is not term3?", ['doc-a', 'doc-b'])['cached']
+    assert service.chat_with_documents("what is TERM3?", ['doc-a', 'doc-b'])['cached']
+    assert service.answer_cache.stats()['semantic_hits'] == 0
+
+
+def test_invalidation(service, llm):
+    cache = service.answer_cache
+    for document_ids in (['doc-a'], ['doc-a', 'doc-b'], None):
+        service.chat_with_documents("What is term3?", document_ids)
+    cache.invalidate_document('doc-b')
+    calls = llm.chat.completions.calls
+    # Only answers depending on the changed document are dropped
+    assert service.chat_with_documents("What is term3?", ['doc-a'])['cached']
+    assert not service.chat_with_documents("What is term3?", ['doc-a', 'doc-b'])['cached']
+    assert not service.chat_with_documents("What is term3?")['cached']
+    assert llm.chat.completions.calls == calls + 2
+
+    # An answer computed while its document changed is not cached
+    generation = cache.generation()
+    cache.invalidate_document('doc-a')
+    key = AnswerCache.make_key("Computed during an upload", ['doc-a'], 'hybrid', 5)
+    cache.put(key, {'answer': 'stale'}, generation)
+    assert cache.get(key)[0] is None
+    assert cache.stats()['invalidations']
+
+
+def test_expiry_and_eviction(service, clock):
+    service.chat_with_documents("What is term2?", ['doc-a'])
+    clock.now += 601
+    assert not service.chat_with_documents("What is term2?", ['doc-a'])['cached']
+    assert service.answer_cache.stats()['expirations'] == 1
+
+    small = AnswerCache(max_entries=2)
+    for name in ('a', 'b'):
+        small.put((name, None), {'answer': name}, small.generation())
+    small.get(('a', None))
+    small.put(('c', None), {'answer': 'c'}, small.generation())
+    assert small.get(('b', None))[0] is None, "The least recently used answer should be evicted first"
+    assert small.get(('a', None))[0] is not None
+    assert small.stats()['evictions'] == 1
+
+
+def test_document_changes_pruned(clock):
+    cache = AnswerCache(ttl=600, clock=clock)
+    for i in range(1000):
+        cache.invalidate_document(f'doc-{i}')
+        clock.now += 6
+    assert len(cache._document_changes) <= 101, "Changes older than the TTL should be forgotten"
+
+    # Answers computed since the forgotten changes are cached, ones from before them are not
+    generation = cache.generation()
+    key = AnswerCache.make_key("Which documents changed?", ['doc-0'], 'vector', 5)
+    cache.put(key, {'answer': 'stale'}, 0)
+    assert cache.get(key)[0] is None
+    cache.put(key, {'answer': 'fresh'}, generation)
+    assert cache.get(key)[0] == {'answer': 'fresh'}
+
+    # A document changed again is kept once, at its latest change
+    cache.invalidate_document('doc-999')
+    assert list(cache._document_changes)[-1] == 'doc-999'
+    assert list(cache._document_changes).count('doc-999') == 1
+    key = AnswerCache.make_key("And now?", ['doc-999'], 'vector', 5)
+    cache.put(key, {'answer': 'stale'}, generation)
+    assert cache.get(key)[0] is None
+
+
+def test_routes(client, ingestion, upload):
+    first = upload("Ribosomes translate messenger RNA into protein. " * 40, 'biology.txt')
+    ask = lambda: client.post('/api/chat', json={'query': 'What do ribosomes do?'}).get_json()
+    assert not ask()['cached']
+    assert ask()['cached']
+    upload("Mitochondria produce most of the cell's energy. " * 40, 'energy.txt')
+    assert not ask()['cached'], "An upload should invalidate answers over all documents"
+    ask()
+    client.delete(f"/api/delete-document/{first['document_id']}")
+    assert not ask()['cached'], "Deleting a document should invalidate answers that used it"
+
+    stats = client.get('/api/cache-stats').get_json()
+    assert stats['answers']['hits'] == 2 and stats['answers']['invalidations'] >= 2
+    assert 'hit_rate' in stats['embeddings']
@@ -0,0 +1,165 @@
+"""
+Async server test for the AI Research Assistant
+Serves the API with uvicorn against a slow mock LLM, and checks that
+concurrent chat requests are answered together on one event loop, that
+the async chat, streaming and summary routes respond like the Flask
+routes, with the same validation and CORS headers, and share their
+caches, and that other routes and uploads are passed through to Flask
+"""
+
+import http.client
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import uvicorn
+from flask_cors import CORS
+
+from document import Document, db
+from mock_openai import MockAsyncOpenAIClient, MockOpenAIClient, mock_embedding
+from research_assistant_async import create_asgi_app
+
+LLM_SECONDS = 0.5
+CONCURRENT_REQUESTS = 20
+ALLOWED_ORIGIN = 'https://assistant.example.com'
+
+
+def request(port, method, path, body=None, headers=None):
+    """(status, decoded JSON or text) of a request"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    if isinstance(body, dict):
+        body, headers = json.dumps(body), {'Content-Type': 'application/json', **(headers or {})}
+    connection.request(method, path, body, headers or {})
+    response = connection.getresponse()
+    data = response.read().decode('utf-8')
+    connection.close()
+    if response.getheader('Content-Type', '').startswith('application/json'):
+        data = json.loads(data)
+    return response.status, data
+
+
+@pytest.fixture
+def port(app, routes):
+    """Port of a uvicorn server serving the app over ASGI, with one document and a slow LLM"""
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+    CORS(app, origins=[ALLOWED_ORIGIN])
+    texts = [f"Passage {i} on photosynthesis converting light into chemical energy in chloroplasts."
+             for i in range(8)]
+    with app.app_context():
+        db.session.add(Document(document_id='plants', filename='plants.txt', content=" ".join(texts),
+                                file_type='txt'))
+        db.session.commit()
+    routes.vector_store.add_embeddings(
+        [mock_embedding(text) for text in texts],
+        [{'document_id': 'plants', 'filename': 'plants.txt', 'chunk_index': i, 'text': text}
+         for i, text in enumerate(texts)])
+
+    client = MockOpenAIClient(embedding_latency=0.05, chat_latency=LLM_SECONDS, chat_token_latency=0.01)
+    async_client = MockAsyncOpenAIClient(client)
+    rag_service = routes.rag_service
+    rag_service.openai_client = rag_service.summarizer.openai_client = client
+    rag_service.async_openai_client = rag_service.summarizer.async_openai_client = async_client
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(create_asgi_app(app), log_level='warning'))
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    yield sock.getsockname()[1]
+    server.should_exit = True
+
+
+def test_concurrent_chat(port):
+    # Distinct questions, so neither the answer cache nor coalescing helps
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENT_REQUESTS) as executor:
+        results = list(executor.map(
+            lambda i: request(port, 'POST', '/api/chat', {'query': f'Question {i} on light energy?'}),
+            range(CONCURRENT_REQUESTS)))
+    elapsed = time.perf_counter() - start
+    assert all(status == 200 and data['citations'] for status, data in results), results[0]
+    assert elapsed <= LLM_SECONDS * 3, "Concurrent chat requests should wait on the LLM together"
+
+
+def test_retrieval_off_event_loop(port, routes, monkeypatch):
+    # Searches that wait on the vector store's lock must not hold up the loop
+    search = routes.vector_store.search
+
+    def slow_search(*args, **kwargs):
+        time.sleep(0.2)
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(routes.vector_store, 'search', slow_search)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(
+            lambda i: request(port, 'POST', '/api/chat', {'query': f'Slow question {i}?'}), range(10)))
+    elapsed = time.perf_counter() - start
+    assert all(status == 200 for status, _ in results), results[0]
+    assert elapsed < LLM_SECONDS + 0.2 * 10 / 2, "Retrieval ran one request at a time on the event loop"
+
+
+def test_chat_matches_flask(port, client):
+    question = {'query': 'How do plants store energy from light?'}
+    status, answer = request(port, 'POST', '/api/chat', question)
+    again = client.post('/api/chat', json=question).get_json()
+    assert status == 200 and not answer['cached']
+    assert again['cached'] and {**answer, 'cached': True} == again, \
+        "The async answer should match the Flask route's and be cached for it"
+
+    status, body = request(port, 'POST', '/api/chat/stream', {'query': 'Which organelle captures light?'})
+    events = [(block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+              for block in body.strip().split('\n\n')]
+    names = [name for name, _ in events]
+    tokens = "".join(data['content'] for name, data in events if name == 'token')
+    assert status == 200 and names[0] == 'citations' and names[-1] == 'done'
+    assert tokens == events[-1][1]['answer']
+
+    for path, body in (('/api/chat', {}), ('/api/chat/stream', {'query': 'x', 'retrieval_mode': 'fuzzy'})):
+        status, error = request(port, 'POST', path, body)
+        assert status == 400 and error == client.post(path, json=body).get_json()
+
+
+def test_cors_headers_match_flask(port, client):
+    question = {'query': 'Which organelle captures light?'}
+    allowed = {}
+    for origin in (ALLOWED_ORIGIN, 'https://elsewhere.example.com'):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.request('POST', '/api/chat', json.dumps(question),
+                           {'Content-Type': 'application/json', 'Origin': origin})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        flask_response = client.post('/api/chat', json=question, headers={'Origin': origin})
+        allowed[origin] = response.getheader('Access-Control-Allow-Origin')
+        assert allowed[origin] == flask_response.headers.get('Access-Control-Allow-Origin'), origin
+    assert allowed == {ALLOWED_ORIGIN: ALLOWED_ORIGIN, 'https://elsewhere.example.com': None}
+
+
+def test_summaries(port, client):
+    status, summary = request(port, 'POST', '/api/summarize-document/plants', {'max_bullets': 3})
+    assert status == 200 and summary['filename'] == 'plants.txt' and summary['summary']
+    assert request(port, 'POST', '/api/summarize-document/unknown', {})[0] == 404
+    for body in ({'max_bullets': 'three'}, {'max_bullets': 0}):
+        status, error = request(port, 'POST', '/api/summarize-document/plants', body)
+        assert status == 400
+        assert error == client.post('/api/summarize-document/plants', json=body).get_json()
+
+
+def test_other_routes_served_by_flask(port):
+    status, documents = request(port, 'GET', '/api/documents')
+    assert status == 200 and [d['document_id'] for d in documents['documents']] == ['plants']
+
+    boundary = 'test-boundary'
+    upload = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="notes.exe"\r\n'
+              f'Content-Type: application/octet-stream\r\n\r\nbinary\r\n--{boundary}--\r\n')
+    status, error = request(port, 'POST', '/api/upload-document', upload,
+                            {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    assert status == 400 and 'not supported' in error['error']
+    too_large, _ = request(port, 'POST', '/api/upload-document', 'x' * (1024 * 1024 + 1),
+                           {'Content-Type': 'application/octet-stream'})
+    assert too_large == 413
@@ -0,0 +1,130 @@
+"""
+Batch search and batch chat test for the AI Research Assistant
+Checks that VectorStore.search_batch and hybrid_search_batch return what
+a search per query returns (filtered, after deletions, across a
+checkpoint and the vectors added since), that RAGService.chat_batch
+answers like chat_with_documents with bulk embedding requests, the answer
+cache and per-question errors, and that /api/chat/batch validates requests
+"""
+
+import random
+
+import pytest
+
+from answer_cache import AnswerCache
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient, mock_embedding
+from rag_service import RAGService
+
+DIMENSION = 64
+random.seed(5)
+VOCABULARY = [f"term{i}" for i in range(500)]
+
+
+def add_document(store, document_id, count):
+    texts = [" ".join(random.choice(VOCABULARY) for _ in range(20)) for _ in range(count)]
+    store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                         [{'document_id': document_id, 'filename': f'{document_id}.txt',
+                           'chunk_index': i, 'text': text} for i, text in enumerate(texts)])
+
+
+def same_results(batch, single):
+    """Same chunks in the same order, scores equal up to float rounding"""
+    return len(batch) == len(single) and all(
+        [chunk for chunk, _ in a] == [chunk for chunk, _ in b] and
+        all(abs(x - y) < 1e-5 for (_, x), (_, y) in zip(a, b))
+        for a, b in zip(batch, single))
+
+
+def rounded(result):
+    """A chat result with its citations' scores rounded, as batched searches score in another order"""
+    citations = [dict(citation, similarity_score=round(citation['similarity_score'], 5))
+                 for citation in result['citations']]
+    return dict(result, cached=False, citations=citations)
+
+
+def test_search_batch(tmp_path):
+    store = VectorStore(dimension=DIMENSION, mmap_index=True, collapse_similarity=None)
+    for d in range(30):
+        add_document(store, f'doc-{d}', 12)
+    store.save_to_file(str(tmp_path / 'vector_store'))
+    # Searched across the mapped checkpoint and the vectors added since
+    for d in range(30, 40):
+        add_document(store, f'doc-{d}', 12)
+    store.remove_document('doc-3')
+    store.remove_document('doc-35')
+
+    queries = [" ".join(random.choice(VOCABULARY) for _ in range(3)) for _ in range(25)]
+    embeddings = [mock_embedding(query, DIMENSION) for query in queries]
+    for document_ids in (None, ['doc-1', 'doc-3', 'doc-31'], ['missing']):
+        batch = store.search_batch(embeddings, k=5, document_ids=document_ids)
+        single = [store.search(embedding, k=5, document_ids=document_ids) for embedding in embeddings]
+        assert same_results(batch, single), document_ids
+        hybrid = store.hybrid_search_batch(queries, embeddings, k=5, document_ids=document_ids)
+        hybrid_single = [store.hybrid_search(query, embedding, k=5, document_ids=document_ids)
+                         for query, embedding in zip(queries, embeddings)]
+        assert same_results(hybrid, hybrid_single), document_ids
+    assert store.search_batch([], k=5) == []
+    assert len(store.search_batch(embeddings[:1], k=5)[0]) == 5
+
+
+@pytest.fixture
+def store():
+    store = VectorStore(dimension=DIMENSION)
+    for d in range(10):
+        add_document(store, f'doc-{d}', 8)
+    return store
+
+
+def test_chat_batch(store):
+    client = MockOpenAIClient(dimension=DIMENSION)
+    rag_service = RAGService(store, openai_client=client, answer_cache=AnswerCache())
+
+    queries = [f"What about term{i} and term{i + 1}?" for i in range(40)]
+    queries.append(queries[0])  # Repeated within the batch
+    results = rag_service.chat_batch(queries, ['doc-1', 'doc-2', 'doc-3'], retrieval_mode='vector')
+    assert client.embeddings.calls == 1, "The questions should be embedded in bulk"
+    reference = RAGService(store, openai_client=MockOpenAIClient(dimension=DIMENSION))
+    expected = [reference.chat_with_documents(query, ['doc-1', 'doc-2', 'doc-3'], retrieval_mode='vector')
+                for query in queries]
+    assert [rounded(result) for result in results] == [rounded(result) for result in expected]
+
+    again = rag_service.chat_batch(queries[:5] + ["A new question on term7?"], ['doc-1', 'doc-2', 'doc-3'],
+                                   retrieval_mode='vector')
+    assert [result['cached'] for result in again] == [True] * 5 + [False]
+
+    embedding_calls = client.embeddings.calls
+    lexical = rag_service.chat_batch(queries[:3], retrieval_mode='lexical')
+    assert client.embeddings.calls == embedding_calls, "Lexical batches should not embed the questions"
+    assert [r['retrieved_chunks'] for r in lexical] == [len(store.lexical_search(q, 5)) for q in queries[:3]]
+
+
+def test_chat_batch_errors(store):
+    client = MockOpenAIClient(dimension=DIMENSION)
+    rag_service = RAGService(store, openai_client=client)
+    create = client.chat.completions.create
+
+    def failing(**kwargs):
+        if 'term2 ' in kwargs['messages'][1]['content']:
+            raise RuntimeError("model overloaded")
+        return create(**kwargs)
+
+    client.chat.completions.create = failing
+    failed = rag_service.chat_batch(["Tell me about term2 and term3?", "Tell me about term9?"],
+                                    retrieval_mode='hybrid')
+    assert 'model overloaded' in failed[0].get('error', ''), "A failed answer should be reported per question"
+    assert 'answer' in failed[1]
+
+
+def test_batch_route(client, routes):
+    routes.vector_store.add_embeddings(
+        [mock_embedding("Photosynthesis turns light into energy.")],
+        [{'document_id': 'plants', 'chunk_index': 0, 'text': "Photosynthesis turns light into energy."}])
+
+    response = client.post('/api/chat/batch', json={'queries': ["What is photosynthesis?", "Why light?"]})
+    results = response.get_json().get('results', [])
+    assert response.status_code == 200 and len(results) == 2
+    assert all(r['citations'] for r in results)
+    for body in ({}, {'queries': []}, {'queries': ['ok', '']}, {'queries': 'text'},
+                 {'queries': ['q'] * (routes.MAX_BATCH_QUERIES + 1)}, {'queries': ['q'], 'retrieval_mode': 'fuzzy'}):
+        assert client.post('/api/chat/batch', json=body).status_code == 400, body
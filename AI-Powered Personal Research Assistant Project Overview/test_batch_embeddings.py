@@ -0,0 +1,113 @@
+"""
+Batched embedding test for the AI Research Assistant
+Checks that generate_embeddings returns embeddings in input order, packs
+texts into batches bounded by size and tokens, keeps at most
+max_concurrency requests in flight, sends each distinct uncached text
+once, reports progress and surfaces failed batches
+"""
+
+import threading
+
+import pytest
+
+from document_processor import DocumentProcessor
+from embedding_cache import EmbeddingCache
+from mock_openai import MockOpenAIClient, mock_embedding
+
+TEXTS = [f"Passage {i} on protein folding and chaperones." for i in range(40)]
+
+
+class InFlightEmbeddings:
+    """Wraps client.embeddings, recording the batches sent and the peak number of concurrent requests"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.batches = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, input):
+        with self._lock:
+            self.batches.append(list(input))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            return self.embeddings.create(model=model, input=input)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FailingEmbeddings:
+    def create(self, model, input):
+        raise RuntimeError("rate limited")
+
+
+def processor_with(embeddings=None, **kwargs):
+    client = MockOpenAIClient(dimension=16, embedding_latency=0.05)
+    if embeddings is not None:
+        client.embeddings = embeddings(client.embeddings)
+    return client, DocumentProcessor(openai_client=client, **kwargs)
+
+
+def test_order_and_batch_size():
+    client, processor = processor_with(InFlightEmbeddings, max_batch_size=8, max_concurrency=3)
+    embeddings = processor.generate_embeddings(TEXTS)
+    assert embeddings == [mock_embedding(text, 16) for text in TEXTS]
+    assert [len(batch) for batch in client.embeddings.batches] == [8] * 5
+    assert client.embeddings.peak == 3, "Batches should be sent concurrently, at most max_concurrency at a time"
+    assert processor.generate_embeddings([]) == []
+
+
+def test_batches_bounded_by_tokens():
+    client, processor = processor_with(InFlightEmbeddings, max_batch_tokens=40, max_batch_size=512)
+    long_texts = [text * 4 for text in TEXTS[:10]]
+    embeddings = processor.generate_embeddings(long_texts)
+    assert embeddings == [mock_embedding(text, 16) for text in long_texts]
+    token_counter = processor.chunker.token_counter
+    assert len(client.embeddings.batches) > 1
+    for batch in client.embeddings.batches:
+        assert len(batch) == 1 or sum(token_counter(text) for text in batch) <= 40
+
+
+def test_cache_sends_each_text_once(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embedding_cache.db'))
+    client, processor = processor_with(embedding_cache=cache, max_batch_size=8)
+    repeated = TEXTS[:10] + TEXTS[:10]
+    assert processor.generate_embeddings(repeated) == [mock_embedding(text, 16) for text in repeated]
+    assert client.embeddings.inputs == 10
+
+    # Cached texts are served without calling the API, whitespace and all
+    reformatted = [text.replace(" ", "  ") for text in TEXTS[:10]] + TEXTS[10:15]
+    reported = []
+    embeddings = processor.generate_embeddings(reformatted, progress=reported.append)
+    assert embeddings[:10] == [mock_embedding(text, 16) for text in TEXTS[:10]]
+    assert client.embeddings.inputs == 15
+    assert reported == [10, 15]
+    cache.close()
+
+
+def test_progress_and_embed_chunks():
+    reported = []
+    client, processor = processor_with(max_batch_size=4, max_concurrency=2)
+    processor.generate_embeddings(TEXTS[:10], progress=reported.append)
+    assert sorted(reported) == reported and reported[-1] == 10 and len(reported) == 3
+
+    # embed_chunks groups chunks and keeps counting across groups
+    reported.clear()
+    chunks = [(i // 5 + 1, text) for i, text in enumerate(TEXTS[:20])]
+    groups = list(processor.embed_chunks(iter(chunks), progress=reported.append))
+    assert [len(group) for group in groups] == [8, 8, 4]
+    assert [(page, text) for group in groups for page, text, _ in group] == chunks
+    assert reported[-1] == 20 and sorted(reported) == reported
+
+
+def test_failed_batch_raises():
+    client = MockOpenAIClient(dimension=16)
+    client.embeddings = FailingEmbeddings()
+    processor = DocumentProcessor(openai_client=client, max_batch_size=4)
+    with pytest.raises(Exception, match="rate limited"):
+        processor.generate_embeddings(TEXTS[:10])
+    with pytest.raises(Exception, match="rate limited"):
+        processor.generate_embeddings(TEXTS[:1])
@@ -0,0 +1,112 @@
+"""
+Chunking test for the AI Research Assistant
+Checks that every strategy keeps chunks within the token budget, covers
+the text with overlapping chunks and ends them at its boundaries, that
+short sections under headings share chunks, that chunking makes steady
+progress through pathological text, and that embedding batches are sized
+with the chunker's token counter
+"""
+
+import random
+
+import pytest
+
+from chunking import CHUNKING_STRATEGIES, build_chunker, estimate_tokens
+from document_processor import DocumentProcessor
+from mock_openai import MockOpenAIClient
+
+random.seed(5)
+VOCABULARY = [f"word{i}" for i in range(500)]
+TEXT = "\n\n".join(
+    " ".join(" ".join(random.choice(VOCABULARY) for _ in range(random.randint(5, 25))) + "."
+             for _ in range(random.randint(2, 8)))
+    for _ in range(60))
+
+
+def words_of(text):
+    return text.replace('\n', ' ').split()
+
+
+@pytest.mark.parametrize('strategy', CHUNKING_STRATEGIES)
+def test_chunks_within_budget_and_overlapping(strategy):
+    chunker = build_chunker(strategy, chunk_size=64, chunk_overlap=16)
+    chunks = chunker.chunk_text(TEXT)
+    assert len(chunks) > 10
+    assert all(estimate_tokens(chunk) <= 64 for chunk in chunks)
+    # Chunks cover the text in order, each starting inside the previous one
+    assert " ".join(words_of(TEXT)).startswith(" ".join(words_of(chunks[0])))
+    assert " ".join(words_of(TEXT)).endswith(" ".join(words_of(chunks[-1])))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert words_of(chunk)[0] in words_of(previous)[len(words_of(previous)) // 2:]
+
+
+def test_sentence_and_paragraph_boundaries():
+    # Sentences shorter than half a chunk, so there is always one to end at
+    text = " ".join(" ".join(random.choice(VOCABULARY) for _ in range(random.randint(3, 10))) + "."
+                    for _ in range(300))
+    sentence_chunks = build_chunker('sentence', chunk_size=64, chunk_overlap=16).chunk_text(text)
+    assert all(chunk.endswith('.') for chunk in sentence_chunks)
+    fixed_chunks = build_chunker('fixed', chunk_size=64, chunk_overlap=16).chunk_text(text)
+    assert not all(chunk.endswith('.') for chunk in fixed_chunks)
+
+    document = "\n\n".join(f"# Heading {h}\n\n" + " ".join(f"Point {h}.{i} is made here." for i in range(8))
+                           for h in range(6))
+    paragraph_chunks = build_chunker('paragraph', chunk_size=128, chunk_overlap=16).chunk_text(document)
+    assert all(chunk.startswith('# Heading') for chunk in paragraph_chunks), "Chunks should be cut at headings"
+    assert sum(chunk.count('# Heading') for chunk in paragraph_chunks) == 6
+    assert len(paragraph_chunks) < 6, "Short sections should share a chunk up to the budget"
+
+
+def test_heading_runs_merged():
+    text = '\n# h' * 50000
+    chunks = build_chunker('paragraph', chunk_size=64, chunk_overlap=16).chunk_text(text)
+    assert all(estimate_tokens(chunk) <= 64 for chunk in chunks)
+    assert all(chunk.startswith('# h') for chunk in chunks)
+    # Each chunk fills at least half its window
+    assert len(chunks) <= len(text) / (64 // 2 * 4) + 1
+
+
+@pytest.mark.parametrize('text', [
+    'x' * 200000,  # No boundaries at all
+    'a. ' * 60000,  # A boundary every few characters
+    ('word ' * 2000 + 'y' * 5000) * 10,  # Words around long unbreakable runs
+    '.' * 200000,  # Runs of sentence punctuation, without whitespace to end them
+    '!?' * 100000,
+    ('.' * 3000 + ' ') * 60,
+], ids=['no-boundaries', 'tiny-sentences', 'long-runs', 'dot-runs', 'punctuation-runs', 'spaced-dot-runs'])
+@pytest.mark.parametrize('strategy', CHUNKING_STRATEGIES)
+def test_progress_on_pathological_text(text, strategy):
+    chunker = build_chunker(strategy, chunk_size=64, chunk_overlap=16)
+    chunks = chunker.chunk_text(text)
+    # Each chunk moves on by at least half a window less the overlap
+    assert len(chunks) <= len(text) / ((64 // 2 - 16) * 4) + 2
+    assert all(estimate_tokens(chunk) <= 64 for chunk in chunks)
+
+
+def test_custom_token_counter_and_pages():
+    def count_words(text):
+        return len(text.split())
+
+    chunker = build_chunker('fixed', chunk_size=20, chunk_overlap=5, token_counter=count_words)
+    chunks = chunker.chunk_text(" ".join(VOCABULARY[:200]))
+    assert all(count_words(chunk) <= 20 for chunk in chunks)
+
+    pages = [(page, " ".join(f"page{page}-word{i}" for i in range(100)) + " ") for page in range(1, 4)]
+    paged = list(build_chunker('sentence', chunk_size=64, chunk_overlap=8).iter_chunks(pages))
+    assert [page for page, _ in paged] == sorted(page for page, _ in paged)
+    assert all(chunk.split()[0].startswith(f"page{page}-") for page, chunk in paged)
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        build_chunker('semantic')
+    with pytest.raises(ValueError):
+        build_chunker('sentence', chunk_size=50, chunk_overlap=50)
+
+
+def test_embedding_batches_use_chunker_token_counter():
+    client = MockOpenAIClient(dimension=8)
+    chunker = build_chunker('sentence', token_counter=lambda text: len(text.split()))
+    processor = DocumentProcessor(openai_client=client, chunker=chunker, max_batch_tokens=10, max_concurrency=1)
+    embeddings = processor.generate_embeddings([f"one two three four text{i}" for i in range(6)])
+    assert len(embeddings) == 6 and client.embeddings.calls == 3
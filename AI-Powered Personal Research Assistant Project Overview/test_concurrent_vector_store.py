@@ -0,0 +1,199 @@
+"""
+Concurrency stress test for the vector store
+Hammers one VectorStore from many threads: writers add documents, a
+deleter removes some, a saver logs changes and triggers checkpoints and
+compactions, while searchers run vector, filtered and hybrid searches.
+Checks that every search sees a consistent store (each hit's metadata
+belongs to its vector, filters hold, stable documents are always found),
+that the store ends consistent and reloads the same, and reports search
+throughput with and without the writes
+"""
+
+import queue
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from document_processor import VectorStore
+from mock_openai import mock_embedding
+
+DIMENSION = 64
+CHUNKS_PER_DOCUMENT = 8
+STABLE_DOCUMENTS = 20
+WRITERS = 4
+DOCUMENTS_PER_WRITER = 40
+SEARCHERS = 6
+
+
+def chunk_text(document_id, chunk_index):
+    return f"Chunk {chunk_index} of {document_id} mentions marker{document_id.replace('-', '')}"
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def add_document(store, document_id):
+    texts = [chunk_text(document_id, j) for j in range(CHUNKS_PER_DOCUMENT)]
+    store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                         [{'document_id': document_id, 'chunk_index': j, 'text': text}
+                          for j, text in enumerate(texts)])
+
+
+def check_hits(hits, query, document_ids=None):
+    """Problem with a search's hits, or None"""
+    for chunk, score in hits:
+        if chunk is None or chunk.get('text') != chunk_text(chunk['document_id'], chunk['chunk_index']):
+            return f"hit without its metadata: {chunk}"
+        if query is not None and abs(score - float(unit(query) @ unit(mock_embedding(chunk['text'], DIMENSION)))) > 1e-3:
+            return f"hit's metadata does not belong to its vector: {chunk['text']} scored {score:.4f}"
+        if document_ids and chunk['document_id'] not in document_ids:
+            return f"hit outside the filter {document_ids}: {chunk['document_id']}"
+    return None
+
+
+def search_once(store, rng, known):
+    """One random search; a problem with it, or None"""
+    document_id = f"stable-{rng.randrange(STABLE_DOCUMENTS)}"
+    kind = rng.randrange(3)
+    if kind == 0:
+        text = chunk_text(document_id, rng.randrange(CHUNKS_PER_DOCUMENT))
+        query = mock_embedding(text, DIMENSION)
+        hits = store.search(query, k=3)
+        if not hits or hits[0][0]['text'] != text:
+            return f"stable chunk {text!r} not found"
+        return check_hits(hits, query)
+    if kind == 1:
+        filtered = [rng.choice(known)] if known else [document_id]
+        query = mock_embedding(f"query {rng.random()}", DIMENSION)
+        return check_hits(store.search(query, k=5, document_ids=filtered), query, filtered)
+    query = mock_embedding(chunk_text(document_id, 0), DIMENSION)
+    # Terms of every chunk too, whose postings the writers keep changing
+    hits = store.hybrid_search(f"chunk mentions marker{document_id.replace('-', '')}", query, k=3)
+    if not hits or hits[0][0]['document_id'] != document_id:
+        return f"hybrid search missed stable document {document_id}"
+    return check_hits(hits, None)
+
+
+def run_searches(store, stop, known, errors, latencies):
+    rng = random.Random(threading.get_ident())
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            error = search_once(store, rng, known)
+        except Exception as e:
+            error = f"search raised {e!r}"
+        latencies.append(time.perf_counter() - start)
+        if error:
+            errors.append(error)
+
+
+def measure_searches(store, seconds, known, errors, during=None):
+    """(searches per second, latencies) of SEARCHERS threads, while during() runs if given"""
+    stop = threading.Event()
+    latencies = []
+    threads = [threading.Thread(target=run_searches, args=(store, stop, known, errors, latencies))
+               for _ in range(SEARCHERS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if during is None:
+        time.sleep(seconds)
+    else:
+        during()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), np.array(latencies)
+
+
+@pytest.fixture
+def frequent_switches():
+    """Switch threads far more often than usual, so races show up"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_vector_store(tmp_path, frequent_switches, wait_for_maintenance):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=DIMENSION, mmap_index=True, wal_merge_ratio=0.1,
+                        compaction_threshold=0.1, collapse_similarity=None)
+    for i in range(STABLE_DOCUMENTS):
+        add_document(store, f"stable-{i}")
+    store.save_to_file(path)
+
+    errors, known = [], []
+    idle_rate, _ = measure_searches(store, 1.0, known, errors)
+
+    added, removed = [], []
+    removable = queue.Queue()
+
+    def writer(w):
+        for i in range(DOCUMENTS_PER_WRITER):
+            document_id = f"w{w}-d{i}"
+            add_document(store, document_id)
+            added.append(document_id)
+            known.append(document_id)
+            removable.put(document_id)
+            time.sleep(0.002)
+
+    def deleter():
+        while True:
+            document_id = removable.get()
+            if document_id is None:
+                return
+            if len(removed) < len(added) // 2 and store.remove_document(document_id) == CHUNKS_PER_DOCUMENT:
+                removed.append(document_id)
+
+    saving = threading.Event()
+
+    def saver():
+        while not saving.is_set():
+            store.save_to_file(path)
+            time.sleep(0.01)
+
+    def write_everything():
+        background = [threading.Thread(target=deleter), threading.Thread(target=saver)]
+        writers = [threading.Thread(target=writer, args=(w,)) for w in range(WRITERS)]
+        for thread in background + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        removable.put(None)
+        saving.set()
+        for thread in background:
+            thread.join()
+
+    busy_rate, latencies = measure_searches(store, None, known, errors, during=write_everything)
+    print(f"{SEARCHERS} searchers: {idle_rate:.0f} searches/s idle, {busy_rate:.0f} searches/s "
+          f"during {len(added)} adds and {len(removed)} deletes; p99 {np.percentile(latencies, 99) * 1000:.1f}ms")
+    assert not errors, f"{len(errors)} inconsistent searches, e.g. {errors[0]}"
+    assert busy_rate >= idle_rate * 0.25, "Searches should keep being served during writes"
+
+    # The store ends consistent once the last background checkpoint or compaction is done
+    wait_for_maintenance(store)
+    store.save_to_file(path)
+    wait_for_maintenance(store)
+    expected = {f"stable-{i}" for i in range(STABLE_DOCUMENTS)} | set(added) - set(removed)
+    documents = {document_id for document_id, ids in store.document_vectors.items() if len(ids)}
+    live = len(store.chunk_metadata)
+    rows = sum(index.ntotal for index, _ in store._searchable())
+    assert documents == expected
+    assert live == len(expected) * CHUNKS_PER_DOCUMENT
+    assert rows - len(store.tombstones) == live
+    assert len(store.lexical_index) == live
+    assert store.next_id == (STABLE_DOCUMENTS + len(added)) * CHUNKS_PER_DOCUMENT
+
+    # And reloads the same
+    reloaded = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    reloaded.load_from_file(path)
+    query = mock_embedding(chunk_text(sorted(expected)[0], 1), DIMENSION)
+    assert {document_id for document_id, ids in reloaded.document_vectors.items() if len(ids)} == expected
+    assert reloaded.search(query, k=5) == store.search(query, k=5)
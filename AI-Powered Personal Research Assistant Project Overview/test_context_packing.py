@@ -0,0 +1,97 @@
+"""
+Context packing test for the AI Research Assistant
+Checks that consecutive overlapping chunks are merged into one passage
+with the overlap included once, that spans inside other hits are not
+repeated, that the context stays within the token budget, and that
+citation n is the passage marked [n]
+"""
+
+import re
+
+import pytest
+
+from chunking import build_chunker, estimate_tokens
+from context_builder import ContextBuilder, overlap_length
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient, mock_embedding
+from rag_service import RAGService
+
+DIMENSION = 64
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def document_chunks(document_id, text, page_number=None):
+    chunks = build_chunker('sentence', chunk_size=96, chunk_overlap=32).chunk_text(text)
+    return [{'document_id': document_id, 'filename': f'{document_id}.txt', 'chunk_index': i,
+             'text': chunk, 'page_number': page_number} for i, chunk in enumerate(chunks)]
+
+
+def numbering_matches(context, citations):
+    """Citation n is the passage after [n], and there are no other markers"""
+    markers = re.findall(r'^\[(\d+)\]', context, re.MULTILINE)
+    if markers != [str(n) for n in range(1, len(citations) + 1)]:
+        return False
+    passages = re.split(r'^\[\d+\](?: \([^)]*\))? ', context, flags=re.MULTILINE)[1:]
+    return all(passage.startswith(citation['text'].rstrip('.')[:100])
+               for passage, citation in zip(passages, citations))
+
+
+TEXT = " ".join(f"Sentence {i} reports that sample {i} held {i * 7} units of compound X{i % 13}."
+               for i in range(120))
+CHUNKS = document_chunks('report', TEXT, page_number=2)
+OTHER = document_chunks('notes', "Notes on calibration of the mass spectrometer. " * 20)
+HITS = [(CHUNKS[4], 0.9), (OTHER[0], 0.8), (CHUNKS[3], 0.7), (CHUNKS[9], 0.6), (CHUNKS[5], 0.5)]
+
+
+def test_consecutive_chunks_merge():
+    assert overlap_length(CHUNKS[3]['text'], CHUNKS[4]['text']) > 0, "Consecutive chunks should overlap"
+
+    context, citations = ContextBuilder(max_tokens=None).build(HITS)
+    # Passages report[3-5], notes[0] and report[9], in that order
+    assert [c['document_id'] for c in citations] == ['report', 'notes', 'report']
+    assert citations[0]['similarity_score'] == 0.9
+    assert numbering_matches(context, citations)
+
+    # The merged passage reads as the original text, each overlap once
+    first_passage = context.split("\n\n")[0].split(") ", 1)[1]
+    texts = [chunk['text'] for chunk in CHUNKS[3:6]]
+    expected = normalize(" ".join([texts[0], texts[1][overlap_length(texts[0], texts[1]):],
+                                   texts[2][overlap_length(texts[1], texts[2]):]]))
+    assert normalize(first_passage) == expected
+    assert normalize(first_passage) in normalize(TEXT)
+    assert normalize(citations[0]['text']).startswith(normalize(CHUNKS[3]['text'])[:100])
+
+    # A hit inside another hit is not repeated
+    inner = dict(CHUNKS[9], chunk_index=None, text=CHUNKS[9]['text'][20:80])
+    context, citations = ContextBuilder(max_tokens=None).build([(CHUNKS[9], 0.9), (inner, 0.8)])
+    assert len(citations) == 1 and context.count(inner['text']) == 1
+
+
+@pytest.mark.parametrize('budget', [60, 120, 200])
+def test_token_budget(budget):
+    context, citations = ContextBuilder(max_tokens=budget).build(HITS)
+    assert estimate_tokens(context) <= budget
+    assert citations[0]['similarity_score'] == 0.9, "The best hit should be kept first"
+    assert numbering_matches(context, citations)
+
+
+def test_best_hit_cut_to_budget():
+    context, citations = ContextBuilder(max_tokens=10).build(HITS)
+    assert estimate_tokens(context) <= 10 and len(citations) == 1
+    assert CHUNKS[4]['text'].startswith(citations[0]['text'])
+
+
+def test_rag_service_packs_context():
+    store = VectorStore(dimension=DIMENSION)
+    for document in (CHUNKS, OTHER):
+        store.add_embeddings([mock_embedding(chunk['text'], DIMENSION) for chunk in document], document)
+    client = MockOpenAIClient(dimension=DIMENSION)
+    rag = RAGService(store, openai_client=client, context_builder=ContextBuilder(max_tokens=150))
+    result = rag.chat_with_documents("How many units of compound X5 did the samples hold?", k=8)
+    prompt = client.chat.completions.last_messages[-1]['content']
+    context = prompt.split("Context from uploaded documents:\n", 1)[1].split("\n\nQuestion:", 1)[0]
+    assert estimate_tokens(context) <= 150
+    assert numbering_matches(context, result['citations'])
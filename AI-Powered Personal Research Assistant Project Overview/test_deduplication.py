@@ -0,0 +1,165 @@
+"""
+Near-duplicate chunk test for the AI Research Assistant
+Uploads the same paper three times (as is, reformatted and lightly
+edited) and checks that duplicate chunks are linked instead of embedded,
+that searches return each passage once, that links survive deleting the
+original, reloading the store and rebuilding it from the database, and
+that the original is found behind many chunks sharing an LSH band with it
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from chunk_store import write_chunk_store
+from dedup import NUM_PERMUTATIONS, Fingerprint, fingerprint
+from document import Document, DocumentChunk, IngestionJob, db
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient, mock_embedding
+from rebuild_vector_store import rebuild_vector_store
+
+random.seed(7)
+VOCABULARY = [f"term{i}" for i in range(2000)]
+PAPER = "\n\n".join(
+    " ".join(" ".join(random.choice(VOCABULARY) for _ in range(random.randint(8, 16))) + "."
+             for _ in range(6))
+    for _ in range(30))
+
+
+def reformatted(text):
+    """The same words with different capitalization and line breaks, as from another extractor"""
+    return text.upper().replace(". ", ".\n")
+
+
+def edited(text, every=150):
+    """One word in every `every` replaced"""
+    words = text.split(" ")
+    for i in range(0, len(words), every):
+        words[i] = "revised"
+    return " ".join(words)
+
+
+def search(store, text, **kwargs):
+    query = MockOpenAIClient().embeddings.create(model='', input=[text]).data[0].embedding
+    return store.search(query, **kwargs)
+
+
+def test_deduplication(app, client, routes, ingestion, upload):
+    store = routes.vector_store
+    jobs = {}
+    for filename, text in (('paper.txt', PAPER), ('paper-copy.txt', reformatted(PAPER)),
+                           ('paper-v2.txt', edited(PAPER))):
+        job = upload(text, filename)
+        assert job['status'] == IngestionJob.COMPLETED, f"{filename} was not ingested: {job['error']}"
+        jobs[filename] = job
+
+    original, copy, revised = jobs.values()
+    assert original['chunks_deduplicated'] == 0
+    assert copy['chunks_deduplicated'] == copy['chunks_total'], \
+        "A reformatted copy should be fully deduplicated against the original"
+    assert revised['chunks_deduplicated'] >= 0.8 * revised['chunks_total'], \
+        "Too few chunks of the lightly edited version were deduplicated"
+    assert len(store.chunk_metadata) == original['chunks_total'] + revised['chunks_embedded'], \
+        "Duplicate chunks added vectors to the index"
+
+    # Search returns each passage once, listing its duplicate sources
+    passage = PAPER[:600]
+    hits = search(store, passage, k=5)
+    sources = [hit['document_id'] for hit, _ in hits] + [
+        duplicate['document_id'] for hit, _ in hits for duplicate in hit.get('duplicates', [])]
+    assert hits[0][0]['document_id'] == original['document_id'] and len(set(sources)) == 3, \
+        f"Top hit should list all three copies: {hits[0][0].get('duplicates')}"
+    texts = [hit['text'][:80] for hit, _ in hits]
+    assert len(set(texts)) == len(texts), "The same passage was returned more than once"
+    filtered = search(store, passage, k=3, document_ids=[copy['document_id']])
+    assert filtered and all(hit['document_id'] == copy['document_id'] for hit, _ in filtered)
+
+    # Deleting the original hands its vectors over to a copy
+    client.delete(f"/api/delete-document/{original['document_id']}")
+    hits = search(store, passage, k=3)
+    assert hits and hits[0][0]['document_id'] != original['document_id'], \
+        "Deleting the original lost the copies' vectors"
+    with app.app_context():
+        orphaned = DocumentChunk.query.filter_by(duplicate_of_document_id=original['document_id']).count()
+        embedded = DocumentChunk.query.filter_by(document_id=copy['document_id']).filter(
+            DocumentChunk.embedding_blob.isnot(None)).count()
+    assert not orphaned and embedded, "The copy's chunks were not promoted when the original was deleted"
+
+    # Links survive reloading the store and rebuilding it from the database
+    ingestion.stop()
+    reloaded = VectorStore(dimension=store.dimension)
+    reloaded.load_from_file('vector_store')
+    with app.app_context():
+        rebuild_vector_store('rebuilt_store', progress=lambda *args: None)
+    rebuilt = VectorStore(dimension=store.dimension)
+    rebuilt.load_from_file('rebuilt_store')
+    expected = [(hit['document_id'], hit['chunk_index']) for hit, _ in
+                search(store, passage, k=3, document_ids=[revised['document_id']])]
+    for other in (reloaded, rebuilt):
+        found = [(hit['document_id'], hit['chunk_index']) for hit, _ in
+                 search(other, passage, k=3, document_ids=[revised['document_id']])]
+        assert found == expected
+        assert len(other.chunk_metadata) == len(store.chunk_metadata)
+
+
+def test_original_found_behind_many_candidates(app):
+    fp = fingerprint(PAPER[:400])
+    rng = np.random.default_rng(2)
+    with app.app_context():
+        db.session.add(Document(document_id='crowded', filename='crowded.txt', content='', file_type='txt'))
+        for i in range(120):
+            # Shares the first band with fp and little else, so it is a candidate but no duplicate
+            signature = fp.signature.copy()
+            signature[8:] = rng.integers(0, 2 ** 32, NUM_PERMUTATIONS - 8, dtype=np.uint32)
+            chunk = DocumentChunk(document_id='crowded', chunk_index=i, text=f'Candidate {i}')
+            chunk.set_fingerprint(Fingerprint(f'{i:016x}', signature))
+            db.session.add(chunk)
+        original = DocumentChunk(document_id='crowded', chunk_index=120, text=PAPER[:400])
+        original.set_fingerprint(fp)
+        db.session.add(original)
+        db.session.commit()
+
+        assert DocumentChunk.find_original(fp) == ('crowded', 120)
+        assert DocumentChunk.find_original(fp, page_size=7) == ('crowded', 120)
+        unrelated = fingerprint(PAPER[-400:])
+        assert DocumentChunk.find_original(unrelated) is None
+
+
+def add_document(store, document_id, count):
+    texts = [f"Chunk {i} of {document_id}" for i in range(count)]
+    store.add_embeddings([mock_embedding(text, 64) for text in texts],
+                         [{'document_id': document_id, 'chunk_index': i, 'text': text}
+                          for i, text in enumerate(texts)])
+
+
+def test_handover_of_checkpointed_vector(tmp_path):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=64, collapse_similarity=None)
+    add_document(store, 'A', 3)
+    add_document(store, 'D', 3)
+    store.link_duplicates([('A', 0)], [{'document_id': 'B', 'chunk_index': 0, 'text': "Chunk 0 of A"}])
+    store.save_to_file(path)
+    store.checkpoint()
+
+    # B takes over A's checkpointed vector 0, below the IDs of D and C
+    add_document(store, 'C', 2)
+    store.remove_document('A')
+    assert [vector_id for vector_id, _ in store.chunk_metadata.items()] == [0, 3, 4, 5, 6, 7]
+    store.save_to_file(path)
+    store.checkpoint()
+
+    reloaded = VectorStore(dimension=64, collapse_similarity=None)
+    reloaded.load_from_file(path)
+    for document_id, count in (('B', 1), ('C', 2), ('D', 3)):
+        hits = reloaded.search(mock_embedding(f"Chunk 0 of {document_id}", 64), k=5, document_ids=[document_id])
+        assert len(hits) == count, document_id
+        assert len(reloaded.lexical_search("Chunk", k=5, document_ids=[document_id])) == count, document_id
+    assert reloaded.chunk_metadata[0]['document_id'] == 'B'
+
+
+def test_chunk_store_rejects_unordered_ids(tmp_path):
+    path = str(tmp_path / 'chunks')
+    with pytest.raises(ValueError):
+        write_chunk_store(path, [(3, {'text': 'a'}), (1, {'text': 'b'})])
+    assert not list(tmp_path.iterdir())
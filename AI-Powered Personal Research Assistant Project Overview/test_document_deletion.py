@@ -0,0 +1,82 @@
+"""
+Document deletion test for the AI Research Assistant
+Checks that removing a document tombstones its vectors so searches no
+longer return it, that compaction drops them from the index once the
+dead fraction passes the threshold, and that the delete route removes a
+document from the database, the vector store and search results
+"""
+
+from document import Document, DocumentChunk, IngestionJob
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient, mock_embedding
+
+DIMENSION = 64
+CHUNKS_PER_DOCUMENT = 5
+
+
+def add_document(store, document_id):
+    texts = [f"Chunk {i} of {document_id}" for i in range(CHUNKS_PER_DOCUMENT)]
+    store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                         [{'document_id': document_id, 'chunk_index': i, 'text': text}
+                          for i, text in enumerate(texts)])
+
+
+def found(store, document_id):
+    hits = store.search(mock_embedding(f"Chunk 0 of {document_id}", DIMENSION), k=3)
+    return any(hit['document_id'] == document_id for hit, _ in hits)
+
+
+def rows(store):
+    return sum(index.ntotal for index, _ in store._searchable())
+
+
+def test_tombstones_then_compaction(wait_for_maintenance):
+    store = VectorStore(dimension=DIMENSION, compaction_threshold=0.3, collapse_similarity=None)
+    for d in range(10):
+        add_document(store, f'doc-{d}')
+
+    # Below the threshold the vectors stay in the index, tombstoned
+    assert store.remove_document('doc-0') == CHUNKS_PER_DOCUMENT
+    assert store.remove_document('doc-0') == 0
+    wait_for_maintenance(store)
+    assert not found(store, 'doc-0') and found(store, 'doc-1')
+    assert len(store.tombstones) == CHUNKS_PER_DOCUMENT and rows(store) == 10 * CHUNKS_PER_DOCUMENT
+    assert store.dead_fraction() == 0.1
+    assert not store.lexical_search("Chunk of doc-0", k=3, document_ids=['doc-0'])
+    assert not store.search(mock_embedding("Chunk 0 of doc-0", DIMENSION), k=3, document_ids=['doc-0'])
+
+    # Passing it compacts the index in the background
+    for d in (1, 2, 3):
+        store.remove_document(f'doc-{d}')
+    wait_for_maintenance(store)
+    assert not store.tombstones and store.dead_fraction() == 0.0
+    assert rows(store) == 6 * CHUNKS_PER_DOCUMENT
+    assert all(found(store, f'doc-{d}') for d in range(4, 10))
+
+    # New vectors take new IDs, not those of the removed ones
+    add_document(store, 'doc-10')
+    assert found(store, 'doc-10') and store.next_id == 11 * CHUNKS_PER_DOCUMENT
+
+
+def test_delete_route(app, client, routes, ingestion, upload):
+    paper = " ".join(f"Sentence {i} on coral reef bleaching." for i in range(200))
+    kept = upload(" ".join(f"Sentence {i} on glacier retreat." for i in range(200)), 'glaciers.txt')
+    job = upload(paper, 'reefs.txt')
+    assert job['status'] == kept['status'] == IngestionJob.COMPLETED
+    store = routes.vector_store
+    query = MockOpenAIClient().embeddings.create(model='', input=[paper[:300]]).data[0].embedding
+    assert store.search(query, k=3, document_ids=[job['document_id']])
+    assert store.lexical_search("coral reef bleaching", k=3)[0][0]['document_id'] == job['document_id']
+
+    response = client.delete(f"/api/delete-document/{job['document_id']}")
+    assert response.status_code == 200
+    assert not store.search(query, k=3, document_ids=[job['document_id']])
+    assert all(hit['document_id'] == kept['document_id'] for hit, _ in store.search(query, k=5))
+    assert all(hit['document_id'] == kept['document_id'] for hit, _ in store.lexical_search("coral reef", k=5))
+    with app.app_context():
+        assert Document.query.filter_by(document_id=job['document_id']).first() is None
+        assert DocumentChunk.query.filter_by(document_id=job['document_id']).count() == 0
+    listed = [document['document_id'] for document in client.get('/api/documents').get_json()['documents']]
+    assert listed == [kept['document_id']]
+
+    assert client.delete(f"/api/delete-document/{job['document_id']}").status_code == 404
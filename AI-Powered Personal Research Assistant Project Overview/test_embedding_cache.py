@@ -0,0 +1,92 @@
+"""
+Embedding cache test for the AI Research Assistant
+Checks that keys ignore formatting, that vectors are served from memory
+and from disk across instances, that disk hits are not written one by
+one, and that the disk tier is trimmed least recently used first
+"""
+
+import sqlite3
+
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+MODEL = 'text-embedding-ada-002'
+
+
+def vector(i):
+    return [float(i), 1.0, -0.5]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'embedding_cache.db')
+
+
+def last_access(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return dict(conn.execute("SELECT key, last_access FROM embeddings"))
+
+
+def test_keys():
+    assert EmbeddingCache.make_key(MODEL, "Cells  divide.\n") == EmbeddingCache.make_key(MODEL, "Cells divide.")
+    assert EmbeddingCache.make_key(MODEL, "Cells divide.") != EmbeddingCache.make_key('other-model', "Cells divide.")
+
+
+def test_memory_and_disk_tiers(db_path):
+    cache = EmbeddingCache(db_path, max_memory_entries=2)
+    cache.put_many((f'key-{i}', vector(i)) for i in range(3))
+    assert cache.get_many(['key-2', 'key-9']) == {'key-2': vector(2)}
+    assert cache.get('key-0') == vector(0)  # Evicted from memory, found on disk
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['disk_hits']) == (2, 1, 1)
+    assert stats['memory_entries'] == 2 and stats['disk_entries'] == 3
+    cache.close()
+
+    reopened = EmbeddingCache(db_path)
+    assert reopened.stats()['disk_entries'] == 3
+    assert reopened.get('key-1') == vector(1)
+    # Storing a key again replaces it without counting it twice
+    reopened.put('key-1', vector(7))
+    reopened.put_many([('key-3', vector(3)), ('key-3', vector(3))])
+    assert reopened.stats()['disk_entries'] == 4
+    reopened.close()
+    assert EmbeddingCache(db_path).get('key-1') == vector(7)
+
+
+def test_disk_hits_written_in_batches(db_path):
+    cache = EmbeddingCache(db_path, max_memory_entries=1, touch_batch_size=3)
+    cache.put_many((f'key-{i}', vector(i)) for i in range(4))
+    stored = last_access(db_path)
+
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.get('key-0')
+    cache.get('key-1')
+    assert not [s for s in statements if s.startswith('UPDATE')] and last_access(db_path) == stored
+    cache.get('key-2')  # The third hit writes all three access times at once
+    assert len([s for s in statements if s.startswith('UPDATE')]) == 3
+    assert len([s for s in statements if s == 'COMMIT']) == 1
+    touched = last_access(db_path)
+    assert all(touched[f'key-{i}'] > stored[f'key-{i}'] for i in range(3))
+
+    # Puts do not count the table's rows
+    statements.clear()
+    cache.put('key-4', vector(4))
+    assert not [s for s in statements if 'COUNT' in s]
+
+    # Buffered hits are written on close
+    cache.get('key-3')
+    cache.close()
+    assert last_access(db_path)['key-3'] > stored['key-3']
+
+
+def test_disk_eviction_least_recently_used(db_path):
+    cache = EmbeddingCache(db_path, max_memory_entries=1, max_disk_entries=3)
+    cache.put_many((f'key-{i}', vector(i)) for i in range(3))
+    # A buffered hit on the oldest key still keeps it
+    cache.get('key-0')
+    cache.put('key-3', vector(3))
+    assert set(last_access(db_path)) == {'key-0', 'key-2', 'key-3'}
+    assert cache.stats()['disk_entries'] == 3 and cache.stats()['disk_evictions'] == 1
+    cache.close()
@@ -0,0 +1,112 @@
+"""
+Embedding storage test for the AI Research Assistant
+Checks that embeddings round-trip through each binary format within its
+precision, that the bulk loader returns them as one matrix in document
+and chunk order, and that migrate_embeddings upgrades a database of JSON
+embeddings, including one created before the blob columns existed
+"""
+
+import json
+
+import numpy as np
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from document import (Document, DocumentChunk, EMBEDDING_FORMATS, db, decode_embedding, encode_embedding,
+                      migrate_embeddings)
+
+DIMENSION = 32
+# Largest error per component relative to the vector's largest component
+TOLERANCE = {'float32': 0.0, 'float16': 1e-3, 'int8': 1 / 127}
+
+rng = np.random.default_rng(3)
+VECTORS = rng.standard_normal((12, DIMENSION)).astype(np.float32)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'app.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        yield app
+
+
+def add_chunks(embedding_format):
+    """Three documents of four chunks, stored in reverse order; None stores legacy JSON"""
+    for d in range(3):
+        db.session.add(Document(document_id=f'doc-{d}', filename=f'doc-{d}.txt', content='', file_type='txt'))
+    for i in reversed(range(len(VECTORS))):
+        chunk = DocumentChunk(document_id=f'doc-{i // 4}', chunk_index=i % 4, text=f'chunk {i}')
+        if embedding_format is None:
+            chunk.embedding = json.dumps(VECTORS[i].tolist())
+        else:
+            chunk.set_embedding(VECTORS[i], embedding_format)
+        db.session.add(chunk)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('embedding_format', EMBEDDING_FORMATS)
+def test_round_trip(embedding_format):
+    for vector in VECTORS:
+        blob = encode_embedding(vector, embedding_format)
+        decoded = decode_embedding(blob, embedding_format)
+        assert decoded.dtype == np.float32 and decoded.shape == (DIMENSION,)
+        assert np.abs(decoded - vector).max() <= TOLERANCE[embedding_format] * np.abs(vector).max() + 1e-7
+    assert len(encode_embedding(VECTORS[0], 'float16')) == DIMENSION * 2
+    assert len(encode_embedding(VECTORS[0], 'int8')) == DIMENSION + 4
+    assert not decode_embedding(encode_embedding(np.zeros(DIMENSION), 'int8'), 'int8').any()
+
+    with pytest.raises(ValueError):
+        encode_embedding(VECTORS[0], 'bfloat16')
+    with pytest.raises(ValueError):
+        decode_embedding(b'', 'bfloat16')
+
+
+@pytest.mark.parametrize('embedding_format', EMBEDDING_FORMATS + (None,))
+def test_bulk_load(app, embedding_format):
+    db.create_all()
+    add_chunks(embedding_format)
+    atol = TOLERANCE[embedding_format or 'float32'] * np.abs(VECTORS).max()
+    keys, matrix = DocumentChunk.load_embeddings()
+    assert keys == [(f'doc-{i // 4}', i % 4) for i in range(len(VECTORS))]
+    assert matrix.dtype == np.float32 and matrix.shape == VECTORS.shape
+    assert np.allclose(matrix, VECTORS, atol=atol)
+
+    keys, matrix = DocumentChunk.load_embeddings(['doc-2', 'doc-0', 'missing'], batch_size=1)
+    assert keys == [(f'doc-{d}', i) for d in (0, 2) for i in range(4)]
+    assert np.allclose(matrix[4:], VECTORS[8:], atol=atol)
+
+
+def test_migrate_json_embeddings(app):
+    db.create_all()
+    add_chunks(None)
+    legacy = DocumentChunk.query.first()
+    assert legacy.get_embedding() == json.loads(legacy.embedding)
+    assert migrate_embeddings('float16', batch_size=5) == len(VECTORS)
+    chunks = DocumentChunk.query.all()
+    assert all(chunk.embedding is None and chunk.embedding_format == 'float16' for chunk in chunks)
+    for chunk in chunks:
+        index = chunk.chunk_index + 4 * int(chunk.document_id.split('-')[1])
+        assert np.allclose(chunk.get_embedding_array(), VECTORS[index], atol=1e-2)
+        assert isinstance(chunk.get_embedding(), list) and chunk.get_embedding() == chunk.get_embedding_array().tolist()
+    assert migrate_embeddings() == 0, "A second run should find nothing to convert"
+
+
+def test_migrate_database_without_blob_columns(app):
+    Document.__table__.create(db.engine)
+    with db.engine.begin() as connection:
+        connection.execute(text("CREATE TABLE document_chunks (id INTEGER PRIMARY KEY, document_id VARCHAR(36), "
+                                "chunk_index INTEGER, text TEXT, page_number INTEGER, embedding TEXT)"))
+        connection.execute(text("INSERT INTO document_chunks (document_id, chunk_index, text, embedding) "
+                                "VALUES ('doc-0', 0, 'chunk 0', :embedding)"),
+                           {'embedding': json.dumps(VECTORS[0].tolist())})
+
+    assert migrate_embeddings() == 1
+    with db.engine.connect() as connection:
+        row = connection.execute(text("SELECT embedding, embedding_blob, embedding_format "
+                                      "FROM document_chunks")).one()
+    assert row.embedding is None and row.embedding_format == 'float32'
+    assert np.array_equal(decode_embedding(row.embedding_blob), VECTORS[0])
@@ -0,0 +1,74 @@
+"""
+Filtered search test for the AI Research Assistant
+Checks that searches restricted to a few documents return a full k hits
+from those documents, the ones an exact search over them finds, even
+when the rest of the corpus is far closer to the query, on the flat, IVF
+and HNSW backends and on both the exact and the in-index filter paths
+"""
+
+import numpy as np
+import pytest
+
+from document_processor import VectorStore
+from synthetic_data import matryoshka_vectors
+
+DIMENSION = 64
+NUM_VECTORS = 3000
+CHUNKS_PER_DOCUMENT = 20
+K = 10
+
+VECTORS = matryoshka_vectors(NUM_VECTORS, DIMENSION)
+QUERIES = matryoshka_vectors(20, DIMENSION, seed=1)
+SELECTED = ['doc-7', 'doc-42', 'doc-140']
+
+
+def chunk(i):
+    return {'document_id': f'doc-{i // CHUNKS_PER_DOCUMENT}', 'chunk_index': i % CHUNKS_PER_DOCUMENT,
+            'text': f'chunk {i}'}
+
+
+def exact_hits(query, document_ids, k=K):
+    rows = [i for i in range(NUM_VECTORS) if chunk(i)['document_id'] in document_ids]
+    scores = VECTORS[rows] @ query
+    return [rows[j] for j in np.argsort(-scores)[:k]]
+
+
+def hit_ids(row):
+    return [int(c['text'].split()[1]) for c, _ in row]
+
+
+@pytest.mark.parametrize('index_type, options', [
+    ('flat', {}),
+    ('ivf_flat', {'nlist': 32, 'nprobe': 16}),
+    ('hnsw', {'hnsw_m': 16, 'ef_search': 64}),
+])
+@pytest.mark.parametrize('exact_filter_limit', [2000, 0], ids=['exact', 'in-index'])
+def test_full_k_from_selected_documents(wait_for_maintenance, index_type, options, exact_filter_limit):
+    store = VectorStore(dimension=DIMENSION, index_type=index_type, promote_threshold=0,
+                        exact_filter_limit=exact_filter_limit, collapse_similarity=None, **options)
+    store.add_embeddings(VECTORS, [chunk(i) for i in range(NUM_VECTORS)])
+    wait_for_maintenance(store)
+    assert store.active_index_type == index_type
+
+    results = store.search_batch(QUERIES, K, SELECTED)
+    overlap = []
+    for query, row in zip(QUERIES, results):
+        assert len(row) == K, "Filtered searches should return k hits when the documents hold enough"
+        assert all(c['document_id'] in SELECTED for c, _ in row)
+        overlap.append(len(set(hit_ids(row)) & set(exact_hits(query, SELECTED))) / K)
+    if index_type == 'flat' or exact_filter_limit:
+        assert min(overlap) == 1.0, "Small filters should be scored exactly"
+    else:
+        # Two percent of the corpus is past where an in-index filter is
+        # meant to be used, so only a rough match is expected
+        assert np.mean(overlap) >= 0.6
+
+
+def test_small_and_missing_documents():
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    store.add_embeddings(VECTORS[:100], [chunk(i) for i in range(100)])
+    # A document with fewer than k chunks returns all of them
+    row = store.search(QUERIES[0], k=50, document_ids=['doc-2'])
+    assert sorted(hit_ids(row)) == list(range(40, 60))
+    assert hit_ids(store.search(QUERIES[0], k=5, document_ids=['doc-2'])) == exact_hits(QUERIES[0], ['doc-2'], 5)
+    assert store.search(QUERIES[0], k=5, document_ids=['missing']) == []
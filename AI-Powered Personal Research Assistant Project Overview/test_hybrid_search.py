@@ -0,0 +1,130 @@
+"""
+Hybrid retrieval test for the AI Research Assistant
+Indexes chunks mentioning identifiers that embeddings do not capture and
+checks that lexical and hybrid search find them, that the BM25 index
+follows document removal, duplicate handover, the write-ahead log and
+checkpoints, and that RAGService retrieves with each mode, by embedding
+unless asked otherwise, reporting fused scores apart from similarities
+"""
+
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient, mock_embedding
+from rag_service import RAGService
+from vector_persistence import manifest_path
+
+DIMENSION = 64
+random.seed(11)
+VOCABULARY = [f"term{i}" for i in range(3000)]
+IDENTIFIERS = {'brca': 'BRCA1', 'cytokine': 'IL-6', 'glucose': 'C6H12O6'}
+
+
+def sentence(extra=None):
+    words = [random.choice(VOCABULARY) for _ in range(30)]
+    if extra:
+        words.insert(random.randrange(len(words)), extra)
+    return " ".join(words) + "."
+
+
+def add_document(store, document_id, texts):
+    store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                         [{'document_id': document_id, 'filename': f'{document_id}.txt',
+                           'chunk_index': i, 'text': text} for i, text in enumerate(texts)])
+
+
+def top_documents(hits):
+    return [hit['document_id'] for hit, _ in hits]
+
+
+@pytest.fixture
+def store():
+    store = VectorStore(dimension=DIMENSION)
+    for d in range(20):
+        add_document(store, f'doc-{d}', [sentence() for _ in range(10)])
+    for document_id, identifier in IDENTIFIERS.items():
+        add_document(store, document_id, [sentence() for _ in range(4)] + [sentence(identifier)])
+    return store
+
+
+def test_identifiers_found(store):
+    query = "Which variants of BRCA1 were reported?"
+    query_embedding = mock_embedding(query, DIMENSION)
+    assert top_documents(store.lexical_search(query, k=5))[:1] == ['brca']
+    assert 'brca' in top_documents(store.hybrid_search(query, query_embedding, k=5))
+    # Hyphenated and formula identifiers match regardless of case
+    assert top_documents(store.lexical_search("IL-6", k=3))[:1] == ['cytokine']
+    assert top_documents(store.lexical_search("c6h12o6", k=3))[:1] == ['glucose']
+    assert not store.lexical_search("BRCA1", k=3, document_ids=['doc-1', 'cytokine'])
+
+
+def test_lexical_index_persistence(store, tmp_path):
+    # A duplicate of the BRCA1 chunk keeps it findable once the original is removed
+    brca_chunk = store.lexical_search("BRCA1", k=1)[0][0]
+    store.link_duplicates([('brca', brca_chunk['chunk_index'])],
+                          [dict(brca_chunk, document_id='brca-copy', filename='brca-copy.txt')])
+    store.remove_document('brca')
+    store.remove_document('cytokine')
+    assert top_documents(store.lexical_search("BRCA1", k=3)) == ['brca-copy']
+    assert not store.lexical_search("IL-6", k=3)
+
+    path = str(tmp_path / 'vector_store')
+    store.save_to_file(path)
+    add_document(store, 'late', [sentence('TP53')])
+    store.remove_document('glucose')
+    store.save_to_file(path)  # Appended to the write-ahead log
+
+    expected = {q: top_documents(store.lexical_search(q, k=5)) for q in ('BRCA1', 'TP53', 'C6H12O6', 'term7')}
+    for stage in ('log replayed', 'checkpointed', 'rebuilt from chunks'):
+        if stage == 'checkpointed':
+            store.checkpoint()
+            assert any(f.endswith('.lexical') for f in os.listdir(tmp_path))
+        if stage == 'rebuilt from chunks':
+            # A store checkpointed before the lexical index existed
+            with open(manifest_path(path)) as f:
+                manifest = json.load(f)
+            manifest.pop('lexical')
+            with open(manifest_path(path), 'w') as f:
+                json.dump(manifest, f)
+        loaded = VectorStore(dimension=DIMENSION)
+        loaded.load_from_file(path)
+        assert {q: top_documents(loaded.lexical_search(q, k=5)) for q in expected} == expected, stage
+        assert len(loaded.lexical_index) == len(store.lexical_index), stage
+
+
+def test_retrieval_modes(store):
+    add_document(store, 'late', [sentence('TP53')])
+    client = MockOpenAIClient(dimension=DIMENSION)
+    rag = RAGService(store, openai_client=client)
+
+    result = rag.chat_with_documents("What is known about TP53?", k=3, retrieval_mode='lexical')
+    assert client.embeddings.calls == 0, "Lexical retrieval should not embed the query"
+    assert result['citations'][0]['document_id'] == 'late'
+
+    query = "What is known about TP53?"
+    result = rag.chat_with_documents(query, k=3)
+    assert client.embeddings.calls == 1
+    vector_hits = store.search(mock_embedding(query, DIMENSION), k=3)
+    assert [c['document_id'] for c in result['citations']] == top_documents(vector_hits)
+    assert all('fusion_score' not in c for c in result['citations'])
+
+    result = rag.chat_with_documents(query, k=3, retrieval_mode='hybrid')
+    assert 'late' in [c['document_id'] for c in result['citations']]
+    assert all(0 < c['fusion_score'] <= 2 / 61 and c['similarity_score'] != c['fusion_score']
+               for c in result['citations'])
+    # Hybrid hits keep cosine similarities, as vector search reports them, lexical-only hits included
+    query_vector = np.array(mock_embedding(query, DIMENSION))
+    query_vector /= np.linalg.norm(query_vector)
+    for hit, score in store.hybrid_search(query, mock_embedding(query, DIMENSION), k=10):
+        vector = np.array(mock_embedding(hit['text'], DIMENSION))
+        assert score == pytest.approx(query_vector @ vector / np.linalg.norm(vector), abs=1e-5)
+    assert RAGService(store, openai_client=client, retrieval_mode='hybrid').chat_with_documents(
+        query, k=3)['citations'] == result['citations']
+
+    with pytest.raises(ValueError):
+        rag.chat_with_documents("TP53", retrieval_mode='keyword')
@@ -0,0 +1,124 @@
+"""
+Background ingestion test for the AI Research Assistant
+Uploads documents through the API, polls /jobs until they are indexed,
+and checks that jobs left pending by a restart are resumed, and that jobs
+running in another live process are not taken over
+"""
+
+import io
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from mock_openai import MockOpenAIClient
+from document import Document, DocumentChunk, IngestionJob, db
+from ingestion_queue import IngestionQueue
+
+DOCUMENT_TEXT = " ".join(f"Sentence {i} explains why background ingestion keeps uploads fast." for i in range(300))
+# Different text, so the upload is not deduplicated against the resumed job
+PENDING_TEXT = " ".join(f"Paragraph {i} was queued before the server restarted." for i in range(100))
+
+
+def test_ingestion_queue(app, client, routes, wait_for_job):
+    # Slow embeddings make the upload/ingestion split observable
+    routes.document_processor.openai_client = MockOpenAIClient(embedding_latency=0.2)
+    routes.document_processor.max_batch_size = 4
+    routes.document_processor.max_concurrency = 1
+
+    # Simulate a job queued by a process that stopped before handling it
+    with app.app_context():
+        routes.ensure_upload_folder()
+        pending_path = os.path.abspath(os.path.join('uploads', 'pending.txt'))
+        with open(pending_path, 'w') as f:
+            f.write(PENDING_TEXT)
+        db.session.add(IngestionJob(job_id='pending-job', document_id='pending-document',
+                                    filename='pending.txt', file_type='txt', file_path=pending_path))
+        db.session.commit()
+
+    routes.start_ingestion_queue(app)
+
+    response = client.post('/api/upload-document', data={
+        'file': (io.BytesIO(DOCUMENT_TEXT.encode('utf-8')), 'notes.txt')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()['job_id']
+
+    seen_progress = set()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        seen_progress.add((job['stage'], job['chunks_embedded']))
+        if job['status'] in (IngestionJob.COMPLETED, IngestionJob.FAILED):
+            break
+        time.sleep(0.02)
+
+    assert job['status'] == IngestionJob.COMPLETED, job
+    assert job['chunks_embedded'] == job['chunks_total']
+    assert any(stage == 'embedding' and 0 < done < job['chunks_total'] for stage, done in seen_progress), \
+        "No intermediate embedding progress was reported"
+
+    pending = wait_for_job('pending-job')
+    assert pending['status'] == IngestionJob.COMPLETED, "The job pending from before the restart was not resumed"
+
+    bad = client.post('/api/upload-document', data={
+        'file': (io.BytesIO(b'\xff\xfe not utf-8'), 'broken.txt')
+    }, content_type='multipart/form-data').get_json()
+    failed = wait_for_job(bad['job_id'])
+    assert failed['status'] == IngestionJob.FAILED and failed['error']
+
+    with app.app_context():
+        documents = {document.document_id for document in Document.query.all()}
+        chunks = DocumentChunk.query.filter_by(document_id=job['document_id']).count()
+        content = Document.query.filter_by(document_id=job['document_id']).first().content
+    results = routes.vector_store.search(
+        MockOpenAIClient().embeddings.create(model='', input=[DOCUMENT_TEXT[:1000]]).data[0].embedding,
+        k=3, document_ids=[job['document_id']])
+    assert documents == {job['document_id'], 'pending-document'}
+    assert chunks == job['chunks_total'] and results
+    assert content == DOCUMENT_TEXT, "Stored document content differs from the upload"
+    assert not os.listdir('uploads'), "Uploads were not cleaned up"
+
+
+def test_running_jobs_taken_over_only_after_lease_expires(app):
+    handled = []
+    lock = threading.Lock()
+
+    def handler(job):
+        with lock:
+            handled.append(job.job_id)
+        time.sleep(0.5)  # Longer than the lease, which the heartbeat keeps renewing
+
+    now = datetime.utcnow()
+    with app.app_context():
+        for job_id, owner, lease_expires_at in (('live-job', 'live-process', now + timedelta(hours=1)),
+                                                ('dead-job', 'dead-process', now - timedelta(seconds=1))):
+            db.session.add(IngestionJob(job_id=job_id, document_id=job_id, filename=f'{job_id}.txt', file_type='txt',
+                                        file_path=f'{job_id}.txt', status=IngestionJob.RUNNING, owner=owner,
+                                        lease_expires_at=lease_expires_at))
+        db.session.commit()
+
+    first = IngestionQueue(app, handler, num_workers=1, lease_seconds=0.3)
+    second = IngestionQueue(app, handler, num_workers=1, lease_seconds=0.3)
+    assert first.start() == 1, "Only the job whose owner stopped renewing its lease should be recovered"
+    second.start()
+    try:
+        time.sleep(1.0)
+        assert handled == ['dead-job'], "A job was run twice or the live process's job was taken over"
+
+        # The live process dies
+        with app.app_context():
+            IngestionJob.report('live-job', lease_expires_at=datetime.utcnow())
+        deadline = time.time() + 5
+        while time.time() < deadline and len(handled) < 2:
+            time.sleep(0.05)
+        time.sleep(0.5)
+        assert sorted(handled) == ['dead-job', 'live-job']
+    finally:
+        first.stop()
+        second.stop()
+
+    with app.app_context():
+        jobs = {job.job_id: job for job in IngestionJob.query.all()}
+    assert all(job.status == IngestionJob.COMPLETED for job in jobs.values())
+    assert {jobs['dead-job'].owner, jobs['live-job'].owner} <= {first.owner, second.owner}
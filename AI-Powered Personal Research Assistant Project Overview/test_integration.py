@@ -4,12 +4,14 @@ Integration test for the AI Research Assistant
 Tests the core RAG functionality without the web interface
 """
 
-import sys
 import os
-sys.path.insert(0, '/home/ubuntu/research-assistant-backend')
 
-from src.services.document_processor import DocumentProcessor, VectorStore
-from src.services.rag_service import RAGService
+import pytest
+
+from document_processor import DocumentProcessor, VectorStore
+from rag_service import RAGService
+
+pytestmark = pytest.mark.live_openai
 
 def test_document_processing():
     """Test document processing and RAG functionality"""
@@ -22,7 +24,7 @@ def test_document_processing():
     
     # Test document processing
     print("\n📄 Testing document processing...")
-    test_file = "/home/ubuntu/test_document.txt"
+    test_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_document.txt')
     
     try:
         # Extract text
@@ -74,13 +76,10 @@ def test_document_processing():
                 print(f"❌ RAG Error: {str(e)}")
         
         print("\n🎉 Integration test completed successfully!")
-        return True
-        
     except Exception as e:
         print(f"❌ Integration test failed: {str(e)}")
-        return False
+        raise
 
 if __name__ == "__main__":
-    success = test_document_processing()
-    sys.exit(0 if success else 1)
+    test_document_processing()
 
@@ -8,9 +8,8 @@ import sys
 import os
 import json
 import numpy as np
-sys.path.insert(0, '/home/ubuntu/research-assistant-backend')
 
-from src.services.document_processor import DocumentProcessor, VectorStore
+from document_processor import DocumentProcessor, VectorStore
 
 class MockRAGService:
     """Mock RAG service for testing without OpenAI API"""
@@ -70,7 +69,7 @@ def test_mock_integration():
     
     # Test document processing
     print("\n📄 Testing document processing...")
-    test_file = "/home/ubuntu/test_document.txt"
+    test_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_document.txt')
     
     try:
         # Extract text
@@ -141,15 +140,12 @@ def test_mock_integration():
         print(f"   • Similarity search: ✅ Working")
         print(f"   • RAG chat: ✅ Working (mock)")
         
-        return True
-        
     except Exception as e:
         print(f"❌ Mock integration test failed: {str(e)}")
         import traceback
         traceback.print_exc()
-        return False
+        raise
 
 if __name__ == "__main__":
-    success = test_mock_integration()
-    sys.exit(0 if success else 1)
+    test_mock_integration()
 
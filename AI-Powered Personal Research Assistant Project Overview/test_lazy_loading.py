@@ -0,0 +1,109 @@
+"""
+Lazy loading test for the AI Research Assistant
+Checks that a store loaded with mmap_index maps its checkpoint index and
+chunk metadata instead of reading them, decoding only the chunks a search
+returns, that it serves the same results as a fully loaded store through
+adds, deletions and checkpoints, and that chunk store lookups work
+"""
+
+import pytest
+
+from chunk_store import ChunkStore, is_chunk_store, write_chunk_store
+from document_processor import VectorStore
+from mock_openai import mock_embedding
+
+DIMENSION = 64
+DOCUMENTS = 50
+CHUNKS_PER_DOCUMENT = 10
+
+
+def chunks_of(document_id):
+    return [{'document_id': document_id, 'chunk_index': i, 'text': f"Chunk {i} of {document_id}"}
+            for i in range(CHUNKS_PER_DOCUMENT)]
+
+
+def add_document(store, document_id):
+    chunks = chunks_of(document_id)
+    store.add_embeddings([mock_embedding(chunk['text'], DIMENSION) for chunk in chunks], chunks)
+
+
+def query(text):
+    return mock_embedding(text, DIMENSION)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    for d in range(DOCUMENTS):
+        add_document(store, f'doc-{d}')
+    store.save_to_file(path)
+    return path
+
+
+def test_mapped_store_decodes_only_hits(path, monkeypatch):
+    decoded = []
+    decode = ChunkStore._decode
+
+    def counting_decode(self, *args):
+        decoded.append(args)
+        return decode(self, *args)
+
+    monkeypatch.setattr(ChunkStore, '_decode', counting_decode)
+
+    store = VectorStore(dimension=DIMENSION, mmap_index=True, collapse_similarity=None)
+    store.load_from_file(path)
+    assert not decoded, "Loading decoded chunk metadata"
+    assert store.base_index is not None and store.base_index.ntotal == DOCUMENTS * CHUNKS_PER_DOCUMENT
+    assert store.index.ntotal == 0 and not store.chunk_metadata.added
+    assert len(store.chunk_metadata) == DOCUMENTS * CHUNKS_PER_DOCUMENT
+
+    hits = store.search(query("Chunk 3 of doc-17"), k=5)
+    assert hits[0][0]['text'] == "Chunk 3 of doc-17"
+    assert len(decoded) == 5, "Only the hits should be decoded"
+
+
+def test_mapped_store_matches_loaded_store(path, wait_for_maintenance):
+    mapped = VectorStore(dimension=DIMENSION, mmap_index=True, collapse_similarity=None)
+    mapped.load_from_file(path)
+    loaded = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    loaded.load_from_file(path)
+    queries = [query(f"Chunk {i % CHUNKS_PER_DOCUMENT} of doc-{i}") for i in range(0, DOCUMENTS, 7)]
+    assert mapped.search_batch(queries, 5) == loaded.search_batch(queries, 5)
+
+    # New vectors go to the in-memory delta, removals of mapped ones are tombstoned
+    for store in (mapped, loaded):
+        add_document(store, 'new')
+        store.remove_document('doc-7')
+    assert mapped.index.ntotal == CHUNKS_PER_DOCUMENT
+    assert mapped.search_batch(queries, 5) == loaded.search_batch(queries, 5)
+    assert mapped.search(query("Chunk 0 of new"), k=1)[0][0]['document_id'] == 'new'
+    assert not mapped.search(query("Chunk 0 of doc-7"), k=3, document_ids=['doc-7'])
+
+    # A checkpoint merges the delta into a new mapped index
+    mapped.save_to_file(path)
+    mapped.checkpoint()
+    wait_for_maintenance(mapped)
+    assert mapped.index.ntotal == 0 and mapped.base_index.ntotal >= DOCUMENTS * CHUNKS_PER_DOCUMENT
+    assert mapped.search_batch(queries, 5) == loaded.search_batch(queries, 5)
+    reloaded = VectorStore(dimension=DIMENSION, mmap_index=True, collapse_similarity=None)
+    reloaded.load_from_file(path)
+    assert reloaded.search_batch(queries, 5) == loaded.search_batch(queries, 5)
+    assert reloaded.search(query("Chunk 0 of new"), k=1)[0][0]['document_id'] == 'new'
+
+
+def test_chunk_store_lookups(tmp_path):
+    path = str(tmp_path / 'chunks')
+    chunks = list(zip(range(0, 40, 2), chunks_of('a') + chunks_of('b')))
+    write_chunk_store(path, chunks, info={'next_id': 40})
+    assert is_chunk_store(path)
+    (tmp_path / 'notes.json').write_text('{"chunks": {}}')
+    assert not is_chunk_store(str(tmp_path / 'notes.json'))
+
+    store = ChunkStore(path)
+    assert len(store) == 20 and store.info == {'next_id': 40}
+    assert store.get(6) == chunks[3][1] and 6 in store
+    assert store.get(7) is None and 7 not in store and store.get(100) is None
+    assert list(store.items()) == chunks
+    assert {document_id: ids.tolist() for document_id, ids in store.document_vectors().items()} == \
+        {'a': list(range(0, 20, 2)), 'b': list(range(20, 40, 2))}
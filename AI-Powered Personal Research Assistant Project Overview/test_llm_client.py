@@ -0,0 +1,199 @@
+"""
+Shared LLM client test for the AI Research Assistant
+Runs LLMClient against the local fake OpenAI server and checks rate
+limiting, keep-alive connection reuse, retries of 429s and server errors,
+adaptive concurrency, coalescing of identical requests and streaming,
+and the async client under the same limits
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import pytest
+from fake_openai_server import FakeOpenAIServer
+from llm_client import AdaptiveConcurrencyLimiter, AsyncLLMClient, LLMClient, TokenBucket
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def shared_client(server, **kwargs):
+    return LLMClient(openai.OpenAI(base_url=server.url, api_key='test-key', max_retries=0), **kwargs)
+
+
+def embed(client, text):
+    return client.embeddings.create(model=EMBEDDING_MODEL, input=[text])
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate_per_minute=1200, capacity=5)
+    start = time.perf_counter()
+    for _ in range(25):
+        bucket.acquire()
+    # 20 a second with a burst of 5
+    assert 0.9 <= time.perf_counter() - start < 2.0
+
+
+class FakeClock:
+    """Clock and sleep of a TokenBucket, advancing only when it sleeps"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_charges_large_requests():
+    clock = FakeClock()
+    # 600 tokens a minute, so a capacity of 10
+    bucket = TokenBucket(rate_per_minute=600, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(50) == 0, "A request larger than capacity should go ahead from a full bucket"
+    # ...and be charged in full: the next waits out the 40 tokens of debt plus its own 10
+    assert bucket.acquire(10) == pytest.approx(5.0)
+
+    clock.now = 0.0
+    bucket = TokenBucket(rate_per_minute=600, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire(50)
+    # At 10 tokens a second, each request after the first waits for its 50
+    assert clock.now == pytest.approx(9 * 5.0)
+
+
+def test_adaptive_concurrency():
+    limiter = AdaptiveConcurrencyLimiter(max_concurrency=8)
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == 4, "The concurrency limit should halve on overload"
+    for _ in range(4 + 5 + 6 + 7):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 8, "The concurrency limit should grow back"
+
+
+@pytest.fixture
+def rate_limited_server():
+    server = FakeOpenAIServer(requests_per_second=20, latency=0.02).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def flaky_server():
+    server = FakeOpenAIServer(latency=0.2, error_every=4).start()
+    yield server
+    server.stop()
+
+
+def test_rate_limit(rate_limited_server):
+    server = rate_limited_server
+    client = shared_client(server, requests_per_minute=20 * 60 * 0.8, max_concurrency=8)
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(lambda i: embed(client, f"text {i}"), range(80)))
+    stats = client.stats()
+    assert len(results) == 80 and not stats['failures']
+    assert server.rate_limited <= 8, "Requests should be paced under the server's limit"
+    assert server.connections <= 8 and server.max_in_flight <= 8, \
+        "At most max_concurrency keep-alive connections should be used"
+
+    # A client that does not know the limit recovers from the 429s
+    unaware = shared_client(server, requests_per_minute=100000, max_concurrency=16, base_delay=0.05)
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(lambda i: embed(unaware, f"burst {i}"), range(60)))
+    stats = unaware.stats()
+    assert len(results) == 60 and not stats['failures'] and stats['rate_limited']
+    assert stats['concurrency_limit'] < 16, "429s should lower the concurrency limit"
+
+
+def test_coalescing(flaky_server):
+    client = shared_client(flaky_server, base_delay=0.01)
+    barrier = threading.Barrier(20)
+
+    def ask(_):
+        barrier.wait()
+        return client.chat.completions.create(model="gpt-4", max_tokens=50,
+                                              messages=[{"role": "user", "content": "Same question"}])
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        answers = {r.choices[0].message.content for r in executor.map(ask, range(20))}
+    assert len(answers) == 1 and flaky_server.requests <= 2
+    assert client.stats()['coalesced'] >= 18, "Identical requests in flight should share one response"
+
+
+def test_retries_and_streams(flaky_server):
+    client = shared_client(flaky_server, base_delay=0.01)
+    results = [embed(client, f"flaky {i}") for i in range(12)]
+    assert len(results) == 12 and client.stats()['retries'] >= 2 and not client.stats()['failures']
+
+    # A stream holds its slot until it is read or closed
+    stream = client.chat.completions.create(model="gpt-4", stream=True,
+                                            messages=[{"role": "user", "content": "Stream this"}])
+    assert client.limiter.in_flight == 1
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+    unread = client.chat.completions.create(model="gpt-4", stream=True,
+                                            messages=[{"role": "user", "content": "Never read"}])
+    unread.close()
+    assert client.limiter.in_flight == 0 and "Stream this" in text
+
+
+def test_client_errors_not_retried():
+    class Rejecting:
+        class BadRequest(Exception):
+            status_code = 400
+
+        def __init__(self):
+            self.calls = 0
+            self.embeddings = self
+
+        def create(self, **kwargs):
+            self.calls += 1
+            raise self.BadRequest("Invalid input")
+
+    rejecting = Rejecting()
+    with pytest.raises(Rejecting.BadRequest):
+        embed(LLMClient(rejecting), "bad")
+    assert rejecting.calls == 1
+
+
+def test_async_client():
+    server = FakeOpenAIServer(requests_per_second=20, latency=0.05).start()
+    try:
+        shared = shared_client(server, requests_per_minute=20 * 60 * 0.8, max_concurrency=8)
+        client = AsyncLLMClient(shared, openai.AsyncOpenAI(base_url=server.url, api_key='test-key', max_retries=0))
+
+        async def run():
+            texts = [f"async {i}" for i in range(40)] + ["same"] * 10
+            return await asyncio.gather(*(client.embeddings.create(model=EMBEDDING_MODEL, input=[text])
+                                          for text in texts))
+        results = asyncio.run(run())
+        stats = shared.stats()
+        # Paced under the shared limits, and identical requests share one response
+        assert len(results) == 50 and not stats['failures']
+        assert server.rate_limited <= 8 and server.max_in_flight <= 8
+        assert stats['coalesced'] >= 9 and results[-1].data[0].embedding == results[-2].data[0].embedding
+    finally:
+        server.stop()
+
+
+def test_cancelled_async_calls_release_slots():
+    server = FakeOpenAIServer(latency=0.5).start()
+    try:
+        shared = shared_client(server, max_concurrency=4)
+        client = AsyncLLMClient(shared, openai.AsyncOpenAI(base_url=server.url, api_key='test-key', max_retries=0))
+
+        async def run():
+            calls = [asyncio.wait_for(client.embeddings.create(model=EMBEDDING_MODEL, input=[f"cancelled {i}"]), 0.1)
+                     for i in range(4)]
+            outcomes = await asyncio.gather(*calls, return_exceptions=True)
+            assert all(isinstance(outcome, asyncio.TimeoutError) for outcome in outcomes)
+            assert shared.limiter.in_flight == 0, "Cancelled calls kept their slots"
+            # Every slot was taken by a cancelled call; a new one must still get through
+            return await asyncio.wait_for(client.embeddings.create(model=EMBEDDING_MODEL, input=["after"]), 2)
+        assert asyncio.run(run()).data
+        assert shared.limiter.limit == 4 and not shared.stats()['failures']
+    finally:
+        server.stop()
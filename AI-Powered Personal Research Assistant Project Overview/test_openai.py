@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import openai
 import os
+import pytest
+
+pytestmark = pytest.mark.live_openai
 
 def test_openai_connection():
     """Test OpenAI API connection"""
@@ -24,11 +27,9 @@ def test_openai_connection():
         )
         print(f"✅ Chat API working. Response: {response.choices[0].message.content}")
         
-        return True
-        
     except Exception as e:
         print(f"❌ OpenAI API Error: {str(e)}")
-        return False
+        raise
 
 if __name__ == "__main__":
     test_openai_connection()
@@ -0,0 +1,74 @@
+"""
+PDF page number test for the AI Research Assistant
+Checks that PDFs are extracted one span per page, serially and by the
+process pool alike, that each chunk is attributed to the page it starts
+on, and that uploaded PDFs keep page numbers through the database, the
+vector store and the citations and context of chat answers
+"""
+
+import re
+
+import pytest
+
+from benchmark_pdf_extraction import generate_pdf, page_lines
+from document import DocumentChunk, IngestionJob
+from document_processor import DocumentProcessor
+from mock_openai import MockOpenAIClient
+
+NUM_PAGES = 12
+
+
+def first_page_in(chunk):
+    return int(re.search(r"Page (\d+) line", chunk).group(1))
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = str(tmp_path / 'paper.pdf')
+    generate_pdf(path, NUM_PAGES)
+    return path
+
+
+@pytest.mark.parametrize('options', [{}, {'parallel_pdf_pages': 4, 'pdf_workers': 2}], ids=['serial', 'parallel'])
+def test_pages_extracted_in_order(pdf_path, options):
+    processor = DocumentProcessor(openai_client=MockOpenAIClient(dimension=8), **options)
+    pages = processor.extract_pages_from_file(pdf_path, 'pdf')
+    assert [page_number for page_number, _ in pages] == list(range(1, NUM_PAGES + 1))
+    for page_number, text in pages:
+        assert all(line in text for line in page_lines(page_number)[:3])
+        assert f"Page {page_number + 1} line" not in text
+
+    # Streamed and whole-text extraction agree, pages separated by newlines
+    text = processor.extract_text_from_file(pdf_path, 'pdf')
+    assert text == "\n".join(text for _, text in pages)
+    assert [page_number for page_number, _ in processor.iter_text_from_file(pdf_path, 'pdf')] == \
+        list(range(1, NUM_PAGES + 1))
+
+
+def test_chunks_attributed_to_starting_page(pdf_path):
+    processor = DocumentProcessor(openai_client=MockOpenAIClient(dimension=8))
+    chunks = processor.chunk_pages(processor.extract_pages_from_file(pdf_path, 'pdf'))
+    assert len(chunks) > NUM_PAGES
+    assert all(page_number == first_page_in(chunk) for page_number, chunk in chunks)
+    assert [chunk for _, chunk in chunks] == processor.chunk_text(processor.extract_text_from_file(pdf_path, 'pdf'))
+
+
+def test_uploaded_pdf_cites_pages(app, client, routes, ingestion, upload, pdf_path):
+    with open(pdf_path, 'rb') as f:
+        job = upload(f.read(), 'paper.pdf')
+    assert job['status'] == IngestionJob.COMPLETED, job['error']
+    with app.app_context():
+        chunks = DocumentChunk.query.filter_by(document_id=job['document_id']).all()
+    assert chunks and all(chunk.page_number == first_page_in(chunk.text) for chunk in chunks)
+    assert {chunk.page_number for chunk in chunks} == set(range(1, NUM_PAGES + 1))
+    stored = [chunk for _, chunk in routes.vector_store.chunk_metadata.items()]
+    assert all(chunk['page_number'] == first_page_in(chunk['text']) for chunk in stored)
+
+    answer = client.post('/api/chat', json={'query': chunks[5].text, 'document_ids': [job['document_id']]}).get_json()
+    citations = answer['citations']
+    assert citations and all(1 <= citation['page_number'] <= NUM_PAGES for citation in citations)
+    # The best passage holds the chunk asked about, merged with any neighbouring hits
+    prompt = routes.rag_service.openai_client.chat.completions.last_messages[-1]['content']
+    pages = re.search(r"\[1\] \(paper\.pdf, pages? (\d+)(?:-(\d+))?\)", prompt)
+    first, last = int(pages.group(1)), int(pages.group(2) or pages.group(1))
+    assert first == citations[0]['page_number'] <= chunks[5].page_number <= last
@@ -0,0 +1,122 @@
+"""
+Vector store rebuild test for the AI Research Assistant
+Rebuilds the store from the document_chunks table and checks that it
+matches the one built by ingestion, that duplicate chunks are streamed
+into the chunk store as records, that full precision indexes over the
+memory budget are refused, that the swap waits for the store lock, and
+that a process sharing the store picks up the rebuilt one
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from chunk_store import ChunkStore, write_chunk_store
+from document import IngestionJob
+from document_processor import VectorStore
+from mock_openai import MockOpenAIClient
+from rebuild_vector_store import rebuild_vector_store
+from vector_persistence import StoreLock, read_manifest
+
+PAPER = "\n\n".join(" ".join(f"Section {s} sentence {i} on enzyme kinetics and reaction rates." for i in range(12))
+                    for s in range(10))
+
+
+def quiet(*args):
+    pass
+
+
+def search(store, text, **kwargs):
+    query = MockOpenAIClient().embeddings.create(model='', input=[text]).data[0].embedding
+    return [(hit['document_id'], hit['chunk_index']) for hit, _ in store.search(query, **kwargs)]
+
+
+@pytest.mark.parametrize('page_size', [2000, 3])
+def test_rebuild_matches_ingested_store(app, routes, ingestion, upload, page_size):
+    original = upload(PAPER, 'paper.txt')
+    copy = upload(PAPER.upper(), 'paper-copy.txt')
+    assert original['status'] == copy['status'] == IngestionJob.COMPLETED
+    assert copy['chunks_deduplicated'] == copy['chunks_total']
+    ingestion.stop()
+
+    with app.app_context():
+        count = rebuild_vector_store('rebuilt', page_size=page_size, progress=quiet)
+    assert count == original['chunks_total']
+
+    metadata = ChunkStore(os.path.join(os.getcwd(), read_manifest('rebuilt')['metadata']))
+    assert 'links' not in metadata.info, "Duplicate chunks should be records, not part of the footer"
+    assert len(list(metadata.links())) == copy['chunks_total']
+    assert not [name for name in os.listdir('.') if '.rebuild.' in name], "Staged files were left behind"
+
+    rebuilt = VectorStore(dimension=routes.vector_store.dimension)
+    rebuilt.load_from_file('rebuilt')
+    for document_ids in (None, [copy['document_id']]):
+        assert search(rebuilt, PAPER[:300], k=3, document_ids=document_ids) == \
+            search(routes.vector_store, PAPER[:300], k=3, document_ids=document_ids)
+    assert rebuilt.vector_links == routes.vector_store.vector_links
+
+
+def test_full_precision_index_over_budget_refused(app, routes, upload, ingestion):
+    job = upload(PAPER, 'paper.txt')
+    assert job['status'] == IngestionJob.COMPLETED
+    ingestion.stop()
+    budget = job['chunks_total'] * routes.vector_store.dimension * 4 - 1
+
+    with app.app_context():
+        for index_type in ('flat', 'hnsw'):
+            with pytest.raises(Exception, match="over the 0 MB budget"):
+                rebuild_vector_store('rebuilt', index_type=index_type, progress=quiet, max_index_memory=budget)
+        assert read_manifest('rebuilt') is None
+        assert rebuild_vector_store('rebuilt', index_type='flat_int8', progress=quiet,
+                                    max_index_memory=budget) == job['chunks_total']
+
+
+def test_swap_waits_for_store_lock(app, routes, upload, ingestion):
+    assert upload(PAPER, 'paper.txt')['status'] == IngestionJob.COMPLETED
+    ingestion.stop()
+    shared = VectorStore(dimension=routes.vector_store.dimension)
+    shared.share('shared_store', refresh_interval=0.05)
+    assert not shared.chunk_metadata
+    before = read_manifest('shared_store')
+
+    def rebuild():
+        with app.app_context():
+            rebuild_vector_store('shared_store', progress=quiet)
+
+    lock = StoreLock('shared_store')
+    with lock.exclusive():
+        rebuilding = threading.Thread(target=rebuild)
+        rebuilding.start()
+        time.sleep(1.0)
+        assert rebuilding.is_alive() and read_manifest('shared_store') == before, \
+            "The rebuild swapped the store in while another process held its lock"
+    rebuilding.join(30)
+    lock.close()
+    assert read_manifest('shared_store')['version'] == before['version'] + 1
+
+    deadline = time.time() + 5
+    while time.time() < deadline and not shared.chunk_metadata:
+        time.sleep(0.05)
+    shared.stop_sharing()
+    assert search(shared, PAPER[:300], k=3) == search(routes.vector_store, PAPER[:300], k=3)
+
+
+def test_links_stored_in_footer_still_load(tmp_path):
+    # Chunk stores written before links were records
+    store = VectorStore(dimension=64)
+    store.add_embeddings([[1.0] + [0.0] * 63], [{'document_id': 'a', 'chunk_index': 0, 'text': 'Alpha'}])
+    store.save_to_file(str(tmp_path / 'store'))
+    store.checkpoint()
+    path = os.path.join(tmp_path, read_manifest(str(tmp_path / 'store'))['metadata'])
+    old = ChunkStore(path)
+    chunks, info = list(old.items()), dict(old.info)
+    info['links'] = {'0': [{'document_id': 'b', 'chunk_index': 0, 'text': 'Alpha'}]}
+    del old
+    write_chunk_store(path, chunks, info=info)
+
+    loaded = VectorStore(dimension=64)
+    loaded.load_from_file(str(tmp_path / 'store'))
+    assert [chunk['document_id'] for chunk in loaded.vector_links[0]] == ['b']
+    assert loaded.search([1.0] + [0.0] * 63, k=1, document_ids=['b'])
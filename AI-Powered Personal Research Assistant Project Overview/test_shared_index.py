@@ -0,0 +1,132 @@
+"""
+Shared vector index test for the AI Research Assistant
+Runs worker processes that share one vector store on disk: some upload
+and delete documents while others search. Checks that every process sees
+new documents within the refresh interval, that searches are not held up
+by the uploads, that checkpoints written meanwhile are picked up, and that
+every process ends with the same documents and no colliding vector IDs
+"""
+
+import multiprocessing
+import time
+
+import numpy as np
+
+DIMENSION = 64
+WRITERS = 2
+READERS = 2
+DOCUMENTS_PER_WRITER = 12
+CHUNKS_PER_DOCUMENT = 6
+REFRESH_INTERVAL = 0.2
+
+
+def chunk_text(document_id, chunk_index):
+    return f"Chunk {chunk_index} of {document_id} on topic {document_id}-{chunk_index}"
+
+
+def open_store(path):
+    # Spawned processes start without the import hook conftest installs
+    import flat_layout
+    flat_layout.install()
+    from document_processor import VectorStore
+    # A tiny merge ratio, so checkpoints are written while the others read
+    store = VectorStore(dimension=DIMENSION, mmap_index=True, wal_merge_ratio=0.05, collapse_similarity=None)
+    store.share(path, refresh_interval=REFRESH_INTERVAL)
+    return store
+
+
+def final_state(store):
+    """Documents, next vector ID, and whether each document's chunks are found by their own vectors"""
+    from mock_openai import mock_embedding
+    time.sleep(REFRESH_INTERVAL * 3)
+    documents = sorted(document_id for document_id, ids in store.document_vectors.items() if len(ids))
+    consistent = True
+    for document_id in documents:
+        for chunk_index in range(CHUNKS_PER_DOCUMENT):
+            text = chunk_text(document_id, chunk_index)
+            hits = store.search(mock_embedding(text, DIMENSION), k=1)
+            consistent &= bool(hits) and hits[0][0]['text'] == text
+    return documents, store.next_id, consistent
+
+
+def upload(writer, path, results):
+    """Add documents one by one as ingestion does, deleting one of them midway"""
+    from mock_openai import mock_embedding
+    store = open_store(path)
+    for i in range(DOCUMENTS_PER_WRITER):
+        document_id = f"w{writer}-d{i}"
+        texts = [chunk_text(document_id, j) for j in range(CHUNKS_PER_DOCUMENT)]
+        store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                             [{'document_id': document_id, 'chunk_index': j, 'text': text}
+                              for j, text in enumerate(texts)])
+        store.save_to_file(path)
+        results.put(('added', document_id, time.time()))
+        if i == DOCUMENTS_PER_WRITER // 2:
+            store.remove_document(f"w{writer}-d0")
+            store.save_to_file(path)
+        time.sleep(0.05)
+    results.put(('done', f"writer {writer}", None))
+    results.put(('final', f"writer {writer}", final_state(store)))
+
+
+def query(reader, path, results, stop):
+    """Search continuously, recording search latencies and when each document first appears"""
+    store = open_store(path)
+    rng = np.random.default_rng(reader)
+    seen, latencies = {}, []
+    while not stop.is_set():
+        start = time.perf_counter()
+        store.search(rng.standard_normal(DIMENSION).tolist(), k=5)
+        latencies.append(time.perf_counter() - start)
+        now = time.time()
+        for document_id in list(store.document_vectors):
+            seen.setdefault(document_id, now)
+        time.sleep(0.005)
+    results.put(('reader', f"reader {reader}", (seen, latencies)))
+    results.put(('final', f"reader {reader}", final_state(store)))
+
+
+def test_shared_index(tmp_path):
+    path = str(tmp_path / 'vector_store')
+    context = multiprocessing.get_context('spawn')
+    results, stop = context.Queue(), context.Event()
+    processes = [context.Process(target=query, args=(i, path, results, stop)) for i in range(READERS)]
+    processes += [context.Process(target=upload, args=(i, path, results)) for i in range(WRITERS)]
+    for process in processes:
+        process.start()
+
+    added, readers, finals, done = {}, {}, {}, 0
+    while len(finals) < WRITERS + READERS:
+        kind, name, value = results.get(timeout=120)
+        if kind == 'added':
+            added[name] = value
+        elif kind == 'done':
+            done += 1
+            if done == WRITERS:
+                time.sleep(REFRESH_INTERVAL * 3)
+                stop.set()
+        elif kind == 'reader':
+            readers[name] = value
+        else:
+            finals[name] = value
+    for process in processes:
+        process.join(timeout=30)
+
+    # Every process sees new documents within the refresh interval, and searches are not held up
+    expected = sorted(document_id for document_id in added if not document_id.endswith('-d0'))
+    delays = [seen[document_id] - added_at for seen, _ in readers.values()
+              for document_id, added_at in added.items() if document_id in seen]
+    latencies = np.concatenate([latencies for _, latencies in readers.values()])
+    assert len(delays) >= len(added) * READERS - READERS * WRITERS
+    assert max(delays) <= REFRESH_INTERVAL + 1.0
+    assert latencies.max() <= 0.5, "Searches should not wait on uploads"
+
+    # Every process ends with the same documents and vector IDs, as does the store on disk
+    for name, (documents, _, consistent) in finals.items():
+        assert documents == expected and consistent, name
+    next_ids = {next_id for _, next_id, _ in finals.values()}
+    assert next_ids == {WRITERS * DOCUMENTS_PER_WRITER * CHUNKS_PER_DOCUMENT}, \
+        "Vector IDs should be allocated once across processes"
+    reloaded = open_store(path)
+    assert final_state(reloaded)[:2] == (expected, next(iter(next_ids)))
+    reloaded.stop_sharing()
@@ -0,0 +1,101 @@
+"""
+Streaming chat test for the AI Research Assistant
+Serves the API over HTTP against a local fake LLM that streams its answer
+slowly, and checks that /chat/stream sends the citations as soon as
+retrieval is done, then the answer token by token, that the streamed
+answer matches /chat and is cached, and that errors are reported
+"""
+
+import http.client
+import json
+import logging
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+from mock_openai import MockOpenAIClient, mock_embedding
+
+LLM_FIRST_TOKEN_SECONDS = 1.0
+LLM_TOKEN_SECONDS = 0.02
+
+def read_events(port, body):
+    """(seconds since the request, event, data) for each server-sent event"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    start = time.perf_counter()
+    connection.request('POST', '/api/chat/stream', json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    if response.status != 200:
+        return response.status, json.loads(response.read())
+    events, event = [], None
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        line = line.decode('utf-8').rstrip('\n')
+        if line.startswith('event: '):
+            event = line[len('event: '):]
+        elif line.startswith('data: '):
+            events.append((time.perf_counter() - start, event, json.loads(line[len('data: '):])))
+    connection.close()
+    return response.status, events
+
+
+@pytest.fixture
+def llm(routes):
+    texts = [f"Passage {i} on photosynthesis converting light into chemical energy in chloroplasts."
+             for i in range(8)]
+    routes.vector_store.add_embeddings(
+        [mock_embedding(text) for text in texts],
+        [{'document_id': 'plants', 'filename': 'plants.txt', 'chunk_index': i, 'text': text}
+         for i, text in enumerate(texts)])
+    llm = MockOpenAIClient(embedding_latency=0.05, chat_latency=LLM_FIRST_TOKEN_SECONDS,
+                           chat_token_latency=LLM_TOKEN_SECONDS)
+    routes.rag_service.openai_client = llm
+    return llm
+
+
+@pytest.fixture
+def port(app, llm):
+    """Port of a threaded HTTP server serving the app"""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_port
+    server.shutdown()
+
+
+def test_streaming_chat(port, client, llm):
+    question = {'query': 'How do plants store energy from light?'}
+    status, events = read_events(port, question)
+    names = [name for _, name, _ in events]
+    assert status == 200 and names[0] == 'citations' and names[-1] == 'done' and names.count('token') >= 5
+    # Citations arrive before the LLM answers, and tokens as they are generated
+    token_times = [t for t, name, _ in events if name == 'token']
+    assert events[0][0] < LLM_FIRST_TOKEN_SECONDS / 2
+    assert token_times[-1] - token_times[0] >= LLM_TOKEN_SECONDS * 4
+    assert events[0][2]['citations'] and not events[0][2]['cached']
+    answer = "".join(data['content'] for _, name, data in events if name == 'token')
+    assert answer == events[-1][2]['answer'] and answer.startswith("Mock answer")
+
+    # The streamed answer is cached and served by /chat/stream and /chat
+    calls = llm.chat.completions.calls
+    status, events = read_events(port, question)
+    assert events[0][2]['cached'] and [name for _, name, _ in events] == ['citations', 'token', 'done']
+    assert events[1][2]['content'] == answer
+    assert client.post('/api/chat', json=question).get_json()['answer'] == answer
+    assert llm.chat.completions.calls == calls
+
+
+def test_streaming_errors(port, llm):
+    # Invalid requests are rejected before streaming
+    assert read_events(port, {'query': 'Light?', 'retrieval_mode': 'keyword'})[0] == 400
+    assert read_events(port, {})[0] == 400
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("upstream unavailable")
+    llm.chat.completions.create = fail
+    status, events = read_events(port, {'query': 'Where does photosynthesis happen?'})
+    assert status == 200 and events[0][1] == 'citations' and events[-1][1] == 'error'
+    assert 'upstream unavailable' in events[-1][2]['error']
@@ -0,0 +1,85 @@
+"""
+Streaming ingestion test for the AI Research Assistant
+Checks that text and DOCX files are extracted piece by piece into the
+same text as whole-file extraction, that chunking a stream of pieces
+yields the chunks of the whole text while reading only as far ahead as
+it needs, and that an uploaded document is stored whole
+"""
+
+import random
+
+import docx
+import pytest
+
+from document import Document, DocumentChunk, IngestionJob
+from document_processor import DocumentProcessor
+from mock_openai import MockOpenAIClient
+
+random.seed(11)
+VOCABULARY = [f"term{i}" for i in range(1000)]
+PARAGRAPHS = [" ".join(" ".join(random.choice(VOCABULARY) for _ in range(random.randint(6, 20))) + "."
+                       for _ in range(random.randint(2, 6)))
+              for _ in range(1500)]
+TEXT = "\n\n".join(PARAGRAPHS)
+
+
+@pytest.fixture
+def processor():
+    return DocumentProcessor(openai_client=MockOpenAIClient(dimension=8))
+
+
+def test_text_file_streamed_in_blocks(processor, tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text(TEXT, encoding='utf-8')
+    pieces = list(processor.iter_text_from_file(str(path), 'txt'))
+    assert len(TEXT) > 3 * 65536 and len(pieces) == -(-len(TEXT) // 65536)
+    assert all(page_number is None for page_number, _ in pieces)
+    assert "".join(text for _, text in pieces) == TEXT == processor.extract_text_from_file(str(path), 'txt')
+
+    # Chunk boundaries do not depend on where the blocks were cut
+    streamed = [chunk for _, chunk in processor.iter_chunks(pieces)]
+    assert streamed == processor.chunk_text(TEXT)
+    tiny = [(None, TEXT[i:i + 100]) for i in range(0, len(TEXT), 100)]
+    assert [chunk for _, chunk in processor.iter_chunks(tiny)] == streamed
+
+
+def test_docx_streamed_by_paragraph(processor, tmp_path):
+    path = str(tmp_path / 'notes.docx')
+    document = docx.Document()
+    for paragraph in PARAGRAPHS[:200]:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+    pieces = list(processor.iter_text_from_file(path, 'docx'))
+    assert len(pieces) == 200
+    assert "".join(text for _, text in pieces) == "\n".join(PARAGRAPHS[:200])
+    assert [chunk for _, chunk in processor.iter_chunks(pieces)] == \
+        processor.chunk_text(processor.extract_text_from_file(path, 'docx'))
+
+    with pytest.raises(Exception, match="Unsupported file type"):
+        list(processor.iter_text_from_file(path, 'odt'))
+
+
+def test_chunks_yielded_before_stream_ends(processor):
+    read = []
+
+    def pieces():
+        for i, paragraph in enumerate(PARAGRAPHS):
+            read.append(i)
+            yield None, paragraph + "\n\n"
+
+    chunks = processor.iter_chunks(pieces())
+    first = next(chunks)
+    assert PARAGRAPHS[0].startswith(first[1][:50])
+    assert len(read) < 20, f"The first chunk waited for {len(read)} of {len(PARAGRAPHS)} pieces"
+
+
+def test_uploaded_document_stored_whole(app, routes, ingestion, upload):
+    job = upload(TEXT, 'notes.txt', timeout=120)
+    assert job['status'] == IngestionJob.COMPLETED, job['error']
+    with app.app_context():
+        assert Document.query.filter_by(document_id=job['document_id']).one().content == TEXT
+        chunks = DocumentChunk.query.filter_by(document_id=job['document_id']).order_by(
+            DocumentChunk.chunk_index).all()
+    assert [chunk.text for chunk in chunks] == routes.document_processor.chunk_text(TEXT)
+    assert job['chunks_total'] == len(chunks)
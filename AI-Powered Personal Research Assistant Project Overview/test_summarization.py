@@ -0,0 +1,94 @@
+"""
+Summarization test for the AI Research Assistant
+Summarizes a long document with a stub LLM and checks that every section
+is read, that sections are summarized concurrently within the limit, that
+notes are merged level by level until they fit one call, and that
+summarizing again with another number of bullets takes a single call
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from rag_service import RAGService
+from summarizer import DocumentSummarizer
+
+
+class StubLLM:
+    """
+    Chat client whose completion is the first words of each paragraph of
+    the prompt, cut to max_tokens
+    """
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, max_tokens=1000, **kwargs):
+        prompt = messages[-1]['content']
+        with self._lock:
+            self.prompts.append(prompt)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        paragraphs = [p for p in prompt.split("\n\n")[1:] if p.strip()]
+        content = " ".join(" ".join(p.split()[:6]) for p in paragraphs)[:max_tokens * 4]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def long_document(sections):
+    return "\n\n".join(f"## Section {i}\n\n" + " ".join(
+        f"Finding {i}.{j} shows that measurement {i * 100 + j} changed." for j in range(40))
+        for i in range(sections))
+
+
+@pytest.fixture
+def llm():
+    return StubLLM()
+
+
+@pytest.fixture
+def summarizer(llm):
+    return DocumentSummarizer(llm, section_tokens=400, reduce_tokens=200, notes_tokens=100, max_concurrency=3)
+
+
+DOCUMENT = long_document(30)
+
+
+def test_map_reduce(summarizer, llm):
+    result = summarizer.summarize(DOCUMENT, max_bullets=5)
+    assert result['sections'] >= 20 and result['reduce_levels'] >= 2
+    assert result['llm_calls'] == len(llm.prompts)
+    assert any("measurement 2939 changed" in prompt for prompt in llm.prompts), \
+        "The end of the document was never sent to the LLM"
+    # The final call asks for the bullets from notes that fit one call
+    assert "in 5 key bullet points" in llm.prompts[-1] and len(llm.prompts[-1]) <= 200 * 4 + 500
+    assert 1 < llm.max_in_flight <= 3
+
+    again = summarizer.summarize(DOCUMENT, max_bullets=3)
+    assert again['llm_calls'] == 1, "Re-summarizing with other bullets should take one call"
+    assert again['cached_notes'] == result['llm_calls'] - 1
+    assert "in 3 key bullet points" in llm.prompts[-1]
+
+
+def test_short_document(summarizer, llm):
+    short = summarizer.summarize("A short note on enzyme kinetics.", max_bullets=2)
+    assert short['llm_calls'] == 1 and short['sections'] == 1
+    assert "enzyme kinetics" in llm.prompts[0]
+
+
+def test_rag_service_summarizes(summarizer, llm):
+    summarizer.summarize(DOCUMENT, max_bullets=5)
+    rag = RAGService(vector_store=None, openai_client=llm, summarizer=summarizer)
+    calls = len(llm.prompts)
+    assert rag.summarize_document(DOCUMENT, 4)
+    assert len(llm.prompts) == calls + 1, "RAGService should summarize from the cached notes"
+    assert "in 4 key bullet points" in llm.prompts[-1]
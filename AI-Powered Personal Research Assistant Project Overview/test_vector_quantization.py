@@ -0,0 +1,135 @@
+"""
+Compressed index test for the AI Research Assistant
+Checks that the vector store's compressed backends (fp16, int8 and PQ
+codes, with and without PCA or truncation to fewer dimensions) find what
+the exact flat index finds, with exact scores from re-ranking against the
+full-precision vectors, through filtered searches, deletions, compaction,
+checkpoints and reloads, and that invalid options are rejected
+"""
+
+import numpy as np
+import pytest
+
+from document_processor import VectorStore
+from synthetic_data import matryoshka_vectors
+from vector_index import export_vectors
+from vector_persistence import read_manifest
+
+DIMENSION = 64
+NUM_VECTORS = 3000
+CHUNKS_PER_DOCUMENT = 10
+K = 10
+
+# (index_type, options, minimum recall@K against the flat index)
+CONFIGURATIONS = [
+    ('flat_fp16', {}, 0.99),
+    ('flat_int8', {}, 0.99),
+    ('flat_pq', {'pq_m': 16}, 0.9),
+    ('flat_int8', {'reduced_dimension': 32}, 0.9),
+    ('flat_fp16', {'reduced_dimension': 32, 'reduction': 'truncate'}, 0.9),
+    ('ivf_pq', {'pq_m': 16, 'nlist': 16}, 0.9),
+]
+
+VECTORS = matryoshka_vectors(NUM_VECTORS, DIMENSION)
+QUERIES = matryoshka_vectors(50, DIMENSION, seed=1)
+
+
+def chunk(i):
+    return {'document_id': f'doc-{i // CHUNKS_PER_DOCUMENT}', 'chunk_index': i % CHUNKS_PER_DOCUMENT,
+            'text': f'chunk {i}'}
+
+
+@pytest.fixture
+def build(wait_for_maintenance):
+    def build(index_type='flat', **options):
+        """A store of the given backend holding VECTORS, promoted to it"""
+        store = VectorStore(dimension=DIMENSION, index_type=index_type, promote_threshold=0,
+                            collapse_similarity=None, **options)
+        store.add_embeddings(VECTORS, [chunk(i) for i in range(NUM_VECTORS)])
+        wait_for_maintenance(store)
+        return store
+    return build
+
+
+def hit_ids(results):
+    return [[int(c['text'].split()[1]) for c, _ in row] for row in results]
+
+
+def scores_exact(results):
+    """Whether every hit's score is the exact cosine similarity of its vector"""
+    return all(abs(score - float(QUERIES[q] @ VECTORS[int(c['text'].split()[1])])) < 1e-5
+               for q, row in enumerate(results) for c, score in row)
+
+
+def recall(results, expected):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(hit_ids(results), expected) if b])
+
+
+FILTERED = ['doc-3', 'doc-150', 'doc-299']
+
+
+@pytest.fixture(scope='module')
+def expected():
+    """The flat index's hits of QUERIES, unfiltered and filtered to FILTERED"""
+    flat = VectorStore(dimension=DIMENSION, promote_threshold=0, collapse_similarity=None)
+    flat.add_embeddings(VECTORS, [chunk(i) for i in range(NUM_VECTORS)])
+    return hit_ids(flat.search_batch(QUERIES, K)), hit_ids(flat.search_batch(QUERIES, K, FILTERED))
+
+
+@pytest.mark.parametrize('index_type, options, minimum', CONFIGURATIONS)
+def test_compressed_search(build, expected, index_type, options, minimum):
+    expected, expected_filtered = expected
+    store = build(index_type, **options)
+    results = store.search_batch(QUERIES, K)
+    assert store.active_index_type == index_type
+    assert recall(results, expected) >= minimum
+    assert scores_exact(results), "Hits should be re-ranked to exact scores"
+
+    # Filtered searches score the documents' vectors exactly
+    results = store.search_batch(QUERIES, K, FILTERED)
+    assert hit_ids(results) == expected_filtered and scores_exact(results)
+    # Over the exact filter limit: the bitmap selector path, re-ranked too
+    store.exact_filter_limit = 0
+    assert recall(store.search_batch(QUERIES, K, FILTERED), expected_filtered) >= minimum
+
+
+@pytest.mark.parametrize('mmap_index', [False, True])
+def test_persistence(build, wait_for_maintenance, tmp_path, mmap_index):
+    store = build('flat_int8', mmap_index=mmap_index, compaction_threshold=0.05)
+    path = str(tmp_path / 'vector_store')
+    store.save_to_file(path)
+
+    # Logged, then compacted away: dropped from the index in memory, or by a checkpoint when mapped
+    store.add_embeddings(VECTORS[:50], [dict(chunk(i), document_id='copy') for i in range(50)])
+    for d in range(20):
+        store.remove_document(f'doc-{d}')
+    store.save_to_file(path)
+    wait_for_maintenance(store)
+    store.checkpoint()
+
+    reloaded = VectorStore(dimension=DIMENSION, collapse_similarity=None)
+    reloaded.load_from_file(path)
+    results = reloaded.search_batch(QUERIES, K)
+    assert 'vectors' in read_manifest(path) and reloaded.active_index_type == 'flat_int8'
+    assert results == store.search_batch(QUERIES, K) and scores_exact(results)
+
+    # The vector file holds the vectors of the index's rows, which compaction drops
+    rows = sum(index.ntotal for index, _ in reloaded._searchable())
+    assert not any(c['document_id'] in {f'doc-{d}' for d in range(20)} for row in results for c, _ in row)
+    assert len(reloaded._full_vectors) == rows and rows < NUM_VECTORS
+
+    # Rebuilt from the full-precision vectors, not from the int8 codes
+    reloaded.rebuild_index('flat')
+    ids, vectors = export_vectors(reloaded.index)
+    originals = VECTORS[[int(reloaded.chunk_metadata[i]['text'].split()[1]) for i in ids.tolist()]]
+    assert reloaded.active_index_type == 'flat' and np.allclose(vectors, originals, atol=1e-6)
+
+
+@pytest.mark.parametrize('options', [
+    {'index_type': 'flat', 'reduced_dimension': 32},
+    {'index_type': 'flat_int8', 'reduced_dimension': DIMENSION},
+    {'index_type': 'flat_int8', 'reduced_dimension': 32, 'reduction': 'random'},
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        VectorStore(dimension=DIMENSION, **options)
@@ -0,0 +1,129 @@
+"""
+Write-ahead log test for the AI Research Assistant
+Checks that saves after the first append only the changes to the log
+instead of rewriting the checkpoint, that a store reloads to the same
+state from checkpoint plus log, that a record torn by a crash is dropped
+and the log repaired so later saves survive, and that an outgrown log is
+merged into a new checkpoint
+"""
+
+import os
+
+from document_processor import VectorStore
+from mock_openai import mock_embedding
+from vector_persistence import read_manifest
+
+DIMENSION = 64
+CHUNKS_PER_DOCUMENT = 4
+
+
+def add_document(store, document_id):
+    texts = [f"Chunk {i} of {document_id}" for i in range(CHUNKS_PER_DOCUMENT)]
+    store.add_embeddings([mock_embedding(text, DIMENSION) for text in texts],
+                         [{'document_id': document_id, 'chunk_index': i, 'text': text}
+                          for i, text in enumerate(texts)])
+
+
+def documents(store):
+    return sorted(document_id for document_id, ids in store.document_vectors.items() if len(ids))
+
+
+def reload(path, **options):
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None, **options)
+    store.load_from_file(path)
+    return store
+
+
+def stored_file(path, kind):
+    """Path of the store's current file of a kind, the last log for 'wal'"""
+    manifest = read_manifest(path)
+    name = manifest['wals'][-1] if kind == 'wal' else manifest[kind]
+    return os.path.join(os.path.dirname(path), name)
+
+
+def test_saves_append_to_log(tmp_path):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None, wal_merge_ratio=100)
+    for d in range(5):
+        add_document(store, f'doc-{d}')
+    store.save_to_file(path)
+    manifest = read_manifest(path)
+    checkpoint = {name: os.path.getmtime(name)
+                  for name in (stored_file(path, 'index'), stored_file(path, 'metadata'))}
+    wal = stored_file(path, 'wal')
+    assert os.path.getsize(wal) == 0
+
+    sizes = []
+    for d in range(5, 8):
+        add_document(store, f'doc-{d}')
+        store.save_to_file(path)
+        sizes.append(os.path.getsize(wal))
+    store.remove_document('doc-1')
+    store.save_to_file(path)
+    assert sizes[0] > 0 and sizes[1] - sizes[0] == sizes[0] and sizes[2] - sizes[1] == sizes[0], \
+        "Each save should append only the changes since the last"
+    assert os.path.getsize(wal) > sizes[-1]
+    assert read_manifest(path) == manifest
+    assert {name: os.path.getmtime(name) for name in checkpoint} == checkpoint, "Saves rewrote the checkpoint"
+
+    reloaded = reload(path)
+    assert documents(reloaded) == documents(store) == [f'doc-{d}' for d in range(8) if d != 1]
+    assert reloaded.next_id == store.next_id
+    query = mock_embedding("Chunk 2 of doc-6", DIMENSION)
+    assert reloaded.search(query, k=3) == store.search(query, k=3)
+
+
+def test_torn_record_dropped_and_repaired(tmp_path):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None, wal_merge_ratio=100)
+    add_document(store, 'doc-0')
+    store.save_to_file(path)
+    add_document(store, 'doc-1')
+    store.save_to_file(path)
+    wal = stored_file(path, 'wal')
+    intact = os.path.getsize(wal)
+    add_document(store, 'doc-2')
+    store.save_to_file(path)
+
+    # A crash midway through writing doc-2's record
+    with open(wal, 'r+b') as f:
+        f.truncate(intact + (os.path.getsize(wal) - intact) // 2)
+    recovered = reload(path, wal_merge_ratio=100)
+    assert documents(recovered) == ['doc-0', 'doc-1']
+    assert os.path.getsize(wal) == intact, "The torn tail should be truncated"
+
+    # Saves after recovery are appended after the valid records
+    add_document(recovered, 'doc-3')
+    recovered.save_to_file(path)
+    assert documents(reload(path)) == ['doc-0', 'doc-1', 'doc-3']
+
+    # A record with a bad checksum is dropped the same way
+    with open(wal, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    assert documents(reload(path)) == ['doc-0', 'doc-1']
+
+
+def test_outgrown_log_merged_into_checkpoint(tmp_path, wait_for_maintenance):
+    path = str(tmp_path / 'vector_store')
+    store = VectorStore(dimension=DIMENSION, collapse_similarity=None, wal_merge_ratio=0.5)
+    for d in range(4):
+        add_document(store, f'doc-{d}')
+    store.save_to_file(path)
+    first = read_manifest(path)
+
+    for d in range(4, 10):
+        add_document(store, f'doc-{d}')
+        store.remove_document(f'doc-{d - 4}')
+        store.save_to_file(path)
+        wait_for_maintenance(store)
+    manifest = read_manifest(path)
+    assert manifest['version'] > first['version'], "The log was never merged into a checkpoint"
+    assert len(manifest['wals']) == 1
+    assert not os.path.exists(os.path.join(tmp_path, first['index'])), "The old checkpoint was left behind"
+
+    reloaded = reload(path)
+    assert documents(reloaded) == documents(store) == [f'doc-{d}' for d in range(6, 10)]
+    assert reloaded.next_id == store.next_id
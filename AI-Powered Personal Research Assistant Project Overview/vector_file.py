@@ -0,0 +1,165 @@
+"""
+Full-precision vectors kept on disk, for re-ranking compressed search hits
+
+An index of a compressed type (see vector_index.LOSSY_INDEX_TYPES) holds
+codes that only approximate each vector, so VectorStore searches it for a
+shortlist and re-scores the shortlist against the original float32
+vectors. Those live in a vector file, memory-mapped, so only the rows of
+shortlisted vectors are read and the page cache rather than the process
+holds them; the index itself is all that has to stay in memory.
+
+Layout: [vectors: float32, one row per ID][ids: int64][footer JSON][footer length: uint64][MAGIC]
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+from src.services.vector_persistence import fsync_directory
+
+MAGIC = b'RAVECTS1'
+TRAILER = struct.Struct('<Q8s')
+BLOCK_SIZE = 65536  # Rows copied at a time when rewriting a file
+
+
+class VectorFileWriter:
+    """Write (ids, vectors) blocks, in increasing ID order, to a new vector file"""
+
+    def __init__(self, path: str, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self._ids = array('q')
+        self._file = open(f"{path}.tmp", 'wb')
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        self._file.write(np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dimension).tobytes())
+        self._ids.extend(int(vector_id) for vector_id in ids)
+
+    def close(self):
+        f = self._file
+        # Align the IDs so they can be viewed in place
+        f.write(b'\0' * (-f.tell() % 8))
+        ids_offset = f.tell()
+        self._ids.tofile(f)
+        footer = json.dumps({
+            'count': len(self._ids),
+            'dimension': self.dimension,
+            'ids_offset': ids_offset
+        }).encode('utf-8')
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+        os.replace(f"{self.path}.tmp", self.path)
+        fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+
+
+def write_vector_file(path: str, blocks: Iterable[Tuple[np.ndarray, np.ndarray]], dimension: int):
+    """Stream (ids, vectors) blocks, in increasing ID order, into a new vector file"""
+    writer = VectorFileWriter(path, dimension)
+    for ids, vectors in blocks:
+        writer.add(ids, vectors)
+    writer.close()
+
+
+class VectorFile:
+    """Read-only view of a vector file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        footer_length, magic = TRAILER.unpack_from(self._mmap, len(self._mmap) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a vector file")
+        footer_start = len(self._mmap) - TRAILER.size - footer_length
+        footer = json.loads(self._mmap[footer_start:footer_start + footer_length])
+
+        count = footer['count']
+        self.dimension = footer['dimension']
+        self.ids = np.frombuffer(self._mmap, dtype=np.int64, count=count, offset=footer['ids_offset'])
+        self.vectors = np.frombuffer(self._mmap, dtype=np.float32, count=count * self.dimension).reshape(
+            count, self.dimension)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Row of each ID, or -1 for IDs not in the file"""
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == ids[found]
+        return np.where(found, positions, -1)
+
+
+class FullVectors:
+    """
+    Mapping of vector ID -> full-precision vector for VectorStore
+
+    Holds the vectors of every row of the store's index, deleted ones
+    included until they are dropped from it. Vectors from the last
+    checkpoint are read from a memory-mapped VectorFile; vectors added since
+    live in memory, and dropped checkpoint vectors are remembered in a set,
+    like ChunkMetadata's chunks.
+    """
+
+    def __init__(self, dimension: int, base: VectorFile = None, added: dict = None, removed: set = None):
+        self.dimension = dimension
+        self.base = base
+        self.added = added if added is not None else {}
+        self.removed = removed if removed is not None else set()
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        for vector_id, vector in zip(ids.tolist(), vectors):
+            self.added[vector_id] = vector
+
+    def discard(self, ids: Iterable[int]):
+        """Forget the vectors of rows dropped from the index"""
+        for vector_id in ids:
+            if self.added.pop(vector_id, None) is None and self.base is not None:
+                self.removed.add(vector_id)
+
+    def __len__(self) -> int:
+        base_count = len(self.base) - len(self.removed) if self.base is not None else 0
+        return base_count + len(self.added)
+
+    def get_batch(self, ids: np.ndarray) -> np.ndarray:
+        """(len(ids), dimension) array of the vectors with the given IDs"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        positions = self.base.positions(ids) if self.base is not None else np.full(len(ids), -1)
+        in_base = positions >= 0
+        if in_base.any():
+            vectors[in_base] = self.base.vectors[positions[in_base]]
+        for i in np.flatnonzero(~in_base):
+            vector = self.added.get(int(ids[i]))
+            if vector is None:
+                raise KeyError(int(ids[i]))
+            vectors[i] = vector
+        return vectors
+
+    def blocks(self, skip: Iterable[int] = ()) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """(ids, vectors) of every vector not in skip, in increasing ID order"""
+        skip = self.removed.union(skip)
+        skip_ids = np.fromiter(skip, dtype=np.int64, count=len(skip))
+        if self.base is not None:
+            for start in range(0, len(self.base), BLOCK_SIZE):
+                ids = self.base.ids[start:start + BLOCK_SIZE]
+                keep = ~np.isin(ids, skip_ids)
+                yield ids[keep], self.base.vectors[start:start + BLOCK_SIZE][keep]
+        added = sorted(vector_id for vector_id in self.added if vector_id not in skip)
+        for start in range(0, len(added), BLOCK_SIZE):
+            ids = np.array(added[start:start + BLOCK_SIZE], dtype=np.int64)
+            yield ids, np.stack([self.added[vector_id] for vector_id in ids.tolist()])
+
+    def snapshot(self) -> 'FullVectors':
+        """Copy that later changes to this mapping do not affect"""
+        return FullVectors(self.dimension, self.base, dict(self.added), set(self.removed))
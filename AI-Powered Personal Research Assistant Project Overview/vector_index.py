@@ -0,0 +1,190 @@
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+# Supported index backends. All use inner product on L2-normalized vectors,
+# i.e. cosine similarity. The flat_* backends scan compressed codes instead
+# of float32 vectors: 2 (fp16) or 1 (int8) byte per dimension, or pq_m bytes
+# per vector (pq).
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'flat_fp16', 'flat_int8', 'flat_pq')
+COMPRESSED_INDEX_TYPES = ('flat_fp16', 'flat_int8', 'flat_pq')
+# Backends whose scores are approximate; VectorStore re-ranks their hits
+# against the full-precision vectors
+LOSSY_INDEX_TYPES = ('ivf_pq',) + COMPRESSED_INDEX_TYPES
+# Ways to reduce the dimension of vectors before compressing them: a PCA
+# projection learned from the vectors, or keeping the leading dimensions,
+# which only suits Matryoshka-trained embeddings such as text-embedding-3-*
+REDUCTIONS = ('pca', 'truncate')
+
+_SCALAR_QUANTIZERS = {
+    'flat_fp16': faiss.ScalarQuantizer.QT_fp16,
+    'flat_int8': faiss.ScalarQuantizer.QT_8bit
+}
+
+
+def build_index(index_type: str, dimension: int, num_vectors: int = 0,
+                nlist: Optional[int] = None, pq_m: int = 64, hnsw_m: int = 32,
+                ef_construction: int = 80, reduced_dimension: Optional[int] = None,
+                reduction: str = 'pca') -> faiss.Index:
+    """
+    Create an empty (untrained) index of the given backend
+
+    Args:
+        index_type: One of INDEX_TYPES
+        dimension: Vector dimension
+        num_vectors: Expected number of vectors, used to size IVF lists
+        nlist: Number of IVF lists (defaults to ~4 * sqrt(num_vectors))
+        pq_m: Number of PQ sub-quantizers for ivf_pq and flat_pq (must divide
+            the dimension)
+        hnsw_m: Graph degree for hnsw
+        ef_construction: Build-time beam width for hnsw
+        reduced_dimension: Reduce vectors to this dimension before compressing
+            them (COMPRESSED_INDEX_TYPES only); queries are reduced the same way
+        reduction: How to reduce them, one of REDUCTIONS
+    """
+    if reduced_dimension is not None:
+        check_reduction(index_type, dimension, reduced_dimension, reduction)
+        index = build_index(index_type, reduced_dimension, num_vectors, nlist, pq_m)
+        if reduction == 'pca':
+            return faiss.IndexPreTransform(faiss.PCAMatrix(dimension, reduced_dimension), index)
+        # The leading dimensions of a unit vector are renormalized to keep scores cosine similarities
+        index = faiss.IndexPreTransform(faiss.NormalizationTransform(reduced_dimension, 2.0), index)
+        index.prepend_transform(faiss.RemapDimensionsTransform(dimension, reduced_dimension, False))
+        return index
+
+    if index_type in _SCALAR_QUANTIZERS:
+        return faiss.IndexScalarQuantizer(dimension, _SCALAR_QUANTIZERS[index_type], faiss.METRIC_INNER_PRODUCT)
+
+    if index_type == 'flat_pq':
+        if dimension % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the dimension {dimension}")
+        # A single list without residuals is a plain PQ scan; unlike IndexPQ it
+        # takes the ID selectors that skip deleted and filtered-out vectors
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dimension), dimension, 1, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.by_residual = False
+        return index
+
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if dimension % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the dimension {dimension}")
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+        return index
+
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+
+    raise ValueError(f"Unknown index type: {index_type}. Supported types: {', '.join(INDEX_TYPES)}")
+
+
+def default_nlist(num_vectors: int) -> int:
+    """Rule-of-thumb IVF list count, keeping ~39+ training points per list"""
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // 39 or 1))
+
+
+def check_reduction(index_type: str, dimension: int, reduced_dimension: int, reduction: str = 'pca'):
+    """Raise ValueError unless build_index can reduce vectors this way"""
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction: {reduction}. Supported reductions: {', '.join(REDUCTIONS)}")
+    if index_type not in COMPRESSED_INDEX_TYPES:
+        raise ValueError(f"Dimension reduction needs a compressed index type: {', '.join(COMPRESSED_INDEX_TYPES)}")
+    if not 0 < reduced_dimension < dimension:
+        raise ValueError(f"reduced_dimension={reduced_dimension} must be between 1 and the dimension {dimension}")
+
+
+def min_training_vectors(index_type: str, nlist: Optional[int] = None, num_vectors: int = 0,
+                         reduced_dimension: Optional[int] = None, reduction: str = 'pca') -> int:
+    """Smallest number of vectors an index of this type can be trained on"""
+    needed = 0
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = nlist or default_nlist(num_vectors)
+        # PQ codebooks need 256 centroids per sub-quantizer
+        needed = max(nlist, 256) if index_type == 'ivf_pq' else nlist
+    elif index_type == 'flat_pq':
+        needed = 256
+    elif index_type == 'flat_int8':
+        # Per-dimension value ranges
+        needed = 1
+    if reduced_dimension is not None and reduction == 'pca':
+        needed = max(needed, reduced_dimension)
+    return needed
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """Inverse of build_index for an (optionally ID-mapped) index"""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return next(index_type for index_type, qtype in _SCALAR_QUANTIZERS.items() if qtype == index.sq.qtype)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq' if index.by_residual else 'flat_pq'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+def supports_removal(index_type: str) -> bool:
+    """
+    Whether vectors can be dropped in place from an ID-mapped index
+
+    Only the flat indexes renumber their rows on removal the way
+    IndexIDMap2's id_map does. IVF lists (flat_pq's included) keep their row
+    numbers, which would put the ID map out of step, and HNSW graphs cannot
+    drop vectors at all; both are rebuilt instead.
+    """
+    return index_type in ('flat', 'flat_fp16', 'flat_int8')
+
+
+def search_parameters(index_type: str, nprobe: int, ef_search: int, selector=None):
+    """Per-query search parameters for the backend, or None for defaults"""
+    if index_type == 'flat_pq':
+        return faiss.SearchParametersIVF(sel=selector, nprobe=1)
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+def export_vectors(index: faiss.Index, start: int = 0):
+    """
+    Return (ids, vectors) for the rows from start onwards of an ID-mapped index
+
+    Vectors from LOSSY_INDEX_TYPES are reconstructions, not the original
+    values; VectorStore keeps those in a FullVectors store instead.
+    """
+    ids = faiss.vector_to_array(index.id_map)[start:].astype(np.int64)
+    inner = faiss.downcast_index(index.index)
+    if not len(ids):
+        return ids, np.empty((0, inner.d), dtype=np.float32)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    return ids, inner.reconstruct_n(start, len(ids))
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, max_training_vectors: int = 200000):
+    """Train an index on (a random sample of) vectors if it needs training"""
+    if index.is_trained:
+        return
+    if len(vectors) > max_training_vectors:
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), max_training_vectors, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
@@ -0,0 +1,220 @@
+"""
+On-disk format for VectorStore
+
+A store saved under a base path (e.g. 'vector_store') consists of:
+
+* {base}.manifest            JSON naming the current files, swapped atomically
+* {base}.{version}.index     FAISS index checkpoint
+* {base}.{version}.metadata  chunk metadata checkpoint
+* {base}.{version}.lexical   BM25 inverted index checkpoint (see lexical_index.py)
+* {base}.{version}.vectors   full-precision vectors of a compressed index (see vector_file.py)
+* {base}.{version}.wal       append-only log of changes since the checkpoint
+* {base}.lock                lock file of a store shared between processes
+
+Each WAL record is framed as <payload length><crc32><payload>, so a write
+torn by a crash is detected and dropped on recovery instead of corrupting
+the store.
+"""
+
+import fcntl
+import glob
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FRAME_HEADER = struct.Struct('<II')   # payload length, crc32
+PAYLOAD_HEADER = struct.Struct('<I')  # JSON header length
+
+
+def manifest_path(base_path: str) -> str:
+    return f"{base_path}.manifest"
+
+
+def versioned_path(base_path: str, version: int, kind: str) -> str:
+    return f"{base_path}.{version:06d}.{kind}"
+
+
+def read_manifest(base_path: str) -> Optional[dict]:
+    """Return the manifest for base_path, or None if the store has none"""
+    path = manifest_path(base_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(base_path: str, manifest: dict):
+    """Atomically replace the manifest"""
+    write_file_atomic(manifest_path(base_path), json.dumps(manifest).encode('utf-8'))
+
+
+def write_file_atomic(path: str, data):
+    """Write data to path so readers see either the old or the new file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def remove_unreferenced_files(base_path: str, manifest: dict):
+    """Delete versioned files left behind by superseded or interrupted checkpoints"""
+    referenced = {manifest['index'], manifest['metadata'], manifest.get('lexical'), manifest.get('vectors'),
+                  *manifest['wals']}
+    pattern = re.compile(re.escape(os.path.basename(base_path)) +
+                         r'\.\d{6}\.(index|metadata|lexical|vectors|wal)(\.tmp)?$')
+    for path in glob.glob(f"{glob.escape(base_path)}.*"):
+        if pattern.match(os.path.basename(path)) and os.path.basename(path) not in referenced:
+            os.unlink(path)
+
+
+def encode_add(first_id: int, vectors: np.ndarray, metadata: List[dict]) -> bytes:
+    header = {'op': 'add', 'first_id': first_id, 'count': len(metadata), 'metadata': metadata}
+    return _encode(header, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+
+def encode_remove(document_id: str) -> bytes:
+    return _encode({'op': 'remove', 'document_id': document_id})
+
+
+def encode_link(vector_ids: List[int], metadata: List[dict]) -> bytes:
+    return _encode({'op': 'link', 'vector_ids': vector_ids, 'metadata': metadata})
+
+
+def _encode(header: dict, body: bytes = b'') -> bytes:
+    header_bytes = json.dumps(header).encode('utf-8')
+    payload = PAYLOAD_HEADER.pack(len(header_bytes)) + header_bytes + body
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class WriteAheadLog:
+    """Append-only change log; each append is fsynced before returning"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def append(self, records: List[bytes]):
+        if not records:
+            return
+        self._file.write(b''.join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+def read_wal(path: str, dimension: int, repair: bool = False) -> Iterator[dict]:
+    """
+    Yield the records of a WAL in order
+
+    Reading stops at the first incomplete or corrupt record, which can only
+    be the tail of a write interrupted by a crash. With repair=True the file
+    is truncated there so new records are appended after valid data.
+    """
+    for record, _ in iter_wal(path, dimension, repair=repair):
+        yield record
+
+
+def iter_wal(path: str, dimension: int, start: int = 0, repair: bool = False) -> Iterator[Tuple[dict, int]]:
+    """
+    Yield (record, offset after it) for the records of a WAL from offset start
+
+    As read_wal, which it implements. A record still being appended by
+    another process reads as incomplete, so it is not yielded until a
+    later read.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read()
+
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        length, checksum = FRAME_HEADER.unpack_from(data, offset)
+        payload_start = offset + FRAME_HEADER.size
+        payload = data[payload_start:payload_start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        offset = payload_start + length
+        yield _decode(payload, dimension), start + offset
+
+    if repair and offset < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(start + offset)
+
+
+def _decode(payload: bytes, dimension: int) -> dict:
+    (header_length,) = PAYLOAD_HEADER.unpack_from(payload)
+    header_end = PAYLOAD_HEADER.size + header_length
+    record = json.loads(payload[PAYLOAD_HEADER.size:header_end])
+    if record['op'] == 'add':
+        record['vectors'] = np.frombuffer(payload, dtype=np.float32, offset=header_end).reshape(-1, dimension)
+    return record
+
+
+class StoreLock:
+    """
+    Lock on a store shared between processes: exclusive to change it, shared to read it
+
+    Held with flock on {base}.lock, so it is released if its process dies.
+    flock does not exclude threads holding the same file, so holders in
+    one process also take a lock of their own; holding it again from the
+    same thread keeps the lock already held.
+    """
+
+    def __init__(self, base_path: str):
+        self.path = f"{base_path}.lock"
+        self._file = open(self.path, 'a+b')
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+
+    def exclusive(self):
+        return self._hold(fcntl.LOCK_EX)
+
+    def shared(self):
+        return self._hold(fcntl.LOCK_SH)
+
+    @contextmanager
+    def _hold(self, operation: int):
+        with self._thread_lock:
+            if self._depth == 0:
+                fcntl.flock(self._file.fileno(), operation)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        self._file.close()
+
+
+def fsync_directory(path: str):
+    """Persist a rename; not supported on every platform"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)